@@ -2,8 +2,15 @@
 Admin Dashboard - Interface Flet pour l'administration du serveur
 """
 import flet as ft
+import threading
+import time
 from datetime import datetime
 
+# rooms affichées dans le tableau de l'historique (les plus actives)
+HISTORY_ROOMS_SHOWN = 20
+# rafraîchissement des métriques du pool d'E/S, en secondes
+IO_REFRESH_INTERVAL = 1.0
+
 
 def start_admin_ui(server):
     """Lance l'interface admin Flet (appelé depuis le serveur)"""
@@ -17,12 +24,16 @@ def start_admin_ui(server):
         # ================================
         # Tableau des clients
         # ================================
+        # mode multi-processus (ClusterServer) : liste agrégée de tous les workers
+        show_worker = getattr(server, "workers", 1) > 1
+        worker_column = [ft.DataColumn(ft.Text("Worker", weight=ft.FontWeight.BOLD))] if show_worker else []
         clients_table = ft.DataTable(
-            columns=[
+            columns=worker_column + [
                 ft.DataColumn(ft.Text("IP:Port", weight=ft.FontWeight.BOLD)),
                 ft.DataColumn(ft.Text("Pseudo", weight=ft.FontWeight.BOLD)),
                 ft.DataColumn(ft.Text("Room", weight=ft.FontWeight.BOLD)),
                 ft.DataColumn(ft.Text("Dernier msg", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("File d'envoi", weight=ft.FontWeight.BOLD)),
                 ft.DataColumn(ft.Text("Action", weight=ft.FontWeight.BOLD)),
             ],
             rows=[],
@@ -31,39 +42,107 @@ def start_admin_ui(server):
             data_row_max_height=50,
         )
 
+        # ================================
+        # Historique des rooms (mémoire)
+        # ================================
+        history_table = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("Room", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Messages", weight=ft.FontWeight.BOLD), numeric=True),
+                ft.DataColumn(ft.Text("Mémoire", weight=ft.FontWeight.BOLD), numeric=True),
+            ],
+            rows=[],
+            border=ft.border.all(1, ft.Colors.GREY_700),
+            heading_row_color=ft.Colors.BLUE_GREY_900,
+            data_row_max_height=40,
+        )
+        history_total = ft.Text("Historique: 0 Ko", weight=ft.FontWeight.BOLD)
+
+        def refresh_history():
+            """Met à jour le tableau de l'historique des rooms"""
+            stats = server.history_stats()
+            history_table.rows = [
+                ft.DataRow(cells=[
+                    ft.DataCell(ft.Text(room, color=ft.Colors.CYAN_200)),
+                    ft.DataCell(ft.Text(str(count), size=12)),
+                    ft.DataCell(ft.Text(f"{size // 1024} Ko", size=12)),
+                ])
+                for room, count, size in stats[:HISTORY_ROOMS_SHOWN]
+            ]
+            total = sum(size for _, _, size in stats)
+            history_total.value = f"Historique: {len(stats)} rooms, {total // 1024} Ko"
+
+        # ================================
+        # Pool d'E/S (uploads, hachage, GET_FILE)
+        # ================================
+        io_title = ft.Text("Pool E/S", weight=ft.FontWeight.BOLD)
+        io_workers = ft.Text("", size=12)
+        io_queue = ft.Text("", size=12)
+        io_wait = ft.Text("", size=12)
+
+        def refresh_io():
+            """Met à jour les métriques du pool d'E/S"""
+            stats = server.io_stats()
+            io_workers.value = f"Workers occupés: {stats['busy']} / {stats['workers']}"
+            io_queue.value = f"File d'attente: {stats['queued']} / {stats['max_queued']}"
+            if stats["blocked"]:
+                # connexions mises en attente parce que la file était pleine
+                io_queue.value += f" (pleine {stats['blocked']} fois)"
+            io_queue.color = ft.Colors.ORANGE_300 if stats["queued"] >= stats["max_queued"] else None
+            io_wait.value = (f"Attente: moy. {stats['wait_avg_ms']:.1f} ms, "
+                             f"p99 {stats['wait_p99_ms']:.1f} ms, max {stats['wait_max_ms']:.1f} ms")
+
+        def io_refresh_loop():
+            # les métriques changent sans connexion ni déconnexion de client
+            while True:
+                time.sleep(IO_REFRESH_INTERVAL)
+                try:
+                    refresh_io()
+                    page.update()
+                except Exception:
+                    return  # page fermée
+
         def refresh_clients():
             """Met à jour le tableau des clients"""
             clients_table.rows.clear()
-            with server.clients_lock:
-                for client in server.clients:
-                    addr = f"{client['addr'][0]}:{client['addr'][1]}"
-                    pseudo = client["pseudo"] or "-"
-                    room = client["room"] or "(lobby)"
-                    last_msg = "-"
-                    if client["last_message_time"]:
-                        last_msg = client["last_message_time"].strftime("%H:%M:%S")
-
-                    # Bouton kick pour ce client
-                    kick_btn = ft.IconButton(
-                        icon=ft.Icons.PERSON_REMOVE,
-                        icon_color=ft.Colors.RED_400,
-                        tooltip="Kick",
-                        data={"socket": client["socket"], "pseudo": pseudo, "room": room},
-                        on_click=lambda e: show_kick_confirmation(e.control.data),
-                    )
+            clients = server.sessions.all()
+            for client in clients:
+                addr = f"{client.addr[0]}:{client.addr[1]}"
+                pseudo = client.pseudo or "-"
+                room = client.room or "(lobby)"
+                last_msg = "-"
+                if client.last_message_time:
+                    last_msg = client.last_message_time.strftime("%H:%M:%S")
+                outbox = client.outbox
+                queue = f"{outbox.depth} msg / {outbox.bytes // 1024} Ko"
+                if outbox.dropped:
+                    queue += f" ({outbox.dropped} perdus)"
+
+                # Bouton kick pour ce client
+                kick_btn = ft.IconButton(
+                    icon=ft.Icons.PERSON_REMOVE,
+                    icon_color=ft.Colors.RED_400,
+                    tooltip="Kick",
+                    data={"socket": client.socket, "pseudo": pseudo, "room": client.room},
+                    on_click=lambda e: show_kick_confirmation(e.control.data),
+                )
 
-                    clients_table.rows.append(
-                        ft.DataRow(
-                            cells=[
-                                ft.DataCell(ft.Text(addr, size=12)),
-                                ft.DataCell(ft.Text(pseudo, weight=ft.FontWeight.W_500)),
-                                ft.DataCell(ft.Text(room, color=ft.Colors.CYAN_200)),
-                                ft.DataCell(ft.Text(last_msg, size=12)),
-                                ft.DataCell(kick_btn),
-                            ]
-                        )
+                worker_cell = [ft.DataCell(ft.Text(client.worker, size=12))] if show_worker else []
+                clients_table.rows.append(
+                    ft.DataRow(
+                        cells=worker_cell + [
+                            ft.DataCell(ft.Text(addr, size=12)),
+                            ft.DataCell(ft.Text(pseudo, weight=ft.FontWeight.W_500)),
+                            ft.DataCell(ft.Text(room, color=ft.Colors.CYAN_200)),
+                            ft.DataCell(ft.Text(last_msg, size=12)),
+                            ft.DataCell(ft.Text(queue, size=12)),
+                            ft.DataCell(kick_btn),
+                        ]
                     )
-            clients_count.value = f"Clients connectés: {len(server.clients)}"
+                )
+            clients_count.value = f"Clients connectés: {len(clients)}"
+            refresh_history()
+            refresh_io()
             page.update()
 
         def show_kick_confirmation(client_data):
@@ -179,16 +258,34 @@ def start_admin_ui(server):
                         ),
                         ft.Divider(height=10),
 
-                        # Tableau clients
-                        ft.Container(
-                            content=ft.Column(
-                                [clients_table],
-                                scroll=ft.ScrollMode.AUTO,
-                            ),
+                        # Tableau clients + historique des rooms
+                        ft.Row(
+                            [
+                                ft.Container(
+                                    content=ft.Column(
+                                        [clients_table],
+                                        scroll=ft.ScrollMode.AUTO,
+                                    ),
+                                    expand=3,
+                                    border=ft.border.all(1, ft.Colors.GREY_800),
+                                    border_radius=8,
+                                    padding=10,
+                                ),
+                                ft.Container(
+                                    content=ft.Column(
+                                        [io_title, io_workers, io_queue, io_wait,
+                                         ft.Divider(height=10),
+                                         history_total, history_table],
+                                        scroll=ft.ScrollMode.AUTO,
+                                    ),
+                                    expand=1,
+                                    border=ft.border.all(1, ft.Colors.GREY_800),
+                                    border_radius=8,
+                                    padding=10,
+                                ),
+                            ],
                             expand=True,
-                            border=ft.border.all(1, ft.Colors.GREY_800),
-                            border_radius=8,
-                            padding=10,
+                            vertical_alignment=ft.CrossAxisAlignment.START,
                         ),
 
                         ft.Divider(height=10),
@@ -223,5 +320,6 @@ def start_admin_ui(server):
 
         # Premier refresh
         refresh_clients()
+        threading.Thread(target=io_refresh_loop, daemon=True).start()
 
     ft.app(target=main)
@@ -0,0 +1,72 @@
+"""Micro-benchmark: room broadcast cost vs. total connected clients.
+
+Run from the repository root:
+  python -m benchmarks.bench_broadcast
+
+Sessions use a no-op socket so only the server-side lookup/fan-out is
+measured. With the room index, the cost of a broadcast to a 10-member room
+stays flat while the number of connected clients grows; the legacy linear
+scan of a list of dicts grows with it.
+"""
+import contextlib
+import io
+import time
+
+from serveur import CustomServer
+from network.sessions import Session
+
+
+class NullSocket:
+    def sendall(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+def legacy_broadcast(clients, message, room):
+    # Reference implementation of the former list scan (one dict per client).
+    payload = message.encode()
+    for client in clients:
+        if client["room"] == room:
+            client["socket"].sendall(payload)
+
+
+def build(total, room_size):
+    srv = CustomServer()
+    legacy = []
+    for i in range(total):
+        sock = NullSocket()
+        session = Session(sock, ("127.0.0.1", i), f"user{i}")
+        srv.sessions.add(session)
+        srv.sessions.move(session, f"room{i // room_size}")
+        legacy.append({"socket": sock, "pseudo": session.pseudo, "room": session.room})
+    return srv, legacy
+
+
+def timeit(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    room_size = 10
+    repeat = 200
+    print(f"room size = {room_size}, {repeat} broadcasts per measure")
+    print(f"{'sessions':>10} {'rooms':>8} {'registry µs':>12} {'linear µs':>10}")
+    sink = io.StringIO()
+    for total in (1_000, 10_000, 100_000):
+        srv, legacy = build(total, room_size)
+        target = f"room{total // room_size // 2}"
+        with contextlib.redirect_stdout(sink):
+            indexed = timeit(lambda: srv.broadcast("MSG|bench|hello", room=target), repeat)
+        sink.seek(0)
+        sink.truncate()
+        linear = timeit(lambda: legacy_broadcast(legacy, "MSG|bench|hello", target), repeat)
+        print(f"{total:>10} {len(srv.sessions.rooms()):>8} {indexed:>12.1f} {linear:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
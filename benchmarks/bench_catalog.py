@@ -0,0 +1,68 @@
+"""Micro-benchmark: GET_FILE lookup with the catalog vs. a directory scan.
+
+Run from the repository root:
+  python -m benchmarks.bench_catalog [max_files]
+
+Fills a temporary downloads directory with empty legacy files
+(<seq>_<filename>), opens a BlobStore on it (the catalog is built from
+the files on first open) and compares, per lookup:
+- the former GET_FILE resolution: os.listdir + startswith on every entry
+- BlobStore.get_record (indexed sqlite lookup)
+and the cost of one LIST_FILES page for a room.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+from storage.blobstore import BlobStore
+
+
+def legacy_lookup(root, seq):
+    for fn in os.listdir(root):
+        if fn.startswith(seq + "_"):
+            return fn
+    return None
+
+
+def timeit(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    max_files = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    sizes = [n for n in (1_000, 10_000, 100_000, 200_000) if n <= max_files]
+    print(f"{'files':>8} {'rebuild s':>10} {'listdir µs':>12} {'catalog µs':>11} {'page µs':>8}")
+    for total in sizes:
+        root = tempfile.mkdtemp(prefix="bench-catalog-")
+        try:
+            seqs = [uuid.uuid4().hex for _ in range(total)]
+            for seq in seqs:
+                open(os.path.join(root, f"{seq}_file.txt"), "wb").close()
+            start = time.perf_counter()
+            store = BlobStore(root)
+            rebuild = time.perf_counter() - start
+            # room history: the legacy files carry no room, index some records
+            store.catalog.put_many(
+                {"seq": f"r{i}", "filename": f"f{i}", "size": 0, "sha256": None,
+                 "path": None, "room": "room1", "uploaded_at": time.time()}
+                for i in range(1000)
+            )
+            target = seqs[len(seqs) // 2]
+            assert legacy_lookup(root, target) == store.get_record(target)["path"]
+            listdir = timeit(lambda: legacy_lookup(root, target), 5 if total > 10_000 else 50)
+            indexed = timeit(lambda: store.get_record(target), 2000)
+            page = timeit(lambda: store.list_room("room1", 900, 50), 2000)
+            print(f"{total:>8} {rebuild:>10.2f} {listdir:>12.0f} {indexed:>11.1f} {page:>8.1f}")
+            store.catalog.close()
+        finally:
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
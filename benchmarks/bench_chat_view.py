@@ -0,0 +1,141 @@
+"""Benchmark: message list of the client, unbounded vs ChatView window.
+
+Run from the repository root:
+  python -m benchmarks.bench_chat_view [messages]
+
+flet is not needed: controls are stand-ins with the attributes of a
+ft.Text, and page.update() is emulated by a walk over every control of the
+list that reads all its attributes (Flet compares the whole tree to build
+the patch sent to the UI, so its cost grows with the number of controls).
+The main thread, as the client's receive thread, delivers `messages` chat
+messages (default 10k) as fast as it can:
+- unbounded: one control appended per message, page.update() after each
+  one (client.py before ChatView);
+- ChatView: messages kept as tuples, at most WINDOW rendered controls,
+  updates coalesced by UpdateCoalescer (at most one per UPDATE_INTERVAL).
+Reports the time to deliver the messages until the screen is up to date,
+the number of updates, the time spent in updates, the controls alive at
+the end, and in a separate run without updates the memory held by the
+message list (tracemalloc). Then checks that scrolling
+up through the whole store renders every message once, in order.
+"""
+import sys
+import threading
+import time
+import tracemalloc
+
+from chat_view import PAGE, STORE_MAX, UPDATE_INTERVAL, WINDOW, ChatView, UpdateCoalescer
+
+
+class Text:
+    """Stand-in for ft.Text: the attributes Flet keeps per control."""
+
+    def __init__(self, value, color=None, italic=False):
+        self.value = value
+        self.color = color
+        self.italic = italic
+        self.weight = None
+        self.size = None
+        self.visible = True
+        self.disabled = False
+        self.opacity = 1.0
+        self.tooltip = None
+        self.key = None
+        self.data = None
+        self._id = id(self)
+
+
+def emulated_update(controls):
+    # a patch entry per control, as Flet's diff of the page
+    return [tuple(vars(c).values()) for c in list(controls)]
+
+
+def render(entry):
+    return Text(f"{entry[1]} : {entry[2]}", color=entry[3])
+
+
+def run_unbounded(count):
+    controls = []
+    spent = 0.0
+    start = time.perf_counter()
+    for i in range(count):
+        controls.append(render(("msg", "alice", f"message {i}", None)))
+        t0 = time.perf_counter()
+        emulated_update(controls)
+        spent += time.perf_counter() - t0
+    return time.perf_counter() - start, count, spent, controls
+
+
+def run_view(count):
+    controls = []
+    view = ChatView(controls, render)
+    spent = [0.0]
+    shown = threading.Event()
+
+    def update():
+        t0 = time.perf_counter()
+        with view.lock:
+            emulated_update(controls)
+            last = controls[-1].value if controls else None
+        spent[0] += time.perf_counter() - t0
+        if last == f"alice : message {count - 1}":
+            shown.set()
+
+    coalescer = UpdateCoalescer(update)
+    start = time.perf_counter()
+    for i in range(count):
+        view.append(("msg", "alice", f"message {i}", None))
+        coalescer.request()
+    shown.wait()
+    elapsed = time.perf_counter() - start
+    coalescer.close()
+    return elapsed, coalescer.updates, spent[0], controls, view
+
+
+def footprint(count, bounded):
+    tracemalloc.start()
+    controls = []
+    view = ChatView(controls, render) if bounded else None
+    for i in range(count):
+        entry = ("msg", "alice", f"message {i}", None)
+        if bounded:
+            view.append(entry)
+        else:
+            controls.append(render(entry))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size
+
+
+def measure(label, run, count):
+    result = run(count)
+    elapsed, updates, spent, controls = result[:4]
+    memory = footprint(count, label != "unbounded")
+    print(f"{label:<10} {elapsed:7.2f} s  {count / elapsed:9,.0f} msg/s  {updates:6,} updates  "
+          f"{spent:6.2f} s in updates  {len(controls):6,} controls  {memory / 2 ** 20:5.1f} MiB")
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    print(f"{count:,} messages, WINDOW={WINDOW}, STORE_MAX={STORE_MAX:,}, "
+          f"update every {UPDATE_INTERVAL * 1e3:.0f} ms at most")
+    measure("unbounded", run_unbounded, count)
+    _, _, _, controls, view = measure("ChatView", run_view, count)
+
+    # reading back: every message of the store rendered once, in order
+    seen = [c.value for c in controls]
+    top = controls[0]
+    while view.scroll_up():
+        assert len(controls) <= WINDOW
+        shown = [c.value for c in controls[:controls.index(top)]]
+        assert 0 < len(shown) <= PAGE
+        seen[0:0] = shown
+        top = controls[0]
+    kept = min(count, STORE_MAX)
+    assert seen == [f"alice : message {i}" for i in range(count - kept, count)], (len(seen), kept)
+    print(f"scroll up: {kept:,} messages of the store reached, window <= {WINDOW} controls")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Benchmark: persistent chat log (storage.chatlog), append and history reads.
+
+Run from the repository root:
+  python -m benchmarks.bench_chatlog [size_gib] [--no-fsync]
+
+Appends chat messages (60-260 bytes, as MSG frames) to ROOMS rooms in a
+temporary directory until the log holds size_gib GiB (default 2), and
+reports:
+- append(): cost of the call on the sender's path;
+- sustained throughput: messages and MB per second written by the
+  group-committing writer, until close() has flushed and fsynced
+  everything (the producer waits while too many entries are queued);
+- restart: time to reopen the log (recovery of the last segments);
+- random history reads: a page of PAGE entries before a random id of a
+  random room, first pass on the reopened log (indexes loaded and segments
+  mapped on first use), then a second pass. The data was just written, so
+  it is mostly in the page cache.
+Fails with AssertionError if an entry was dropped or a page is wrong.
+"""
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from storage.chatlog import MAX_PENDING, ChatLog
+
+ROOMS = 4
+PAGE = 50
+READS = 2000
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def fill(log, target):
+    rnd = random.Random(1)
+    texts = [f"MSG|user{i % 50}|" + "message de test " * rnd.randrange(3, 16) for i in range(1000)]
+    ids = {f"room{i}": [] for i in range(ROOMS)}
+    rooms = list(ids)
+    call = 0.0
+    written = 0
+    next_id = 1
+    start = time.perf_counter()
+    while written < target:
+        if log._pending > MAX_PENDING // 2:
+            time.sleep(0.001)  # writer behind: measure its throughput, do not drop
+            continue
+        t0 = time.perf_counter()
+        for _ in range(1000):
+            room = rooms[next_id % ROOMS]
+            text = texts[next_id % 1000]
+            log.append(room, {"id": next_id, "ts": time.time(), "text": text})
+            ids[room].append(next_id)
+            written += 24 + len(text) + 11
+            next_id += 1
+        call += time.perf_counter() - t0
+    log.close()
+    elapsed = time.perf_counter() - start
+    return ids, next_id - 1, call, elapsed
+
+
+def reads(log, ids):
+    rnd = random.Random(2)
+    latencies = []
+    for _ in range(READS):
+        room = rnd.choice(list(ids))
+        room_ids = ids[room]
+        i = rnd.randrange(PAGE, len(room_ids))
+        t0 = time.perf_counter()
+        page, cursor = log.page(room, room_ids[i], PAGE)
+        latencies.append(time.perf_counter() - t0)
+        assert [e["id"] for e in page] == room_ids[i - PAGE:i], room
+        assert cursor == room_ids[i - PAGE]
+    return latencies
+
+
+def report(label, latencies):
+    us = [x * 1e6 for x in latencies]
+    print(f"{label:<28} p50 {percentile(us, 0.5):>8.0f} us  p99 {percentile(us, 0.99):>8.0f} us  "
+          f"max {max(us):>8.0f} us  mean {statistics.mean(us):>8.0f} us")
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    size = float(args[0]) if args else 2.0
+    fsync = "--no-fsync" not in sys.argv
+    target = int(size * 1024 ** 3)
+    workdir = tempfile.mkdtemp(prefix="bench-chatlog-")
+    try:
+        log = ChatLog(workdir, fsync=fsync)
+        ids, count, call, elapsed = fill(log, target)
+        assert log.dropped == 0, log.dropped
+        on_disk = sum(b for _, _, b in log.stats())
+        print(f"{count:,} messages, {on_disk / 1024 ** 3:.2f} GiB in {ROOMS} rooms, "
+              f"{sum(s for _, s, _ in log.stats())} segments, fsync {'on' if fsync else 'off'}")
+        print(f"append() call: {call / count * 1e9:.0f} ns")
+        print(f"sustained: {count / elapsed:,.0f} msg/s, {on_disk / elapsed / 1e6:.0f} MB/s "
+              f"({elapsed:.1f} s including the final flush)")
+
+        t0 = time.perf_counter()
+        log = ChatLog(workdir, fsync=fsync)
+        print(f"reopen: {(time.perf_counter() - t0) * 1e3:.0f} ms, last id {log.last_id:,}")
+        assert log.last_id == count
+        report(f"random page of {PAGE}, cold", reads(log, ids))
+        report(f"random page of {PAGE}, warm", reads(log, ids))
+        log.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Benchmark: chat messages/sec of the multi-process server vs worker count.
+
+Run from the repository root:
+  python -m benchmarks.bench_cluster [workers,...] [--asyncio]
+
+For each worker count (default 1,2,4) a ClusterServer is started on a
+random port in a temporary directory. Load generator processes open
+CLIENTS connections spread over ROOMS rooms (SO_REUSEPORT scatters them
+over the workers, so every room spans several workers and its messages
+cross the bus). Every client sends MESSAGES chat messages; the receivers
+count the MSG frames delivered to them. Reported: messages sent/s and
+messages delivered/s (each message reaches the other room members).
+
+The load generators run on the same machine: scaling needs more cores
+than workers + load processes (os.cpu_count() is printed).
+"""
+import multiprocessing
+import os
+import selectors
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+CLIENTS = 32
+ROOMS = 4
+MESSAGES = 1500
+LOAD_PROCESSES = 2
+BATCH = 20
+
+_LENGTH = struct.Struct("!I")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def frame(payload):
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def load(port, ids, ready, go, results):
+    socks = []
+    for i in ids:
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(frame(f"LOGIN|bench{i}".encode()) + frame(f"ROOM|room{i % ROOMS}".encode()))
+        socks.append(sock)
+    room_size = CLIENTS // ROOMS
+    expected = len(ids) * (room_size - 1) * MESSAGES
+    ready.release()
+    go.wait()
+
+    batches = {sock: b"".join(frame(f"MSG|message {n} de bench".encode()) for n in range(BATCH)) for sock in socks}
+
+    def send():
+        for _ in range(MESSAGES // BATCH):
+            for sock in socks:
+                sock.sendall(batches[sock])
+
+    start = time.perf_counter()
+    threading.Thread(target=send, daemon=True).start()
+
+    sel = selectors.DefaultSelector()
+    pending = {}
+    for sock in socks:
+        sock.setblocking(False)
+        sel.register(sock, selectors.EVENT_READ)
+        pending[sock] = b""
+    received = 0
+    last = start
+    deadline = start + 120
+    while received < expected and time.perf_counter() < deadline:
+        events = sel.select(timeout=2)
+        if not events and time.perf_counter() - last > 5:
+            break  # nothing more is coming
+        for key, _ in events:
+            sock = key.fileobj
+            try:
+                data = pending[sock] + sock.recv(1 << 18)
+            except BlockingIOError:
+                continue
+            pos = 0
+            while len(data) - pos >= 4:
+                (length,) = _LENGTH.unpack_from(data, pos)
+                if len(data) - pos - 4 < length:
+                    break
+                if data[pos + 4:pos + 8] == b"MSG|":
+                    received += 1
+                pos += 4 + length
+            pending[sock] = data[pos:]
+            last = time.perf_counter()
+    results.put((len(ids) * MESSAGES, received, expected, last - start))
+    for sock in socks:
+        sock.close()
+
+
+def run(workers, engine):
+    import serveur
+
+    port = free_port()
+    cluster = serveur.ClusterServer(workers)
+    cluster.launch(engine=engine, port=port)
+    try:
+        ctx = multiprocessing.get_context("spawn")
+        ready, go, results = ctx.Semaphore(0), ctx.Event(), ctx.Queue()
+        groups = [list(range(CLIENTS))[p::LOAD_PROCESSES] for p in range(LOAD_PROCESSES)]
+        procs = [ctx.Process(target=load, args=(port, ids, ready, go, results)) for ids in groups]
+        for p in procs:
+            p.start()
+        for _ in procs:
+            ready.acquire()
+        time.sleep(1.0)  # joins and bus subscriptions propagated
+        go.set()
+        sent = received = expected = 0
+        elapsed = 0.0
+        for _ in procs:
+            s, r, e, t = results.get()
+            sent, received, expected = sent + s, received + r, expected + e
+            elapsed = max(elapsed, t)
+        for p in procs:
+            p.join()
+    finally:
+        cluster.stop()
+    return sent / elapsed, received / elapsed, received / expected
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    engine = "asyncio" if "--asyncio" in sys.argv else "threads"
+    counts = [int(n) for n in args[0].split(",")] if args else [1, 2, 4]
+    workdir = tempfile.mkdtemp(prefix="bench-cluster-")
+    os.chdir(workdir)  # the server stores into ./downloads
+    # the server is chatty: silence fd 1, inherited by the workers
+    stdout = os.fdopen(os.dup(1), "w")
+    devnull = open(os.devnull, "w")
+    os.dup2(devnull.fileno(), 1)
+    sys.stdout = devnull
+    try:
+        stdout.write(f"{CLIENTS} clients, {ROOMS} rooms, {MESSAGES} messages each, "
+                     f"engine {engine}, {os.cpu_count()} CPU\n")
+        stdout.write(f"{'workers':>7} {'sent msg/s':>11} {'delivered msg/s':>16} {'delivered':>10}\n")
+        base = None
+        for workers in counts:
+            sent, delivered, ratio = run(workers, engine)
+            base = base or delivered
+            stdout.write(f"{workers:>7} {sent:>11,.0f} {delivered:>16,.0f} {ratio:>9.0%}  x{delivered / base:.2f}\n")
+            stdout.flush()
+    finally:
+        os.chdir("/")
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Benchmark of the message codecs (PROTOCOL.md §12).
+
+Run from the repository root:
+  python -m benchmarks.bench_codec
+
+For every structured message the server emits (LOGIN_OK, UPLOAD_ACCEPT,
+FILE_AVAILABLE, FILE_LIST, SEND_FILE, FILE_STREAM header, HISTORY) and the
+requests it receives: bytes on the wire and encode / decode time per
+message, for stdlib json, orjson (when installed) and the struct codec.
+The round trips themselves are checked by tests/test_codec.py.
+"""
+import base64
+import json
+import time
+
+from network import protocol as proto
+
+
+def server_messages():
+    meta = {"filename": "rapport final.pdf", "size": 1_482_113}
+    files = [
+        {"seq": f"{i:032x}", "filename": f"photo_{i}.jpg", "size": 200_000 + i * 37,
+         "uploader": f"user{i % 7}", "uploaded_at": 1_760_000_000 + i}
+        for i in range(50)
+    ]
+    history = [{"id": 1000 + i, "ts": 1_760_000_000.25 + i, "text": f"MSG|user{i % 7}|message numéro {i}"}
+               for i in range(49)]
+    history.append({"id": 1049, "ts": 1_760_000_049.5,
+                    "event": {"type": "FILE_AVAILABLE", "seq": "9f" * 16, "room": "r1",
+                              "meta": meta, "uploader": "alice"}})
+    return [
+        ("LOGIN_OK", {"type": "LOGIN_OK", "compression": "zlib", "codec": "struct"}),
+        ("LOGIN_OK none", {"type": "LOGIN_OK", "compression": None, "codec": "json"}),
+        ("UPLOAD_ACCEPT", {"type": "UPLOAD_ACCEPT", "seq": "9f" * 16, "status": "send", "offset": 1 << 33}),
+        ("UPLOAD_ACCEPT done", {"type": "UPLOAD_ACCEPT", "seq": "9f" * 16, "status": "complete"}),
+        ("FILE_AVAILABLE", {"type": "FILE_AVAILABLE", "seq": "9f" * 16, "room": "général",
+                            "meta": meta, "uploader": "alice"}),
+        ("FILE_LIST", {"type": "FILE_LIST", "room": "r1", "files": files, "next": 1234}),
+        ("FILE_LIST empty", {"type": "FILE_LIST", "room": "r1", "files": [], "next": None}),
+        ("SEND_FILE", {"type": "SEND_FILE", "seq": "9f" * 16, "meta": meta, "offset": 10, "length": 3000,
+                       "data": base64.b64encode(bytes(range(256)) * 12).decode("ascii")}),
+        ("FILE_STREAM", {"type": "FILE_STREAM", "seq": "9f" * 16, "meta": meta}),
+        ("HISTORY", {"type": "HISTORY", "room": "r1", "before": None, "next": 950, "messages": history}),
+    ]
+
+
+def client_messages():
+    return [
+        ("FILE_BEGIN", {"type": "FILE_BEGIN", "seq": "ab" * 16, "room": "r1",
+                        "meta": {"filename": "a.txt", "size": 12}, "sha256": "cd" * 32}),
+        ("FILE_END", {"type": "FILE_END", "seq": "ab" * 16, "sha256": "cd" * 32}),
+        ("GET_FILE", {"type": "GET_FILE", "seq": "ab" * 16, "filename": "a.txt", "stream": True, "offset": 5}),
+        ("LIST_FILES", {"type": "LIST_FILES", "room": "r1", "limit": 50, "before": 99}),
+        ("HISTORY request", {"type": "HISTORY", "room": "r1", "limit": 50, "before": 1000}),
+    ]
+
+
+def best_of(fn, arg, number, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn(arg)
+        elapsed = (time.perf_counter() - start) / number * 1e9
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class StdlibJson(proto.JsonCodec):
+    def encode(self, obj):
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data):
+        return json.loads(str(data, "utf-8"))
+
+
+def benchmark(messages):
+    codecs = [("json", StdlibJson())]
+    if proto.orjson is not None:
+        codecs.append(("orjson", proto.JSON_CODEC))
+    codecs.append(("struct", proto.STRUCT_CODEC))
+    print(f"{'message':<20} {'codec':<7} {'bytes':>7} {'encode ns':>10} {'decode ns':>10}")
+    for name, msg in messages:
+        number = 2000 if name not in ("FILE_LIST", "HISTORY") else 200
+        for label, codec in codecs:
+            encoded = codec.encode(msg)
+            enc = best_of(codec.encode, msg, number)
+            dec = best_of(codec.decode, encoded, number)
+            print(f"{name:<20} {label:<7} {len(encoded):>7} {enc:>10.0f} {dec:>10.0f}")
+
+
+def main():
+    benchmark(server_messages() + client_messages())
+
+
+if __name__ == "__main__":
+    main()
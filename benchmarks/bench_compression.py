@@ -0,0 +1,92 @@
+"""Benchmark: bytes saved and CPU cost of frame compression.
+
+Run from the repository root:
+  python -m benchmarks.bench_compression
+
+Each payload is cut into FILE_CHUNK_SIZE binary frames (upload path) or
+sent as one JSON frame (chat), compressed with PreparedFrame.compressed
+for every available codec and decoded back with decode_typed. Reported
+per payload and codec: bytes on the wire, bytes saved, compression and
+decompression throughput, and how many frames were sent uncompressed
+because they did not shrink (media, archives).
+"""
+import glob
+import json
+import os
+import random
+import time
+import zlib
+
+from network import protocol as proto
+
+
+def payloads():
+    rnd = random.Random(1)
+    words = ["room", "fichier", "message", "bonjour", "upload", "ok", "erreur", "client", "serveur"]
+    chat = {"type": "MSG", "pseudo": "alice", "room": "room-1", "text": "salut tout le monde"}
+    history = [dict(chat, text=" ".join(rnd.choice(words) for _ in range(12)), id=i) for i in range(60)]
+    log = "".join(
+        f"2026-10-18 12:{i // 60 % 60:02d}:{i % 60:02d} INFO session={rnd.randrange(10_000)} "
+        f"room=room-{rnd.randrange(50)} event={rnd.choice(words)} bytes={rnd.randrange(1 << 20)}\n"
+        for i in range(16_000)
+    ).encode()
+    csv = "".join(
+        f"{i},{rnd.choice(words)},{rnd.randrange(1000)},{rnd.random():.6f}\n" for i in range(40_000)
+    ).encode()
+    source = b"".join(open(p, "rb").read() for p in sorted(glob.glob("**/*.py", recursive=True)))
+    media = os.urandom(1 << 20)
+    return [
+        ("chat message (json)", [proto.PreparedFrame.from_json(chat)]),
+        ("history page (json)", [proto.PreparedFrame.from_json({"type": "HISTORY", "messages": history})]),
+        ("server log", chunks(log)),
+        ("csv", chunks(csv)),
+        ("python sources", chunks(source)),
+        ("media (random)", chunks(media)),
+        ("zlib archive", chunks(zlib.compress(csv))),
+    ]
+
+
+def chunks(data):
+    size = proto.FILE_CHUNK_SIZE
+    return [proto.PreparedFrame.binary({"type": "FILE_CHUNK", "seq": "s", "offset": i}, data[i:i + size])
+            for i in range(0, len(data), size)]
+
+
+def decode(frame):
+    body = b"".join(frame.buffers)
+    word = int.from_bytes(body[:4], "big")
+    if not word & proto.TYPED_FLAG:
+        return proto.Frame(proto.KIND_LEGACY, None, body[4:])
+    return proto.decode_typed(body[4], body[5:])
+
+
+def measure(frames, codec):
+    raw = sum(f.size for f in frames)
+    fresh = [proto.PreparedFrame.__new__(proto.PreparedFrame) for _ in frames]
+    for new, old in zip(fresh, frames):
+        new._set(list(old.buffers[1:]), old.kind)  # empty compression cache
+    start = time.perf_counter()
+    packed = [f.compressed(codec) for f in fresh]
+    t_comp = time.perf_counter() - start
+    start = time.perf_counter()
+    for f in packed:
+        decode(f)
+    t_dec = time.perf_counter() - start
+    wire = sum(f.size for f in packed)
+    skipped = sum(1 for f, p in zip(fresh, packed) if p is f)
+    return raw, wire, t_comp, t_dec, skipped
+
+
+def main():
+    print(f"{'payload':<22} {'codec':<5} {'raw':>9} {'wire':>9} {'saved':>6} "
+          f"{'comp MB/s':>10} {'dec MB/s':>9} {'raw frames':>11}")
+    for name, frames in payloads():
+        for codec in proto.CODECS:
+            raw, wire, t_comp, t_dec, skipped = measure(frames, codec)
+            mb = raw / 1e6
+            print(f"{name:<22} {codec:<5} {raw:>9} {wire:>9} {1 - wire / raw:>6.0%} "
+                  f"{mb / t_comp:>10.1f} {mb / max(t_dec, 1e-9):>9.1f} {skipped:>5}/{len(frames):<5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Micro-benchmark: per-message dispatch overhead.
+
+Run from the repository root:
+  python -m benchmarks.bench_dispatch
+
+Compares, for chat text frames (`MSG|...`) and JSON frames (GET_FILE),
+the former dispatch (decode, try json.loads, on failure decode again and
+run ProtocolParser, then an if/elif chain) with network.dispatch, which
+picks the decoder from the first byte and looks the handler up in a
+table. Handlers are no-ops, so only the dispatch cost is measured.
+"""
+import json
+import time
+
+from network import protocol as proto
+from network.dispatch import Dispatcher
+from parser import Message, ProtocolParser
+
+JSON_COMMANDS = ("SEND_FILE", "FILE_CHUNK", "FILE_BEGIN", "FILE_END", "GET_FILE", "LIST_FILES")
+
+
+def noop(ctx, body, frame=None):
+    return None
+
+
+def legacy_dispatch(ctx, frame):
+    # Reference implementation of the former _handle_frame / recevoir pattern.
+    raw = bytes(frame.data)
+    try:
+        payload = json.loads(raw.decode())
+    except Exception:
+        payload = None
+    if isinstance(payload, dict):
+        t = payload.get("type")
+        for name in JSON_COMMANDS:
+            if t == name:
+                return noop(None, payload)
+    msg = ProtocolParser.parse(raw.decode())
+    if msg.command == "MSG":
+        return noop(None, msg)
+    elif msg.command == "ROOM":
+        return noop(None, msg)
+    elif msg.command == "BEGIN_SEQUENCE":
+        return noop(None, msg)
+    elif msg.command == "QUIT":
+        return False
+    return None
+
+
+def build():
+    commands = Dispatcher()
+    for name in ("MSG", "ROOM", "BEGIN_SEQUENCE", "QUIT"):
+        commands.register(name, noop, Message)
+    for name in JSON_COMMANDS:
+        commands.register(name, noop, dict)
+    return commands
+
+
+def timeit(fn, frames, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for frame in frames:
+            fn(None, frame)
+        elapsed = (time.perf_counter() - start) / len(frames) * 1e9
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    commands = build()
+    cases = {
+        "MSG text": [proto.Frame(proto.KIND_LEGACY, None, memoryview(f"MSG|bonjour tout le monde {i}".encode()))
+                     for i in range(50_000)],
+        "GET_FILE json": [proto.Frame(proto.KIND_LEGACY, None, memoryview(proto.encode_json(
+                          {"type": "GET_FILE", "seq": f"{i:032x}", "filename": "doc.pdf", "stream": True})))
+                          for i in range(50_000)],
+    }
+    print(f"{'frame':<15} {'former ns':>10} {'table ns':>9}")
+    for name, frames in cases.items():
+        old = timeit(legacy_dispatch, frames)
+        new = timeit(commands.dispatch, frames)
+        print(f"{name:<15} {old:>10.0f} {new:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
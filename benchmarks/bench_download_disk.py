@@ -0,0 +1,255 @@
+"""Scenario: received files written to disk, verified, renamed without overwriting.
+
+Run from the repository root:
+  python -m benchmarks.bench_download_disk [size_mib]
+
+Starts a server on a random port in a temporary directory and stores a
+size_mib MiB file (default 256), then:
+- downloads it as a FILE_STREAM (the client's default path) and reports
+  the peak of Python memory allocated while receiving it (tracemalloc);
+- downloads a quarter of that size in the old SEND_FILE format (whole file
+  in base64 in JSON) and reports the peak allocated while saving the
+  received message: whole-file decode as before, and save_received_file;
+- feeds receive_file_stream through a socketpair: a body that does not
+  match the announced SHA-256 (no file kept), a connection dropped half
+  way (only the .part, then resumed and verified), and a name already
+  taken in the download folder (kept, the download gets "name (1).ext");
+- receives two different files of the same name at the same time (two
+  seqs): each into its own .part, both verified;
+- commits COMMITS downloads of the same name at once: all names distinct.
+Fails with AssertionError if a check does not hold.
+"""
+import base64
+import hashlib
+import io
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from network import protocol as proto
+
+COMMITS = 8
+
+
+def report(line):
+    # stdout is silenced: the server and the client modules are chatty
+    print(line, file=sys.__stdout__)
+
+
+def store_file(srv, seq, path):
+    size = os.path.getsize(path)
+    srv.uploads.begin(seq, os.path.basename(path), size, room="bench", uploader="bench")
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            srv.uploads.write(seq, chunk)
+    srv.uploads.finish(seq)
+
+
+def write_random(path, size):
+    with open(path, "wb") as f:
+        for _ in range(size // (1024 * 1024)):
+            f.write(os.urandom(1024 * 1024))
+        f.write(os.urandom(size % (1024 * 1024)))
+    return sha256_of(path)
+
+
+def sha256_of(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def connect(port, pseudo):
+    sock = socket.create_connection(("127.0.0.1", port))
+    proto.send_message(sock, f"LOGIN|{pseudo}".encode())
+    return sock
+
+
+def old_save(filename, data_b64, downloads):
+    # save_received_file before: whole file decoded, written to its final name
+    data = base64.b64decode(data_b64)
+    dst = os.path.join(downloads, filename)
+    with open(dst, "wb") as f:
+        f.write(data)
+    return {"success": True, "path": dst}
+
+
+def main():
+    size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 256 * 1024 * 1024
+    workdir = tempfile.mkdtemp(prefix="bench-download-disk-")
+    cwd = os.getcwd()
+    try:
+        scenario(size, workdir)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def scenario(size, workdir):
+    os.chdir(workdir)  # the server stores into ./downloads
+    sys.stdout = io.StringIO()
+    import serveur
+    import telechargement as dl
+
+    srv = serveur.CustomServer(chatlog_dir=os.path.join(workdir, "chatlog"))
+    listener = socket.create_server(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    threading.Thread(target=srv._run_socket_server, args=(listener,), daemon=True).start()
+
+    big = os.path.join(workdir, "big.bin")
+    digest = write_random(big, size)
+    store_file(srv, "big", big)
+    legacy_size = size // 4
+    small = os.path.join(workdir, "legacy.bin")
+    legacy_digest = write_random(small, legacy_size)
+    store_file(srv, "legacy", small)
+    report(f"{size >> 20} MiB file as FILE_STREAM, {legacy_size >> 20} MiB as SEND_FILE base64")
+
+    # ---- FILE_STREAM: constant memory ----
+    downloads = os.path.join(workdir, "client")
+    sock = connect(port, "stream")
+    reader = proto.FrameReader(sock)
+    dl.request_file_download(sock, "big", "big.bin", downloads)
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    while True:
+        frame = reader.read_frame()
+        if frame.kind == proto.KIND_STREAM:
+            result = dl.receive_file_stream(reader, frame.header, downloads)
+            break
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    sock.close()
+    assert result["success"] and sha256_of(result["path"]) == digest, result
+    report(f"stream     peak {peak / 2 ** 20:7.2f} MiB  {size / elapsed / 1e6:6.0f} MB/s "
+           f"(SHA-256 checked before the rename)")
+
+    # ---- SEND_FILE base64: decoded by slices ----
+    sock = connect(port, "legacy")
+    reader = proto.FrameReader(sock)
+    proto.send_json(sock, {"type": "GET_FILE", "seq": "legacy", "filename": "legacy.bin"})
+    while True:
+        payload = json.loads(bytes(reader.read_frame().data))
+        if payload.get("type") == "SEND_FILE":
+            break
+    sock.close()
+    assert payload.get("sha256") == legacy_digest
+    for label, save in (("before", lambda: old_save("legacy.bin", payload["data"], downloads)),
+                        ("sliced", lambda: dl.save_received_file("legacy.bin", payload["data"], downloads,
+                                                                 sha256=payload["sha256"]))):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        result = save()
+        elapsed = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert result["success"] and sha256_of(result["path"]) == legacy_digest, result
+        os.remove(result["path"])
+        report(f"base64 {label}  peak {peak / 2 ** 20:7.2f} MiB  {elapsed:5.2f} s  (message itself: "
+               f"{len(payload['data']) / 2 ** 20:.0f} MiB)")
+
+    # ---- integrity, interruption and names, through a socketpair ----
+    body = os.urandom(4 * 1024 * 1024)
+    body_digest = hashlib.sha256(body).hexdigest()
+    meta = {"filename": "doc.bin", "size": len(body)}
+    final = os.path.join(downloads, "doc.bin")
+    partial = final + dl.PARTIAL_SUFFIX
+
+    def feed(header, data, cut=None):
+        a, b = socket.socketpair()
+
+        def send():
+            a.sendall(data[:cut])
+            a.close()
+
+        threading.Thread(target=send, daemon=True).start()
+        try:
+            return dl.receive_file_stream(b, dict(header, meta=meta), downloads)
+        finally:
+            b.close()
+
+    result = feed({"offset": 0, "length": len(body), "sha256": "0" * 64}, body)
+    assert not result["success"] and not os.path.exists(final) and not os.path.exists(partial), result
+    report("corrupt    rejected: checksum invalid, neither the file nor its .part kept")
+
+    half = len(body) // 2
+    try:
+        feed({"offset": 0, "length": len(body), "sha256": body_digest}, body, cut=half)
+        raise AssertionError("the cut connection should raise")
+    except ConnectionError:
+        pass
+    assert not os.path.exists(final) and os.path.getsize(partial) == half
+    result = feed({"offset": half, "length": len(body) - half, "sha256": body_digest}, body[half:])
+    assert result["success"] and result["path"] == final and sha256_of(final) == body_digest, result
+    report(f"cut        at {half >> 20} MiB: only the .part on disk, resumed from it and verified")
+
+    with open(final, "wb") as f:
+        f.write(b"somebody else's document")
+    result = feed({"offset": 0, "length": len(body), "sha256": body_digest}, body)
+    assert result["path"] == os.path.join(downloads, "doc (1).bin"), result
+    with open(final, "rb") as f:
+        assert f.read() == b"somebody else's document"
+    report(f"collision  existing doc.bin kept, received as {os.path.basename(result['path'])}")
+
+    # ---- two files of the same name received at once ----
+    twins = {seq: os.urandom(8 * 1024 * 1024) for seq in ("twin-a", "twin-b")}
+    results = {}
+
+    def receive(seq, data):
+        a, b = socket.socketpair()
+        header = {"seq": seq, "offset": 0, "length": len(data), "sha256": hashlib.sha256(data).hexdigest(),
+                  "meta": {"filename": "twin.bin", "size": len(data)}}
+        threading.Thread(target=lambda: (a.sendall(data), a.close()), daemon=True).start()
+        try:
+            results[seq] = dl.receive_file_stream(b, header, downloads)
+        finally:
+            b.close()
+
+    threads = [threading.Thread(target=receive, args=item) for item in twins.items()]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(r["success"] for r in results.values()), results
+    assert len({r["path"] for r in results.values()}) == 2
+    for seq, data in twins.items():
+        with open(results[seq]["path"], "rb") as f:
+            assert f.read() == data, seq
+    report("same name  2 files named twin.bin at once: one .part each, both verified")
+
+    # ---- the same name committed by several downloads at once ----
+    folder = os.path.join(workdir, "same-name")
+    os.makedirs(folder)
+    parts = []
+    for i in range(COMMITS):
+        parts.append(os.path.join(folder, f"part-{i}"))
+        with open(parts[-1], "wb") as f:
+            f.write(str(i).encode())
+    barrier = threading.Barrier(COMMITS)
+    names = []
+
+    def commit(part):
+        barrier.wait()
+        names.append(dl._commit_download(part, folder, "same.txt"))
+
+    threads = [threading.Thread(target=commit, args=(p,)) for p in parts]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    contents = sorted(open(n, "rb").read() for n in names)
+    assert len(set(names)) == COMMITS and contents == sorted(str(i).encode() for i in range(COMMITS))
+    report(f"concurrent {COMMITS} downloads of same.txt: {COMMITS} distinct files, none overwritten")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Benchmark: per-recipient CPU cost of broadcast encoding.
+
+Run from the repository root:
+  python -m benchmarks.bench_fanout
+
+"before" reproduces the former path (json.dumps + encode + length prefix +
+concatenation for each recipient, then sendall). "after" builds one
+PreparedFrame and sends its header/payload buffers with sendmsg.
+Recipients are connected socketpairs drained by a background thread, so
+the send syscalls are included.
+"""
+import json
+import socket
+import struct
+import threading
+import time
+
+from network import protocol as proto
+
+
+def legacy_send_json(sock, obj):
+    payload = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    sock.sendall(struct.pack("!I", len(payload)) + payload)
+
+
+def drain(sock):
+    try:
+        while sock.recv(1 << 20):
+            pass
+    except OSError:
+        pass
+
+
+def make_recipients(n):
+    pairs = [socket.socketpair() for _ in range(n)]
+    for _, remote in pairs:
+        threading.Thread(target=drain, args=(remote,), daemon=True).start()
+    return pairs
+
+
+def measure(fn, rounds):
+    start = time.process_time()
+    for _ in range(rounds):
+        fn()
+    return time.process_time() - start
+
+
+def main():
+    members = 500
+    pairs = make_recipients(members)
+    socks = [local for local, _ in pairs]
+
+    cases = {
+        "FILE_AVAILABLE": {
+            "type": "FILE_AVAILABLE", "seq": "3f2a9c", "room": "room1",
+            "meta": {"filename": "installer.msi", "size": 524288000}, "uploader": "alice",
+        },
+        "JSON 64 KiB": {"type": "NOTE", "room": "room1", "data": "x" * 65536},
+    }
+
+    print(f"{members} recipients, CPU µs per recipient (process_time)")
+    print(f"{'message':>16} {'before':>10} {'after':>10} {'speedup':>8}")
+    for name, obj in cases.items():
+        rounds = 20
+
+        def before():
+            for s in socks:
+                legacy_send_json(s, obj)
+
+        def after():
+            frame = proto.PreparedFrame.from_json(obj)
+            for s in socks:
+                proto.send_frame(s, frame)
+
+        t_before = measure(before, rounds) / (rounds * members) * 1e6
+        t_after = measure(after, rounds) / (rounds * members) * 1e6
+        print(f"{name:>16} {t_before:>10.2f} {t_after:>10.2f} {t_before / t_after:>7.1f}x")
+
+    for local, remote in pairs:
+        local.close()
+        remote.close()
+
+
+if __name__ == "__main__":
+    main()
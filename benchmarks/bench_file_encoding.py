@@ -0,0 +1,94 @@
+"""Benchmark: file transfer throughput, base64-in-JSON vs binary frames.
+
+Run from the repository root:
+  python -m benchmarks.bench_file_encoding
+
+Each case streams the same random payload over a socketpair, sender and
+receiver in separate threads, including all encode/decode work:
+- upload: 64 KiB FILE_CHUNK messages (streaming SEND_FILE path)
+- GET_FILE: one SEND_FILE response carrying the whole file
+"""
+import base64
+import os
+import socket
+import threading
+import time
+
+from network import protocol as proto
+
+
+def run(send, recv):
+    a, b = socket.socketpair()
+    received = []
+    reader = threading.Thread(target=lambda: received.append(recv(b)))
+    start = time.perf_counter()
+    reader.start()
+    send(a)
+    reader.join()
+    elapsed = time.perf_counter() - start
+    a.close()
+    b.close()
+    return elapsed, received[0]
+
+
+def upload_cases(data):
+    chunks = [data[i:i + proto.FILE_CHUNK_SIZE] for i in range(0, len(data), proto.FILE_CHUNK_SIZE)]
+
+    def send_b64(sock):
+        for c in chunks:
+            proto.send_json(sock, {"type": "FILE_CHUNK", "seq": "s", "data": base64.b64encode(c).decode("ascii")})
+
+    def recv_b64(sock):
+        total = 0
+        for _ in chunks:
+            total += len(base64.b64decode(proto.recv_json(sock)["data"]))
+        return total
+
+    def send_raw(sock):
+        for c in chunks:
+            proto.send_binary(sock, {"type": "FILE_CHUNK", "seq": "s"}, c)
+
+    def recv_raw(sock):
+        total = 0
+        for _ in chunks:
+            total += len(proto.recv_frame(sock).data)
+        return total
+
+    return (send_b64, recv_b64), (send_raw, recv_raw)
+
+
+def get_file_cases(data):
+    meta = {"filename": "f.bin", "size": len(data)}
+
+    def send_b64(sock):
+        proto.send_json(sock, {"type": "SEND_FILE", "seq": "s", "meta": meta, "data": base64.b64encode(data).decode("ascii")})
+
+    def recv_b64(sock):
+        return len(base64.b64decode(proto.recv_json(sock)["data"]))
+
+    def send_raw(sock):
+        proto.send_binary(sock, {"type": "SEND_FILE", "seq": "s", "meta": meta}, data)
+
+    def recv_raw(sock):
+        return len(proto.recv_frame(sock).data)
+
+    return (send_b64, recv_b64), (send_raw, recv_raw)
+
+
+def main():
+    size = 64 * 1024 * 1024
+    data = os.urandom(size)
+    mb = size / (1024 * 1024)
+    print(f"payload {mb:.0f} MiB, throughput in MiB/s of file data")
+    print(f"{'path':>10} {'base64+JSON':>12} {'binary':>10}")
+    for name, cases in (("upload", upload_cases(data)), ("GET_FILE", get_file_cases(data))):
+        rates = []
+        for send, recv in cases:
+            elapsed, total = run(send, recv)
+            assert total == size
+            rates.append(mb / elapsed)
+        print(f"{name:>10} {rates[0]:>12.1f} {rates[1]:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
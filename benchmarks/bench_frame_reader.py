@@ -0,0 +1,103 @@
+"""Benchmark: frames/sec for small messages, recv_frame vs FrameReader.
+
+Run from the repository root:
+  python -m benchmarks.bench_frame_reader
+
+A sender thread writes a burst of small chat frames (`MSG|pseudo|text`) to
+a socketpair in large writes; the receiver decodes them either with
+recv_frame (two recv calls and two copies per frame) or with one
+FrameReader (recv_into a reusable buffer, memoryview frames).
+
+Before timing, the FrameReader output is checked against the encoded
+frames on a stream of mixed kinds and sizes delivered in random-size
+pieces, so frames split across reads and many frames per read are both
+exercised.
+"""
+import random
+import socket
+import threading
+import time
+
+from network import protocol as proto
+
+
+class ChoppedSocket:
+    """Delivers a byte string through recv_into in random-size pieces."""
+
+    def __init__(self, data, rnd):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.rnd = rnd
+
+    def recv_into(self, buffer, nbytes=0):
+        n = min(nbytes or len(buffer), self.rnd.randint(1, 70_000), len(self.data) - self.pos)
+        buffer[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+def check_reader():
+    rnd = random.Random(7)
+    frames, expected = [], []
+    for i in range(3000):
+        size = rnd.choice((0, 1, 30, 500, 20_000, 70_000, 300_000))
+        data = rnd.randbytes(size) if hasattr(rnd, "randbytes") else bytes(rnd.getrandbits(8) for _ in range(size))
+        kind = rnd.choice(("legacy", "binary", "compressed"))
+        if kind == "legacy":
+            frame = proto.PreparedFrame(data)
+        elif kind == "binary":
+            frame = proto.PreparedFrame.binary({"type": "FILE_CHUNK", "i": i}, data)
+        else:
+            frame = proto.PreparedFrame(b"MSG|a|" + b"x" * size).compressed("zlib")
+            data = b"MSG|a|" + b"x" * size
+        frames.append(b"".join(frame.buffers))
+        expected.append(data)
+    reader = proto.FrameReader(ChoppedSocket(b"".join(frames), rnd))
+    for data in expected:
+        assert bytes(reader.read_frame().data) == data
+    print(f"FrameReader: {len(expected)} frames of mixed sizes decoded correctly")
+
+
+def run(count, decode):
+    a, b = socket.socketpair()
+    payloads = [f"MSG|user{i % 50}|bonjour tout le monde {i}".encode() for i in range(1000)]
+    batch = b"".join(b"".join(proto.PreparedFrame(p).buffers) for p in payloads)
+
+    def send():
+        for _ in range(count // len(payloads)):
+            a.sendall(batch)
+
+    sender = threading.Thread(target=send)
+    start = time.perf_counter()
+    sender.start()
+    decode(b, count)
+    elapsed = time.perf_counter() - start
+    sender.join()
+    a.close()
+    b.close()
+    return count / elapsed
+
+
+def with_recv_frame(sock, count):
+    for _ in range(count):
+        bytes(proto.recv_frame(sock).data)
+
+
+def with_reader(sock, count):
+    reader = proto.FrameReader(sock)
+    for _ in range(count):
+        bytes(reader.read_frame().data)
+
+
+def main():
+    check_reader()
+    count = 300_000
+    old = run(count, with_recv_frame)
+    new = run(count, with_reader)
+    print(f"{count} small frames")
+    print(f"  recv_frame  : {old:>12,.0f} frames/s")
+    print(f"  FrameReader : {new:>12,.0f} frames/s  (x{new / old:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""Benchmark: chat latency while other clients upload and download files.
+
+Run from the repository root:
+  python -m benchmarks.bench_iopool [seconds] [--threads]
+
+Starts a server in a child process (asyncio engine, or threads) and, for
+`seconds` (default 10):
+- UPLOADERS clients send FILE_MIB MiB files in the old SEND_FILE format
+  (whole file in base64 in JSON), back to back;
+- DOWNLOADERS clients fetch a FILE_MIB MiB file with GET_FILE without
+  "stream" (base64 in JSON), back to back;
+- a chat client sends a MSG every CHAT_INTERVAL to a room where a second
+  client measures the delay until it receives it.
+Twice: disk and codec work on the I/O pool, then inline in the connection
+handler as before the pool (_submit_io replaced by a direct call in the
+server process). Reports the chat latency, the files stored and sent, and
+for the pool its highest queue length / busy workers and the wait times.
+Fails with AssertionError if the pool queue grows past its bound plus one
+task per connection (asyncio: the task submitted before the read pauses).
+"""
+import base64
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from network import protocol as proto
+from network.dispatch import decode_frame
+
+UPLOADERS = 4
+DOWNLOADERS = 4
+FILE_MIB = 8
+CHAT_INTERVAL = 0.02
+SEQ = "bench-iopool"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def serve(workdir, engine, inline, ready, control):
+    import builtins
+    builtins.print = lambda *a, **k: None  # server traces
+    os.chdir(workdir)
+    import serveur
+    srv = serveur.CustomServer(chatlog_dir=os.path.join(workdir, "chatlog"))
+    if inline:
+        srv._submit_io = lambda session, fn, *args: fn(*args)
+    data = os.urandom(FILE_MIB * 1024 * 1024)
+    srv.uploads.begin(SEQ, "download.bin", len(data), room="bench", uploader="bench")
+    srv.uploads.write(SEQ, data)
+    srv.uploads.finish(SEQ)
+    peak = {"queued": 0, "busy": 0}
+
+    def sample():
+        while True:
+            stats = srv.io_stats()
+            peak["queued"] = max(peak["queued"], stats["queued"])
+            peak["busy"] = max(peak["busy"], stats["busy"])
+            time.sleep(0.005)
+
+    def answer():
+        control.recv()
+        control.send(dict(srv.io_stats(), peak_queued=peak["queued"], peak_busy=peak["busy"],
+                          io_queue=serveur.IO_QUEUE))
+
+    threading.Thread(target=sample, daemon=True).start()
+    threading.Thread(target=answer, daemon=True).start()
+    listener = socket.create_server(("127.0.0.1", 0), backlog=64)
+    ready.put(listener.getsockname()[1])
+    srv.runner(engine)(listener)
+
+
+def connect(port, name, room):
+    sock = socket.create_connection(("127.0.0.1", port))
+    proto.send_message(sock, f"LOGIN|{name}".encode())
+    proto.send_message(sock, f"ROOM|{room}".encode())
+    return sock
+
+
+def drain(sock, on_frame, stop):
+    reader = proto.FrameReader(sock)
+    try:
+        while not stop.is_set():
+            command, body = decode_frame(reader.read_frame())
+            on_frame(command, body)
+    except (OSError, ValueError):
+        pass
+
+
+def uploader(port, i, stop):
+    sock = connect(port, f"up{i}", "io")
+    threading.Thread(target=drain, args=(sock, lambda c, b: None, stop), daemon=True).start()
+    n = 0
+    while not stop.is_set():
+        data = base64.b64encode(os.urandom(FILE_MIB * 1024 * 1024)).decode("ascii")
+        proto.send_json(sock, {"type": "SEND_FILE", "seq": f"up{i}-{n}",
+                               "meta": {"filename": f"up{i}-{n}.bin"}, "data": data})
+        n += 1
+
+
+def downloader(port, i, stop, sent):
+    sock = connect(port, f"down{i}", "files")
+    reader = proto.FrameReader(sock)
+    # HISTORY and SYSTEM received first: a reply larger than the outbox limit
+    # behind them would disconnect the client as a slow consumer
+    while decode_frame(reader.read_frame())[0] != "SYSTEM":
+        pass
+    while not stop.is_set():
+        proto.send_json(sock, {"type": "GET_FILE", "seq": SEQ, "filename": "download.bin"})
+        while True:
+            command, body = decode_frame(reader.read_frame())
+            if command == "SEND_FILE":
+                assert len(base64.b64decode(body["data"])) == FILE_MIB * 1024 * 1024
+                with sent.get_lock():
+                    sent.value += 1
+                break
+
+
+def load(port, stop, stored, sent):
+    """Load process: uploaders, downloaders and an observer counting FILE_AVAILABLE."""
+    def on_frame(command, body):
+        if command == "FILE_AVAILABLE":
+            with stored.get_lock():
+                stored.value += 1
+
+    # FILE_AVAILABLE skips the uploader: counted by an observer of the room
+    observer = connect(port, "observer", "io")
+    threads = [threading.Thread(target=drain, args=(observer, on_frame, stop))]
+    threads += [threading.Thread(target=uploader, args=(port, i, stop)) for i in range(UPLOADERS)]
+    threads += [threading.Thread(target=downloader, args=(port, i, stop, sent)) for i in range(DOWNLOADERS)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    stop.wait()
+
+
+def run(ctx, port, seconds):
+    """Chat pair in this process, the file traffic in a load process."""
+    stop = threading.Event()
+    latencies = []
+    receiver = connect(port, "receiver", "chat")
+
+    def on_chat(command, body):
+        if command == "MSG" and len(body.args) == 2:
+            latencies.append(time.perf_counter() - float(body.args[1]))
+
+    threading.Thread(target=drain, args=(receiver, on_chat, stop), daemon=True).start()
+    chat = connect(port, "chatter", "chat")
+    load_stop = ctx.Event()
+    stored, sent = ctx.Value("i", 0), ctx.Value("i", 0)
+    loader = ctx.Process(target=load, args=(port, load_stop, stored, sent), daemon=True)
+    loader.start()
+    time.sleep(1.0)  # load running
+    latencies.clear()
+    stored_before, sent_before = stored.value, sent.value
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        proto.send_message(chat, f"MSG|{time.perf_counter()!r}".encode())
+        time.sleep(CHAT_INTERVAL)
+    counts = {"stored": stored.value - stored_before, "sent": sent.value - sent_before}
+    time.sleep(0.5)
+    stop.set()
+    load_stop.set()
+    loader.terminate()
+    return latencies, counts
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    seconds = float(args[0]) if args else 10.0
+    engine = "threads" if "--threads" in sys.argv else "asyncio"
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{engine} server, {UPLOADERS} uploaders + {DOWNLOADERS} downloaders of {FILE_MIB} MiB files "
+          f"(base64 in JSON), 1 chat message every {CHAT_INTERVAL * 1e3:.0f} ms, {seconds:.0f} s")
+    for label, inline in (("I/O pool", False), ("inline", True)):
+        workdir = tempfile.mkdtemp(prefix="bench-iopool-")
+        ready = ctx.Queue()
+        control, child_control = ctx.Pipe()
+        server = ctx.Process(target=serve, args=(workdir, engine, inline, ready, child_control), daemon=True)
+        server.start()
+        try:
+            port = ready.get(timeout=60)
+            latencies, counts = run(ctx, port, seconds)
+            control.send("stats")
+            stats = control.recv()
+        finally:
+            server.terminate()
+            shutil.rmtree(workdir, ignore_errors=True)
+        ms = [x * 1e3 for x in latencies]
+        print(f"{label:<9} chat p50 {percentile(ms, 0.5):7.1f} ms  p99 {percentile(ms, 0.99):7.1f} ms  "
+              f"max {max(ms):7.1f} ms  ({len(ms)} msgs)  files stored {counts['stored']:3}  "
+              f"sent {counts['sent']:3}")
+        if not inline:
+            print(f"{'':<9} pool: queue <= {stats['peak_queued']} (bound {stats['io_queue']}), "
+                  f"busy <= {stats['peak_busy']}/{stats['workers']}, full {stats['blocked']} times, "
+                  f"wait avg {stats['wait_avg_ms']:.1f} ms  p99 {stats['wait_p99_ms']:.1f} ms  "
+                  f"max {stats['wait_max_ms']:.1f} ms")
+            assert stats["peak_queued"] <= stats["io_queue"] + UPLOADERS + DOWNLOADERS + 3, stats
+
+
+if __name__ == "__main__":
+    main()
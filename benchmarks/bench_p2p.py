@@ -0,0 +1,192 @@
+"""Benchmark: direct (P2P) file transfer between two clients vs server relay.
+
+Run from the repository root:
+  python -m benchmarks.bench_p2p [size_mib]
+
+Starts a server (threads engine) behind a TCP proxy that counts every byte
+the server receives or sends, then, for each mode, two client processes
+that join the same room: a recipient, and a sender that sends it a
+size_mib MiB file (default 64) with send_file_to_member:
+- relay: direct transfers disabled (P2P_MIN_SIZE above the file size), the
+  file is uploaded to the server and downloaded from it;
+- direct: the server only brokers P2P_INVITE, the file goes from the
+  sender's listening socket to the recipient;
+- fallback: the recipient is given a closed port, reports P2P_FAILED and
+  the sender falls back to the relay.
+Reports the time until the recipient has the file, the bytes through the
+server and its average bandwidth. Fails with AssertionError if the file
+received differs, or if the direct mode sent the file through the server.
+"""
+import multiprocessing
+import os
+import queue
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import serveur
+import telechargement as dl
+from network import protocol as proto
+from network.dispatch import decode_frame
+
+TIMEOUT = 120
+
+
+class CountingProxy:
+    """Forwards connections to the server and counts the bytes both ways."""
+
+    def __init__(self, server_port):
+        self.server_port = server_port
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        self.bytes = 0
+        self._lock = threading.Lock()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            client, _ = self.listener.accept()
+            upstream = socket.create_connection(("127.0.0.1", self.server_port))
+            for src, dst in ((client, upstream), (upstream, client)):
+                threading.Thread(target=self._pump, args=(src, dst), daemon=True).start()
+
+    def _pump(self, src, dst):
+        buf = bytearray(256 * 1024)
+        try:
+            while True:
+                n = src.recv_into(buf)
+                if not n:
+                    break
+                dst.sendall(memoryview(buf)[:n])
+                with self._lock:
+                    self.bytes += n
+        except OSError:
+            pass
+        finally:
+            for s in (src, dst):
+                try:
+                    s.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+def client(name, port, mode, path, downloads, results):
+    """Client process: recipient when path is None, sender otherwise."""
+    import builtins
+    builtins.print = lambda *a, **k: None  # traces of the client modules
+    if mode == "relay":
+        dl.P2P_MIN_SIZE = 1 << 62
+    sock = socket.create_connection(("127.0.0.1", port))
+    proto.send_message(sock, f"LOGIN|{name}".encode())
+    proto.send_message(sock, b"ROOM|bench")
+
+    def on_invite(invite):
+        if mode == "fallback":
+            closed = socket.create_server(("127.0.0.1", 0))
+            invite = dict(invite, peer={"ip": "127.0.0.1", "port": closed.getsockname()[1]})
+            closed.close()
+        result = dl.receive_file_p2p(sock, invite, downloads)
+        if result["success"]:
+            results.put(("received", result["path"], time.perf_counter()))
+
+    def receive():
+        reader = proto.FrameReader(sock)
+        while True:
+            command, body = decode_frame(reader.read_frame())
+            if command == "UPLOAD_ACCEPT":
+                dl.handle_upload_accept(body)
+            elif command == "P2P_INVITE" and body.get("role") == "caller":
+                threading.Thread(target=on_invite, args=(body,), daemon=True).start()
+            elif command == "P2P_INVITE":
+                dl.handle_p2p_invite(body)
+            elif command == "P2P_FAILED":
+                dl.handle_p2p_failed(body)
+            elif command == "FILE_AVAILABLE" and body.get("to"):
+                dl.request_file_download(sock, body["seq"], body["meta"]["filename"], downloads)
+            elif command == "FILE_STREAM":
+                result = dl.receive_file_stream(reader, body, downloads)
+                if result["success"] and not result["path"].endswith(dl.PARTIAL_SUFFIX):
+                    results.put(("received", result["path"], time.perf_counter()))
+
+    threading.Thread(target=receive, daemon=True).start()
+    if path is None:
+        time.sleep(0.3)  # in the room before the sender starts
+        results.put(("ready", name, None))
+        time.sleep(TIMEOUT)
+        return
+    time.sleep(0.3)
+    start = time.perf_counter()
+    result = dl.send_file_to_member(sock, "bench", "recipient-" + mode, path)
+    results.put(("sent", result, start))
+    time.sleep(TIMEOUT)
+
+
+def run_mode(mode, proxy, path, workdir):
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    downloads = os.path.join(workdir, "recv-" + mode)
+    recipient = ctx.Process(target=client, args=("recipient-" + mode, proxy.port, mode, None, downloads, results),
+                            daemon=True)
+    recipient.start()
+    assert results.get(timeout=30)[0] == "ready"
+    before = proxy.bytes
+    sender = ctx.Process(target=client, args=("sender-" + mode, proxy.port, mode, path, downloads, results),
+                         daemon=True)
+    sender.start()
+    sent = received = None
+    try:
+        while sent is None or received is None:
+            kind, value, at = results.get(timeout=TIMEOUT)
+            if kind == "sent":
+                sent, start = value, at
+            elif kind == "received":
+                received, end = value, at
+    except queue.Empty:
+        raise AssertionError(f"{mode}: transfer not finished after {TIMEOUT} s (sent={sent})")
+    finally:
+        time.sleep(0.2)
+        server_bytes = proxy.bytes - before
+        for p in (sender, recipient):
+            p.terminate()
+    assert sent["success"], sent
+    assert dl.file_sha256(received) == dl.file_sha256(path), mode
+    return end - start, server_bytes, sent["p2p"]
+
+
+def main():
+    size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 64 * 1024 * 1024
+    workdir = tempfile.mkdtemp(prefix="bench-p2p-")
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)  # store of the server: ./downloads
+        import builtins
+        print_ = builtins.print
+        builtins.print = lambda *a, **k: None  # server traces
+        srv = serveur.CustomServer(chatlog_dir=os.path.join(workdir, "chatlog"))
+        listener = socket.create_server(("127.0.0.1", 0))
+        threading.Thread(target=srv._run_socket_server, args=(listener,), daemon=True).start()
+        proxy = CountingProxy(listener.getsockname()[1])
+        print_(f"file: {size / 1024 ** 2:.0f} MiB, sender -> recipient in one room, localhost")
+        for mode in ("relay", "direct", "fallback"):
+            # new content each time: the server store deduplicates uploads
+            path = os.path.join(workdir, f"payload-{mode}.bin")
+            with open(path, "wb") as f:
+                for _ in range(size // (1024 * 1024)):
+                    f.write(os.urandom(1024 * 1024))
+            elapsed, server_bytes, p2p = run_mode(mode, proxy, path, workdir)
+            print_(f"{mode:<9} {elapsed:6.2f} s  server traffic {server_bytes / 1024 ** 2:8.1f} MiB  "
+                   f"({server_bytes / elapsed / 1e6:7.1f} MB/s)  direct={p2p}")
+            if mode == "direct":
+                assert p2p and server_bytes < size // 100, server_bytes
+            else:
+                assert not p2p and server_bytes >= 2 * size, server_bytes
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
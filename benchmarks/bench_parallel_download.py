@@ -0,0 +1,171 @@
+"""Benchmark: download of a large file over K parallel data connections.
+
+Run from the repository root:
+  python -m benchmarks.bench_parallel_download [size_mib] [--asyncio] [--cap=MBps]
+
+Starts a server in a child process (threads engine, or asyncio) whose store
+holds a size_mib MiB file (default 256), logs in on a control connection to
+get the data token of LOGIN_OK, then downloads the file:
+- single stream: one GET_FILE stream on the control connection, received
+  with receive_file_stream (the client's default path);
+- download_file_parallel with K = 1, 2, 4, 8 data connections, 8 MiB
+  ranges written at their position in the preallocated file.
+Each download is verified against the SHA-256 of the file (included in the
+parallel timings, which check it before renaming the file). Reports the
+throughput of each run (best of REPEAT).
+
+On localhost one sendfile stream is not limited by the link, unlike a
+long fat network where a TCP stream is capped by window / RTT. --cap=MBps
+puts a proxy in front of the server that limits each connection to MBps
+(server to client) to emulate such a link.
+"""
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import telechargement as dl
+from network import protocol as proto
+
+REPEAT = 3
+SEQ = "bench-parallel"
+
+
+def serve(workdir, path, engine, ready):
+    import builtins
+    builtins.print = lambda *a, **k: None  # server traces
+    os.chdir(workdir)
+    import serveur
+    srv = serveur.CustomServer(chatlog_dir=os.path.join(workdir, "chatlog"))
+    size = os.path.getsize(path)
+    srv.uploads.begin(SEQ, os.path.basename(path), size, room="bench", uploader="bench")
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(proto.FILE_CHUNK_SIZE * 16)
+            if not chunk:
+                break
+            srv.uploads.write(SEQ, chunk)
+    srv.uploads.finish(SEQ)
+    listener = socket.create_server(("127.0.0.1", 0))
+    ready.put(listener.getsockname()[1])
+    srv.runner(engine)(listener)
+
+
+class CappedProxy:
+    """Forwards connections to the server, each limited to `rate` bytes/s downstream."""
+
+    def __init__(self, server_port, rate):
+        self.server_port = server_port
+        self.rate = rate
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            client, _ = self.listener.accept()
+            upstream = socket.create_connection(("127.0.0.1", self.server_port))
+            threading.Thread(target=self._pump, args=(client, upstream, None), daemon=True).start()
+            threading.Thread(target=self._pump, args=(upstream, client, self.rate), daemon=True).start()
+
+    @staticmethod
+    def _pump(src, dst, rate):
+        buf = bytearray(64 * 1024)
+        start = time.perf_counter()
+        sent = 0
+        try:
+            while True:
+                n = src.recv_into(buf)
+                if not n:
+                    break
+                dst.sendall(memoryview(buf)[:n])
+                if rate:
+                    sent += n
+                    delay = start + sent / rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+        except OSError:
+            pass
+        finally:
+            for s in (src, dst):
+                try:
+                    s.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+def single_stream(port, filename, downloads):
+    sock = socket.create_connection(("127.0.0.1", port))
+    proto.send_message(sock, b"LOGIN|bench-single")
+    dl.request_file_download(sock, SEQ, filename, downloads)
+    reader = proto.FrameReader(sock)
+    while True:
+        frame = reader.read_frame()
+        if frame.kind == proto.KIND_STREAM:
+            result = dl.receive_file_stream(reader, frame.header, downloads)
+            break
+    sock.close()
+    return result
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    size = int(float(args[0]) * 1024 * 1024) if args else 256 * 1024 * 1024
+    engine = "asyncio" if "--asyncio" in sys.argv else "threads"
+    cap = [float(a.split("=", 1)[1]) * 1e6 for a in sys.argv[1:] if a.startswith("--cap=")]
+    workdir = tempfile.mkdtemp(prefix="bench-parallel-")
+    ctx = multiprocessing.get_context("spawn")
+    server = None
+    try:
+        path = os.path.join(workdir, "payload.bin")
+        with open(path, "wb") as f:
+            for _ in range(size // (1024 * 1024)):
+                f.write(os.urandom(1024 * 1024))
+        digest = dl.file_sha256(path)
+        ready = ctx.Queue()
+        server = ctx.Process(target=serve, args=(workdir, path, engine, ready), daemon=True)
+        server.start()
+        port = ready.get(timeout=120)
+        if cap:
+            port = CappedProxy(port, cap[0]).port
+
+        import builtins
+        print_ = builtins.print
+        builtins.print = lambda *a, **k: None  # client traces
+        control = socket.create_connection(("127.0.0.1", port))
+        proto.send_message(control, b"LOGIN|bench|zlib|json")
+        login_ok = proto.recv_json(control)
+        token = login_ok["data_token"]
+        downloads = os.path.join(workdir, "recv")
+        link = f"connections capped at {cap[0] / 1e6:.0f} MB/s" if cap else "localhost"
+        print_(f"{size / 1024 ** 2:.0f} MiB file, {engine} server, {link}, best of {REPEAT}")
+
+        def measure(label, download):
+            best = None
+            for _ in range(REPEAT):
+                shutil.rmtree(downloads, ignore_errors=True)
+                t0 = time.perf_counter()
+                result = download()
+                elapsed = time.perf_counter() - t0
+                assert result["success"], result
+                assert dl.file_sha256(result["path"]) == digest, label
+                best = elapsed if best is None else min(best, elapsed)
+            print_(f"{label:<22} {best:6.2f} s  {size / best / 1e6:8.0f} MB/s")
+
+        measure("single stream", lambda: single_stream(port, "payload.bin", downloads))
+        for k in (1, 2, 4, 8):
+            measure(f"parallel, K={k}", lambda: dl.download_file_parallel(
+                "127.0.0.1", port, token, SEQ, "payload.bin", connections=k, downloads_dir=downloads))
+        control.close()
+    finally:
+        if server is not None:
+            server.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Scenario: interrupted upload and download, resumed on a new connection.
+
+Run from the repository root:
+  python -m benchmarks.bench_resume [size_mib]
+
+Starts a server on a random port in a temporary directory, then:
+- uploads a file through a socket that is killed once half of the file has
+  been sent, reconnects and sends it again: the retry must only send the
+  bytes the server does not have yet, and the stored file must match;
+- downloads it through a socket killed after a third of the body, then
+  asks again: only the missing range is streamed into the .part file.
+Prints the bytes sent by each attempt and fails with AssertionError if a
+retry resends data or the result differs from the original.
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from network import protocol as proto
+
+
+class KilledSocket:
+    """Socket wrapper that kills the connection after `limit` bytes."""
+
+    def __init__(self, sock, send_limit=None, recv_limit=None):
+        self.sock = sock
+        self.send_limit = send_limit
+        self.recv_limit = recv_limit
+        self.sent = 0
+        self.received = 0
+
+    def _kill(self):
+        self.sock.shutdown(socket.SHUT_RDWR)
+        raise ConnectionResetError("connexion coupée (scénario)")
+
+    def sendmsg(self, buffers):
+        if self.send_limit is not None and self.sent >= self.send_limit:
+            self._kill()
+        n = self.sock.sendmsg(buffers)
+        self.sent += n
+        return n
+
+    def sendall(self, data):
+        self.sendmsg([data])
+
+    def recv(self, n):
+        return self.sock.recv(n)
+
+    def recv_into(self, buf, n=0):
+        if self.recv_limit is not None and self.received >= self.recv_limit:
+            self._kill()
+        n = self.sock.recv_into(buf, n)
+        self.received += n
+        return n
+
+
+def connect(port, pseudo, room):
+    sock = socket.create_connection(("127.0.0.1", port))
+    proto.send_message(sock, f"LOGIN|{pseudo}".encode())
+    proto.send_message(sock, f"ROOM|{room}".encode())
+    return sock
+
+
+def start_receiver(sock, dl, downloads, results):
+    def run():
+        try:
+            while True:
+                frame = proto.recv_frame(sock)
+                if frame.kind == proto.KIND_STREAM:
+                    results.append(dl.receive_file_stream(sock, frame.header, downloads))
+                    continue
+                raw = bytes(frame.data)
+                if raw.startswith(b"{"):
+                    payload = json.loads(raw)
+                    if payload.get("type") == "UPLOAD_ACCEPT":
+                        dl.handle_upload_accept(payload)
+        except (ConnectionError, OSError) as ex:
+            results.append(ex)
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    return t
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timeout")
+        time.sleep(0.01)
+
+
+def sha256_of(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def report(line):
+    # stdout is silenced: the server and the client modules are chatty
+    print(line, file=sys.__stdout__)
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 * 1024 if len(sys.argv) > 1 else 64 * 1024 * 1024
+    workdir = tempfile.mkdtemp(prefix="bench-resume-")
+    try:
+        scenario(size, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def scenario(size, workdir):
+    os.chdir(workdir)  # the server stores into ./downloads
+    sys.stdout = io.StringIO()
+    import serveur
+    import telechargement as dl
+
+    srv = serveur.CustomServer()
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    port = listener.getsockname()[1]
+    threading.Thread(target=srv._run_socket_server, args=(listener,), daemon=True).start()
+
+    src = os.path.join(workdir, "source.bin")
+    with open(src, "wb") as f:
+        f.write(os.urandom(size))
+    digest = sha256_of(src)
+
+    # ---- upload, killed half way ----
+    sock = connect(port, "alice", "r1")
+    start_receiver(sock, dl, None, [])
+    killed = KilledSocket(sock, send_limit=size // 2)
+    try:
+        dl.send_file_to_room(killed, "r1", src, seq="resume-1")
+        raise AssertionError("la connexion aurait dû être coupée")
+    except ConnectionError:
+        pass
+    report(f"upload 1 : {killed.sent:>11} octets envoyés, connexion coupée")
+    wait_for(lambda: srv.uploads.get("resume-1") is not None and srv.uploads.get("resume-1").owner is None)
+    kept = srv.uploads.get("resume-1").received
+
+    sock = connect(port, "alice", "r1")
+    start_receiver(sock, dl, None, [])
+    result = dl.send_file_to_room(sock, "r1", src)
+    report(f"upload 2 : {result['sent']:>11} octets envoyés (serveur avait {kept})")
+    assert result["success"] and result["sent"] == size - kept, result
+    wait_for(lambda: srv.store.get_record("resume-1") is not None)
+    assert srv.store.get_record("resume-1")["sha256"] == digest
+    sock.close()
+
+    # ---- download, killed after a third ----
+    downloads = os.path.join(workdir, "client")
+    results = []
+    sock = connect(port, "bob", "r1")
+    killed = KilledSocket(sock, recv_limit=size // 3)
+    start_receiver(killed, dl, downloads, results)
+    dl.request_file_download(sock, "resume-1", "source.bin", downloads)
+    wait_for(lambda: results)
+    partial = os.path.getsize(dl._partial_path(downloads, "source.bin", "resume-1"))
+    report(f"download 1 : {killed.received:>9} octets reçus, connexion coupée ({partial} sur disque)")
+    assert isinstance(results[0], ConnectionError), results
+
+    results = []
+    sock = connect(port, "bob", "r1")
+    counter = KilledSocket(sock)
+    start_receiver(counter, dl, downloads, results)
+    dl.request_file_download(sock, "resume-1", "source.bin", downloads)
+    wait_for(lambda: results)
+    report(f"download 2 : {counter.received:>9} octets reçus (reprise à {partial})")
+    assert results[0]["success"], results
+    assert counter.received < size - partial + 4096
+    assert sha256_of(os.path.join(downloads, "source.bin")) == digest
+    report("OK: fichiers identiques, seuls les octets manquants ont été renvoyés")
+
+
+if __name__ == "__main__":
+    main()
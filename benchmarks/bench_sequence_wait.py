@@ -0,0 +1,149 @@
+"""Benchmark: waking up on a sequence completion, threaded vs asyncio.
+
+Run from the repository root:
+  python -m benchmarks.bench_sequence_wait [rounds]
+
+A completer thread completes the sequences (as the receive thread does with
+UPLOAD_ACCEPT). For each way of waiting, measures the latency from the
+complete_sequence() call to the moment the waiter runs again:
+- callback: add_done_callback, runs on the completer thread (lower bound);
+- wait(): a thread blocked on the sequence's threading.Event;
+- Future.result(): concurrent.futures.Future from future();
+- await: an asyncio future of a loop running on another thread, resolved
+  through call_soon_threadsafe.
+Each round is one sequence at a time; the completer gives the waiter a
+moment to block first. Then, for BATCH sequences completed in a burst,
+the time from the last completion to the return of wait_all() vs
+wait_all_async().
+"""
+import asyncio
+import queue
+import sys
+import threading
+import time
+
+from network.state_machine import IntermediateStateManager
+
+BATCH = 10_000
+SETTLE = 0.0002  # the waiter blocks before the completion
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Completer(threading.Thread):
+    def __init__(self, mgr):
+        super().__init__(daemon=True)
+        self.mgr = mgr
+        self.todo = queue.Queue()
+        self.sent_at = {}
+
+    def run(self):
+        while True:
+            seq_ids = self.todo.get()
+            time.sleep(SETTLE)
+            for seq_id in seq_ids:
+                self.sent_at[seq_id] = time.perf_counter()
+                assert self.mgr.complete_sequence(seq_id, {"seq": seq_id})
+
+
+def run_callback(mgr, completer, rounds):
+    latencies = []
+    woken = threading.Event()
+
+    def done(seq_id, state, result):
+        latencies.append(time.perf_counter() - completer.sent_at[seq_id])
+        woken.set()
+
+    for i in range(rounds):
+        seq_id = f"cb-{i}"
+        woken.clear()
+        mgr.begin_sequence(seq_id)
+        mgr.add_done_callback(seq_id, done)
+        completer.todo.put([seq_id])
+        woken.wait()
+    return latencies
+
+
+def run_wait(mgr, completer, rounds):
+    latencies = []
+    for i in range(rounds):
+        seq_id = f"wait-{i}"
+        mgr.begin_sequence(seq_id)
+        completer.todo.put([seq_id])
+        assert mgr.wait(seq_id) == {"seq": seq_id}
+        latencies.append(time.perf_counter() - completer.sent_at[seq_id])
+    return latencies
+
+
+def run_future(mgr, completer, rounds):
+    latencies = []
+    for i in range(rounds):
+        seq_id = f"fut-{i}"
+        fut = mgr.begin_sequence(seq_id, future=True)
+        completer.todo.put([seq_id])
+        assert fut.result() == {"seq": seq_id}
+        latencies.append(time.perf_counter() - completer.sent_at[seq_id])
+    return latencies
+
+
+def run_await(mgr, completer, rounds):
+    async def main():
+        loop = asyncio.get_running_loop()
+        latencies = []
+        for i in range(rounds):
+            seq_id = f"aw-{i}"
+            fut = mgr.begin_sequence(seq_id, loop=loop)
+            completer.todo.put([seq_id])
+            assert await fut == {"seq": seq_id}
+            latencies.append(time.perf_counter() - completer.sent_at[seq_id])
+        return latencies
+
+    return asyncio.run(main())
+
+
+def batch_wait_all(mgr, completer):
+    seq_ids = [f"batch-{i}" for i in range(BATCH)]
+    for seq_id in seq_ids:
+        mgr.begin_sequence(seq_id)
+    completer.todo.put(seq_ids)
+    done, pending = mgr.wait_all(seq_ids, timeout=30)
+    woke = time.perf_counter()
+    assert len(done) == BATCH and not pending
+    return woke - completer.sent_at[seq_ids[-1]]
+
+
+def batch_wait_all_async(mgr, completer):
+    async def main():
+        seq_ids = [f"abatch-{i}" for i in range(BATCH)]
+        for seq_id in seq_ids:
+            mgr.begin_sequence(seq_id)
+        completer.todo.put(seq_ids)
+        done, pending = await mgr.wait_all_async(seq_ids, timeout=30)
+        woke = time.perf_counter()
+        assert len(done) == BATCH and not pending
+        return woke - completer.sent_at[seq_ids[-1]]
+
+    return asyncio.run(main())
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    mgr = IntermediateStateManager(finished_ttl=5.0)
+    completer = Completer(mgr)
+    completer.start()
+    print(f"{rounds:,} sequences per way of waiting, completed by another thread")
+    for label, run in (("callback", run_callback), ("wait()", run_wait),
+                       ("Future.result()", run_future), ("await (asyncio)", run_await)):
+        us = [x * 1e6 for x in run(mgr, completer, rounds)]
+        print(f"{label:<18} p50 {percentile(us, 0.5):>6.1f} us  p99 {percentile(us, 0.99):>7.1f} us  "
+              f"max {max(us):>8.1f} us")
+    print(f"{BATCH:,} sequences completed in a burst, last completion -> return:")
+    print(f"{'wait_all()':<18} {batch_wait_all(mgr, completer) * 1e3:>6.2f} ms")
+    print(f"{'wait_all_async()':<18} {batch_wait_all_async(mgr, completer) * 1e3:>6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
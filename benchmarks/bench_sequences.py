@@ -0,0 +1,97 @@
+"""Benchmark: 100k concurrent sequences on one timer thread.
+
+Run from the repository root:
+  python -m benchmarks.bench_sequences [count]
+
+Begins `count` sequences (default 100k) on an IntermediateStateManager with
+random timeouts of 1 to 3 seconds. Half of them are completed before their
+timeout by callbacks scheduled on the same Scheduler (as the server's
+simulated processing), WAITERS threads block in wait() on some of them,
+the others time out. Reports the begin rate, how late timeouts fire
+(lateness of on_timeout after the deadline), the number of threads alive
+during the run. That every sequence ends exactly once and that nothing
+is left behind is checked by tests/test_sequences.py.
+"""
+import random
+import sys
+import threading
+import time
+
+from network.state_machine import IntermediateStateManager
+from network.timers import Scheduler
+
+WAITERS = 4
+WAITED = 500  # sequences per waiter thread
+FINISHED_TTL = 10.0  # waiters reach every entry before it is forgotten
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rnd = random.Random(5)
+    threads_before = threading.active_count()
+    scheduler = Scheduler()
+    mgr = IntermediateStateManager(scheduler, finished_ttl=FINISHED_TTL)
+    deadlines = {}
+    lateness = []
+    timed_out = []
+    completed = []
+    lock = threading.Lock()
+
+    def on_timeout(seq_id):
+        late = time.monotonic() - deadlines[seq_id]
+        with lock:
+            lateness.append(late)
+            timed_out.append(seq_id)
+
+    def complete(seq_id):
+        if mgr.complete_sequence(seq_id, {"seq": seq_id}):
+            with lock:
+                completed.append(seq_id)
+
+    seqs = [f"seq-{i}" for i in range(count)]
+    to_complete = set(rnd.sample(seqs, count // 2))
+    start = time.perf_counter()
+    for seq_id in seqs:
+        timeout = rnd.uniform(1.0, 3.0)
+        deadlines[seq_id] = time.monotonic() + timeout
+        mgr.begin_sequence(seq_id, timeout, on_timeout=on_timeout)
+        if seq_id in to_complete:
+            scheduler.call_later(timeout * rnd.uniform(0.1, 0.9), complete, seq_id)
+    begin_elapsed = time.perf_counter() - start
+    print(f"{count:,} sequences begun in {begin_elapsed * 1e3:.0f} ms "
+          f"({count / begin_elapsed:,.0f} seq/s), {len(scheduler):,} timers pending")
+
+    waited = {}
+
+    def waiter(ids):
+        for seq_id in ids:
+            waited[seq_id] = mgr.wait(seq_id)
+
+    waited_ids = rnd.sample(seqs, WAITERS * WAITED)
+    waiters = [threading.Thread(target=waiter, args=(waited_ids[i::WAITERS],)) for i in range(WAITERS)]
+    for t in waiters:
+        t.start()
+    peak_threads = threading.active_count()
+    while len(completed) + len(timed_out) < count and time.perf_counter() - start < 60:
+        peak_threads = max(peak_threads, threading.active_count())
+        time.sleep(0.05)
+    for t in waiters:
+        t.join()
+    resolved = time.perf_counter() - start
+
+    print(f"resolved in {resolved:.2f} s: {len(completed):,} completed, {len(timed_out):,} timed out, "
+          f"{len(waited):,} waited by {WAITERS} threads")
+    ms = [x * 1e3 for x in lateness]
+    print(f"timeout lateness: p50 {percentile(ms, 0.5):.1f} ms  p99 {percentile(ms, 0.99):.1f} ms  "
+          f"max {max(ms):.1f} ms")
+    print(f"threads: {threads_before} before, {peak_threads} at most during the run "
+          f"(1 timer thread + {WAITERS} waiters)")
+
+
+if __name__ == "__main__":
+    main()
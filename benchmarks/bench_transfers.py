@@ -0,0 +1,339 @@
+"""Benchmark: chat while the client uploads files in the background.
+
+Run from the repository root:
+  python -m benchmarks.bench_transfers [file_mib] [--asyncio] [--cap=MBps]
+
+Starts a server in a child process (threads engine, or asyncio), behind a
+proxy that limits each connection to CAP_MBPS MB/s from client to server
+(--cap=0: localhost, where an upload is too quick to matter). A client
+"alice" shares UPLOADS files of file_mib MiB (default 32) in a room while
+the user types a chat message every CHAT_INTERVAL; "bob", in the same
+room, measures the delay until each message arrives. Three ways to run the
+uploads:
+- inline: send_file_to_room in the UI handler, as client.py before the
+  transfer manager; the messages typed meanwhile wait for the upload;
+- threads: one thread per upload on the shared socket, chat from the UI
+  thread, no sender: frames written by several threads can interleave
+  (SO_SNDBUF is reduced so that partial sends happen on localhost);
+- manager: TransferManager (TRANSFER_CONCURRENCY at a time) on a
+  SocketSender, chat from the UI thread.
+Reports the chat latency, the files stored by the server (checked against
+their SHA-256) and, for the manager, the peak of running transfers and the
+progress notifications. Then, with the manager: cancels an upload half way
+and checks that the server dropped the partial file, that chat still goes
+through and that the same file can be sent again; downloads a file over the
+data connections with progress; and fails with AssertionError on any
+mismatch.
+"""
+import collections
+import hashlib
+import io
+import multiprocessing
+import os
+import queue
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.bench_parallel_download import CappedProxy
+from network import protocol as proto
+from network.dispatch import decode_frame
+
+UPLOADS = 4
+CAP_MBPS = 40
+CHAT_INTERVAL = 0.02
+SNDBUF = 32 * 1024
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def report(line):
+    # stdout is silenced: the client modules are chatty
+    print(line, file=sys.__stdout__)
+
+
+def serve(workdir, engine, ready, control):
+    import builtins
+    builtins.print = lambda *a, **k: None  # server traces
+    os.chdir(workdir)
+    import serveur
+    srv = serveur.CustomServer(chatlog_dir=os.path.join(workdir, "chatlog"))
+
+    def answer():
+        while True:
+            control.recv()
+            parts = [n for n in os.listdir("downloads") if n.endswith(".part")] if os.path.isdir("downloads") else []
+            records = [r["sha256"] for r in srv.store.list_room("files", None, 1000)[0]]
+            control.send({"uploads": len(srv.uploads._uploads), "parts": parts, "stored": records})
+
+    threading.Thread(target=answer, daemon=True).start()
+    listener = socket.create_server(("127.0.0.1", 0), backlog=64)
+    ready.put(listener.getsockname()[1])
+    srv.runner(engine)(listener)
+
+
+class UplinkProxy(CappedProxy):
+    """CappedProxy limiting the client to server direction (uploads)."""
+
+    def _accept(self):
+        while True:
+            client, _ = self.listener.accept()
+            upstream = socket.create_connection(("127.0.0.1", self.server_port))
+            threading.Thread(target=self._pump, args=(client, upstream, self.rate), daemon=True).start()
+            threading.Thread(target=self._pump, args=(upstream, client, None), daemon=True).start()
+
+
+class Client:
+    """Control connection with a receive thread, as client.py."""
+
+    def __init__(self, port, pseudo, dl, sender=False, on_msg=None, sndbuf=None):
+        sock = socket.create_connection(("127.0.0.1", port))
+        if sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+        self.sock = dl.SocketSender(sock) if sender else sock
+        self.dl = dl
+        self.on_msg = on_msg
+        self.login_ok = threading.Event()
+        self.available = []
+        self.closed = None
+        self.data_token = None
+        proto.send_message(self.sock, f"LOGIN|{pseudo}|{','.join(proto.CODECS)}|json".encode())
+        proto.send_message(self.sock, b"ROOM|files")
+        threading.Thread(target=self._receive, daemon=True).start()
+        self.login_ok.wait(10)
+
+    def _receive(self):
+        reader = proto.FrameReader(self.sock)
+        try:
+            while True:
+                command, body = decode_frame(reader.read_frame())
+                if command == "LOGIN_OK":
+                    self.data_token = body["data_token"]
+                    self.login_ok.set()
+                elif command == "UPLOAD_ACCEPT":
+                    self.dl.handle_upload_accept(body)
+                elif command == "FILE_AVAILABLE":
+                    self.available.append(body)
+                elif command == "MSG" and self.on_msg is not None:
+                    self.on_msg(body)
+        except (OSError, ValueError) as ex:
+            self.closed = ex
+
+
+def server_state(control):
+    control.send("state")
+    return control.recv()
+
+
+def chat_latency(port, dl, mode, files, control):
+    latencies = []
+    received = []
+
+    def on_msg(body):
+        if len(body.args) == 2 and body.args[1].startswith("t="):
+            received.append(body.args[1])
+            latencies.append(time.perf_counter() - float(body.args[1][2:]))
+
+    bob = Client(port, f"bob-{mode}", dl, on_msg=on_msg)
+    alice = Client(port, f"alice-{mode}", dl, sender=mode == "manager",
+                   sndbuf=SNDBUF if mode == "threads" else None)
+    typed = queue.Queue()
+    done = threading.Event()
+
+    def typist():
+        # the user types while the files are sent
+        while not done.is_set():
+            typed.put(f"t={time.perf_counter()!r}")
+            time.sleep(CHAT_INTERVAL)
+
+    def send_typed(wait=None):
+        # what has been typed, after waiting up to `wait` seconds for a message
+        try:
+            text = typed.get(timeout=wait) if wait else typed.get_nowait()
+            while True:
+                proto.send_message(alice.sock, f"MSG|{text}".encode())
+                text = typed.get_nowait()
+        except queue.Empty:
+            return
+
+    stats = {"peak": 0, "notifications": 0}
+    before = len(server_state(control)["stored"])
+    threading.Thread(target=typist, daemon=True).start()
+    start = time.perf_counter()
+    try:
+        if mode == "inline":
+            for path in files:
+                dl.send_file_to_room(alice.sock, "files", path)
+                send_typed()
+        elif mode == "threads":
+            def upload(path):
+                try:
+                    dl.send_file_to_room(alice.sock, "files", path)
+                except OSError as ex:
+                    stats["error"] = ex
+
+            uploads = [threading.Thread(target=upload, args=(path,), daemon=True) for path in files]
+            for t in uploads:
+                t.start()
+            while any(t.is_alive() for t in uploads) and alice.closed is None:
+                send_typed(0.05)
+        else:
+            def on_update(transfer):
+                stats["notifications"] += 1
+                running = sum(1 for t in manager.transfers() if t.state == "running")
+                stats["peak"] = max(stats["peak"], running)
+
+            manager = dl.TransferManager(on_update=on_update)
+            for path in files:
+                manager.upload(alice.sock, "files", path)
+            while any(t.active for t in manager.transfers()):
+                send_typed(0.05)
+            stats["transfers"] = manager.transfers()
+    except (OSError, ConnectionError) as ex:
+        stats["error"] = ex
+    elapsed = time.perf_counter() - start
+    done.set()
+    send_typed()
+    time.sleep(1.0)
+    stored = server_state(control)["stored"]
+    stored = stored[:len(stored) - before]  # newest first
+    stats["received"] = len(received)
+    alice.sock.close()
+    bob.sock.close()
+    return latencies, elapsed, stored, stats, alice
+
+
+def sha256_of(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timeout")
+        time.sleep(0.01)
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    size = int(args[0]) * 1024 * 1024 if args else 32 * 1024 * 1024
+    engine = "asyncio" if "--asyncio" in sys.argv else "threads"
+    cap = [float(a.split("=", 1)[1]) for a in sys.argv[1:] if a.startswith("--cap=")]
+    cap = cap[0] if cap else CAP_MBPS
+    workdir = tempfile.mkdtemp(prefix="bench-transfers-")
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Queue()
+    control, child_control = ctx.Pipe()
+    server = ctx.Process(target=serve, args=(os.path.join(workdir, "server"), engine, ready, child_control),
+                         daemon=True)
+    os.makedirs(os.path.join(workdir, "server"))
+    server.start()
+    try:
+        port = ready.get(timeout=60)
+        if cap:
+            port = UplinkProxy(port, cap * 1e6).port
+        sys.stdout = io.StringIO()
+        import telechargement as dl
+        scenario(dl, port, size, workdir, f"{engine} server, uploads capped at {cap:.0f} MB/s" if cap
+                 else f"{engine} server on localhost", control)
+    finally:
+        sys.stdout = sys.__stdout__
+        server.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def scenario(dl, port, size, workdir, setup, control):
+    files = []
+    for i in range(UPLOADS):
+        path = os.path.join(workdir, f"share-{i}.bin")
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+        files.append(path)
+    digests = collections.Counter(sha256_of(p) for p in files)
+    report(f"{setup}, {UPLOADS} uploads of {size >> 20} MiB, 1 chat message every "
+           f"{CHAT_INTERVAL * 1e3:.0f} ms, SO_SNDBUF {SNDBUF >> 10} KiB for threads, "
+           f"manager: {dl.TRANSFER_CONCURRENCY} at a time")
+
+    for mode in ("inline", "threads", "manager"):
+        for path in files:
+            # new content each run: otherwise the server skips it (status complete)
+            with open(path, "r+b") as f:
+                f.write(os.urandom(16))
+        digests = collections.Counter(sha256_of(p) for p in files)
+        latencies, elapsed, stored, stats, alice = chat_latency(port, dl, mode, files, control)
+        ok = collections.Counter(stored) == digests
+        ms = [x * 1e3 for x in latencies] or [float("nan")]
+        line = (f"{mode:<8} uploads {elapsed:6.2f} s  chat p50 {percentile(ms, 0.5):7.1f} ms  "
+                f"p99 {percentile(ms, 0.99):7.1f} ms  max {max(ms):7.1f} ms  "
+                f"({stats['received']} msgs)  files stored {len(stored)}/{UPLOADS} "
+                f"{'ok' if ok else 'MISMATCH'}")
+        if alice.closed is not None or "error" in stats:
+            line += f"  connection lost: {stats.get('error') or alice.closed}"
+        report(line)
+        if mode == "manager":
+            throughput = sum(t.throughput for t in stats["transfers"]) / len(stats["transfers"])
+            report(f"{'':<8} running <= {stats['peak']} (limit {dl.TRANSFER_CONCURRENCY}), "
+                   f"{stats['notifications']} progress notifications, {throughput / 1e6:.0f} MB/s per transfer")
+            assert ok, "manager: stored files differ from the sent ones"
+            assert stats["peak"] <= dl.TRANSFER_CONCURRENCY, stats
+            assert all(t.state == "done" and t.progress == 1.0 for t in stats["transfers"])
+
+    # ---- cancel half way, then the same file again ----
+    big = os.path.join(workdir, "cancel.bin")
+    with open(big, "wb") as f:
+        f.write(os.urandom(4 * size))
+    got = []
+    bob = Client(port, "bob-cancel", dl, on_msg=lambda body: got.append(body.args[-1]))
+    alice = Client(port, "alice-cancel", dl, sender=True)
+    manager = dl.TransferManager()
+    baseline = server_state(control)  # partial uploads left by the threads run
+    transfer = manager.upload(alice.sock, "files", big)
+    wait_for(lambda: transfer.progress >= 0.5, timeout=60)
+    t0 = time.perf_counter()
+    manager.cancel(transfer.id)
+    wait_for(lambda: not transfer.active)
+    cancel_ms = (time.perf_counter() - t0) * 1e3
+    proto.send_message(alice.sock, b"MSG|after-cancel")
+    wait_for(lambda: "after-cancel" in got)
+    wait_for(lambda: server_state(control)["uploads"] == baseline["uploads"])
+    state = server_state(control)
+    assert transfer.state == "cancelled" and state["parts"] == baseline["parts"], (transfer.state, state)
+    report(f"cancel   at {transfer.progress:.0%}: stopped in {cancel_ms:.1f} ms, "
+           f"server dropped the partial file, chat still delivered")
+    again = manager.upload(alice.sock, "files", big)
+    wait_for(lambda: not again.active, timeout=120)
+    assert again.state == "done" and again.result["sent"] == os.path.getsize(big), (again.state, again.message)
+    wait_for(lambda: any(a["meta"]["filename"] == "cancel.bin" for a in bob.available))
+    report(f"resend   {again.result['sent'] >> 20} MiB sent from the start, "
+           f"{again.throughput / 1e6:.0f} MB/s, stored")
+
+    # ---- download over the data connections, with progress ----
+    seen = []
+    manager = dl.TransferManager(on_update=lambda t: seen.append((t.state, t.done)))
+    downloads = os.path.join(workdir, "client")
+    record = next(a for a in bob.available if a["meta"]["filename"] == "cancel.bin")
+    down = manager.download("127.0.0.1", port, bob.data_token, record["seq"], "cancel.bin",
+                            downloads_dir=downloads)
+    wait_for(lambda: not down.active, timeout=120)
+    assert down.state == "done", down.message
+    assert sha256_of(os.path.join(downloads, "cancel.bin")) == sha256_of(big)
+    steps = sum(1 for state, _ in seen if state == "running")
+    report(f"download {down.size >> 20} MiB in {down.finished - down.started:.2f} s "
+           f"({down.throughput / 1e6:.0f} MB/s), {steps} progress notifications, checksum ok")
+    alice.sock.close()
+    bob.sock.close()
+
+
+if __name__ == "__main__":
+    main()
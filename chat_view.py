@@ -0,0 +1,215 @@
+"""
+Fil de messages du client : fenêtre bornée de contrôles sur un stock compact.
+
+Chaque message est gardé sous forme d'un tuple (type, champs...) dans un
+stock borné (STORE_MAX messages, les plus anciens oubliés, rechargeables
+par HISTORY). Seule une fenêtre d'au plus WINDOW messages existe sous forme
+de contrôles Flet, dans la liste `controls` du ListView : l'arbre comparé à
+chaque page.update() ne grandit pas avec la durée de la session.
+
+    view = ChatView(listview.controls, render)
+    view.append(("msg", "alice", "salut"))   # en bas (suivi du bas)
+    view.scroll_up()                         # PAGE messages plus anciens en haut
+    view.prepend(entries)                    # page d'historique reçue du serveur
+
+Le module n'importe pas flet : `render(entry)` construit le contrôle.
+Toutes les méthodes prennent `view.lock`, à tenir aussi pendant
+page.update() (le thread de réception modifie la liste).
+"""
+import collections
+import itertools
+import threading
+import time
+
+# messages gardés en mémoire ; au-delà les plus anciens sont oubliés
+STORE_MAX = 10_000
+# contrôles rendus au plus
+WINDOW = 200
+# messages rendus à chaque remontée (ou descente) de la fenêtre
+PAGE = 50
+# au plus un page.update() par intervalle (secondes)
+UPDATE_INTERVAL = 1 / 30
+
+
+class ChatView:
+    def __init__(self, controls, render, store_max=STORE_MAX, window=WINDOW, page=PAGE):
+        if window < page:
+            raise ValueError("window doit contenir au moins une page")
+        self.controls = controls
+        self.render = render
+        self.store_max = store_max
+        self.window = window
+        self.page = page
+        self.lock = threading.RLock()
+        self._store = collections.deque()
+        # indices absolus : _first celui de _store[0], fenêtre rendue [_start, _end)
+        self._first = 0
+        self._start = 0
+        self._end = 0
+        self.unseen = 0  # messages arrivés pendant la lecture de messages plus anciens
+        # des messages ont été oubliés (STORE_MAX) : une page HISTORY plus
+        # ancienne laisserait un trou, le haut du stock est définitif
+        self.truncated = False
+
+    def __len__(self):
+        return len(self._store)
+
+    @property
+    def following(self):
+        """True quand la fenêtre montre les derniers messages (les nouveaux s'y ajoutent)."""
+        return self._end == self._first + len(self._store)
+
+    @property
+    def at_top(self):
+        """True quand le message le plus ancien du stock est rendu."""
+        return self._start == self._first
+
+    def clear(self):
+        with self.lock:
+            self._store.clear()
+            self.controls.clear()
+            self._first = self._start = self._end = 0
+            self.unseen = 0
+            self.truncated = False
+
+    def append(self, entry):
+        """Nouveau message, en bas."""
+        with self.lock:
+            following = self.following
+            self._store.append(entry)
+            if following:
+                self.controls.append(self.render(entry))
+                self._end += 1
+                self._trim_top()
+            else:
+                self.unseen += 1
+            self._evict()
+
+    def extend(self, entries):
+        with self.lock:
+            for entry in entries:
+                self.append(entry)
+
+    def prepend(self, entries):
+        """Page plus ancienne (HISTORY), au-dessus du stock.
+
+        Retourne False quand le stock est plein : la page est tronquée et
+        rien de plus ancien ne peut être chargé."""
+        with self.lock:
+            entries = list(entries)
+            room = max(0, self.store_max - len(self._store))
+            full = len(entries) > room
+            if full:
+                entries = entries[len(entries) - room:]
+            at_top = self.at_top
+            self._store.extendleft(reversed(entries))
+            self._first -= len(entries)
+            if at_top:
+                # la fenêtre était en haut : la page reçue s'affiche tout de suite
+                self._show_older(len(entries))
+            return not full
+
+    def scroll_up(self):
+        """Rend PAGE messages plus anciens en haut de la fenêtre.
+
+        Retourne False si le haut du stock est déjà rendu (page suivante à
+        demander au serveur)."""
+        with self.lock:
+            if self.at_top:
+                return False
+            self._show_older(self.page)
+            return True
+
+    def scroll_down(self):
+        """Rend PAGE messages plus récents en bas de la fenêtre (lecture de l'historique)."""
+        with self.lock:
+            if self.following:
+                return False
+            count = min(self.page, self._first + len(self._store) - self._end)
+            self.controls.extend(map(self.render, self._slice(self._end, self._end + count)))
+            self._end += count
+            self._trim_top()
+            if self.following:
+                self.unseen = 0
+            return True
+
+    def scroll_to_end(self):
+        """Revient aux derniers messages."""
+        with self.lock:
+            if self.following:
+                return
+            self._end = self._first + len(self._store)
+            self._start = max(self._first, self._end - self.window)
+            self.controls[:] = map(self.render, self._slice(self._start, self._end))
+            self.unseen = 0
+
+    def _show_older(self, count):
+        count = min(count, self._start - self._first)
+        if not count:
+            return
+        self.controls[0:0] = map(self.render, self._slice(self._start - count, self._start))
+        self._start -= count
+        excess = self._end - self._start - self.window
+        if excess > 0:
+            del self.controls[-excess:]
+            self._end -= excess
+
+    def _trim_top(self):
+        excess = self._end - self._start - self.window
+        if excess > 0:
+            del self.controls[:excess]
+            self._start += excess
+
+    def _evict(self):
+        excess = len(self._store) - self.store_max
+        if excess <= 0:
+            return
+        for _ in range(excess):
+            self._store.popleft()
+        self._first += excess
+        self.truncated = True
+        if self._start < self._first:
+            # haut de la fenêtre oublié (lecture d'anciens messages pendant un flot)
+            del self.controls[:min(self._first, self._end) - self._start]
+            self._start = self._first
+            self._end = max(self._end, self._first)
+
+    def _slice(self, start, end):
+        return itertools.islice(self._store, start - self._first, end - self._first)
+
+
+class UpdateCoalescer:
+    """Regroupe les demandes de rafraîchissement : au plus un appel à
+    `update` par `interval`, sur un thread dédié.
+
+    request() ne bloque jamais : un flot de messages reçus donne un
+    page.update() toutes les `interval` secondes, pas un par message."""
+
+    def __init__(self, update, interval=UPDATE_INTERVAL):
+        self.update = update
+        self.interval = interval
+        self.updates = 0  # appels à update (statistique)
+        self._dirty = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="ui-update", daemon=True)
+        self._thread.start()
+
+    def request(self):
+        self._dirty.set()
+
+    def close(self):
+        self._closed = True
+        self._dirty.set()
+
+    def _run(self):
+        while True:
+            self._dirty.wait()
+            if self._closed:
+                return
+            self._dirty.clear()
+            try:
+                self.update()
+            except Exception as ex:
+                print(f"[CLIENT] Erreur rafraîchissement: {ex}")
+            self.updates += 1
+            time.sleep(self.interval)
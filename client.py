@@ -1,12 +1,21 @@
+import collections
+import os
 import socket
 import threading
 import flet as ft
 from network import protocol as proto
-import json
+from network.dispatch import Dispatcher
+from parser import Message, ProtocolParser, ProtocolError
 import telechargement as dl
+from chat_view import ChatView, UpdateCoalescer
 
 SERVER_IP = "127.0.0.1"
 SERVER_PORT = 54321
+# distance (pixels) au bord du fil de messages qui déclenche le chargement
+# des messages plus anciens (en haut) ou plus récents (en bas)
+SCROLL_EDGE = 40
+# transferts affichés (les plus récents)
+TRANSFERS_SHOWN = 5
 
 
 def main(page: ft.Page):
@@ -18,9 +27,18 @@ def main(page: ft.Page):
     sclient = None
     pseudo = ""
     room = None  # room par défaut
+    compression = None  # algorithme accepté par le serveur (LOGIN_OK)
+    codec = proto.JSON_CODEC  # codec des messages structurés (LOGIN_OK)
+    data_token = None  # connexions de données pour les téléchargements parallèles (LOGIN_OK)
     
     # Tracker les fichiers disponibles par room
     files_by_room = {}  # Format: {"room1": {"seq": "...", "filename": "...", "uploader": "..."}, ...}
+    # fichiers déjà affichés dans la room (HISTORY et FILE_LIST se recoupent)
+    fichiers_affiches = set()
+    history_cursor = None  # "before" de la page d'historique précédente (HISTORY)
+    history_pending = False  # requête HISTORY en cours (remontée du fil)
+    # messages admin reçus, ouverts en dialogue au prochain rafraîchissement
+    notifications = collections.deque()
 
     def toggle_theme(e):
         """Bascule entre mode clair et sombre"""
@@ -42,18 +60,172 @@ def main(page: ft.Page):
     )
 
     pseudo_field = ft.TextField(label="Pseudo", width=300)
-    messages = ft.Column(scroll="auto", expand=True)
     status = ft.Text("Déconnecté", color="red")
     message_field = ft.TextField(label="Message", width=350)
 
+    # ----------------------------
+    # Fil de messages : ListView (seuls les contrôles visibles sont construits
+    # côté Flet) sur une fenêtre bornée de ChatView ; les messages sont
+    # gardés sous forme de tuples, voir rendre()
+    # ----------------------------
+    def charger_historique(e=None):
+        nonlocal sclient, history_pending
+        if not sclient or not room or history_cursor is None or history_pending:
+            return
+        try:
+            history_pending = True
+            dl.request_history(sclient, room, before=history_cursor, codec=codec)
+        except (OSError, socket.error, ConnectionError) as ex:
+            history_pending = False
+            status.value = f"Erreur historique: {ex}"
+            status.color = "red"
+            sclient = None
+            page.update()
+
+    def remonter(e=None):
+        # messages plus anciens : d'abord ceux du stock local, puis le serveur
+        if view.scroll_up():
+            rafraichir()
+        elif not view.truncated:
+            charger_historique()
+
+    def aller_en_bas(e=None):
+        view.scroll_to_end()
+        rafraichir()
+
+    def on_messages_scroll(e):
+        if e.pixels <= e.min_scroll_extent + SCROLL_EDGE:
+            remonter()
+        elif e.pixels >= e.max_scroll_extent - SCROLL_EDGE and view.scroll_down():
+            rafraichir()
+
+    messages = ft.ListView(expand=True, auto_scroll=True, on_scroll=on_messages_scroll)
+    history_button = ft.TextButton("Messages précédents", on_click=remonter, visible=False)
+    unseen_label = ft.Text("")
+    unseen_button = ft.TextButton(content=unseen_label, on_click=aller_en_bas, visible=False)
+
+    def mettre_a_jour():
+        # thread de UpdateCoalescer : la fenêtre ne bouge pas pendant la comparaison
+        with view.lock:
+            # en bas du fil, les nouveaux messages restent visibles ; pendant la
+            # lecture de messages plus anciens, la position n'est pas modifiée
+            messages.auto_scroll = view.following
+            unseen_button.visible = view.unseen > 0
+            unseen_label.value = f"{view.unseen} nouveaux messages ↓"
+            history_button.visible = not view.at_top or (history_cursor is not None and not view.truncated)
+            afficher_transferts()
+            while notifications:
+                ouvrir_notification(notifications.popleft())
+            page.update()
+
+    def rendre(entry):
+        """Contrôle Flet d'un message du fil (tuple (type, champs...))."""
+        kind = entry[0]
+        if kind == "msg":
+            _, auteur, texte, color = entry
+            return ft.Text(f"{auteur} : {texte}", color=color)
+        if kind == "system":
+            return ft.Text(entry[1], italic=True, color="grey")
+        if kind == "note":
+            return ft.Text(entry[1], italic=True, color=entry[2])
+        if kind == "error":
+            return ft.Text(entry[1], color="red")
+        if kind == "file":
+            return ligne_fichier(*entry[1:])
+        if kind == "admin":
+            return ft.Text(f"🔔 {entry[1]}", italic=True, color="orange", weight=ft.FontWeight.BOLD)
+        raise ValueError(f"message inconnu: {kind}")
+
+    view = ChatView(messages.controls, rendre)
+    # un flot de messages reçus : au plus un page.update() par image
+    rafraichir = UpdateCoalescer(mettre_a_jour).request
+
+    def afficher(entry):
+        view.append(entry)
+        rafraichir()
+
     room_buttons = ft.Row([
         ft.Button(content=ft.Text("Room 1"), on_click=lambda e: changer_room("room1")),
         ft.Button(content=ft.Text("Room 2"), on_click=lambda e: changer_room("room2")),
         ft.Button(content=ft.Text("Room 3"), on_click=lambda e: changer_room("room3")),
     ])
 
+    # ----------------------------
+    # Transferts en arrière-plan : au plus dl.TRANSFER_CONCURRENCY à la
+    # fois, progression rafraîchie avec le fil de messages
+    # ----------------------------
+    transfers_column = ft.Column(spacing=2)
+    lignes_transferts = {}  # id -> (ligne, barre, texte, bouton d'annulation)
+
+    def ligne_transfert(transfer):
+        bar = ft.ProgressBar(value=0, width=160)
+        label = ft.Text("", size=12)
+        cancel = ft.IconButton(icon=ft.Icons.CLOSE, tooltip="Annuler",
+                               on_click=lambda e: transfers.cancel(transfer.id))
+        sens = "↑" if transfer.kind == "upload" else "↓"
+        row = ft.Row([ft.Text(f"{sens} {transfer.name}", width=150, no_wrap=True), bar, label, cancel])
+        return row, bar, label, cancel
+
+    def texte_transfert(transfer):
+        debit = f"{transfer.throughput / 1e6:.1f} Mo/s"
+        if transfer.state == "queued":
+            return "en attente"
+        if transfer.state == "running":
+            return f"{transfer.progress:.0%} · {debit}" if transfer.size else debit
+        if transfer.state == "done":
+            return f"terminé · {debit}"
+        if transfer.state == "cancelled":
+            return "annulé"
+        return f"échec : {transfer.message}"
+
+    def afficher_transferts():
+        # thread de UpdateCoalescer, juste avant page.update()
+        shown = transfers.transfers()[-TRANSFERS_SHOWN:]
+        for transfer in shown:
+            if transfer.id not in lignes_transferts:
+                lignes_transferts[transfer.id] = ligne_transfert(transfer)
+            _, bar, label, cancel = lignes_transferts[transfer.id]
+            # taille pas encore connue (téléchargement) : barre indéterminée
+            bar.value = transfer.progress if transfer.size or not transfer.active else None
+            label.value = texte_transfert(transfer)
+            cancel.visible = transfer.active
+        ids = {t.id for t in shown}
+        for transfer_id in [i for i in lignes_transferts if i not in ids]:
+            del lignes_transferts[transfer_id]
+        transfers_column.controls[:] = [lignes_transferts[t.id][0] for t in shown]
+
+    def on_transfer_update(transfer):
+        # threads des transferts : ne bloque pas, l'affichage suit par rafraichir()
+        result = transfer.result
+        if transfer.kind == "upload" and transfer.state == "done":
+            mode = " en direct" if result.get("p2p") else ""
+            afficher(("note", f"** Fichier envoyé{mode} : {result['filename']} ({result['size']} octets) **", "green"))
+        elif transfer.kind == "upload" and transfer.state == "failed":
+            afficher(("error", f"Erreur envoi fichier {transfer.name}: {transfer.message}"))
+        elif transfer.kind == "download" and transfer.state == "done":
+            afficher_resultat_fichier(result)
+        elif transfer.kind == "download" and transfer.state == "failed":
+            telecharger_flux_unique(transfer)
+        rafraichir()
+
+    transfers = dl.TransferManager(on_update=on_transfer_update)
+
+    def telecharger_flux_unique(transfer):
+        # connexions de données refusées ou coupées : un seul flux sur la connexion principale
+        if not sclient:
+            afficher_resultat_fichier(transfer.result)
+            return
+        print(f"[CLIENT] Téléchargement parallèle impossible ({transfer.message}), flux unique")
+        seq, fname = transfer.source
+        try:
+            dl.request_file_download(sclient, seq, fname, codec=codec)
+        except (OSError, socket.error, ConnectionError) as ex:
+            afficher(("error", f"Erreur téléchargement: {ex}"))
+
     # TextField pour le chemin du fichier
     file_path_field = ft.TextField(label="Chemin du fichier à envoyer", width=350, read_only=True)
+    # envoi à un seul membre de la room, en direct si possible (P2P)
+    recipient_field = ft.TextField(label="Destinataire (pseudo, vide = toute la room)", width=350)
     selected_file_path = None
     
     def pick_file(e=None):
@@ -71,7 +243,7 @@ def main(page: ft.Page):
         page.update()
     
     def send_file_from_path(e=None):
-        nonlocal sclient
+        nonlocal sclient, selected_file_path
         if not sclient:
             status.value = "Connectez-vous d'abord"
             status.color = "red"
@@ -100,33 +272,27 @@ def main(page: ft.Page):
             page.update()
             return
         
-        try:
-            result = dl.send_file_to_room(sclient, room, path)
-            if result["success"]:
-                messages.controls.append(ft.Text(f"** Fichier envoyé : {result['filename']} ({result['size']} octets) **", italic=True, color="green"))
-                file_path_field.value = ""
-                file_path_field.color = None
-                selected_file_path = None
-            else:
-                status.value = result["message"]
-                status.color = "red"
-            page.update()
-        except (OSError, socket.error, ConnectionError) as ex:
-            status.value = f"Erreur envoi fichier: {ex}"
-            status.color = "red"
-            sclient = None
-            page.update()
-        except Exception as ex:
-            status.value = f"Erreur envoi fichier: {ex}"
+        if not os.path.isfile(path):
+            status.value = f"Fichier introuvable: {path}"
             status.color = "red"
             page.update()
+            return
+        
+        # envoi en arrière-plan : l'interface et le chat restent utilisables,
+        # le résultat arrive par on_transfer_update
+        recipient = recipient_field.value.strip() if recipient_field.value else ""
+        transfers.upload(sclient, room, path, to=recipient or None, compression=compression, codec=codec)
+        file_path_field.value = ""
+        file_path_field.color = None
+        selected_file_path = None
+        rafraichir()
 
 
     # ----------------------------
     # Fonctions
     # ----------------------------
     def changer_room(new_room):
-        nonlocal room, sclient
+        nonlocal room, sclient, history_cursor, history_pending
         if not sclient:
             status.value = "Connectez-vous d'abord"
             status.color = "red"
@@ -143,14 +309,20 @@ def main(page: ft.Page):
         
         old_room = room
         room = new_room
+        # fil de la nouvelle room seulement : son historique arrive avec HISTORY
+        view.clear()
+        fichiers_affiches.clear()
+        history_cursor = None
+        history_pending = False
         try:
             proto.send_message(sclient, f"ROOM|{room}".encode())
+            dl.request_file_list(sclient, room, codec=codec)
             status.value = f"Vous êtes dans {room}"
             status.color = "blue"
             if old_room:
-                messages.controls.append(ft.Text(f"** Changement de room : {old_room} -> {room} **", italic=True, color="grey"))
+                afficher(("note", f"** Changement de room : {old_room} -> {room} **", "grey"))
             else:
-                messages.controls.append(ft.Text(f"** Vous êtes dans {room} **", italic=True, color="grey"))
+                afficher(("note", f"** Vous êtes dans {room} **", "grey"))
         except (OSError, socket.error, ConnectionError) as ex:
             status.value = f"Erreur envoi room: {ex}"
             status.color = "red"
@@ -159,108 +331,209 @@ def main(page: ft.Page):
         
         page.update()
 
+    def ligne_fichier(uploader, seq, fname):
+        def on_download_click(e):
+            nonlocal sclient
+            if not dl.check_socket_connection(sclient):
+                status.value = "Connexion perdue"
+                status.color = "red"
+                sclient = None
+                page.update()
+                return
+            if data_token:
+                # plusieurs connexions de données, en arrière-plan (gestionnaire de transferts)
+                transfers.download(SERVER_IP, SERVER_PORT, data_token, seq, fname)
+                rafraichir()
+                return
+            try:
+                dl.request_file_download(sclient, seq, fname, codec=codec)
+            except (OSError, socket.error, ConnectionError) as ex:
+                status.value = f"Erreur téléchargement: {ex}"
+                status.color = "red"
+                page.update()
+
+        return ft.Row([ft.Text(f"{uploader} a partagé : {fname}"), ft.Button("Télécharger", on_click=on_download_click)])
+
+    # ----------------------------
+    # Commandes reçues du serveur : handler(reader, corps, trame)
+    # ----------------------------
+    def afficher_resultat_fichier(result):
+        if result["success"]:
+            afficher(("note", f"** Fichier reçu et enregistré : {result['path']} **", "green"))
+        else:
+            afficher(("error", f"Erreur sauvegarde fichier: {result['message']}"))
+
+    def on_file_stream(reader, header, frame):
+        # fichier en flux : le corps suit l'en-tête (une partie peut déjà être dans le buffer du reader)
+        afficher_resultat_fichier(dl.receive_file_stream(reader, header))
+
+    def on_send_file(reader, payload, frame):
+        fname = payload.get("meta", {}).get("filename")
+        sha256 = payload.get("sha256")
+        seq = payload.get("seq")
+        if frame.kind == proto.KIND_BINARY:
+            # fichier en trame binaire (réponse à GET_FILE raw)
+            afficher_resultat_fichier(dl.save_received_data(fname, frame.data, sha256=sha256, seq=seq))
+        else:
+            afficher_resultat_fichier(dl.save_received_file(fname, payload.get("data", ""),
+                                                            sha256=sha256, seq=seq))
+
+    def on_file_available(reader, payload, frame):
+        file_info = dl.handle_file_available(payload, files_by_room)
+        fichiers_affiches.add(file_info["seq"])
+        afficher(("file", file_info["uploader"], file_info["seq"], file_info["filename"]))
+        if payload.get("to"):
+            # fichier qui nous est adressé (relais d'un envoi direct) : téléchargé
+            # tout de suite, en reprenant la partie déjà reçue en direct
+            dl.request_file_download(sclient, file_info["seq"], file_info["filename"], codec=codec)
+
+    def on_p2p_invite(reader, payload, frame):
+        if payload.get("role") != "caller":
+            dl.handle_p2p_invite(payload)  # réponse à notre P2P_REQUEST
+            return
+        fname = payload.get("meta", {}).get("filename")
+        afficher(("note", f"** {payload.get('from')} vous envoie {fname} en direct **", "grey"))
+        # connexion à l'émetteur hors du thread de réception
+        threading.Thread(
+            target=lambda: afficher_resultat_fichier(dl.receive_file_p2p(sclient, payload, codec=codec)),
+            daemon=True,
+        ).start()
+
+    def on_p2p_failed(reader, payload, frame):
+        dl.handle_p2p_failed(payload)
+
+    def on_file_list(reader, payload, frame):
+        # historique des fichiers de la room (page la plus récente)
+        if payload.get("room") != room:
+            return  # réponse pour une room quittée depuis
+        for f in reversed(payload.get("files", [])):
+            if f["seq"] in fichiers_affiches:
+                continue
+            fichiers_affiches.add(f["seq"])
+            view.append(("file", f.get("uploader"), f["seq"], f["filename"]))
+        rafraichir()
+
+    def ligne_historique(entry):
+        """Message du fil pour une entrée de l'historique de la room (None si ignorée)."""
+        event = entry.get("event")
+        if event is not None:
+            # fichier partagé (FILE_AVAILABLE)
+            seq = event.get("seq")
+            if seq in fichiers_affiches:
+                return None
+            fichiers_affiches.add(seq)
+            return ("file", event.get("uploader"), seq, event.get("meta", {}).get("filename"))
+        try:
+            msg = ProtocolParser.parse(entry.get("text", ""))
+        except ProtocolError:
+            return None
+        if msg.command == "MSG" and len(msg.args) >= 2:
+            return ("msg", msg.args[0], msg.args[1], "grey")
+        if msg.command == "SYSTEM" and msg.args:
+            return ("system", msg.args[0])
+        return None
+
+    def on_history(reader, payload, frame):
+        nonlocal history_cursor, history_pending
+        if payload.get("room") != room:
+            return  # réponse pour une room quittée depuis
+        history_pending = False
+        lignes = [c for c in map(ligne_historique, payload.get("messages", [])) if c is not None]
+        history_cursor = payload.get("next")
+        if payload.get("before") is None:
+            # à l'entrée dans la room : derniers messages
+            view.extend(lignes)
+        elif not view.prepend(lignes):
+            # page plus ancienne, insérée au-dessus ; stock plein : on s'arrête là
+            history_cursor = None
+        rafraichir()
+
+    def on_login_ok(reader, payload, frame):
+        nonlocal compression, codec, data_token
+        compression = payload.get("compression")
+        data_token = payload.get("data_token")
+        codec = proto.MESSAGE_CODECS.get(payload.get("codec"), proto.JSON_CODEC)
+
+    def on_upload_accept(reader, payload, frame):
+        dl.handle_upload_accept(payload)
+
+    def on_msg(reader, msg, frame):
+        if len(msg.args) >= 2:
+            afficher(("msg", msg.args[0], msg.args[1], None))
+
+    def on_admin_broadcast(reader, msg, frame):
+        admin_message = msg.args[0] if msg.args else "Message du serveur"
+        # dialogue ouvert par mettre_a_jour ; le message reste dans le fil pour historique
+        notifications.append(admin_message)
+        afficher(("admin", admin_message))
+
+    def ouvrir_notification(admin_message):
+        # Afficher une notification/dialog pour les messages admin
+        def close_notification(e):
+            notification_dialog.open = False
+            page.update()
+
+        notification_dialog = ft.AlertDialog(
+            modal=True,
+            title=ft.Row([
+                ft.Icon(ft.Icons.CAMPAIGN, color=ft.Colors.ORANGE_400),
+                ft.Text("📢 Notification Admin", weight=ft.FontWeight.BOLD),
+            ]),
+            content=ft.Container(
+                content=ft.Text(admin_message, size=14, color=ft.Colors.BLACK),
+                padding=10,
+                bgcolor=ft.Colors.AMBER_100,
+                border_radius=8,
+            ),
+            actions=[
+                ft.Button(
+                    "OK",
+                    on_click=close_notification,
+                ),
+            ],
+            actions_alignment=ft.MainAxisAlignment.CENTER,
+        )
+
+        page.overlay.append(notification_dialog)
+        notification_dialog.open = True
+
+    def on_system(reader, msg, frame):
+        if msg.args:
+            afficher(("system", msg.args[0]))
+
+    def on_unknown(reader, command, body, frame):
+        if command is None and frame.kind == proto.KIND_LEGACY and not frame.data:
+            return False  # trame vide : le serveur ferme la connexion
+        print(f"[CLIENT] Commande ignorée: {command}")
+        return None
+
+    commandes = Dispatcher(unknown=on_unknown)
+    for command, handler, body in (
+        ("FILE_STREAM", on_file_stream, dict),
+        ("SEND_FILE", on_send_file, dict),
+        ("FILE_AVAILABLE", on_file_available, dict),
+        ("FILE_LIST", on_file_list, dict),
+        ("HISTORY", on_history, dict),
+        ("LOGIN_OK", on_login_ok, dict),
+        ("UPLOAD_ACCEPT", on_upload_accept, dict),
+        ("P2P_INVITE", on_p2p_invite, dict),
+        ("P2P_FAILED", on_p2p_failed, dict),
+        ("MSG", on_msg, Message),
+        ("ADMIN_BROADCAST", on_admin_broadcast, Message),
+        ("SYSTEM", on_system, Message),
+    ):
+        commandes.register(command, handler, body)
+
     def recevoir():
         nonlocal sclient
+        # lecture bufferisée : plusieurs trames par recv, sans copie par trame
+        reader = proto.FrameReader(sclient)
         while True:
             try:
                 if not sclient:
                     break
-                raw = proto.recv_message(sclient)
-                if not raw:
+                if commandes.dispatch(reader, reader.read_frame()) is False:
                     break
-                text = None
-                try:
-                    payload = json.loads(raw.decode())
-                except Exception as e:
-                    payload = None
-                    print(f"[CLIENT] Erreur JSON decode: {e}")
-
-                if payload:
-                    t = payload.get("type")
-                    print(f"[CLIENT] Reçu: type={t}, payload={payload}")
-                    if t == "FILE_AVAILABLE":
-                        file_info = dl.handle_file_available(payload, files_by_room)
-
-                        def on_download_click(e, seq=file_info["seq"], fname=file_info["filename"]):
-                            nonlocal sclient
-                            if not dl.check_socket_connection(sclient):
-                                status.value = "Connexion perdue"
-                                status.color = "red"
-                                sclient = None
-                                page.update()
-                                return
-                            try:
-                                dl.request_file_download(sclient, seq, fname)
-                            except (OSError, socket.error, ConnectionError) as ex:
-                                status.value = f"Erreur téléchargement: {ex}"
-                                status.color = "red"
-                                page.update()
-
-                        messages.controls.append(ft.Row([ft.Text(f"{file_info['uploader']} a partagé : {file_info['filename']}"), ft.Button("Télécharger", on_click=on_download_click)]))
-                        page.update()
-
-                    elif t == "SEND_FILE":
-                        meta = payload.get("meta", {})
-                        fname = meta.get("filename")
-                        data_b64 = payload.get("data", "")
-                        
-                        result = dl.save_received_file(fname, data_b64)
-                        if result["success"]:
-                            messages.controls.append(ft.Text(f"** Fichier reçu et enregistré : {result['path']} **", italic=True, color="green"))
-                        else:
-                            messages.controls.append(ft.Text(f"Erreur sauvegarde fichier: {result['message']}", color="red"))
-                        page.update()
-
-                    else:
-                        text = str(payload)
-
-                else:
-                    text = raw.decode()
-
-                if text:
-                    parts = text.split("|")
-                    if parts[0] == "MSG":
-                        messages.controls.append(ft.Text(f"{parts[1]} : {parts[2]}"))
-                    elif parts[0] == "ADMIN_BROADCAST":
-                        # Afficher une notification/dialog pour les messages admin
-                        admin_message = parts[1] if len(parts) > 1 else "Message du serveur"
-                        
-                        def close_notification(e):
-                            notification_dialog.open = False
-                            page.update()
-                        
-                        notification_dialog = ft.AlertDialog(
-                            modal=True,
-                            title=ft.Row([
-                                ft.Icon(ft.Icons.CAMPAIGN, color=ft.Colors.ORANGE_400),
-                                ft.Text("📢 Notification Admin", weight=ft.FontWeight.BOLD),
-                            ]),
-                            content=ft.Container(
-                                content=ft.Text(admin_message, size=14, color=ft.Colors.BLACK),
-                                padding=10,
-                                bgcolor=ft.Colors.AMBER_100,
-                                border_radius=8,
-                            ),
-                            actions=[
-                                ft.Button(
-                                    "OK",
-                                    on_click=close_notification,
-                                ),
-                            ],
-                            actions_alignment=ft.MainAxisAlignment.CENTER,
-                        )
-                        
-                        page.overlay.append(notification_dialog)
-                        notification_dialog.open = True
-                        
-                        # les messages sont ajoutés dans le chat pour historique
-                        messages.controls.append(
-                            ft.Text(f"🔔 {admin_message}", italic=True, color="orange", weight=ft.FontWeight.BOLD)
-                        )
-                        page.update()
-                    elif parts[0] == "SYSTEM":
-                        messages.controls.append(ft.Text(parts[1], italic=True, color="grey"))
-                        page.update()
             except (ConnectionError, OSError, socket.error) as ex:
                 print(f"[CLIENT] Connexion fermée: {ex}")
                 status.value = "Connexion perdue"
@@ -282,7 +555,7 @@ def main(page: ft.Page):
                 break
 
     def connecter(e):
-        nonlocal sclient, pseudo
+        nonlocal sclient, pseudo, compression, codec, data_token
         pseudo = pseudo_field.value.strip()
         if not pseudo:
             status.value = "Pseudo requis"
@@ -295,6 +568,9 @@ def main(page: ft.Page):
             sclient.settimeout(5)  # Timeout de 5 secondes
             sclient.connect((SERVER_IP, SERVER_PORT))
             sclient.settimeout(None)  # Retirer le timeout après connexion
+            # un seul thread écrit sur la socket : chat et blocs de fichiers
+            # envoyés depuis plusieurs threads ne s'entrelacent pas
+            sclient = dl.SocketSender(sclient)
         except (socket.timeout, ConnectionRefusedError, OSError) as ex:
             status.value = f"Erreur connexion: {ex}"
             status.color = "red"
@@ -315,7 +591,12 @@ def main(page: ft.Page):
 
         # login sans room (use framing)
         try:
-            proto.send_message(sclient, f"LOGIN|{pseudo}".encode())
+            compression = None
+            codec = proto.JSON_CODEC
+            data_token = None
+            # propose les algorithmes de compression et les codecs de messages
+            # disponibles (par préférence), le serveur choisit
+            proto.send_message(sclient, f"LOGIN|{pseudo}|{','.join(proto.CODECS)}|{','.join(proto.MESSAGE_CODECS)}".encode())
             status.value = f"Connecté en tant que {pseudo}"
             status.color = "green"
             threading.Thread(target=recevoir, daemon=True).start()
@@ -375,14 +656,18 @@ def main(page: ft.Page):
         ft.Divider(),
         ft.Text("Partage de fichiers", size=18, weight="bold"),
         file_path_field,
+        recipient_field,
         ft.Row([
             ft.Button(content=ft.Text("Sélectionner un fichier"), on_click=pick_file),
             ft.Button(content=ft.Text("Envoyer un fichier"), on_click=send_file_from_path),
         ]),
+        transfers_column,
         status,
         ft.Divider(),
         ft.Text("Messages", size=18),
+        history_button,
         messages,
+        unseen_button,
         ft.Row([message_field, ft.Button(content=ft.Text("Envoyer"), on_click=envoyer)])
     ], expand=True))
 
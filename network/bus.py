@@ -0,0 +1,206 @@
+"""Local fan-out bus between the processes of a multi-process server.
+
+Every process of the cluster (workers "w0".."wN-1" and the supervisor
+"master") listens on a Unix domain socket `<directory>/<name>.sock` and
+opens one outbound connection to each peer's socket, so every link has a
+single writer and a single reader:
+
+    commands = Dispatcher()
+    commands.register("BROADCAST", on_broadcast, dict)  # on_broadcast(peer, event, frame)
+    bus = Bus(directory, "w0", ["w1", "w2", "master"], commands)
+    bus.connect()
+    bus.subscribe("room-1")                    # a local client joined room-1
+    bus.publish({"type": "BROADCAST", ...}, room="room-1")
+    bus.send("master", {"type": "CLIENTS", ...})
+
+Events are structured messages in the client framing (protocol.JSON_CODEC)
+and are dispatched on the receiving side with the peer name as context.
+Room interest is tracked by the bus itself: each process announces the
+rooms that have local members (HELLO, SUBSCRIBE, UNSUBSCRIBE), and an
+event published for a room is encoded once and only sent to the peers with
+members in it. Events without a room go to every peer.
+
+Outbound frames go through an OutboundQueue drained by a writer thread, as
+for client sockets: publishing never blocks on a busy peer.
+"""
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+
+from network import protocol as proto
+from network.dispatch import Dispatcher
+from network.outbound import OutboundQueue, SlowConsumerPolicy, start_writer_thread
+
+BUS_CONNECT_TIMEOUT = 15.0
+# events queued for one peer before the link is considered dead
+BUS_QUEUE_BYTES = 64 * 1024 * 1024
+
+
+class Bus:
+    def __init__(self, directory: str, name: str, peers: Iterable[str], commands: Dispatcher,
+                 on_peer_lost: Optional[Callable[[str], None]] = None):
+        self.directory = directory
+        self.name = name
+        self.peers = [p for p in peers if p != name]
+        self.commands = commands
+        self.on_peer_lost = on_peer_lost
+        self.lock = threading.Lock()
+        self._rooms: Set[str] = set()              # rooms with local members
+        self._interest: Dict[str, Set[str]] = {}   # room -> peers with members
+        self._links: Dict[str, OutboundQueue] = {}
+        self._closed = False
+        commands.register("SUBSCRIBE", self._on_subscribe, dict)
+        commands.register("UNSUBSCRIBE", self._on_unsubscribe, dict)
+
+        path = self.path_of(name)
+        if os.path.exists(path):
+            os.remove(path)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(path)
+        self._listener.listen(len(self.peers) + 1)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def path_of(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.sock")
+
+    # ---- outbound ----
+
+    def connect(self, timeout: float = BUS_CONNECT_TIMEOUT) -> None:
+        """Open the links to every peer (retried while the peers start)."""
+        deadline = time.monotonic() + timeout
+        for peer in self.peers:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            while True:
+                try:
+                    sock.connect(self.path_of(peer))
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if time.monotonic() > deadline:
+                        sock.close()
+                        raise ConnectionError(f"bus peer {peer} unreachable")
+                    time.sleep(0.05)
+            outbox = OutboundQueue(
+                SlowConsumerPolicy("disconnect", BUS_QUEUE_BYTES, max_stall=None),
+                on_overflow=lambda reason, s=sock: self._shutdown(s),
+            )
+            start_writer_thread(sock, outbox)
+            with self.lock:
+                self._links[peer] = outbox
+                outbox.put(self._frame({"type": "HELLO", "name": self.name, "rooms": sorted(self._rooms)}))
+
+    def subscribe(self, room: str) -> None:
+        """Announce that `room` has members in this process."""
+        with self.lock:
+            if room in self._rooms:
+                return
+            self._rooms.add(room)
+            self._put_all(self._frame({"type": "SUBSCRIBE", "room": room}))
+
+    def unsubscribe(self, room: str) -> None:
+        with self.lock:
+            if room not in self._rooms:
+                return
+            self._rooms.discard(room)
+            self._put_all(self._frame({"type": "UNSUBSCRIBE", "room": room}))
+
+    def publish(self, event: Dict[str, Any], room: Optional[str] = None) -> None:
+        """Send an event to the peers with members in `room` (every peer if None)."""
+        frame = self._frame(event)
+        with self.lock:
+            if room is None:
+                self._put_all(frame)
+                return
+            for peer in self._interest.get(room, ()):
+                link = self._links.get(peer)
+                if link is not None:
+                    link.put(frame)
+
+    def send(self, peer: str, event: Dict[str, Any]) -> bool:
+        link = self._links.get(peer)
+        return link is not None and link.put(self._frame(event))
+
+    def _put_all(self, frame: proto.PreparedFrame) -> None:
+        for link in self._links.values():
+            link.put(frame)
+
+    @staticmethod
+    def _frame(event: Dict[str, Any]) -> proto.PreparedFrame:
+        return proto.JSON_CODEC.frame(event)
+
+    @staticmethod
+    def _shutdown(sock: socket.socket) -> None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    # ---- inbound ----
+
+    def _accept_loop(self) -> None:
+        while True:
+            try:
+                sock, _ = self._listener.accept()
+            except OSError:
+                return  # closed
+            threading.Thread(target=self._read_loop, args=(sock,), daemon=True).start()
+
+    def _read_loop(self, sock: socket.socket) -> None:
+        reader = proto.FrameReader(sock)
+        peer = None
+        try:
+            hello = proto.decode_message(reader.read_frame())
+            if hello.get("type") != "HELLO":
+                return
+            peer = hello["name"]
+            with self.lock:
+                for room in hello.get("rooms", ()):
+                    self._interest.setdefault(room, set()).add(peer)
+            while True:
+                frame = reader.read_frame()
+                if frame.kind == proto.KIND_LEGACY and not frame.data:
+                    break
+                self.commands.dispatch(peer, frame)
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            sock.close()
+            if peer is not None:
+                self._forget(peer)
+
+    def _on_subscribe(self, peer: str, event: Dict[str, Any], frame: proto.Frame) -> None:
+        with self.lock:
+            self._interest.setdefault(event.get("room"), set()).add(peer)
+
+    def _on_unsubscribe(self, peer: str, event: Dict[str, Any], frame: proto.Frame) -> None:
+        room = event.get("room")
+        with self.lock:
+            members = self._interest.get(room)
+            if members is not None:
+                members.discard(peer)
+                if not members:
+                    del self._interest[room]
+
+    def _forget(self, peer: str) -> None:
+        with self.lock:
+            for room in list(self._interest):
+                members = self._interest[room]
+                members.discard(peer)
+                if not members:
+                    del self._interest[room]
+        if self.on_peer_lost is not None and not self._closed:
+            self.on_peer_lost(peer)
+
+    def close(self) -> None:
+        self._closed = True
+        with self.lock:
+            links = list(self._links.values())
+            self._links.clear()
+        for link in links:
+            link.close(flush=True)
+        self._listener.close()
+        try:
+            os.remove(self.path_of(self.name))
+        except OSError:
+            pass
@@ -0,0 +1,86 @@
+"""Command table shared by the server and the client.
+
+A received frame is classified once, from its kind and first byte:
+- KIND_BINARY / KIND_STREAM: command = header["type"], body = header
+- KIND_JSON, or an untyped frame starting with "{": command = obj["type"],
+  body = the decoded JSON object
+- KIND_STRUCT: same, decoded with the compact message codec
+- anything else: `COMMAND|arg|...` text, body = parser.Message
+
+then handed to the handler registered for the command:
+
+    commands = Dispatcher()
+    commands.register("MSG", on_msg, Message)   # on_msg(ctx, body, frame)
+    commands.dispatch(session, frame)
+
+Handlers get the untouched Frame too (raw bytes of binary frames). The
+optional body type (dict for JSON/header commands, Message for text ones)
+is checked before calling the handler. The return value of the handler is
+returned by dispatch; unknown commands, and commands whose body has the
+wrong type, go to the `unknown` handler, or are ignored. No exception is
+raised or caught on the normal path: only a malformed JSON or struct
+payload is reported as command None.
+"""
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+from network import protocol as proto
+from parser import ProtocolParser
+
+Handler = Callable[[Any, Any, proto.Frame], Any]
+
+_BRACE = ord("{")
+
+
+def decode_frame(frame: proto.Frame) -> Tuple[Optional[str], Any]:
+    """(command, body) of a frame; (None, None) when it carries no command."""
+    kind = frame.kind
+    if kind == proto.KIND_BINARY or kind == proto.KIND_STREAM:
+        header = frame.header or {}
+        return header.get("type"), header
+    data = frame.data
+    if not data:
+        return None, None
+    if kind == proto.KIND_JSON or (kind == proto.KIND_LEGACY and data[0] == _BRACE):
+        try:
+            obj = proto.decode_json(data)
+        except ValueError:
+            return None, None
+        if not isinstance(obj, dict):
+            return None, None
+        return obj.get("type"), obj
+    if kind == proto.KIND_STRUCT:
+        try:
+            obj = proto.STRUCT_CODEC.decode(data)
+        except ValueError:
+            return None, None
+        return obj.get("type"), obj
+    msg = ProtocolParser.parse(str(data, "utf-8", "replace"))
+    return msg.command, msg
+
+
+class Dispatcher:
+    def __init__(self, unknown: Optional[Callable[[Any, Optional[str], Any, proto.Frame], Any]] = None):
+        self._handlers: Dict[str, Tuple[Handler, Optional[Type]]] = {}
+        self.unknown = unknown
+
+    def register(self, command: str, handler: Handler, body: Optional[Type] = None) -> None:
+        self._handlers[command] = (handler, body)
+
+    def command(self, name: str, body: Optional[Type] = None) -> Callable[[Handler], Handler]:
+        """Decorator form of register."""
+        def decorate(handler: Handler) -> Handler:
+            self.register(name, handler, body)
+            return handler
+        return decorate
+
+    def __contains__(self, command: str) -> bool:
+        return command in self._handlers
+
+    def dispatch(self, ctx: Any, frame: proto.Frame) -> Any:
+        command, body = decode_frame(frame)
+        entry = self._handlers.get(command)
+        if entry is not None and (entry[1] is None or isinstance(body, entry[1])):
+            return entry[0](ctx, body, frame)
+        if self.unknown is not None:
+            return self.unknown(ctx, command, body, frame)
+        return None
@@ -0,0 +1,162 @@
+"""Bounded worker pool for blocking disk and codec work.
+
+Connection handlers hand file persistence, hashing and base64 encoding to a
+fixed number of worker threads instead of running them inline:
+
+    io = IOPool(workers=4, max_queued=64)
+    io.submit(session, write_chunk, session, seq, data)
+
+Tasks submitted with the same key (the session) run one at a time, in
+submission order: the chunks of an upload are written in sequence and
+FILE_END runs after them. Tasks of different keys run in parallel. A task
+reports its result itself, by queueing a frame on the session's outbox.
+
+Backpressure: at most `max_queued` tasks wait for a worker. submit() blocks
+the calling thread until one is taken (threads engine: the connection stops
+reading its socket, TCP slows the client down). With block=False the task
+is queued anyway and the caller awaits ready_async() before reading the
+next frame (asyncio engine, the event loop must not block).
+
+An exception raised by a task is printed and does not stop its worker.
+"""
+import asyncio
+import collections
+import threading
+import time
+import traceback
+from typing import Any, Callable, Deque, Dict, Hashable, List, Tuple
+
+# wait times kept for stats(): the last WAIT_SAMPLES tasks
+WAIT_SAMPLES = 256
+
+
+class IOPool:
+    def __init__(self, workers: int = 4, max_queued: int = 64, name: str = "io"):
+        if workers < 1 or max_queued < 1:
+            raise ValueError("workers and max_queued must be >= 1")
+        self.workers = workers
+        self.max_queued = max_queued
+        self.name = name
+        # key -> tasks not started yet; a key is present while one of its
+        # tasks is queued or running, and in _ready only when none is running
+        self._tasks: Dict[Hashable, Deque[Tuple[float, Callable[..., Any], tuple]]] = {}
+        self._ready: Deque[Hashable] = collections.deque()
+        self._queued = 0
+        self._busy = 0
+        self._done = 0
+        self._blocked = 0  # submitters that waited for room in the queue
+        self._waits: Deque[float] = collections.deque(maxlen=WAIT_SAMPLES)
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._cond = threading.Condition()
+        self._not_full = threading.Condition(self._cond)
+        self._threads: List[threading.Thread] = []
+        self._closed = False
+
+    def submit(self, key: Hashable, fn: Callable[..., Any], *args: Any, block: bool = True) -> None:
+        """Run fn(*args) on a worker, after the tasks already submitted with `key`."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("pool closed")
+            if block and self._queued >= self.max_queued:
+                self._blocked += 1
+                while self._queued >= self.max_queued and not self._closed:
+                    self._not_full.wait()
+                if self._closed:
+                    raise RuntimeError("pool closed")
+            if len(self._threads) < self.workers and self._busy + len(self._ready) >= len(self._threads):
+                thread = threading.Thread(target=self._run, name=f"{self.name}-{len(self._threads)}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            tasks = self._tasks.get(key)
+            if tasks is None:
+                tasks = self._tasks[key] = collections.deque()
+                self._ready.append(key)
+                self._cond.notify()
+            tasks.append((time.monotonic(), fn, args))
+            self._queued += 1
+
+    def full(self) -> bool:
+        """True when submit() would block."""
+        return self._queued >= self.max_queued
+
+    def ready_async(self) -> "asyncio.Future":
+        """Future of the running loop, resolved when the queue has room again."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        with self._cond:
+            if self._queued < self.max_queued or self._closed:
+                fut.set_result(None)
+            else:
+                self._blocked += 1
+                self._async_waiters.append((loop, fut))
+        return fut
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._ready:
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                key = self._ready.popleft()
+                queued_at, fn, args = self._tasks[key].popleft()
+                self._queued -= 1
+                self._busy += 1
+                self._waits.append(time.monotonic() - queued_at)
+                waiters = self._wake_submitters()
+            for loop, fut in waiters:
+                try:
+                    loop.call_soon_threadsafe(_set_ready, fut)
+                except RuntimeError:
+                    pass  # loop closed, nobody awaits anymore
+            try:
+                fn(*args)
+            except Exception:
+                traceback.print_exc()
+            with self._cond:
+                self._busy -= 1
+                self._done += 1
+                if self._tasks[key]:
+                    self._ready.append(key)
+                    self._cond.notify()
+                else:
+                    del self._tasks[key]
+
+    def _wake_submitters(self) -> List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]:
+        # under the lock, a task just left the queue
+        if self._queued >= self.max_queued:
+            return []
+        self._not_full.notify()
+        waiters, self._async_waiters = self._async_waiters, []
+        return waiters
+
+    def stats(self) -> dict:
+        """Queue length, busy workers and wait times (ms) of the recent tasks."""
+        with self._cond:
+            waits = sorted(self._waits)
+            stats = {"workers": self.workers, "threads": len(self._threads), "busy": self._busy,
+                     "queued": self._queued, "max_queued": self.max_queued, "done": self._done,
+                     "blocked": self._blocked}
+        stats["wait_avg_ms"] = sum(waits) / len(waits) * 1e3 if waits else 0.0
+        stats["wait_p99_ms"] = waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1e3 if waits else 0.0
+        stats["wait_max_ms"] = waits[-1] * 1e3 if waits else 0.0
+        return stats
+
+    def close(self) -> None:
+        """Stop the workers once the queued tasks are done; blocked submit() calls raise."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            self._not_full.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, fut in waiters:
+            try:
+                loop.call_soon_threadsafe(_set_ready, fut)
+            except RuntimeError:
+                pass
+
+
+def _set_ready(fut: asyncio.Future) -> None:
+    # on the loop thread
+    if not fut.done():
+        fut.set_result(None)
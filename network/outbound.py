@@ -0,0 +1,243 @@
+"""Bounded per-session outbound queues.
+
+Every frame written to a client goes through its OutboundQueue and is sent
+by a single writer (a thread for the threaded engine, a task for asyncio).
+Producers such as broadcast only enqueue, so a client with a full TCP window
+never blocks the sender or the other recipients. Queue items are
+protocol.PreparedFrame objects: a broadcast enqueues the same encoded frame
+on every recipient's queue; protocol.FileStream items stream a file body
+with sendfile once their header frame is written.
+
+Slow consumers are handled by a SlowConsumerPolicy:
+- max_bytes: cap on queued bytes. When exceeded, mode "drop_oldest" first
+  drops the oldest droppable (chat) frames; mode "disconnect", or nothing
+  left to drop, disconnects the client.
+- max_stall: seconds without the writer making progress while frames are
+  pending before the client is disconnected.
+A single frame is always accepted into an empty queue, whatever its size.
+Items discarded unsent (overflow, close without flush) have the file of
+their FileStream closed.
+"""
+import asyncio
+import collections
+import socket
+import threading
+import time
+from typing import Callable, Optional, Union
+
+from network import protocol as proto
+
+
+class SlowConsumerPolicy:
+    __slots__ = ("mode", "max_bytes", "max_stall")
+
+    def __init__(self, mode: str = "drop_oldest", max_bytes: int = 4 * 1024 * 1024,
+                 max_stall: Optional[float] = 30.0):
+        if mode not in ("drop_oldest", "disconnect"):
+            raise ValueError(f"unknown slow consumer mode {mode}")
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.max_stall = max_stall
+
+
+EMPTY = object()
+
+
+class OutboundQueue:
+    """Thread-safe FIFO of prepared frames with slow-consumer accounting."""
+
+    def __init__(self, policy: Optional[SlowConsumerPolicy] = None,
+                 on_overflow: Optional[Callable[[str], None]] = None):
+        self.policy = policy or SlowConsumerPolicy()
+        self.on_overflow = on_overflow
+        self.bytes = 0
+        self.dropped = 0
+        self._items = collections.deque()  # (data, droppable)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._flush = False
+        self._failed = False
+        self._inflight = False
+        self._last_progress = time.monotonic()
+        self._waker: Optional[Callable[[], None]] = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._items)
+
+    def set_waker(self, waker: Callable[[], None]) -> None:
+        """Register a callback run after each put/close (used by the asyncio writer)."""
+        self._waker = waker
+
+    def put(self, data: Union[proto.PreparedFrame, proto.FileStream], droppable: bool = False) -> bool:
+        """Enqueue a framed message. Returns False if it was not queued."""
+        reason = None
+        with self._cond:
+            if self._closed or self._failed:
+                return False
+            if not self._items and not self._inflight:
+                self._last_progress = time.monotonic()
+            reason = self._check_overflow(len(data))
+            if reason is None:
+                self._items.append((data, droppable))
+                self.bytes += len(data)
+                self._cond.notify()
+            else:
+                self._failed = True
+                self._discard()
+                self._cond.notify()
+        self._wake()
+        if reason is not None:
+            if self.on_overflow:
+                self.on_overflow(reason)
+            return False
+        return True
+
+    def _check_overflow(self, size: int) -> Optional[str]:
+        policy = self.policy
+        busy = self._items or self._inflight
+        if (busy and policy.max_stall is not None
+                and time.monotonic() - self._last_progress > policy.max_stall):
+            return f"no progress for {policy.max_stall}s"
+        if not self._items or self.bytes + size <= policy.max_bytes:
+            return None
+        if policy.mode == "drop_oldest":
+            kept = collections.deque()
+            while self._items and self.bytes + size > policy.max_bytes:
+                item = self._items.popleft()
+                if item[1]:
+                    self.bytes -= len(item[0])
+                    self.dropped += 1
+                else:
+                    kept.append(item)
+            kept.extend(self._items)
+            self._items = kept
+            if not self._items or self.bytes + size <= policy.max_bytes:
+                return None
+        return f"{self.bytes + size} bytes queued (max {policy.max_bytes})"
+
+    def get(self, timeout: Optional[float] = None):
+        """Blocking dequeue for writer threads. None means: stop writing."""
+        with self._cond:
+            while not self._items:
+                if self._closed or self._failed:
+                    return None
+                if not self._cond.wait(timeout):
+                    return EMPTY
+            return self._pop()
+
+    def poll(self):
+        """Non-blocking dequeue: an item, EMPTY, or None once closed."""
+        with self._cond:
+            if self._items:
+                return self._pop()
+            if self._closed or self._failed:
+                return None
+            return EMPTY
+
+    def _pop(self):
+        if self._closed and not self._flush:
+            self._discard()
+            return None
+        data, _ = self._items.popleft()
+        self.bytes -= len(data)
+        self._inflight = True
+        return data
+
+    def done(self) -> None:
+        """Called by the writer once the last dequeued frame has been sent."""
+        with self._cond:
+            self._inflight = False
+            self._last_progress = time.monotonic()
+
+    def close(self, flush: bool = False) -> None:
+        """Stop the writer. With flush=True pending frames are sent first."""
+        with self._cond:
+            self._closed = True
+            self._flush = flush
+            if not flush:
+                # the writer may be gone already (dead socket, cancelled task)
+                self._discard()
+            self._cond.notify_all()
+        self._wake()
+
+    def _discard(self) -> None:
+        for data, _ in self._items:
+            if isinstance(data, proto.FileStream):
+                data.file.close()
+        self._items.clear()
+        self.bytes = 0
+
+    @property
+    def flushing(self) -> bool:
+        return self._closed and self._flush
+
+    def _wake(self) -> None:
+        if self._waker:
+            try:
+                self._waker()
+            except RuntimeError:
+                # event loop already closed
+                pass
+
+
+def run_writer(sock: socket.socket, outbox: OutboundQueue) -> None:
+    """Writer thread body: drain the queue into a blocking socket."""
+    try:
+        while True:
+            data = outbox.get()
+            if data is None:
+                break
+            if isinstance(data, proto.FileStream):
+                proto.send_stream(sock, data)
+            else:
+                proto.send_frame(sock, data)
+            outbox.done()
+    except OSError:
+        # broken stream or dead peer: make the reader notice too
+        outbox.close()
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        return
+    if outbox.flushing:
+        # kick: everything was sent, now wake up the reader
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def start_writer_thread(sock: socket.socket, outbox: OutboundQueue) -> threading.Thread:
+    t = threading.Thread(target=run_writer, args=(sock, outbox), daemon=True)
+    t.start()
+    return t
+
+
+async def run_writer_async(writer: asyncio.StreamWriter, outbox: OutboundQueue) -> None:
+    """Writer task body for the asyncio engine."""
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+    outbox.set_waker(lambda: loop.call_soon_threadsafe(wakeup.set))
+    try:
+        while True:
+            wakeup.clear()
+            data = outbox.poll()
+            if data is EMPTY:
+                await wakeup.wait()
+                continue
+            if data is None:
+                break
+            if isinstance(data, proto.FileStream):
+                await proto.async_send_stream(writer, data)
+            else:
+                writer.writelines(data.buffers)
+                await writer.drain()
+            outbox.done()
+    except (ConnectionError, OSError):
+        outbox.close()
+        writer.transport.abort()
+        return
+    if outbox.flushing:
+        writer.close()
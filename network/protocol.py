@@ -1,26 +1,630 @@
 """Utilities for message framing and simple JSON messages.
 
 Format on the wire:
-  [4 bytes length (uint32 network order)] [payload bytes]
-payload is UTF-8 JSON by convention.
+  legacy frame: [4 bytes length (uint32 network order)] [payload bytes]
+  typed frame:  [4 bytes 0x80000000 | length] [1 byte kind] [payload bytes]
+payload is UTF-8 JSON or `COMMAND|arg|...` text by convention.
+
+Typed frames set the high bit of the length word, which legacy frames never
+do (payloads are < 2 GiB), so both formats can be read from the same socket
+during the migration (PROTOCOL.md §4). Kinds:
+  KIND_TEXT    `COMMAND|...` text
+  KIND_JSON    UTF-8 JSON object
+  KIND_BINARY  [2 bytes header length][JSON header][raw bytes], used to carry
+               file data without base64
+  KIND_STREAM  JSON header announcing `length` raw bytes that follow the
+               frame on the socket (GET_FILE served with sendfile)
+  KIND_STRUCT  structured message in the compact binary codec (below)
+recv_frame reports KIND_LEGACY for untyped frames. After a KIND_STREAM frame
+the caller must consume exactly header["length"] bytes (recv_stream_into).
+
+Compression (negotiated at LOGIN, PROTOCOL.md §11): the FLAG_COMPRESSED bit
+of the kind byte marks a frame whose payload is [1 byte codec][compressed
+payload]; recv_frame decompresses it transparently, so the flag is never
+visible to callers. Only frames of at least COMPRESS_MIN_SIZE bytes are
+compressed, and a frame is sent as is when compression does not save at
+least 1 - COMPRESS_MAX_RATIO of it (media, archives).
+
+Message codecs (negotiated at LOGIN, PROTOCOL.md §12): structured messages
+(dicts such as FILE_AVAILABLE or FILE_LIST) are encoded by a MessageCodec.
+JSON_CODEC sends untyped UTF-8 JSON, readable by every client; STRUCT_CODEC
+sends KIND_STRUCT frames: tagged values with fixed-size packed integers and
+floats, length-prefixed strings, and the protocol's keys and common values
+(STRUCT_STRINGS) as one-byte ids. decode_message(frame) reads either, so a
+peer may receive both on the same connection. JSON goes through orjson
+when it is installed (same bytes on the wire, parsed by the same peers).
 
 Functions:
+- PreparedFrame(payload) / PreparedFrame.from_json(dict) /
+  PreparedFrame.binary(header, data): a frame encoded once and reusable for
+  any number of recipients; frame.compressed(codec) returns the compressed
+  variant (cached, or the frame itself when compressing is not worth it)
+- choose_codec(offered) / CODECS: compression negotiation
+- JSON_CODEC / STRUCT_CODEC / MESSAGE_CODECS / choose_message_codec(offered):
+  codec.encode(dict) -> bytes, codec.decode(bytes) -> dict,
+  codec.frame(dict) -> PreparedFrame; decode_message(frame) -> dict
+- send_frame(sock, frame): scatter/gather send of a PreparedFrame
 - send_message(sock, obj)
+- send_binary(sock, header, data)
+- FileStream(header, file, offset, count) / send_stream(sock, stream):
+  header frame + file body sent with socket.sendfile (zero-copy)
+- recv_stream_into(sock, fileobj, count): copy a stream body to a file
+- FrameReader(sock, max_frame=...): buffered reader yielding frames as
+  memoryviews into a reusable buffer (many frames per recv, no per-frame
+  allocation); frames over max_frame bytes raise ValueError
+- recv_frame(sock, max_length=...) -> Frame(kind, header, data)
 - recv_message(sock) -> bytes
-- send_json(sock, dict)
-- recv_json(sock) -> dict
+- send_json(sock, dict, codec=JSON_CODEC)
+- recv_json(sock) -> dict (any codec)
+- async_send_message(writer, payload) / async_recv_frame(reader) /
+  async_recv_message(reader) for asyncio streams (same wire format)
 
 This module is minimal and safe to integrate alongside existing code.
 """
+import asyncio
+import base64
+import binascii
 import json
 import struct
 import socket
-from typing import Any, Dict
+import zlib
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Union
+
+try:
+    import lzma
+except ImportError:  # Python built without liblzma
+    lzma = None
+
+try:
+    import orjson
+except ImportError:  # optional: faster JSON, same output
+    orjson = None
+
+# raw bytes per FILE_CHUNK message of a streaming upload
+FILE_CHUNK_SIZE = 64 * 1024
+
+TYPED_FLAG = 0x80000000
+MAX_FRAME_LENGTH = TYPED_FLAG - 1
+
+KIND_LEGACY = 0
+KIND_TEXT = 1
+KIND_JSON = 2
+KIND_BINARY = 3
+KIND_STREAM = 4
+KIND_STRUCT = 5
+
+# kind byte bit: the payload is [1 byte codec id][compressed payload]
+FLAG_COMPRESSED = 0x80
+
+# compression codecs, by preference order; ids go on the wire
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+CODECS = {"zlib": CODEC_ZLIB}
+if lzma is not None:
+    CODECS["lzma"] = CODEC_LZMA
+ZLIB_LEVEL = 1
+LZMA_PRESET = 1
+# frames smaller than this are never compressed (not worth the CPU)
+COMPRESS_MIN_SIZE = 512
+# frames larger than this are sent as is (bounds memory on both sides)
+COMPRESS_MAX_SIZE = 64 * 1024 * 1024
+# compressed size must be at most this fraction of the original
+COMPRESS_MAX_RATIO = 0.9
+# larger payloads are first probed on a sample of this size, so media and
+# archives are skipped without compressing them whole
+COMPRESS_SAMPLE_SIZE = 4096
+
+# read size used when copying a stream body from the socket to disk
+STREAM_BUFFER_SIZE = 256 * 1024
+
+# FrameReader buffer: starts small (idle chat connections), grows up to the
+# max for bigger frames (FILE_CHUNK); larger frames get their own buffer
+READ_BUFFER_SIZE = 16 * 1024
+READ_BUFFER_MAX = 256 * 1024
+# base64 of whole files (old SEND_FILE format) done by slices of this many
+# bytes: the GIL is released between two slices (multiple of 3 and 4)
+B64_SLICE = 768 * 1024
+
+# what zlib and lzma raise on damaged input (neither is a ValueError)
+_DECOMPRESS_ERRORS = (zlib.error,) if lzma is None else (zlib.error, lzma.LZMAError)
+
+_LENGTH = struct.Struct("!I")
+_TYPED_HEADER = struct.Struct("!IB")
+_BINARY_HEADER_LENGTH = struct.Struct("!H")
+
+
+class Frame(NamedTuple):
+    kind: int
+    header: Optional[Dict[str, Any]]  # JSON header of a KIND_BINARY/KIND_STREAM frame
+    data: Union[bytes, memoryview]     # payload, or raw bytes of a binary frame
+
+
+def encode_json(obj: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass  # what orjson refuses (ints over 64 bits, non-str keys)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def decode_json(data: Union[bytes, memoryview]) -> Any:
+    # orjson reads integers beyond 64 bits as floats: protocol values
+    # (sizes, offsets, ids) stay well below
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(str(data, "utf-8"))
+
+
+def b64encode_sliced(data: Union[bytes, memoryview]) -> str:
+    """base64.b64encode(data) as str, by slices of B64_SLICE bytes.
+
+    binascii holds the GIL for the whole buffer (~40 ms for 8 MiB): by
+    slices, the other threads (the asyncio loop) run in between."""
+    view = memoryview(data)
+    return "".join(binascii.b2a_base64(view[i:i + B64_SLICE], newline=False).decode("ascii")
+                   for i in range(0, len(view), B64_SLICE))
+
+
+def b64decode_sliced(text: str) -> bytes:
+    """base64.b64decode(text) by slices of B64_SLICE characters.
+
+    Slices are decoded strictly; text with other characters than the base64
+    alphabet (line breaks) is decoded in one piece, as b64decode does."""
+    raw = text.encode("ascii") if isinstance(text, str) else bytes(text)
+    if len(raw) % 4:
+        return base64.b64decode(raw)
+    try:
+        return b"".join(base64.b64decode(raw[i:i + B64_SLICE], validate=True)
+                        for i in range(0, len(raw), B64_SLICE))
+    except binascii.Error:
+        return base64.b64decode(raw)
+
+
+def choose_codec(offered: Iterable[str]) -> Optional[str]:
+    """First codec of the peer's list (its preference order) we support."""
+    for name in offered:
+        if name in CODECS:
+            return name
+    return None
+
+
+def compress(payload: bytes, codec: str) -> Optional[bytes]:
+    """[codec id][compressed payload], or None when it does not shrink enough."""
+    if len(payload) > 4 * COMPRESS_SAMPLE_SIZE:
+        sample = payload[:COMPRESS_SAMPLE_SIZE]
+        if len(zlib.compress(sample, 1)) > len(sample) * COMPRESS_MAX_RATIO:
+            return None
+    if codec == "zlib":
+        body = zlib.compress(payload, ZLIB_LEVEL)
+    elif codec == "lzma" and lzma is not None:
+        body = lzma.compress(payload, preset=LZMA_PRESET)
+    else:
+        raise ValueError(f"unknown codec {codec}")
+    if len(body) + 1 > len(payload) * COMPRESS_MAX_RATIO:
+        return None
+    return bytes((CODECS[codec],)) + body
+
+
+def decompress(body: bytes) -> bytes:
+    """Payload of a compressed frame body; ValueError when it is damaged."""
+    if not body:
+        raise ValueError("empty compressed frame")
+    codec = body[0]
+    try:
+        if codec == CODEC_ZLIB:
+            d = zlib.decompressobj()
+            data = d.decompress(memoryview(body)[1:], COMPRESS_MAX_SIZE)
+            complete = d.eof and not d.unconsumed_tail
+        elif codec == CODEC_LZMA and lzma is not None:
+            d = lzma.LZMADecompressor()
+            data = d.decompress(memoryview(body)[1:], COMPRESS_MAX_SIZE)
+            complete = d.eof
+        else:
+            raise ValueError(f"unknown compression codec {codec}")
+    except _DECOMPRESS_ERRORS as e:
+        raise ValueError(f"corrupt compressed frame: {e}") from e
+    if not complete:
+        raise ValueError("corrupt or oversized compressed frame")
+    return data
+
+
+class PreparedFrame:
+    """A framed message built once and shared by every recipient.
+
+    The frame header and the payload are kept as separate buffers and sent
+    with sendmsg, so neither the encoding nor the `length + payload` copy is
+    repeated per recipient. Compressed variants are cached on the frame: a
+    broadcast is compressed once per codec, not once per recipient.
+    """
+
+    __slots__ = ("buffers", "size", "kind", "_variants")
+
+    def __init__(self, payload: bytes, kind: int = KIND_LEGACY):
+        self._set([payload], kind)
+
+    def _set(self, parts: List[bytes], kind: int) -> None:
+        length = sum(len(p) for p in parts)
+        if length > MAX_FRAME_LENGTH:
+            raise ValueError(f"frame too large ({length} bytes)")
+        if kind == KIND_LEGACY:
+            head = _LENGTH.pack(length)
+        else:
+            head = _TYPED_HEADER.pack(TYPED_FLAG | length, kind)
+        self.buffers: Sequence[bytes] = (head, *parts)
+        self.size = len(head) + length
+        self.kind = kind
+        self._variants = None
+
+    def compressed(self, codec: Optional[str]) -> "PreparedFrame":
+        """This frame compressed with `codec`, or the frame itself when it is
+        too small, too large, already compressed or does not shrink."""
+        if (not codec or self.kind & FLAG_COMPRESSED
+                or not COMPRESS_MIN_SIZE <= self.size <= COMPRESS_MAX_SIZE):
+            return self
+        if self._variants is None:
+            self._variants = {}
+        frame = self._variants.get(codec)
+        if frame is None:
+            body = compress(b"".join(self.buffers[1:]), codec)
+            if body is None:
+                frame = self
+            else:
+                frame = PreparedFrame.__new__(PreparedFrame)
+                frame._set([body], self.kind | FLAG_COMPRESSED)
+            self._variants[codec] = frame
+        return frame
+
+    @classmethod
+    def from_json(cls, obj: Dict[str, Any], kind: int = KIND_LEGACY) -> "PreparedFrame":
+        return cls(encode_json(obj), kind)
+
+    @classmethod
+    def binary(cls, header: Dict[str, Any], data: bytes) -> "PreparedFrame":
+        """Raw bytes plus a small JSON header, without base64."""
+        head = encode_json(header)
+        frame = cls.__new__(cls)
+        frame._set([_BINARY_HEADER_LENGTH.pack(len(head)), head, data], KIND_BINARY)
+        return frame
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class MessageCodec:
+    """Encoding of structured messages (dicts), negotiated per connection.
+
+    Every codec sends frames of its own kind, so the receiver finds the codec
+    from the frame (decode_message) whatever was negotiated.
+    """
+
+    name = ""
+    kind = KIND_LEGACY
+
+    def encode(self, obj: Dict[str, Any]) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: Union[bytes, memoryview]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def frame(self, obj: Dict[str, Any]) -> PreparedFrame:
+        return PreparedFrame(self.encode(obj), self.kind)
+
+
+class JsonCodec(MessageCodec):
+    """UTF-8 JSON in untyped frames, understood by every client."""
+
+    name = "json"
+    kind = KIND_LEGACY
+
+    def encode(self, obj: Dict[str, Any]) -> bytes:
+        return encode_json(obj)
+
+    def decode(self, data: Union[bytes, memoryview]) -> Dict[str, Any]:
+        obj = decode_json(data)
+        if not isinstance(obj, dict):
+            raise ValueError("message is not a JSON object")
+        return obj
+
+
+# Strings sent as a one-byte id by StructCodec, as dict keys or values. The
+# position of a string is its id on the wire: only append (at most 254), or
+# bump _STRUCT_VERSION.
+STRUCT_STRINGS = (
+    "type", "seq", "room", "meta", "filename", "size", "uploader", "sha256",
+    "status", "offset", "length", "data", "files", "next", "uploaded_at",
+    "compression", "codec", "stream", "raw", "id", "limit", "before",
+    "pseudo", "text", "messages", "error", "success", "total",
+    "FILE_AVAILABLE", "UPLOAD_ACCEPT", "FILE_LIST", "LOGIN_OK", "SEND_FILE",
+    "GET_FILE", "LIST_FILES", "FILE_BEGIN", "FILE_CHUNK", "FILE_END",
+    "FILE_STREAM", "send", "complete", "zlib", "lzma", "json", "struct",
+    "HISTORY", "ts", "event",
+    "P2P_REQUEST", "P2P_INVITE", "P2P_FAILED", "to", "from", "peer", "ip", "port",
+    "role", "token", "reason",
+)
+_STRUCT_VERSION = 1
+_STRUCT_IDS = {name: i for i, name in enumerate(STRUCT_STRINGS)}
+_KEY_STR8 = 0xFE
+_KEY_STR32 = 0xFF
+assert len(STRUCT_STRINGS) < _KEY_STR8
+
+# value tags
+(_T_NONE, _T_FALSE, _T_TRUE, _T_INT8, _T_INT32, _T_INT64, _T_BIGINT, _T_FLOAT,
+ _T_STR8, _T_STR32, _T_ATOM, _T_LIST, _T_DICT) = range(13)
+
+_TAG_INT8 = struct.Struct("!Bb")
+_TAG_INT32 = struct.Struct("!Bi")
+_TAG_INT64 = struct.Struct("!Bq")
+_TAG_FLOAT = struct.Struct("!Bd")
+_TAG_U16 = struct.Struct("!BH")
+_TAG_U32 = struct.Struct("!BI")
+_U32 = _LENGTH
+_I32 = struct.Struct("!i")
+_I64 = struct.Struct("!q")
+_F64 = struct.Struct("!d")
+_U16 = struct.Struct("!H")
+
+
+class StructCodec(MessageCodec):
+    """Compact binary encoding of JSON-like values (stdlib only).
+
+    Payload: [1 byte version][value]. A value is a one-byte tag followed by
+    fixed-size fields (network order): int8/int32/int64, float64, u8 or u32
+    length + UTF-8 for strings, u8 id for STRUCT_STRINGS, u32 count for
+    lists and dicts. Dict keys are a u8 id, or 0xFE/0xFF + length + UTF-8.
+    Decoding gives what JSON would: tuples come back as lists.
+    """
 
+    name = "struct"
+    kind = KIND_STRUCT
 
-def send_message(sock: socket.socket, payload: bytes) -> None:
-    length = struct.pack("!I", len(payload))
-    sock.sendall(length + payload)
+    def encode(self, obj: Dict[str, Any]) -> bytes:
+        if not isinstance(obj, dict):
+            raise TypeError("a message must be a dict")
+        out = bytearray((_STRUCT_VERSION,))
+        self._pack(obj, out)
+        return bytes(out)
+
+    def _pack(self, obj: Any, out: bytearray) -> None:
+        t = type(obj)
+        if t is str:
+            atom = _STRUCT_IDS.get(obj)
+            if atom is not None:
+                out.append(_T_ATOM)
+                out.append(atom)
+                return
+            raw = obj.encode("utf-8")
+            if len(raw) < 256:
+                out.append(_T_STR8)
+                out.append(len(raw))
+            else:
+                out += _TAG_U32.pack(_T_STR32, len(raw))
+            out += raw
+        elif t is int:
+            if -0x80 <= obj < 0x80:
+                out += _TAG_INT8.pack(_T_INT8, obj)
+            elif -0x80000000 <= obj < 0x80000000:
+                out += _TAG_INT32.pack(_T_INT32, obj)
+            elif -0x8000000000000000 <= obj < 0x8000000000000000:
+                out += _TAG_INT64.pack(_T_INT64, obj)
+            else:
+                raw = str(obj).encode("ascii")
+                out += _TAG_U16.pack(_T_BIGINT, len(raw))
+                out += raw
+        elif t is dict:
+            out += _TAG_U32.pack(_T_DICT, len(obj))
+            for key, value in obj.items():
+                if type(key) is not str:
+                    raise TypeError(f"dict keys must be str, not {type(key).__name__}")
+                atom = _STRUCT_IDS.get(key)
+                if atom is not None:
+                    out.append(atom)
+                else:
+                    raw = key.encode("utf-8")
+                    if len(raw) < 256:
+                        out.append(_KEY_STR8)
+                        out.append(len(raw))
+                    else:
+                        out += _TAG_U32.pack(_KEY_STR32, len(raw))
+                    out += raw
+                self._pack(value, out)
+        elif t is list or t is tuple:
+            out += _TAG_U32.pack(_T_LIST, len(obj))
+            for item in obj:
+                self._pack(item, out)
+        elif obj is None:
+            out.append(_T_NONE)
+        elif obj is True:
+            out.append(_T_TRUE)
+        elif obj is False:
+            out.append(_T_FALSE)
+        elif t is float:
+            out += _TAG_FLOAT.pack(_T_FLOAT, obj)
+        elif isinstance(obj, str):  # subclasses (enums...), as json does
+            self._pack(str.__str__(obj), out)
+        elif isinstance(obj, int):
+            self._pack(int.__int__(obj), out)
+        elif isinstance(obj, float):
+            self._pack(float.__float__(obj), out)
+        else:
+            raise TypeError(f"{t.__name__} is not serializable")
+
+    def decode(self, data: Union[bytes, memoryview]) -> Dict[str, Any]:
+        data = bytes(data)
+        if not data or data[0] != _STRUCT_VERSION:
+            raise ValueError("unknown struct message version")
+        try:
+            obj, pos = self._unpack(data, 1)
+        except (IndexError, struct.error, UnicodeDecodeError, RecursionError) as e:
+            raise ValueError(f"corrupt struct message ({e})") from e
+        if pos != len(data) or not isinstance(obj, dict):
+            raise ValueError("corrupt struct message")
+        return obj
+
+    def _unpack(self, data: bytes, pos: int):
+        tag = data[pos]
+        pos += 1
+        if tag == _T_ATOM:
+            return STRUCT_STRINGS[data[pos]], pos + 1
+        if tag == _T_STR8:
+            end = pos + 1 + data[pos]
+            return data[pos + 1:end].decode("utf-8"), self._check(data, end)
+        if tag == _T_INT8:
+            return data[pos] - 256 if data[pos] > 127 else data[pos], pos + 1
+        if tag == _T_INT32:
+            return _I32.unpack_from(data, pos)[0], pos + 4
+        if tag == _T_DICT:
+            (count,) = _U32.unpack_from(data, pos)
+            pos += 4
+            obj = {}
+            for _ in range(count):
+                key = data[pos]
+                if key < _KEY_STR8:
+                    key = STRUCT_STRINGS[key]
+                    pos += 1
+                else:
+                    if key == _KEY_STR8:
+                        end = pos + 2 + data[pos + 1]
+                        pos += 2
+                    else:
+                        end = pos + 5 + _U32.unpack_from(data, pos + 1)[0]
+                        pos += 5
+                    key = data[pos:self._check(data, end)].decode("utf-8")
+                    pos = end
+                obj[key], pos = self._unpack(data, pos)
+            return obj, pos
+        if tag == _T_LIST:
+            (count,) = _U32.unpack_from(data, pos)
+            pos += 4
+            items = []
+            for _ in range(count):
+                item, pos = self._unpack(data, pos)
+                items.append(item)
+            return items, pos
+        if tag == _T_STR32:
+            end = pos + 4 + _U32.unpack_from(data, pos)[0]
+            return data[pos + 4:end].decode("utf-8"), self._check(data, end)
+        if tag == _T_NONE:
+            return None, pos
+        if tag == _T_TRUE:
+            return True, pos
+        if tag == _T_FALSE:
+            return False, pos
+        if tag == _T_INT64:
+            return _I64.unpack_from(data, pos)[0], pos + 8
+        if tag == _T_FLOAT:
+            return _F64.unpack_from(data, pos)[0], pos + 8
+        if tag == _T_BIGINT:
+            end = pos + 2 + _U16.unpack_from(data, pos)[0]
+            return int(data[pos + 2:self._check(data, end)]), end
+        raise ValueError(f"unknown struct tag {tag}")
+
+    @staticmethod
+    def _check(data: bytes, end: int) -> int:
+        if end > len(data):
+            raise IndexError("truncated string")
+        return end
+
+
+JSON_CODEC = JsonCodec()
+STRUCT_CODEC = StructCodec()
+MESSAGE_CODECS: Dict[str, MessageCodec] = {c.name: c for c in (STRUCT_CODEC, JSON_CODEC)}
+
+
+def choose_message_codec(offered: Iterable[str]) -> MessageCodec:
+    """First message codec of the peer's list we support, JSON otherwise."""
+    for name in offered:
+        codec = MESSAGE_CODECS.get(name)
+        if codec is not None:
+            return codec
+    return JSON_CODEC
+
+
+def decode_message(frame: Frame) -> Dict[str, Any]:
+    """Structured message carried by a frame, whatever codec encoded it."""
+    if frame.kind == KIND_STRUCT:
+        return STRUCT_CODEC.decode(frame.data)
+    return JSON_CODEC.decode(frame.data)
+
+
+class FileStream:
+    """A KIND_STREAM header frame followed by `count` bytes of an open file.
+
+    The file body is sent with socket.sendfile (os.sendfile where available,
+    chunked reads otherwise) and never enters Python memory. len() only counts
+    the header frame, as the body is not buffered.
+    """
+
+    __slots__ = ("frame", "file", "offset", "count")
+
+    def __init__(self, header: Dict[str, Any], file, offset: int, count: int):
+        header = dict(header, offset=offset, length=count)
+        self.frame = PreparedFrame.from_json(header, KIND_STREAM)
+        self.file = file
+        self.offset = offset
+        self.count = count
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+
+def sendmsg_all(sock: socket.socket, buffers: Sequence[bytes]) -> None:
+    """sendall() for a list of buffers, without joining them."""
+    if not hasattr(sock, "sendmsg"):
+        # Windows sockets and socket-like wrappers
+        sock.sendall(b"".join(buffers))
+        return
+    views = [memoryview(b) for b in buffers if len(b)]
+    while views:
+        sent = sock.sendmsg(views)
+        while sent:
+            first = views[0]
+            if sent >= len(first):
+                sent -= len(first)
+                views.pop(0)
+            else:
+                views[0] = first[sent:]
+                sent = 0
+
+
+def send_frame(sock: socket.socket, frame: PreparedFrame) -> None:
+    sendmsg_all(sock, frame.buffers)
+
+
+def send_message(sock: socket.socket, payload: bytes, codec: Optional[str] = None) -> None:
+    send_frame(sock, PreparedFrame(payload).compressed(codec))
+
+
+def send_binary(sock: socket.socket, header: Dict[str, Any], data: bytes,
+                codec: Optional[str] = None) -> None:
+    send_frame(sock, PreparedFrame.binary(header, data).compressed(codec))
+
+
+def send_stream(sock: socket.socket, stream: FileStream) -> None:
+    try:
+        send_frame(sock, stream.frame)
+        sent = sock.sendfile(stream.file, stream.offset, stream.count) if stream.count else 0
+    finally:
+        stream.file.close()
+    if sent != stream.count:
+        # the peer expects exactly `count` bytes: the stream is unusable
+        raise ConnectionError(f"file stream truncated ({sent}/{stream.count} bytes)")
+
+
+def recv_stream_into(sock: Union[socket.socket, "FrameReader"], fileobj, count: int) -> None:
+    """Copy the `count` raw bytes following a KIND_STREAM frame into fileobj.
+
+    `sock` is the FrameReader the header frame came from, or a plain socket
+    when the header was read with recv_frame."""
+    buf = bytearray(min(STREAM_BUFFER_SIZE, max(count, 1)))
+    view = memoryview(buf)
+    remaining = count
+    while remaining:
+        n = sock.recv_into(view, min(len(buf), remaining))
+        if not n:
+            raise ConnectionError("socket closed while reading")
+        fileobj.write(view[:n])
+        remaining -= n
 
 
 def recv_exact(sock: socket.socket, n: int) -> bytes:
@@ -33,17 +637,212 @@ def recv_exact(sock: socket.socket, n: int) -> bytes:
     return bytes(buf)
 
 
+def decode_typed(kind: int, body: Union[bytes, memoryview]) -> Frame:
+    """Frame of a typed payload; any malformed payload raises ValueError."""
+    if kind & FLAG_COMPRESSED:
+        kind &= ~FLAG_COMPRESSED
+        body = decompress(body)
+        if kind == KIND_LEGACY:
+            return Frame(kind, None, body)
+    if kind == KIND_STREAM:
+        return Frame(kind, _decode_header(body), b"")
+    if kind == KIND_BINARY:
+        if len(body) < _BINARY_HEADER_LENGTH.size:
+            raise ValueError("truncated binary frame")
+        (hlen,) = _BINARY_HEADER_LENGTH.unpack_from(body)
+        if 2 + hlen > len(body):
+            raise ValueError("binary frame header longer than the frame")
+        view = memoryview(body)
+        return Frame(kind, _decode_header(view[2:2 + hlen]), view[2 + hlen:])
+    return Frame(kind, None, body)
+
+
+def _decode_header(data: Union[bytes, memoryview]) -> Dict[str, Any]:
+    header = decode_json(data)
+    if not isinstance(header, dict):
+        raise ValueError("frame header is not a JSON object")
+    return header
+
+
+class FrameReader:
+    """Per-connection frame reader for a blocking socket.
+
+    Reads as much as the socket has with recv_into into a reusable buffer and
+    cuts frames out of it: a burst of small frames costs one recv, and a
+    frame split across reads is simply completed by the next one.
+
+    Frame payloads are memoryviews into the buffer, only valid until the
+    next read_frame() call: copy them (bytes(...)) to keep them longer.
+    After a KIND_STREAM frame, pass the reader itself to recv_stream_into,
+    as part of the body may already be buffered.
+
+    Memory follows the bytes received, not the declared length: a frame
+    larger than READ_BUFFER_MAX gets its own buffer, grown as it arrives.
+    """
+
+    __slots__ = ("sock", "max_frame", "_buf", "_view", "_start", "_end")
+
+    def __init__(self, sock: socket.socket, buffer_size: int = READ_BUFFER_SIZE,
+                 max_frame: int = MAX_FRAME_LENGTH):
+        self.sock = sock
+        # longer frames raise ValueError before any of their bytes is read
+        self.max_frame = max_frame
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+    def __iter__(self):
+        while True:
+            yield self.read_frame()
+
+    def read_frame(self) -> Frame:
+        start = self._start
+        end = self._end
+        if end - start >= 4:
+            # fast path: a whole untyped frame already in the buffer
+            (word,) = _LENGTH.unpack_from(self._buf, start)
+            stop = start + 4 + word
+            if stop <= end:
+                self._start = stop if stop < end else 0
+                if stop == end:
+                    self._end = 0
+                return Frame(KIND_LEGACY, None, self._view[start + 4:stop])
+        (word,) = _LENGTH.unpack(self._take(4))
+        length = _frame_length(word, self.max_frame)
+        if not word & TYPED_FLAG:
+            return Frame(KIND_LEGACY, None, self._take(length))
+        kind = self._take(1)[0]
+        return decode_typed(kind, self._take(length))
+
+    def recv_into(self, buffer, nbytes: int = 0) -> int:
+        """socket.recv_into, serving already buffered bytes first."""
+        nbytes = nbytes or len(buffer)
+        buffered = self._end - self._start
+        if not buffered:
+            return self.sock.recv_into(buffer, nbytes)
+        n = min(buffered, nbytes)
+        buffer[:n] = self._view[self._start:self._start + n]
+        self._consume(n)
+        return n
+
+    def _take(self, n: int) -> memoryview:
+        if n > len(self._buf):
+            if n > READ_BUFFER_MAX:
+                return self._take_large(n)
+            self._grow(n)
+        if self._end - self._start < n:
+            self._fill(n)
+        view = self._view[self._start:self._start + n]
+        self._consume(n)
+        return view
+
+    def _consume(self, n: int) -> None:
+        self._start += n
+        if self._start == self._end:
+            # empty: the next recv reuses the buffer from the start
+            self._start = self._end = 0
+
+    def _fill(self, n: int) -> None:
+        if self._start + n > len(self._buf):
+            # move the partial frame to the front (usually a few bytes)
+            pending = self._end - self._start
+            self._view[:pending] = self._view[self._start:self._end]
+            self._start, self._end = 0, pending
+        while self._end - self._start < n:
+            got = self.sock.recv_into(self._view[self._end:])
+            if not got:
+                raise ConnectionError("socket closed while reading")
+            self._end += got
+
+    def _grow(self, n: int) -> None:
+        # a new buffer: views handed out earlier keep the old one alive
+        size = len(self._buf)
+        while size < n:
+            size *= 2
+        buf = bytearray(min(size, READ_BUFFER_MAX))
+        pending = self._end - self._start
+        buf[:pending] = self._view[self._start:self._end]
+        self._buf = buf
+        self._view = memoryview(buf)
+        self._start, self._end = 0, pending
+
+    def _take_large(self, n: int) -> memoryview:
+        # doubled as the bytes arrive: a length word alone never allocates n bytes
+        out = bytearray(self._view[self._start:self._end])
+        self._start = self._end = 0
+        have = len(out)
+        while have < n:
+            size = min(n, max(2 * have, READ_BUFFER_MAX))
+            out += bytes(size - have)
+            with memoryview(out) as view:
+                while have < size:
+                    got = self.sock.recv_into(view[have:size])
+                    if not got:
+                        raise ConnectionError("socket closed while reading")
+                    have += got
+        return memoryview(out)
+
+
+def _frame_length(word: int, max_length: int) -> int:
+    length = word & MAX_FRAME_LENGTH
+    if length > max_length:
+        raise ValueError(f"frame too large ({length} bytes, at most {max_length})")
+    return length
+
+
+def recv_frame(sock: socket.socket, max_length: int = MAX_FRAME_LENGTH) -> Frame:
+    (word,) = _LENGTH.unpack(recv_exact(sock, 4))
+    length = _frame_length(word, max_length)
+    if not word & TYPED_FLAG:
+        return Frame(KIND_LEGACY, None, recv_exact(sock, length))
+    kind = recv_exact(sock, 1)[0]
+    return decode_typed(kind, recv_exact(sock, length))
+
+
 def recv_message(sock: socket.socket) -> bytes:
-    header = recv_exact(sock, 4)
-    (length,) = struct.unpack("!I", header)
-    return recv_exact(sock, length)
+    """Payload of the next frame (for binary frames: the raw data only)."""
+    return bytes(recv_frame(sock).data)
 
 
-def send_json(sock: socket.socket, obj: Dict[str, Any]) -> None:
-    payload = json.dumps(obj, separators=(",", ":")).encode("utf-8")
-    send_message(sock, payload)
+def send_json(sock: socket.socket, obj: Dict[str, Any], codec: Optional["MessageCodec"] = None) -> None:
+    send_frame(sock, (codec or JSON_CODEC).frame(obj))
 
 
 def recv_json(sock: socket.socket) -> Dict[str, Any]:
-    data = recv_message(sock)
-    return json.loads(data.decode("utf-8"))
+    return decode_message(recv_frame(sock))
+
+
+async def async_send_message(writer: asyncio.StreamWriter, payload: bytes) -> None:
+    writer.writelines(PreparedFrame(payload).buffers)
+    await writer.drain()
+
+
+async def async_send_stream(writer: asyncio.StreamWriter, stream: FileStream) -> None:
+    try:
+        writer.writelines(stream.frame.buffers)
+        await writer.drain()
+        sent = 0
+        if stream.count:
+            loop = asyncio.get_running_loop()
+            sent = await loop.sendfile(writer.transport, stream.file, stream.offset, stream.count)
+    finally:
+        stream.file.close()
+    if sent != stream.count:
+        raise ConnectionError(f"file stream truncated ({sent}/{stream.count} bytes)")
+
+
+async def async_recv_frame(reader: asyncio.StreamReader, max_length: int = MAX_FRAME_LENGTH) -> Frame:
+    try:
+        (word,) = _LENGTH.unpack(await reader.readexactly(4))
+        length = _frame_length(word, max_length)
+        if not word & TYPED_FLAG:
+            return Frame(KIND_LEGACY, None, await reader.readexactly(length))
+        kind = (await reader.readexactly(1))[0]
+        return decode_typed(kind, await reader.readexactly(length))
+    except asyncio.IncompleteReadError as e:
+        raise ConnectionError("socket closed while reading") from e
+
+
+async def async_recv_message(reader: asyncio.StreamReader) -> bytes:
+    return bytes((await async_recv_frame(reader)).data)
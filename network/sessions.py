@@ -0,0 +1,232 @@
+"""Session registry: O(1) lookups of connected clients.
+
+Indexes kept in sync under a single lock:
+- socket -> Session
+- pseudo -> Session (last login wins when pseudos collide)
+- room   -> set of Session
+
+Broadcasting to a room therefore costs O(room size) instead of
+O(connected clients).
+
+In cluster mode each worker process only knows its own sessions: they are
+summarised with Session.info() and aggregated by the supervisor in a
+RemoteRegistry of RemoteSession (read-only, same attributes as Session).
+"""
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Union
+
+from network import protocol as proto
+from network.outbound import OutboundQueue
+
+
+class Session:
+    __slots__ = ("socket", "addr", "pseudo", "room", "last_message_time", "outbox",
+                 "compression", "codec", "data_token")
+
+    def __init__(self, sock, addr, pseudo: str, outbox: Optional[OutboundQueue] = None):
+        self.socket = sock
+        self.addr = addr
+        self.pseudo = pseudo
+        self.room: Optional[str] = None
+        self.last_message_time = None
+        self.outbox = outbox if outbox is not None else OutboundQueue()
+        self.compression: Optional[str] = None  # compression negotiated at LOGIN
+        self.codec: proto.MessageCodec = proto.JSON_CODEC  # structured messages, idem
+        self.data_token: Optional[str] = None  # opens DataSessions (LOGIN_OK)
+
+    def send(self, payload: Union[bytes, proto.PreparedFrame, proto.FileStream],
+             droppable: bool = False) -> bool:
+        """Queue a frame for this client; never blocks on the socket.
+
+        Pass a PreparedFrame to share one encoding between many recipients.
+        Frames are compressed when the client negotiated compression and it
+        pays off (the compressed variant is cached on the frame)."""
+        if isinstance(payload, (bytes, bytearray)):
+            # text or JSON payload: untyped frame, understood by every client
+            payload = proto.PreparedFrame(payload)
+        if self.compression and isinstance(payload, proto.PreparedFrame):
+            payload = payload.compressed(self.compression)
+        return self.outbox.put(payload, droppable)
+
+    def send_json(self, obj: Dict[str, Any]) -> bool:
+        """Send a structured message with the codec negotiated at LOGIN."""
+        return self.send(self.codec.frame(obj))
+
+    def info(self) -> Dict[str, Any]:
+        """JSON summary shown by the admin dashboard (see RemoteSession)."""
+        outbox = self.outbox
+        return {
+            "addr": list(self.addr) if self.addr else None,
+            "pseudo": self.pseudo,
+            "room": self.room,
+            "last_message_time": self.last_message_time.timestamp() if self.last_message_time else None,
+            "depth": outbox.depth,
+            "bytes": outbox.bytes,
+            "dropped": outbox.dropped,
+        }
+
+    def __repr__(self) -> str:
+        return f"Session({self.pseudo!r}, room={self.room!r})"
+
+
+class DataSession(Session):
+    """Extra connection of a logged-in client, for bulk downloads only.
+
+    Opened with the data token of the control Session; never registered in
+    the SessionRegistry, so it is in no room and not listed anywhere.
+    """
+    __slots__ = ("control",)
+
+    def __init__(self, sock, addr, control: Session, outbox: Optional[OutboundQueue] = None):
+        super().__init__(sock, addr, control.pseudo, outbox)
+        self.control = control
+        self.codec = control.codec
+
+    def __repr__(self) -> str:
+        return f"DataSession({self.pseudo!r})"
+
+
+class SessionRegistry:
+    """Thread-safe index of sessions by socket, pseudo and room.
+
+    Read helpers return snapshots so callers can send without holding the lock.
+    """
+
+    def __init__(self, on_room_change: Optional[Callable[[str, bool], None]] = None):
+        self.lock = threading.RLock()
+        # on_room_change(room, True) when a room gets its first member,
+        # (room, False) when its last member leaves; called under the lock
+        self.on_room_change = on_room_change
+        self._by_socket: Dict[object, Session] = {}
+        self._by_pseudo: Dict[str, Session] = {}
+        self._rooms: Dict[str, Set[Session]] = {}
+
+    def add(self, session: Session) -> None:
+        with self.lock:
+            self._by_socket[session.socket] = session
+            self._by_pseudo[session.pseudo] = session
+            if session.room is not None:
+                self._join_room(session)
+
+    def remove(self, sock) -> Optional[Session]:
+        with self.lock:
+            session = self._by_socket.pop(sock, None)
+            if session is None:
+                return None
+            if self._by_pseudo.get(session.pseudo) is session:
+                del self._by_pseudo[session.pseudo]
+            self._leave_room(session)
+            return session
+
+    def move(self, session: Session, room: Optional[str]) -> Optional[str]:
+        """Change the room of a session and return the previous one."""
+        with self.lock:
+            old_room = session.room
+            self._leave_room(session)
+            session.room = room
+            if room is not None and session.socket in self._by_socket:
+                self._join_room(session)
+            return old_room
+
+    def _join_room(self, session: Session) -> None:
+        members = self._rooms.get(session.room)
+        if members is None:
+            members = self._rooms[session.room] = set()
+            if self.on_room_change is not None:
+                self.on_room_change(session.room, True)
+        members.add(session)
+
+    def _leave_room(self, session: Session) -> None:
+        members = self._rooms.get(session.room)
+        if members is not None:
+            members.discard(session)
+            if not members:
+                del self._rooms[session.room]
+                if self.on_room_change is not None:
+                    self.on_room_change(session.room, False)
+
+    def get(self, sock) -> Optional[Session]:
+        with self.lock:
+            return self._by_socket.get(sock)
+
+    def by_pseudo(self, pseudo: str) -> Optional[Session]:
+        with self.lock:
+            return self._by_pseudo.get(pseudo)
+
+    def members(self, room: str) -> List[Session]:
+        with self.lock:
+            return list(self._rooms.get(room, ()))
+
+    def all(self) -> List[Session]:
+        with self.lock:
+            return list(self._by_socket.values())
+
+    def rooms(self) -> List[str]:
+        with self.lock:
+            return list(self._rooms)
+
+    def __len__(self) -> int:
+        return len(self._by_socket)
+
+
+class OutboxStats(NamedTuple):
+    depth: int
+    bytes: int
+    dropped: int
+
+
+class RemoteSession:
+    """Session held by a worker process, as seen by the supervisor."""
+
+    __slots__ = ("socket", "addr", "pseudo", "room", "last_message_time", "outbox", "worker")
+
+    def __init__(self, worker: str, info: Dict[str, Any]):
+        self.socket = None  # not reachable from the supervisor: kick by pseudo
+        self.worker = worker
+        self.addr = tuple(info["addr"]) if info.get("addr") else ("?", 0)
+        self.pseudo = info.get("pseudo")
+        self.room = info.get("room")
+        ts = info.get("last_message_time")
+        self.last_message_time = datetime.fromtimestamp(ts) if ts else None
+        self.outbox = OutboxStats(info.get("depth", 0), info.get("bytes", 0), info.get("dropped", 0))
+
+    def __repr__(self) -> str:
+        return f"RemoteSession({self.pseudo!r}, room={self.room!r}, worker={self.worker!r})"
+
+
+class RemoteRegistry:
+    """Sessions of every worker, rebuilt from their latest snapshots."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._by_worker: Dict[str, List[RemoteSession]] = {}
+
+    def update(self, worker: str, infos: Iterable[Dict[str, Any]]) -> None:
+        sessions = [RemoteSession(worker, info) for info in infos]
+        with self.lock:
+            self._by_worker[worker] = sessions
+
+    def drop(self, worker: str) -> None:
+        with self.lock:
+            self._by_worker.pop(worker, None)
+
+    def by_pseudo(self, pseudo: str) -> Optional[RemoteSession]:
+        for session in self.all():
+            if session.pseudo == pseudo:
+                return session
+        return None
+
+    def members(self, room: str) -> List[RemoteSession]:
+        return [s for s in self.all() if s.room == room]
+
+    def all(self) -> List[RemoteSession]:
+        with self.lock:
+            return [s for sessions in self._by_worker.values() for s in sessions]
+
+    def rooms(self) -> List[str]:
+        return sorted({s.room for s in self.all() if s.room is not None})
+
+    def __len__(self) -> int:
+        with self.lock:
+            return sum(len(sessions) for sessions in self._by_worker.values())
@@ -2,18 +2,53 @@
 
 This provides a blocking wait API (synchronous) and a non-blocking check API.
 It is intentionally lightweight so it can be integrated in threaded or asyncio apps.
+
+Every sequence has a timeout. Timeouts and the expiry of finished entries
+are driven by one Scheduler (network.timers) shared by all the sequences:
+no thread per sequence, and entries nobody waits for are forgotten
+finished_ttl seconds after they complete or time out.
+
+Besides wait(), a sequence can be observed without blocking a thread:
+add_done_callback(), future() (a concurrent.futures.Future, or an asyncio
+future when a loop is given: the result crosses to the loop with
+call_soon_threadsafe) and, for several sequences at once, wait_any() /
+wait_all() and their asyncio counterparts.
 """
+import asyncio
+import collections
+import concurrent.futures
 import threading
 import time
-from typing import Dict, Optional
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from network.timers import Scheduler, Timer
+
+DEFAULT_TIMEOUT = 30.0
+# finished sequences stay readable (wait) this long
+FINISHED_TTL = 60.0
+
+PENDING = "pending"
+COMPLETE = "complete"
+TIMEOUT = "timeout"
+
+# fn(seq_id, state, result): state is COMPLETE or TIMEOUT (result None)
+DoneCallback = Callable[[str, str, Optional[dict]], None]
+
+
+class SequenceTimeout(TimeoutError):
+    """Raised by the futures of a sequence that timed out."""
 
 
 class SequenceEntry:
     def __init__(self, seq_id: str):
         self.seq_id = seq_id
-        self.event = threading.Event()
+        self.event: Optional[threading.Event] = None  # created by the first wait()
         self.result = None
         self.created_at = time.time()
+        self.state = PENDING
+        self.timer: Optional[Timer] = None  # timeout
+        self.on_timeout: Optional[Callable[[str], None]] = None
+        self.callbacks: Optional[List[DoneCallback]] = None  # add_done_callback, futures
 
 
 class IntermediateStateManager:
@@ -21,45 +56,296 @@ class IntermediateStateManager:
 
     Usage:
       mgr = IntermediateStateManager()
-      mgr.begin_sequence('42')
+      mgr.begin_sequence('42', timeout=10, on_timeout=lambda seq: ...)
       # elsewhere, when COMPLETE arrives:
       mgr.complete_sequence('42', result={'status':'ok'})
       # sender can wait:
       res = mgr.wait('42', timeout=30)
+      # or, in a coroutine:
+      fut = mgr.begin_sequence('43', loop=asyncio.get_running_loop())
+      res = await fut
+
+    A sequence not completed within its timeout is finished in the TIMEOUT
+    state: waiters get None, futures raise SequenceTimeout and
+    on_timeout(seq_id) runs on the scheduler thread (keep it short).
+    Done callbacks run on the thread that finishes the sequence (the
+    completing thread, or the scheduler thread on timeout).
     """
 
-    def __init__(self):
+    def __init__(self, scheduler: Optional[Scheduler] = None, default_timeout: float = DEFAULT_TIMEOUT,
+                 finished_ttl: float = FINISHED_TTL):
         self._seqs: Dict[str, SequenceEntry] = {}
         self._lock = threading.Lock()
+        self.scheduler = scheduler if scheduler is not None else Scheduler("sequences")
+        self.default_timeout = default_timeout
+        self.finished_ttl = finished_ttl
+        # finished entries in expiry order (same ttl for all), purged by one timer
+        self._finished: Deque[Tuple[float, SequenceEntry]] = collections.deque()
+        self._purge_timer: Optional[Timer] = None
 
-    def begin_sequence(self, seq_id: str) -> None:
+    def begin_sequence(self, seq_id: str, timeout: Optional[float] = None,
+                       on_timeout: Optional[Callable[[str], None]] = None,
+                       future: bool = False, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Start a sequence; with future=True or a loop, return future(seq_id, loop)."""
+        ent = SequenceEntry(seq_id)
+        ent.on_timeout = on_timeout
         with self._lock:
             if seq_id in self._seqs:
                 raise RuntimeError(f"sequence {seq_id} already exists")
-            self._seqs[seq_id] = SequenceEntry(seq_id)
+            self._seqs[seq_id] = ent
+            ent.timer = self.scheduler.call_later(
+                self.default_timeout if timeout is None else timeout, self._expire, ent)
+        if future or loop is not None:
+            return self.future(seq_id, loop)
+        return None
 
-    def complete_sequence(self, seq_id: str, result: Optional[dict] = None) -> None:
+    def complete_sequence(self, seq_id: str, result: Optional[dict] = None) -> bool:
+        """Finish a pending sequence; False if unknown, already completed or timed out."""
         with self._lock:
             ent = self._seqs.get(seq_id)
-            if not ent:
-                return
+            if not ent or ent.state != PENDING:
+                return False
             ent.result = result
+            ent.state = COMPLETE
+            callbacks = self._finish(ent)
+        self._run_callbacks(ent, callbacks)
+        return True
+
+    def _expire(self, ent: SequenceEntry) -> None:
+        with self._lock:
+            if ent.state != PENDING or self._seqs.get(ent.seq_id) is not ent:
+                return
+            ent.state = TIMEOUT
+            callbacks = self._finish(ent)
+        self._run_callbacks(ent, callbacks)
+        if ent.on_timeout is not None:
+            ent.on_timeout(ent.seq_id)
+
+    def _finish(self, ent: SequenceEntry) -> Optional[List[DoneCallback]]:
+        # lock held: wake the waiters, keep the entry for late ones, then forget it.
+        # Returns the done callbacks, to run once the lock is released.
+        ent.timer.cancel()
+        if ent.event is not None:
             ent.event.set()
-            # keep entry for short time; cleanup can remove it later
+        self._finished.append((time.monotonic() + self.finished_ttl, ent))
+        if self._purge_timer is None:
+            self._purge_timer = self.scheduler.call_later(self.finished_ttl, self._purge)
+        callbacks, ent.callbacks = ent.callbacks, None
+        return callbacks
+
+    @staticmethod
+    def _run_callbacks(ent: SequenceEntry, callbacks: Optional[List[DoneCallback]]) -> None:
+        for fn in callbacks or ():
+            try:
+                fn(ent.seq_id, ent.state, ent.result)
+            except Exception as ex:
+                print(f"[SEQUENCE] callback {ent.seq_id}: {ex!r}")
+
+    def _purge(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            finished = self._finished
+            while finished and finished[0][0] <= now:
+                ent = finished.popleft()[1]
+                if self._seqs.get(ent.seq_id) is ent:
+                    del self._seqs[ent.seq_id]
+            self._purge_timer = None
+            if finished:
+                self._purge_timer = self.scheduler.call_later(finished[0][0] - now, self._purge)
 
     def wait(self, seq_id: str, timeout: Optional[float] = None) -> Optional[dict]:
         ent = None
         with self._lock:
             ent = self._seqs.get(seq_id)
-        if not ent:
-            raise KeyError(f"unknown sequence {seq_id}")
+            if not ent:
+                raise KeyError(f"unknown sequence {seq_id}")
+            if ent.event is None:
+                ent.event = threading.Event()
+                if ent.state != PENDING:
+                    ent.event.set()
         finished = ent.event.wait(timeout=timeout)
         res = ent.result if finished else None
-        # cleanup after wait
-        with self._lock:
-            self._seqs.pop(seq_id, None)
+        self._forget([ent])
         return res
 
+    def _forget(self, entries: Iterable[SequenceEntry]) -> None:
+        # cleanup after wait. A sequence still pending is abandoned by its
+        # waiter: its callbacks and futures see it time out (not on_timeout,
+        # the waiter already knows).
+        abandoned = []
+        with self._lock:
+            for ent in entries:
+                if self._seqs.get(ent.seq_id) is not ent:
+                    continue
+                del self._seqs[ent.seq_id]
+                ent.timer.cancel()
+                if ent.state == PENDING:
+                    ent.state = TIMEOUT
+                    if ent.event is not None:
+                        ent.event.set()
+                    abandoned.append((ent, ent.callbacks))
+                    ent.callbacks = None
+        for ent, callbacks in abandoned:
+            self._run_callbacks(ent, callbacks)
+
+    def add_done_callback(self, seq_id: str, fn: DoneCallback) -> None:
+        """Call fn(seq_id, state, result) once the sequence is finished.
+
+        Called right away, on this thread, if it already is.
+        """
+        self._add_done_callbacks([(seq_id, fn)])
+
+    def _add_done_callbacks(self, pairs: List[Tuple[str, DoneCallback]]) -> None:
+        # all or nothing: an unknown sequence raises KeyError before any
+        # callback is registered (a registered one cannot be taken back)
+        with self._lock:
+            entries = []
+            for seq_id, fn in pairs:
+                ent = self._seqs.get(seq_id)
+                if not ent:
+                    raise KeyError(f"unknown sequence {seq_id}")
+                entries.append(ent)
+            finished = []
+            for ent, (seq_id, fn) in zip(entries, pairs):
+                if ent.state == PENDING:
+                    if ent.callbacks is None:
+                        ent.callbacks = []
+                    ent.callbacks.append(fn)
+                else:
+                    finished.append((ent, fn))
+        for ent, fn in finished:
+            fn(ent.seq_id, ent.state, ent.result)
+
+    def future(self, seq_id: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """A future resolved with the result, or failing with SequenceTimeout.
+
+        Without a loop: a concurrent.futures.Future (result(timeout) blocks).
+        With a loop: an asyncio future of that loop, to await there; it is
+        resolved from any thread through loop.call_soon_threadsafe.
+        Cancelling the future does not cancel the sequence.
+        """
+        fut, done = self._future_callback(loop)
+        self.add_done_callback(seq_id, done)
+        return fut
+
+    @staticmethod
+    def _future_callback(loop: Optional[asyncio.AbstractEventLoop]):
+        # (future, done callback resolving it), see future()
+        if loop is None:
+            fut = concurrent.futures.Future()
+
+            def done(sid, state, result):
+                try:
+                    _resolve(fut, sid, state, result)
+                except concurrent.futures.InvalidStateError:
+                    pass  # cancelled by its owner
+        else:
+            fut = loop.create_future()
+
+            def done(sid, state, result):
+                try:
+                    loop.call_soon_threadsafe(_resolve_async, fut, sid, state, result)
+                except RuntimeError:
+                    pass  # loop closed, nobody awaits anymore
+        return fut, done
+
+    def wait_any(self, seq_ids: Iterable[str],
+                 timeout: Optional[float] = None) -> Tuple[Dict[str, Optional[dict]], Set[str]]:
+        """Block until one of the sequences is finished, or timeout.
+
+        Returns (done, pending): done maps the finished sequences to their
+        result (None when timed out), pending holds the others. As with
+        wait(), finished sequences are forgotten; pending ones are kept.
+        An empty list returns ({}, set()) at once; an unknown sequence
+        raises KeyError before anything is waited on.
+        """
+        return self._wait_many(list(seq_ids), timeout, 1)
+
+    def wait_all(self, seq_ids: Iterable[str],
+                 timeout: Optional[float] = None) -> Tuple[Dict[str, Optional[dict]], Set[str]]:
+        """Block until all the sequences are finished, or timeout; see wait_any."""
+        seq_ids = list(seq_ids)
+        return self._wait_many(seq_ids, timeout, len(seq_ids))
+
+    def _wait_many(self, seq_ids: List[str], timeout: Optional[float], needed: int):
+        # one condition for the whole set, whatever its size
+        if not seq_ids:
+            return {}, set()
+        cond = threading.Condition()
+        finished = [0]
+
+        def done(sid, state, result):
+            with cond:
+                finished[0] += 1
+                if finished[0] >= needed:
+                    cond.notify()
+
+        self._add_done_callbacks([(seq_id, done) for seq_id in seq_ids])
+        with cond:
+            cond.wait_for(lambda: finished[0] >= needed, timeout)
+        return self._collect(seq_ids)
+
+    async def wait_any_async(self, seq_ids: Iterable[str], timeout: Optional[float] = None):
+        """wait_any() for a coroutine: the loop thread is not blocked."""
+        return await self._wait_many_async(list(seq_ids), timeout, asyncio.FIRST_COMPLETED)
+
+    async def wait_all_async(self, seq_ids: Iterable[str], timeout: Optional[float] = None):
+        """wait_all() for a coroutine: the loop thread is not blocked."""
+        return await self._wait_many_async(list(seq_ids), timeout, asyncio.ALL_COMPLETED)
+
+    async def _wait_many_async(self, seq_ids: List[str], timeout: Optional[float], return_when: str):
+        if not seq_ids:
+            return {}, set()
+        loop = asyncio.get_running_loop()
+        pairs = [self._future_callback(loop) for _ in seq_ids]
+        self._add_done_callbacks([(seq_id, done) for seq_id, (_, done) in zip(seq_ids, pairs)])
+        futures = [fut for fut, _ in pairs]
+        _, pending = await asyncio.wait(futures, timeout=timeout, return_when=return_when)
+        for fut in pending:
+            fut.cancel()
+        return self._collect(seq_ids)
+
+    def _collect(self, seq_ids: List[str]) -> Tuple[Dict[str, Optional[dict]], Set[str]]:
+        done: Dict[str, Optional[dict]] = {}
+        pending: Set[str] = set()
+        entries = []
+        with self._lock:
+            for seq_id in seq_ids:
+                ent = self._seqs.get(seq_id)
+                if ent is None:
+                    continue  # forgotten meanwhile (another waiter)
+                if ent.state == PENDING:
+                    pending.add(seq_id)
+                else:
+                    done[seq_id] = ent.result
+                    entries.append(ent)
+        self._forget(entries)
+        return done, pending
+
     def is_pending(self, seq_id: str) -> bool:
         with self._lock:
-            return seq_id in self._seqs
+            ent = self._seqs.get(seq_id)
+            return ent is not None and ent.state == PENDING
+
+    def state(self, seq_id: str) -> Optional[str]:
+        """PENDING, COMPLETE or TIMEOUT; None once forgotten."""
+        with self._lock:
+            ent = self._seqs.get(seq_id)
+            return ent.state if ent is not None else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._seqs)
+
+
+def _resolve(fut, seq_id: str, state: str, result: Optional[dict]) -> None:
+    if state == COMPLETE:
+        fut.set_result(result)
+    else:
+        fut.set_exception(SequenceTimeout(f"sequence {seq_id} timed out"))
+
+
+def _resolve_async(fut: asyncio.Future, seq_id: str, state: str, result: Optional[dict]) -> None:
+    # on the loop thread
+    if not fut.done():
+        _resolve(fut, seq_id, state, result)
@@ -0,0 +1,114 @@
+"""Single-thread timer scheduler.
+
+One thread sleeps until the earliest deadline of a heap and runs the due
+callbacks, instead of one sleeping thread per delayed call:
+
+    timers = Scheduler()
+    timer = timers.call_later(2.0, fn, arg)
+    timer.cancel()
+
+Callbacks run on the scheduler thread in deadline order, so they must be
+short (queue a frame, set an event): a slow callback delays the next ones.
+An exception raised by a callback is printed and does not stop the
+scheduler. cancel() is O(1): a cancelled timer stays in the heap until its
+deadline, or until cancelled timers are the majority and the heap is
+rebuilt.
+"""
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from typing import Any, Callable, List, Tuple
+
+# rebuild the heap when it holds more cancelled timers than this (and than live ones)
+COMPACT_MIN_CANCELLED = 1024
+
+
+class Timer:
+    __slots__ = ("deadline", "fn", "args", "cancelled", "_scheduler")
+
+    def __init__(self, scheduler: "Scheduler", deadline: float, fn: Callable[..., Any], args: tuple):
+        self._scheduler = scheduler
+        self.deadline = deadline  # time.monotonic()
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self) -> bool:
+        """Prevent the call; False if it already ran (or was cancelled)."""
+        return self._scheduler._cancel(self)
+
+
+class Scheduler:
+    def __init__(self, name: str = "timers"):
+        self.name = name
+        self._heap: List[Tuple[float, int, Timer]] = []
+        self._counter = itertools.count()  # ties: first scheduled runs first
+        self._cancelled = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def call_later(self, delay: float, fn: Callable[..., Any], *args: Any) -> Timer:
+        """Run fn(*args) on the scheduler thread in `delay` seconds."""
+        timer = Timer(self, time.monotonic() + max(0.0, delay), fn, args)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("scheduler closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, (timer.deadline, next(self._counter), timer))
+            if self._heap[0][2] is timer:
+                self._cond.notify()  # new earliest deadline
+        return timer
+
+    def _cancel(self, timer: Timer) -> bool:
+        with self._cond:
+            if timer.cancelled or timer.fn is None:
+                return False
+            timer.cancelled = True
+            timer.fn = timer.args = None  # release what the callback holds
+            self._cancelled += 1
+            if self._cancelled > COMPACT_MIN_CANCELLED and self._cancelled * 2 > len(self._heap):
+                self._heap = [item for item in self._heap if not item[2].cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+            return True
+
+    def _run(self) -> None:
+        while True:
+            due = []
+            with self._cond:
+                while not due:
+                    if self._closed:
+                        return
+                    now = time.monotonic()
+                    heap = self._heap
+                    while heap and heap[0][0] <= now:
+                        timer = heapq.heappop(heap)[2]
+                        if timer.cancelled:
+                            self._cancelled -= 1
+                            continue
+                        due.append((timer.fn, timer.args))
+                        timer.fn = timer.args = None  # ran: cancel() returns False
+                    if not due:
+                        self._cond.wait(heap[0][0] - now if heap else None)
+            for fn, args in due:
+                try:
+                    fn(*args)
+                except Exception:
+                    traceback.print_exc()
+
+    def close(self) -> None:
+        """Stop the thread; pending timers never run."""
+        with self._cond:
+            self._closed = True
+            self._heap.clear()
+            self._cond.notify()
+
+    def __len__(self) -> int:
+        """Timers waiting to run."""
+        with self._cond:
+            return len(self._heap) - self._cancelled
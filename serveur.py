@@ -1,315 +1,872 @@
+import asyncio
+import collections
 import socket
 import threading
 import time
-import json
 import base64
+import multiprocessing
 import os
+import secrets
+import shutil
+import signal
+import sys
+import tempfile
+import uuid
 from datetime import datetime
 
-from parser import ProtocolParser, ProtocolError
+from parser import Message, ProtocolError
 from network import protocol as proto
+from network.dispatch import Dispatcher
+from network.iopool import IOPool
 from network import state_machine as sm
+from network.timers import Scheduler
+from network.outbound import OutboundQueue, SlowConsumerPolicy, start_writer_thread, run_writer_async
+from network.bus import Bus
+from network.sessions import DataSession, Session, SessionRegistry, RemoteRegistry
+from storage.blobstore import BlobStore
+from storage.chatlog import ChatLog
+from storage.history import RoomHistory
+from storage.uploads import UploadManager, UploadError
+
+HOST = "127.0.0.1"
+PORT = 54321
+LISTEN_BACKLOG = 1024
+# mode multi-processus : délai max entre deux envois de la liste des clients au superviseur
+CLUSTER_SNAPSHOT_INTERVAL = 0.5
+# séquences (BEGIN_SEQUENCE|seq|timeout) : délai par défaut et maximum, en secondes
+SEQUENCE_TIMEOUT = 30.0
+SEQUENCE_MAX_TIMEOUT = 3600.0
+# traitement simulé d'une séquence avant COMPLETE
+SEQUENCE_PROCESS_DELAY = 2.0
+# derniers messages d'une room envoyés au client qui la rejoint (HISTORY)
+HISTORY_ON_JOIN = 50
+# messages de room conservés dans l'historique
+HISTORY_TEXT_PREFIXES = ("MSG|", "SYSTEM|")
+# journal persistant des messages (storage.chatlog) et sa rétention
+CHATLOG_DIR = os.path.join("downloads", "chatlog")
+CHATLOG_MAX_AGE = 90 * 24 * 3600  # secondes
+CHATLOG_MAX_BYTES = 1024 * 1024 * 1024  # par room
+# transferts directs (P2P_REQUEST) : taille du jeton à usage unique remis aux deux pairs
+P2P_TOKEN_BYTES = 16
+# connexions de données (DATA|jeton) ouvertes en plus par un client pour
+# télécharger un fichier par plages en parallèle
+MAX_DATA_CONNECTIONS = 8
+# pool d'E/S : écriture des uploads, hachage, lecture et base64 des GET_FILE,
+# hors du thread (ou de la boucle) qui lit la connexion. Au-delà de IO_QUEUE
+# tâches en attente, la lecture des connexions qui en soumettent est suspendue
+IO_WORKERS = 4
+IO_QUEUE = 64
+# GET_FILE sans "stream" : la plage est lue en mémoire (SEND_FILE) ; au-delà
+# de cette taille la requête est refusée, le client doit la demander en flux
+SEND_FILE_MAX_BYTES = 64 * 1024 * 1024
+# taille maximale d'une trame reçue : avant le LOGIN (une ligne de texte), sur
+# une connexion de données (GET_FILE seulement), puis sur la connexion
+# principale (SEND_FILE de l'ancien format : le fichier entier en base64,
+# plafonné comme les réponses SEND_FILE). Au-delà, la connexion est fermée
+LOGIN_MAX_FRAME = 4 * 1024
+DATA_MAX_FRAME = 64 * 1024
+CLIENT_MAX_FRAME = SEND_FILE_MAX_BYTES // 3 * 4 + 64 * 1024
 
 
 class CustomServer:
-    def __init__(self):
-        self.clients = []
-        self.clients_lock = threading.Lock()
+    def __init__(self, slow_policy=None, chatlog_dir=CHATLOG_DIR):
+        self.sessions = SessionRegistry()
+        # politique appliquée aux clients qui ne lisent pas assez vite
+        self.slow_policy = slow_policy or SlowConsumerPolicy()
         self.on_clients_change = None  # callback UI admin
-        self.seq_mgr = sm.IntermediateStateManager()
+        # un seul thread pour tous les délais (séquences, envois différés)
+        self.timers = Scheduler()
+        self.seq_mgr = sm.IntermediateStateManager(self.timers, default_timeout=SEQUENCE_TIMEOUT)
+        self.store = BlobStore("downloads")
+        self.uploads = UploadManager(self.store)
+        # derniers messages de chaque room, renvoyés à ceux qui la rejoignent ;
+        # tous sont aussi écrits dans le journal (pages plus anciennes, redémarrage)
+        self.chatlog = ChatLog(chatlog_dir, max_age=CHATLOG_MAX_AGE, max_bytes=CHATLOG_MAX_BYTES)
+        self.history = RoomHistory(log=self.chatlog)
+        self.io = IOPool(IO_WORKERS, IO_QUEUE)
+        self._loop = None  # boucle asyncio quand engine="asyncio"
+        self.bus = None  # bus inter-processus en mode multi-processus (attach_bus)
+        self._snapshot_pending = False
+        self._snapshot_lock = threading.Lock()
+        # jeton de données -> session de contrôle, et connexions ouvertes par jeton
+        self._data_tokens = {}
+        self._data_connections = collections.Counter()
+        self._data_lock = threading.Lock()
+
+        # table des commandes : une seule lecture de la trame, puis le handler
+        # handler(session, corps, trame) ; False ferme la connexion
+        self.commands = Dispatcher(unknown=self._handle_unknown)
+        for command, handler, body in (
+            ("MSG", self._handle_msg, Message),
+            ("ROOM", self._handle_room, Message),
+            ("SEND_FILE", self._handle_send_file, dict),
+            ("FILE_BEGIN", self._handle_file_begin, dict),
+            ("FILE_CHUNK", self._handle_chunk_frame, dict),
+            ("FILE_END", self._handle_file_end, dict),
+            ("FILE_CANCEL", self._handle_file_cancel, dict),
+            ("GET_FILE", self._handle_get_file, dict),
+            ("LIST_FILES", self._handle_list_files, dict),
+            ("HISTORY", self._handle_history, dict),
+            ("BEGIN_SEQUENCE", self._handle_begin_sequence, Message),
+            ("P2P_REQUEST", self._handle_p2p_request, dict),
+            ("P2P_FAILED", self._handle_p2p_failed, dict),
+            ("QUIT", self._handle_quit, None),
+        ):
+            self.commands.register(command, handler, body)
+        # avant le LOGIN, seule la commande LOGIN est acceptée
+        self.login_commands = Dispatcher(unknown=self._login_required)
+        self.login_commands.register("LOGIN", self._login, Message)
+        self.login_commands.register("DATA", self._login_data, Message)
+        # connexions de données : téléchargements seulement
+        self.data_commands = Dispatcher(unknown=self._handle_unknown)
+        self.data_commands.register("GET_FILE", self._handle_get_file, dict)
+        self.data_commands.register("QUIT", self._handle_quit, None)
 
     # ------------------------
     # BROADCAST
     # ------------------------
     def broadcast(self, message, room=None, sender_socket=None):
         """Broadcast a message to all clients in a room.
-        If message is a dict, sends as JSON. Otherwise sends as encoded bytes."""
-        with self.clients_lock:
-            print(f"[DEBUG] Broadcast: room={room}, recipients={len(self.clients)}, is_dict={isinstance(message, dict)}")
-            for client in self.clients:
-                # If room is specified, only send to clients in that room
-                # If room is None, send to all clients except the sender
-                if room is not None:
-                    match = client["socket"] != sender_socket and client["room"] == room
-                else:
-                    match = client["socket"] != sender_socket
-                    
-                print(f"  - Client {client['pseudo']} (room={client['room']}): match={match}")
-                if match:
-                    try:
-                        if isinstance(message, dict):
-                            print(f"    -> Envoi JSON à {client['pseudo']}")
-                            proto.send_json(client["socket"], message)
-                        else:
-                            print(f"    -> Envoi message à {client['pseudo']}")
-                            proto.send_message(client["socket"], str(message).encode())
-                    except Exception as e:
-                        print(f"    -> Erreur: {e}")
+        If message is a dict, sends as JSON. Otherwise sends as encoded bytes.
+
+        If room is specified, only clients in that room receive it (room index,
+        cost proportional to the room size). If room is None, send to all
+        clients. The sender is always skipped.
+
+        Frames are only queued on each recipient's outbox: a slow client
+        cannot stall the broadcast. Text (chat) frames may be dropped by the
+        slow consumer policy, JSON notifications never are. Dicts are encoded
+        once per message codec in use among the recipients.
+
+        In cluster mode the message is also published on the bus: the other
+        workers deliver it to their own clients in the room."""
+        self._deliver(message, room, sender_socket)
+        if self.bus is not None:
+            if isinstance(message, dict):
+                event = {"type": "BROADCAST", "room": room, "message": message}
+            else:
+                event = {"type": "BROADCAST", "room": room, "text": str(message)}
+            self.bus.publish(event, room)
+
+    def _deliver(self, message, room=None, sender_socket=None):
+        """Diffusion aux clients de ce processus uniquement."""
+        if room is not None:
+            # enregistré et destinataires lus sous le verrou des sessions, comme
+            # l'entrée dans une room (_handle_room) : le nouveau membre reçoit ce
+            # message soit dans son historique, soit en direct
+            with self.sessions.lock:
+                self._record(message, room)
+                recipients = self.sessions.members(room)
+        else:
+            recipients = self.sessions.all()
+        # encodé une seule fois, partagé par tous les destinataires
+        is_dict = isinstance(message, dict)
+        if is_dict:
+            frames = {}
+            for client in recipients:
+                if client.socket is sender_socket:
+                    continue
+                frame = frames.get(client.codec)
+                if frame is None:
+                    frame = frames[client.codec] = client.codec.frame(message)
+                client.send(frame, droppable=False)
+            return
+        frame = proto.PreparedFrame(str(message).encode())
+        for client in recipients:
+            if client.socket is sender_socket:
+                continue
+            client.send(frame, droppable=True)
+
+    def _record(self, message, room):
+        # historique de la room : messages de chat, messages système, fichiers partagés
+        if isinstance(message, dict):
+            if message.get("type") == "FILE_AVAILABLE":
+                self.history.append(room, event=message)
+        elif str(message).startswith(HISTORY_TEXT_PREFIXES):
+            self.history.append(room, text=str(message))
+
+    def io_stats(self):
+        """Métriques du pool d'E/S (file d'attente, workers occupés, attente)."""
+        return self.io.stats()
+
+    def history_stats(self):
+        """(room, messages, octets) de l'historique, rooms les plus actives d'abord."""
+        return self.history.stats()
 
     # ------------------------
     # ADMIN BROADCAST
     # ------------------------
     def send_admin_broadcast(self, message, target_type="all", target=None):
-        timestamp = datetime.now().strftime("%d/%m/%Y %Hh%M")
-        formatted = f"ADMIN_BROADCAST|Message du serveur le {timestamp} : {message}"
-
-        with self.clients_lock:
-            for client in self.clients:
-                try:
-                    if target_type == "all":
-                        proto.send_message(client["socket"], formatted.encode())
-                    elif target_type == "room" and client["room"] == target:
-                        proto.send_message(client["socket"], formatted.encode())
-                    elif target_type == "mp" and client["pseudo"] == target:
-                        proto.send_message(client["socket"], formatted.encode())
-                except Exception:
-                    pass
+        formatted = format_admin_broadcast(message)
+        self._deliver_admin(formatted, target_type, target)
+        if self.bus is not None:
+            self.bus.publish(
+                {"type": "ADMIN_BROADCAST", "text": formatted, "target_type": target_type, "target": target},
+                target if target_type == "room" else None,
+            )
+
+    def _deliver_admin(self, formatted, target_type, target):
+        if target_type == "all":
+            recipients = self.sessions.all()
+        elif target_type == "room":
+            recipients = self.sessions.members(target)
+        elif target_type == "mp":
+            session = self.sessions.by_pseudo(target)
+            recipients = [session] if session else []
+        else:
+            recipients = []
+
+        frame = proto.PreparedFrame(formatted.encode())
+        for client in recipients:
+            client.send(frame)
 
     # ------------------------
     # KICK
     # ------------------------
     def kick_client(self, client_socket, pseudo=None, room=None):
-        try:
-            proto.send_message(
-                client_socket,
-                "SYSTEM|Vous avez été kické par l'administrateur".encode()
-            )
-            client_socket.close()
-        except Exception:
-            pass
-
-        with self.clients_lock:
-            self.clients = [c for c in self.clients if c["socket"] != client_socket]
+        session = self.sessions.remove(client_socket)
+        if session:
+            session.send("SYSTEM|Vous avez été kické par l'administrateur".encode())
+            # le writer envoie ce qui reste puis ferme la connexion
+            session.outbox.close(flush=True)
 
         if pseudo:
             self.broadcast(f"SYSTEM|{pseudo} a été kické", room=room)
 
         self._notify_ui()
 
+    # ------------------------
+    # SLOW CONSUMERS
+    # ------------------------
+    def _drop_slow_client(self, session, reason):
+        print(f"[DEBUG] Client lent déconnecté: {session.pseudo} ({reason})")
+        try:
+            session.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
     # ------------------------
     # UI NOTIFY
     # ------------------------
     def _notify_ui(self):
+        if self.bus is not None:
+            self._schedule_snapshot()
         if self.on_clients_change:
             try:
                 self.on_clients_change()
             except Exception:
                 pass
 
+    # ------------------------
+    # CLUSTER (worker)
+    # ------------------------
+    def attach_bus(self, directory, name, peers):
+        """Relie ce serveur (un worker) aux autres processus du cluster.
+
+        Les diffusions, broadcasts admin et kicks passent par le bus ; la
+        liste des clients est envoyée au superviseur ("master")."""
+        commands = Dispatcher()
+        commands.register("BROADCAST", self._on_bus_broadcast, dict)
+        commands.register("ADMIN_BROADCAST", self._on_bus_admin_broadcast, dict)
+        commands.register("KICK", self._on_bus_kick, dict)
+        self.bus = Bus(directory, name, peers, commands, on_peer_lost=self._on_bus_peer_lost)
+        # le bus ne relaie une diffusion qu'aux workers qui ont des membres dans la room
+        self.sessions.on_room_change = self._on_room_change
+        return self.bus
+
+    def _on_room_change(self, room, active):
+        if active:
+            self.bus.subscribe(room)
+        else:
+            self.bus.unsubscribe(room)
+
+    def _on_bus_broadcast(self, peer, event, frame):
+        message = event.get("message")
+        self._deliver(message if isinstance(message, dict) else event.get("text", ""), event.get("room"))
+
+    def _on_bus_admin_broadcast(self, peer, event, frame):
+        self._deliver_admin(event.get("text", ""), event.get("target_type"), event.get("target"))
+
+    def _on_bus_kick(self, peer, event, frame):
+        session = self.sessions.by_pseudo(event.get("pseudo"))
+        if session:
+            self.kick_client(session.socket, pseudo=session.pseudo, room=session.room)
+
+    def _on_bus_peer_lost(self, peer):
+        if peer == "master":
+            # superviseur arrêté : le worker s'arrête aussi
+            print(f"[DEBUG] Superviseur perdu, arrêt du worker {self.bus.name}")
+            self.chatlog.close()
+            os._exit(0)
+
+    def _schedule_snapshot(self):
+        # au plus un envoi par CLUSTER_SNAPSHOT_INTERVAL, même sous forte charge
+        with self._snapshot_lock:
+            if self._snapshot_pending:
+                return
+            self._snapshot_pending = True
+        self._call_later(CLUSTER_SNAPSHOT_INTERVAL, self._send_snapshot)
+
+    def _send_snapshot(self):
+        with self._snapshot_lock:
+            self._snapshot_pending = False
+        self.bus.send("master", {"type": "CLIENTS", "clients": [s.info() for s in self.sessions.all()],
+                                 "history": self.history_stats(), "io": self.io_stats()})
+
     # ------------------------
     # CLIENT HANDLER
     # ------------------------
-    def dialoguer(self, sclient: socket.socket, adclient, callback_tchao):
-        print(f"Connexion depuis {adclient}")
+    def _login(self, conn, msg, frame):
+        """Valide la trame LOGIN et enregistre le client. Retourne la Session ou None."""
+        sclient, adclient = conn
+
+        # LOGIN|pseudo, LOGIN|pseudo|zlib,lzma (algorithmes de compression acceptés)
+        # ou LOGIN|pseudo|zlib,lzma|struct,json (codecs de messages acceptés)
+        if len(msg.args) not in (1, 2, 3) or not msg.args[0]:
+            return self._login_required(conn)
+
+        session = Session(sclient, adclient, msg.args[0])
+        session.outbox = OutboundQueue(
+            self.slow_policy,
+            on_overflow=lambda reason: self._drop_slow_client(session, reason)
+        )
+        if len(msg.args) >= 2:
+            session.compression = proto.choose_codec(msg.args[1].split(","))
+            codec = proto.JSON_CODEC
+            if len(msg.args) == 3:
+                codec = proto.choose_message_codec(msg.args[2].split(","))
+            # réponse seulement aux clients qui négocient : les anciens n'en attendent pas.
+            # LOGIN_OK part en JSON, les messages suivants avec le codec choisi.
+            # data_token ouvre des connexions de données (DATA|jeton) tant que
+            # cette connexion reste ouverte. Pas de jeton en mode multi-processus :
+            # il n'est connu que de ce worker, et SO_REUSEPORT envoie chaque
+            # connexion de données à un worker au hasard, qui la refuserait ;
+            # sans jeton le client télécharge sur la connexion principale
+            if self.bus is None:
+                session.data_token = secrets.token_urlsafe(P2P_TOKEN_BYTES)
+                with self._data_lock:
+                    self._data_tokens[session.data_token] = session
+            session.send_json({"type": "LOGIN_OK", "compression": session.compression, "codec": codec.name,
+                               "data_token": session.data_token})
+            session.codec = codec
+        self.sessions.add(session)
+
+        self._notify_ui()
+        return session
+
+    def _login_data(self, conn, msg, frame):
+        """Connexion de données DATA|jeton d'un client connecté. Retourne la DataSession ou None."""
+        sclient, adclient = conn
+        token = msg.args[0] if msg.args else ""
+        with self._data_lock:
+            control = self._data_tokens.get(token)
+            if control is not None and self._data_connections[token] < MAX_DATA_CONNECTIONS:
+                self._data_connections[token] += 1
+            else:
+                control = None
+        if control is None:
+            proto.send_message(sclient, "ERROR|Jeton de données invalide".encode())
+            return None
+        session = DataSession(sclient, adclient, control)
+        session.outbox = OutboundQueue(
+            self.slow_policy,
+            on_overflow=lambda reason: self._drop_slow_client(session, reason)
+        )
+        return session
+
+    def _login_required(self, conn, command=None, body=None, frame=None):
+        proto.send_message(conn[0], "ERROR|Pseudo requis".encode())
+        return None
+
+    def _announce_file(self, session, up, to=None):
+        # Notify the room that a file has been uploaded via JSON notification
+        notify = {
+            "type": "FILE_AVAILABLE",
+            "seq": up.seq,
+            "room": up.room,
+            "meta": {"filename": up.filename, "size": up.size},
+            "uploader": up.uploader,
+        }
+        if to:
+            # envoi à un seul membre (relais d'un transfert direct impossible)
+            target = self.sessions.by_pseudo(to)
+            if target is None:
+                session.send(f"ERROR|Destinataire {to} introuvable".encode())
+                return
+            notify.update(room=session.room, to=to)
+            target.send_json(notify)
+            return
+        self.broadcast(notify, room=up.room, sender_socket=session.socket)
+
+    # ------------------------
+    # POOL D'E/S
+    # ------------------------
+    def _submit_io(self, session, fn, *args):
+        """Confie fn(*args) au pool d'E/S, après les tâches déjà confiées pour cette session.
 
-        pseudo = None
-        room = None
+        Le résultat est renvoyé par la tâche elle-même sur la file d'envoi de
+        la session. Pool plein : le thread de la connexion attend (moteur
+        threads) ; la boucle asyncio ne bloque jamais, dialoguer_async attend
+        avant de lire la trame suivante."""
+        self.io.submit(session, self._run_io, fn, args, block=self._loop is None)
 
+    def _run_io(self, fn, args):
         try:
-            # ---- LOGIN ----
-            raw = proto.recv_message(sclient)
-            msg = ProtocolParser.parse(raw.decode())
+            fn(*args)
+        finally:
+            if self.bus is not None:
+                # métriques du pool à jour sur le dashboard du superviseur
+                self._schedule_snapshot()
+
+    def _handle_send_file(self, session, payload, frame=None):
+        # room lue maintenant : la tâche peut passer après un ROOM suivant
+        self._submit_io(session, self._store_send_file, session, payload, payload.get("room") or session.room)
+
+    def _store_send_file(self, session, payload, room_name):
+        # ancien format : fichier entier en base64, stocké comme un upload en un bloc
+        meta = payload.get("meta", {})
+        fname = meta.get("filename", "file.bin")
+        seq_id = payload.get("seq") or uuid.uuid4().hex
+
+        print(f"[DEBUG] SEND_FILE reçu: fname={fname}, seq_id={seq_id}, room_name={room_name}, pseudo={session.pseudo}")
+
+        try:
+            data = proto.b64decode_sliced(payload.get("data", ""))
+            up = self.uploads.begin(seq_id, fname, len(data), room=room_name,
+                                    uploader=session.pseudo, owner=session)
+            if not up.complete:
+                self.uploads.write(seq_id, data)
+                up = self.uploads.finish(seq_id)
+            print(f"[DEBUG] Fichier sauvegardé: {up.path}")
+            self._announce_file(session, up)
+        except Exception as e:
+            print(f"[DEBUG] Erreur SEND_FILE: {e}")
+            self.uploads.abort(seq_id)
+            session.send(f"ERROR|Enregistrement fichier impossible".encode())
+
+    # ---- upload en flux : FILE_BEGIN / FILE_CHUNK* / FILE_END ----
+    def _handle_file_begin(self, session, payload, frame=None):
+        # "to" : fichier pour un seul membre, hors de l'historique de la room
+        room_name = None if payload.get("to") else payload.get("room") or session.room
+        self._submit_io(session, self._begin_upload, session, payload, room_name)
+
+    def _begin_upload(self, session, payload, room_name):
+        meta = payload.get("meta", {})
+        seq_id = payload.get("seq", "")
+        try:
+            up = self.uploads.begin(
+                seq_id,
+                meta.get("filename", "file.bin"),
+                int(meta.get("size", 0)),
+                room=room_name,
+                uploader=session.pseudo,
+                owner=session,
+                sha256=payload.get("sha256"),
+            )
+        except (UploadError, OSError, ValueError) as e:
+            print(f"[DEBUG] Erreur FILE_BEGIN: {e}")
+            session.send(f"ERROR|Enregistrement fichier impossible".encode())
+            return
+
+        if up.complete:
+            # contenu déjà présent dans le store : rien à transférer
+            session.send_json({"type": "UPLOAD_ACCEPT", "seq": seq_id, "status": "complete"})
+            self._announce_file(session, up, payload.get("to"))
+        else:
+            # offset > 0 : reprise d'un upload interrompu, seuls les octets manquants sont envoyés
+            session.send_json({"type": "UPLOAD_ACCEPT", "seq": seq_id, "status": "send", "offset": up.received})
+
+    def _write_chunk(self, session, seq_id, data, offset=None):
+        if isinstance(data, str):
+            # ancien format : bloc en base64 dans du JSON
+            try:
+                data = base64.b64decode(data)
+            except ValueError:
+                data = b""
+        try:
+            self.uploads.write(seq_id, data, offset)
+        except (UploadError, OSError, ValueError) as e:
+            print(f"[DEBUG] Erreur FILE_CHUNK: {e}")
+            self.uploads.abort(seq_id)
+            session.send(f"ERROR|Enregistrement fichier impossible".encode())
+
+    def _handle_file_end(self, session, payload, frame=None):
+        self._submit_io(session, self._finish_upload, session, payload)
+
+    def _finish_upload(self, session, payload):
+        seq_id = payload.get("seq", "")
+        if self.uploads.get(seq_id) is None:
+            # upload déjà abandonné (erreur signalée sur FILE_BEGIN/FILE_CHUNK)
+            return
+        try:
+            up = self.uploads.finish(seq_id, payload.get("sha256"))
+        except (UploadError, OSError) as e:
+            print(f"[DEBUG] Erreur FILE_END: {e}")
+            session.send(f"ERROR|Enregistrement fichier impossible".encode())
+            return
+        print(f"[DEBUG] Fichier sauvegardé: {up.path}")
+        self._announce_file(session, up, payload.get("to"))
+
+    def _handle_file_cancel(self, session, payload, frame=None):
+        # après les blocs déjà soumis : le fichier partiel est complet jusque-là
+        self._submit_io(session, self._cancel_upload, session, payload.get("seq", ""))
+
+    def _cancel_upload(self, session, seq_id):
+        if self.uploads.cancel(seq_id, session):
+            print(f"[DEBUG] Upload annulé par {session.pseudo}: {seq_id}")
+
+    def _resolve_file(self, seq_id, fname):
+        """Retourne (chemin, nom du fichier, sha256) pour un GET_FILE, ou None.
+
+        Recherche indexée dans le catalogue, par seq puis par nom de fichier."""
+        record = self.store.get_record(seq_id) if seq_id else None
+        if record is None and fname:
+            record = self.store.find_by_filename(fname)
+        if record is None:
+            return None
+        return self.store.path_of(record), record["filename"], record["sha256"]
 
-            if msg.command != "LOGIN" or len(msg.args) != 1:
-                proto.send_message(sclient, "ERROR|Pseudo requis".encode())
+    def _handle_list_files(self, session, payload, frame=None):
+        # historique des fichiers de la room courante, page par page (du plus récent au plus ancien)
+        room = session.room
+        if payload.get("room") not in (None, room):
+            session.send(b"ERROR|LIST_FILES: room non rejointe")
+            return
+        try:
+            files, cursor = self.store.list_room(room, payload.get("before"), payload.get("limit", 50))
+        except (TypeError, ValueError):
+            session.send(b"ERROR|Requete LIST_FILES invalide")
+            return
+        session.send_json({
+            "type": "FILE_LIST",
+            "room": room,
+            "files": [
+                # pas de sha256 : il ne doit pas circuler hors des téléchargements
+                {"seq": f["seq"], "filename": f["filename"], "size": f["size"],
+                 "uploader": f["uploader"], "uploaded_at": f["uploaded_at"]}
+                for f in files
+            ],
+            "next": cursor,
+        })
+
+    def _handle_history(self, session, payload, frame=None):
+        # messages plus anciens d'une room, page par page (HISTORY avec "before") :
+        # lus dans le journal sur disque, donc par le pool d'E/S
+        self._submit_io(session, self._send_history, session, payload, payload.get("room") or session.room)
+
+    def _send_history(self, session, payload, room):
+        try:
+            messages, cursor = self.history.page(room, payload.get("before"), payload.get("limit", HISTORY_ON_JOIN))
+        except (TypeError, ValueError):
+            session.send(b"ERROR|Requete HISTORY invalide")
+            return
+        session.send_json({"type": "HISTORY", "room": room, "messages": messages,
+                           "next": cursor, "before": payload.get("before")})
+
+    def _handle_get_file(self, session, payload, frame=None):
+        self._submit_io(session, self._send_file, session, payload)
+
+    def _send_file(self, session, payload):
+        # client requests a file by seq and filename
+        seq_id = payload.get("seq", "")
+        fname = payload.get("filename") or None
+        # plage demandée (reprise d'un téléchargement) : tout le fichier par défaut,
+        # validée avant d'ouvrir le fichier
+        try:
+            offset = int(payload.get("offset") or 0)
+            length = None if payload.get("length") is None else int(payload["length"])
+        except (TypeError, ValueError):
+            session.send(b"ERROR|Plage invalide")
+            return
+        if offset < 0 or (length is not None and length < 0):
+            session.send(b"ERROR|Plage invalide")
+            return
+        try:
+            found = self._resolve_file(seq_id, fname)
+            if not found:
+                session.send(f"ERROR|Fichier introuvable".encode())
+                return
+            target, filename, sha256 = found
+            f = open(target, "rb")
+            try:
+                size = os.fstat(f.fileno()).st_size
+                if offset > size:
+                    session.send(b"ERROR|Plage invalide")
+                    return
+                count = size - offset if length is None else min(length, size - offset)
+                meta = {"filename": filename, "size": size}
+                if payload.get("stream"):
+                    # en-tête puis corps du fichier envoyé par sendfile (zero-copy)
+                    # sha256 : vérification d'un fichier reçu par plages (connexions de données)
+                    header = {"type": "FILE_STREAM", "seq": seq_id, "meta": meta, "sha256": sha256}
+                    if session.send(proto.FileStream(header, f, offset, count)):
+                        f = None  # fermé par le writer de la session après l'envoi
+                    return
+                if count > SEND_FILE_MAX_BYTES:
+                    session.send(b"ERROR|Fichier trop volumineux, demandez-le en flux")
+                    return
+                f.seek(offset)
+                data = f.read(count)
+            finally:
+                if f is not None:
+                    f.close()
+            # sha256 : le client vérifie le fichier avant de le renommer
+            header = {"type": "SEND_FILE", "seq": seq_id, "meta": meta, "sha256": sha256}
+            if offset or count != size:
+                header.update(offset=offset, length=count)
+            if payload.get("raw"):
+                # trame binaire : pas de base64
+                session.send(proto.PreparedFrame.binary(header, data))
+            else:
+                header["data"] = proto.b64encode_sliced(data)
+                session.send_json(header)
+        except Exception as e:
+            print(f"[DEBUG] Erreur GET_FILE: {e}")
+            session.send(f"ERROR|Lecture fichier impossible".encode())
+
+    def _handle_begin_sequence(self, session, msg, frame=None):
+        # BEGIN_SEQUENCE|seq ou BEGIN_SEQUENCE|seq|timeout (secondes)
+        seq_id = msg.args[0] if msg.args else str(int(time.time()))
+        timeout = SEQUENCE_TIMEOUT
+        if len(msg.args) >= 2:
+            try:
+                timeout = float(msg.args[1])
+            except ValueError:
+                timeout = -1
+            if not 0 < timeout <= SEQUENCE_MAX_TIMEOUT:
+                session.send(f"ERROR|{seq_id}|timeout invalide".encode())
                 return
 
-            pseudo = msg.args[0]
+        try:
+            self.seq_mgr.begin_sequence(
+                seq_id, timeout,
+                on_timeout=lambda sid: session.send(f"ERROR|{sid}|timeout".encode()),
+            )
+        except RuntimeError:
+            session.send(f"ERROR|Sequence {seq_id} déjà existante".encode())
+            return
 
-            client_info = {
-                "socket": sclient,
-                "addr": adclient,
-                "pseudo": pseudo,
-                "room": None,
-                "last_message_time": None
-            }
+        def process_sequence(owner, sid):
+            result = {"status": "ok"}
+            # rien si la séquence a expiré entre-temps (ERROR|seq|timeout déjà envoyé)
+            if self.seq_mgr.complete_sequence(sid, result):
+                owner.send(f"COMPLETE|{sid}|{result}".encode())
 
-            with self.clients_lock:
-                self.clients.append(client_info)
+        self._call_later(SEQUENCE_PROCESS_DELAY, process_sequence, session, seq_id)
 
-            self._notify_ui()
+    # ---- transfert direct entre deux membres d'une room (P2P_REQUEST / P2P_INVITE) ----
+    def _handle_p2p_request(self, session, payload, frame=None):
+        # l'émetteur écoute sur `port` ; le serveur ne fait que présenter les
+        # pairs, les octets du fichier ne passent pas par lui
+        seq_id = payload.get("seq", "")
+        target = self.sessions.by_pseudo(payload.get("to") or "")
+        try:
+            port = int(payload.get("port"))
+        except (TypeError, ValueError):
+            port = 0
+        if target is None or target is session or session.room is None or target.room != session.room:
+            error = "destinataire absent de la room"
+        elif not 0 < port < 65536:
+            error = "port invalide"
+        else:
+            error = None
+        if error:
+            session.send_json({"type": "P2P_INVITE", "seq": seq_id, "error": error})
+            return
+        # jeton à usage unique : présenté par le destinataire à la connexion,
+        # l'émetteur refuse toute autre connexion
+        token = secrets.token_urlsafe(P2P_TOKEN_BYTES)
+        target.send_json({
+            "type": "P2P_INVITE", "seq": seq_id, "role": "caller",
+            "peer": {"ip": session.addr[0], "port": port}, "token": token,
+            "from": session.pseudo, "room": session.room,
+            "meta": payload.get("meta", {}), "sha256": payload.get("sha256"),
+        })
+        session.send_json({
+            "type": "P2P_INVITE", "seq": seq_id, "role": "listener",
+            "peer": {"ip": target.addr[0], "port": None}, "token": token, "to": target.pseudo,
+        })
 
-            # ---- MESSAGE LOOP ----
-            while True:
-                raw = proto.recv_message(sclient)
-                if not raw:
-                    break
+    def _handle_p2p_failed(self, session, payload, frame=None):
+        # le destinataire n'a pas pu joindre l'émetteur : prévenu tout de suite,
+        # il passe par le relais du serveur sans attendre la fin de son délai
+        target = self.sessions.by_pseudo(payload.get("to") or "")
+        if target is not None:
+            target.send_json({"type": "P2P_FAILED", "seq": payload.get("seq", ""),
+                              "from": session.pseudo, "reason": payload.get("reason")})
 
-                # Try JSON first (for SEND_FILE and future structured messages)
-                handled = False
-                try:
-                    payload = json.loads(raw.decode())
-                except Exception:
-                    payload = None
-
-                if payload:
-                    t = payload.get("type")
-                    if t == "SEND_FILE":
-                        meta = payload.get("meta", {})
-                        fname = meta.get("filename", "file.bin")
-                        seq_id = payload.get("seq", "")
-                        room_name = payload.get("room", room)
-                        
-                        # If room_name is still None, try to get it from client info
-                        if room_name is None:
-                            with self.clients_lock:
-                                for c in self.clients:
-                                    if c["socket"] == sclient:
-                                        room_name = c["room"]
-                                        break
-                        
-                        data_b64 = payload.get("data", "")
-                        
-                        print(f"[DEBUG] SEND_FILE reçu: fname={fname}, seq_id={seq_id}, room_name={room_name}, pseudo={pseudo}")
-                        
-                        try:
-                            os.makedirs("downloads", exist_ok=True)
-                            data = base64.b64decode(data_b64)
-                            dst = os.path.join("downloads", f"{seq_id}_{fname}") if seq_id else os.path.join("downloads", fname)
-                            with open(dst, "wb") as f:
-                                f.write(data)
-                            print(f"[DEBUG] Fichier sauvegardé: {dst}")
-                            
-                            # Notify the room that a file has been uploaded via JSON notification
-                            notify = {
-                                "type": "FILE_AVAILABLE",
-                                "seq": seq_id,
-                                "room": room_name,
-                                "meta": {"filename": fname, "size": len(data)},
-                                "uploader": pseudo,
-                            }
-                            print(f"[DEBUG] Broadcasting FILE_AVAILABLE: {notify}")
-                            self.broadcast(notify, room=room_name, sender_socket=sclient)
-                        except Exception as e:
-                            print(f"[DEBUG] Erreur SEND_FILE: {e}")
-                            try:
-                                proto.send_message(sclient, f"ERROR|Enregistrement fichier impossible".encode())
-                            except Exception:
-                                pass
-                        handled = True
-                    elif t == "GET_FILE":
-                        # client requests a file by seq and filename
-                        seq_id = payload.get("seq", "")
-                        fname = payload.get("filename") or None
-                        # find file on disk
-                        try:
-                            candidates = []
-                            if seq_id:
-                                # match prefix
-                                for fn in os.listdir("downloads"):
-                                    if fn.startswith(seq_id + "_"):
-                                        candidates.append(fn)
-                            if not candidates and fname:
-                                # try direct filename
-                                if os.path.exists(os.path.join("downloads", fname)):
-                                    candidates.append(fname)
-                            if not candidates:
-                                proto.send_message(sclient, f"ERROR|Fichier introuvable".encode())
-                            else:
-                                target = os.path.join("downloads", candidates[0])
-                                with open(target, "rb") as f:
-                                    data = f.read()
-                                b64 = base64.b64encode(data).decode("ascii")
-                                resp = {"type": "SEND_FILE", "seq": seq_id, "meta": {"filename": os.path.basename(target), "size": len(data)}, "data": b64}
-                                proto.send_json(sclient, resp)
-                        except Exception as e:
-                            print(f"[DEBUG] Erreur GET_FILE: {e}")
-                            try:
-                                proto.send_message(sclient, f"ERROR|Lecture fichier impossible".encode())
-                            except Exception:
-                                pass
-                        handled = True
-
-                if handled:
-                    continue
+    def _handle_chunk_frame(self, session, body, frame):
+        # copie : la trame ne vit que jusqu'à la lecture suivante (FrameReader).
+        # Ancien format (base64 dans du JSON) : décodé par le pool
+        data = bytes(frame.data) if frame.kind == proto.KIND_BINARY else body.get("data", "")
+        self._submit_io(session, self._write_chunk, session, body.get("seq", ""), data, body.get("offset"))
 
-                msg = ProtocolParser.parse(raw.decode())
-
-                # MESSAGE
-                if msg.command == "MSG":
-                    # Mettre à jour le dernier temps de message
-                    with self.clients_lock:
-                        for c in self.clients:
-                            if c["socket"] == sclient:
-                                c["last_message_time"] = datetime.now()
-
-                    self._notify_ui()
-                    # diffuse dans la room actuelle
-                    self.broadcast(f"MSG|{pseudo}|{msg.args[0]}", room=room, sender_socket=sclient)
-
-                # CHANGE ROOM
-                elif msg.command == "ROOM":
-                    old_room = room
-                    room = msg.args[0]
-
-                    with self.clients_lock:
-                        for c in self.clients:
-                            if c["socket"] == sclient:
-                                c["room"] = room
-
-                    self._notify_ui()
-
-                    if old_room:
-                        self.broadcast(
-                            f"SYSTEM|{pseudo} a quitté la room {old_room}",
-                            room=old_room
-                        )
-
-                    self.broadcast(
-                        f"SYSTEM|{pseudo} a rejoint la room {room}",
-                        room=room
-                    )
-
-                # SEQUENCE
-                elif msg.command == "BEGIN_SEQUENCE":
-                    seq_id = msg.args[0] if msg.args else str(int(time.time()))
-
-                    try:
-                        self.seq_mgr.begin_sequence(seq_id)
-                    except RuntimeError:
-                        proto.send_message(
-                            sclient,
-                            f"ERROR|Sequence {seq_id} déjà existante".encode()
-                        )
-                        continue
-
-                    def process_sequence(sock, sid):
-                        time.sleep(2)
-                        result = {"status": "ok"}
-                        try:
-                            proto.send_message(
-                                sock,
-                                f"COMPLETE|{sid}|{result}".encode()
-                            )
-                        except Exception:
-                            pass
-                        self.seq_mgr.complete_sequence(sid, result)
-
-                    threading.Thread(
-                        target=process_sequence,
-                        args=(sclient, seq_id),
-                        daemon=True
-                    ).start()
-
-                # QUIT
-                elif msg.command == "QUIT":
-                    break
+    def _handle_msg(self, session, msg, frame):
+        if not msg.args:
+            return
+        # Mettre à jour le dernier temps de message
+        session.last_message_time = datetime.now()
 
-        except (ProtocolError, ConnectionResetError):
-            pass
+        self._notify_ui()
+        # diffuse dans la room actuelle
+        self.broadcast(f"MSG|{session.pseudo}|{msg.args[0]}", room=session.room, sender_socket=session.socket)
+
+    def _handle_room(self, session, msg, frame):
+        if not msg.args:
+            return
+        pseudo = session.pseudo
+        room = msg.args[0]
+        # historique lu hors du verrou des sessions : il peut lire le journal sur
+        # disque. Sous le verrou (pris aussi par _deliver), seules les entrées
+        # arrivées entre-temps, en mémoire, sont ajoutées, puis la page est mise
+        # en file et le client entre dans la room : aucun message diffusé entre
+        # les deux n'est perdu, en double ou dans le désordre
+        messages, cursor = self.history.page(room, None, HISTORY_ON_JOIN)
+        with self.sessions.lock:
+            newer = self.history.since(room, messages[-1]["id"] if messages else 0)
+            if newer:
+                messages = messages + newer
+                if len(messages) > HISTORY_ON_JOIN:
+                    # les plus anciennes sortent de la page : la suivante repart d'ici
+                    messages = messages[-HISTORY_ON_JOIN:]
+                    cursor = messages[0]["id"]
+            session.send_json({"type": "HISTORY", "room": room, "messages": messages,
+                               "next": cursor, "before": None})
+            old_room = self.sessions.move(session, room)
+
+        self._notify_ui()
+
+        if old_room:
+            self.broadcast(
+                f"SYSTEM|{pseudo} a quitté la room {old_room}",
+                room=old_room
+            )
+
+        self.broadcast(
+            f"SYSTEM|{pseudo} a rejoint la room {room}",
+            room=room
+        )
+
+    def _handle_quit(self, session, msg, frame):
+        return False
+
+    def _handle_unknown(self, session, command, body, frame):
+        if command is None and frame.kind == proto.KIND_LEGACY and not frame.data:
+            # trame vide : fin de connexion
+            return False
+        print(f"[DEBUG] Commande ignorée: {command}")
+        return None
 
-        # ---- DISCONNECT ----
-        with self.clients_lock:
-            self.clients = [c for c in self.clients if c["socket"] != sclient]
+    def _handle_frame(self, session, frame):
+        """Traite une trame reçue après le LOGIN.
+
+        Partagé par les deux moteurs (threads et asyncio).
+        Retourne False quand la connexion doit être fermée."""
+        commands = self.data_commands if isinstance(session, DataSession) else self.commands
+        return commands.dispatch(session, frame) is not False
+
+    def _disconnect(self, sclient, session):
+        if isinstance(session, DataSession):
+            session.outbox.close()
+            with self._data_lock:
+                token = session.control.data_token
+                self._data_connections[token] -= 1
+                if not self._data_connections[token]:
+                    del self._data_connections[token]
+            sclient.close()
+            return
+        self.sessions.remove(sclient)
+        if session is not None and session.data_token is not None:
+            with self._data_lock:
+                self._data_tokens.pop(session.data_token, None)
+        if session:
+            session.outbox.close()
+            # upload interrompu : conservé pour une reprise (FILE_BEGIN avec le même seq),
+            # après les blocs encore dans le pool d'E/S
+            self._submit_io(session, self.uploads.suspend_owner, session)
 
         self._notify_ui()
         sclient.close()
 
-        if pseudo:
-            self.broadcast(f"SYSTEM|{pseudo} a quitté le chat", room=room)
+        if session:
+            self.broadcast(f"SYSTEM|{session.pseudo} a quitté le chat", room=session.room)
+
+    def dialoguer(self, sclient: socket.socket, adclient, callback_tchao):
+        print(f"Connexion depuis {adclient}")
 
+        session = None
+
+        # lecture bufferisée : plusieurs trames par recv, sans copie par trame
+        reader = proto.FrameReader(sclient, max_frame=LOGIN_MAX_FRAME)
+
+        try:
+            # ---- LOGIN ----
+            session = self.login_commands.dispatch((sclient, adclient), reader.read_frame())
+            if session:
+                reader.max_frame = _max_frame(session)
+                start_writer_thread(sclient, session.outbox)
+
+            # ---- MESSAGE LOOP ----
+            while session:
+                frame = reader.read_frame()
+                if not self._handle_frame(session, frame):
+                    break
+
+        except (ProtocolError, ConnectionError, ValueError):
+            # ValueError : trame illisible (JSON, struct ou compression invalide)
+            pass
+        finally:
+            # ---- DISCONNECT ----
+            self._disconnect(sclient, session)
         callback_tchao(adclient)
 
+    async def dialoguer_async(self, reader, writer):
+        """Equivalent asyncio de dialoguer : une coroutine par connexion."""
+        adclient = writer.get_extra_info("peername")
+        sclient = _AsyncSocket(asyncio.get_running_loop(), writer)
+        print(f"Connexion depuis {adclient}")
+
+        session = None
+        writer_task = None
+
+        try:
+            frame = await proto.async_recv_frame(reader, LOGIN_MAX_FRAME)
+            session = self.login_commands.dispatch((sclient, adclient), frame)
+            if session:
+                max_frame = _max_frame(session)
+                writer_task = asyncio.create_task(run_writer_async(writer, session.outbox))
+
+            while session:
+                frame = await proto.async_recv_frame(reader, max_frame)
+                if not self._handle_frame(session, frame):
+                    break
+                if self.io.full():
+                    # pool d'E/S plein : plus rien n'est lu sur cette connexion
+                    await self.io.ready_async()
+
+        except (ProtocolError, ConnectionError, ValueError):
+            # ValueError : trame illisible (JSON, struct ou compression invalide)
+            pass
+        finally:
+            self._disconnect(sclient, session)
+            if writer_task is not None:
+                # la file est fermée : le writer s'arrête, ou reste bloqué sur un
+                # client qui ne lit plus ; annulé puis attendu dans les deux cas
+                writer_task.cancel()
+                await asyncio.gather(writer_task, return_exceptions=True)
+        self.au_revoir(adclient)
+
+    # ------------------------
+    # TIMERS
+    # ------------------------
+    def _call_later(self, delay, fn, *args):
+        """Planifie fn(*args) après delay secondes selon le moteur actif."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.call_later, delay, fn, *args)
+            return
+        # moteur threads : le thread des timers, pas un thread par appel
+        self.timers.call_later(delay, fn, *args)
+
     # ------------------------
     # CALLBACK
     # ------------------------
@@ -328,27 +885,286 @@ class CustomServer:
                 daemon=True
             ).start()
 
+    def runner(self, engine):
+        """Boucle d'acceptation du moteur demandé (bloquante)."""
+        return self._run_asyncio_server if engine == "asyncio" else self._run_socket_server
+
+    def _run_asyncio_server(self, sserveur):
+        async def serve():
+            self._loop = asyncio.get_running_loop()
+            server = await asyncio.start_server(self.dialoguer_async, sock=sserveur)
+            async with server:
+                await server.serve_forever()
+
+        asyncio.run(serve())
+
     # ------------------------
     # START SERVER
     # ------------------------
-    def start(self, with_admin_ui=True):
-        sserveur = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sserveur.bind(("127.0.0.1", 54321))
-        sserveur.listen()
-        print("Serveur démarré sur 127.0.0.1:54321")
+    def start(self, with_admin_ui=True, engine="threads", host=HOST, port=PORT):
+        """Démarre le serveur.
+
+        engine="threads" : un thread par connexion (historique).
+        engine="asyncio" : une seule boucle d'événements pour toutes les connexions.
+        Pour plusieurs processus, voir ClusterServer.
+        """
+        if engine not in ("threads", "asyncio"):
+            raise ValueError(f"moteur inconnu: {engine}")
+
+        if engine == "asyncio":
+            _raise_fd_limit()
+
+        sserveur = _listen(host, port)
+        print(f"Serveur démarré sur {host}:{port} (moteur {engine})")
 
         threading.Thread(
-            target=self._run_socket_server,
+            target=self.runner(engine),
             args=(sserveur,),
             daemon=True
         ).start()
 
-        if with_admin_ui:
-            from admin_dashboard import start_admin_ui
-            start_admin_ui(self)
+        try:
+            if with_admin_ui:
+                from admin_dashboard import start_admin_ui
+                start_admin_ui(self)
+            else:
+                while True:
+                    time.sleep(1)
+        finally:
+            # messages encore en attente d'écriture dans le journal
+            self.chatlog.close()
+
+
+class ClusterServer:
+    """Superviseur du mode multi-processus.
+
+    Lance `workers` processus CustomServer qui écoutent tous sur le même
+    port (SO_REUSEPORT : le noyau répartit les connexions entre eux). Les
+    processus sont reliés par un bus local (network.bus, sockets Unix) :
+    diffusions dans les rooms, broadcasts admin et kicks traversent les
+    workers, une room répartie sur plusieurs workers se comporte comme une
+    seule. Chaque worker envoie régulièrement la liste de ses clients au
+    superviseur, qui présente au dashboard admin la liste agrégée avec la
+    même interface que CustomServer (sessions, kick_client,
+    send_admin_broadcast, on_clients_change).
+
+    Le stockage (blobs, catalogue sqlite, uploads partiels) est partagé sur
+    disque ; un upload interrompu repris sur un autre worker repart de son
+    fichier partiel."""
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.sessions = RemoteRegistry()
+        self.on_clients_change = None  # callback UI admin
+        self.bus = None
+        self._processes = []
+        self._directory = None
+        self._history = {}  # worker -> [(room, messages, octets)]
+        self._io = {}  # worker -> métriques de son pool d'E/S
+
+    def launch(self, engine="threads", host=HOST, port=PORT):
+        """Démarre les workers et le bus, sans bloquer."""
+        if engine not in ("threads", "asyncio"):
+            raise ValueError(f"moteur inconnu: {engine}")
+        if not hasattr(socket, "SO_REUSEPORT") or not hasattr(socket, "AF_UNIX"):
+            raise ValueError("mode multi-processus indisponible sur cette plateforme (SO_REUSEPORT)")
+
+        # catalogue construit (ou reconstruit) une seule fois, avant les workers
+        BlobStore("downloads").close()
+
+        self._directory = tempfile.mkdtemp(prefix="dropbox-bus-")
+        names = [f"w{i}" for i in range(self.workers)]
+        commands = Dispatcher()
+        commands.register("CLIENTS", self._on_clients, dict)
+        self.bus = Bus(self._directory, "master", names, commands, on_peer_lost=self._on_worker_lost)
+
+        ctx = multiprocessing.get_context("spawn")
+        try:
+            for name in names:
+                process = ctx.Process(
+                    target=_run_worker,
+                    args=(name, self._directory, names + ["master"], engine, host, port),
+                    name=f"dropbox-{name}",
+                    daemon=True,
+                )
+                process.start()
+                self._processes.append(process)
+            self.bus.connect()
+        except BaseException:
+            self.stop()
+            raise
+        print(f"Serveur démarré sur {host}:{port} ({self.workers} workers, moteur {engine})")
+
+    def start(self, with_admin_ui=True, engine="threads", host=HOST, port=PORT):
+        self.launch(engine, host, port)
+        try:
+            if with_admin_ui:
+                from admin_dashboard import start_admin_ui
+                start_admin_ui(self)
+            else:
+                for process in self._processes:
+                    process.join()
+        finally:
+            self.stop()
+
+    def stop(self):
+        if self.bus is not None:
+            self.bus.close()
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join(5)
+        self._processes = []
+        if self._directory:
+            shutil.rmtree(self._directory, ignore_errors=True)
+
+    # ---- interface utilisée par le dashboard admin ----
+
+    def send_admin_broadcast(self, message, target_type="all", target=None):
+        self.bus.publish(
+            {"type": "ADMIN_BROADCAST", "text": format_admin_broadcast(message),
+             "target_type": target_type, "target": target},
+            target if target_type == "room" else None,
+        )
+
+    def kick_client(self, client_socket, pseudo=None, room=None):
+        # les sockets appartiennent aux workers : le kick est transmis par pseudo
+        session = self.sessions.by_pseudo(pseudo) if pseudo else None
+        if session:
+            self.bus.send(session.worker, {"type": "KICK", "pseudo": pseudo})
+
+    def history_stats(self):
+        # chaque worker garde l'historique des rooms où il a eu des membres :
+        # une room présente sur plusieurs workers y est dupliquée
+        rooms = {}
+        for stats in list(self._history.values()):
+            for room, count, size in stats:
+                total = rooms.setdefault(room, [0, 0])
+                total[0] = max(total[0], count)
+                total[1] += size
+        return sorted(((room, count, size) for room, (count, size) in rooms.items()),
+                      key=lambda r: -r[2])
+
+    def io_stats(self):
+        # un pool par worker : tailles et compteurs additionnés, attentes au pire
+        pools = list(self._io.values())
+        total = {key: sum(p.get(key, 0) for p in pools)
+                 for key in ("workers", "threads", "busy", "queued", "max_queued", "done", "blocked")}
+        for key in ("wait_avg_ms", "wait_p99_ms", "wait_max_ms"):
+            total[key] = max((p.get(key, 0.0) for p in pools), default=0.0)
+        return total
+
+    def _on_clients(self, worker, event, frame):
+        self.sessions.update(worker, event.get("clients", ()))
+        self._history[worker] = event.get("history", ())
+        if "io" in event:
+            self._io[worker] = event["io"]
+        self._notify_ui()
+
+    def _on_worker_lost(self, worker):
+        print(f"[DEBUG] Worker {worker} arrêté")
+        self.sessions.drop(worker)
+        self._history.pop(worker, None)
+        self._io.pop(worker, None)
+        self._notify_ui()
+
+    def _notify_ui(self):
+        if self.on_clients_change:
+            try:
+                self.on_clients_change()
+            except Exception:
+                pass
+
+
+def _run_worker(name, directory, peers, engine, host, port):
+    """Processus worker du mode multi-processus (voir ClusterServer)."""
+    if engine == "asyncio":
+        _raise_fd_limit()
+    # un journal par worker : un répertoire n'a qu'un seul écrivain
+    srv = CustomServer(chatlog_dir=os.path.join(CHATLOG_DIR, name))
+    bus = srv.attach_bus(directory, name, peers)
+    sserveur = _listen(host, port, reuse_port=True)
+    bus.connect()
+    # arrêt par le superviseur (terminate) : le journal est vidé avant de sortir
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        srv.runner(engine)(sserveur)
+    finally:
+        srv.chatlog.close()
+
+
+def _listen(host, port, reuse_port=False):
+    sserveur = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if reuse_port:
+        # plusieurs processus sur le même port, le noyau répartit les connexions
+        sserveur.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sserveur.bind((host, port))
+    sserveur.listen(LISTEN_BACKLOG)
+    return sserveur
+
+
+def _max_frame(session):
+    """Plus grande trame acceptée après le LOGIN sur la connexion de cette session."""
+    return DATA_MAX_FRAME if isinstance(session, DataSession) else CLIENT_MAX_FRAME
+
+
+def format_admin_broadcast(message):
+    timestamp = datetime.now().strftime("%d/%m/%Y %Hh%M")
+    return f"ADMIN_BROADCAST|Message du serveur le {timestamp} : {message}"
+
+
+class _AsyncSocket:
+    """Façade type socket au-dessus d'un asyncio.StreamWriter.
+
+    Les trames des clients connectés passent par leur outbox (run_writer_async) ;
+    cette façade sert aux réponses avant LOGIN et à la fermeture depuis
+    n'importe quel thread : les appels sont replanifiés sur la boucle."""
+
+    def __init__(self, loop, writer):
+        self._loop = loop
+        self._writer = writer
+
+    def _in_loop(self):
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def sendall(self, data):
+        if self._writer.is_closing():
+            raise ConnectionError("socket closed")
+        if self._in_loop():
+            self._writer.write(data)
         else:
-            while True:
-                time.sleep(1)
+            self._loop.call_soon_threadsafe(self._writer.write, data)
+
+    def close(self):
+        if self._in_loop():
+            self._writer.close()
+        else:
+            self._loop.call_soon_threadsafe(self._writer.close)
+
+    def shutdown(self, how=None):
+        # coupe immédiatement la connexion (client lent) : le lecteur reçoit EOF
+        self._loop.call_soon_threadsafe(self._writer.transport.abort)
+
+    def getpeername(self):
+        return self._writer.get_extra_info("peername")
+
+
+def _raise_fd_limit():
+    """Monte la limite de descripteurs au maximum autorisé (10k+ connexions)."""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        target = hard if hard != resource.RLIM_INFINITY else max(soft, 65536)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError):
+            pass
 
 
 if __name__ == "__main__":
@@ -359,6 +1175,12 @@ if __name__ == "__main__":
     print("👤 Pour lancer un client : python client.py")
     print("=" * 60)
     print()
-    
-    srv = CustomServer()
-    srv.start()
+
+    engine = "asyncio" if "--asyncio" in sys.argv else "threads"
+    if "--workers" in sys.argv:
+        # python serveur.py --workers 4 : un processus par worker, même port
+        workers = int(sys.argv[sys.argv.index("--workers") + 1])
+        ClusterServer(workers).start(engine=engine)
+    else:
+        srv = CustomServer()
+        srv.start(engine=engine)
@@ -0,0 +1,196 @@
+"""Content-addressed, deduplicated file store behind downloads/.
+
+Layout:
+  downloads/blobs/<2 first hex chars>/<sha256>   file contents, stored once
+  downloads/meta/<seq>.json                      one record per shared file:
+      {"seq", "filename", "size", "sha256", "room", "uploader", "uploaded_at"}
+
+  downloads/catalog.sqlite3                      index of the records (FileCatalog)
+
+The same file shared in several rooms is one blob referenced by several
+records. Lookups and reference counts come from the catalog; when the
+catalog file is missing it is rebuilt from the meta records and from the
+legacy downloads/<seq>_<filename> files. A blob is deleted when its last
+record is removed.
+
+Several processes may share the store (multi-process server): blobs are
+moved in place atomically and the catalog is a WAL sqlite database, but
+reference counts are cached per process, so records should only be
+removed while a single process runs.
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from storage.catalog import FileCatalog
+
+
+class BlobStore:
+    def __init__(self, root: str = "downloads"):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        self.meta_dir = os.path.join(root, "meta")
+        self._lock = threading.Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.meta_dir, exist_ok=True)
+        self.catalog = FileCatalog(os.path.join(root, "catalog.sqlite3"))
+        if self.catalog.created:
+            self.rebuild_catalog()
+        self._refs: Dict[str, int] = self.catalog.sha256_counts()
+
+    # ---- blobs ----
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blob_dir, sha256[:2], sha256)
+
+    def has_blob(self, sha256: Optional[str]) -> bool:
+        return bool(sha256) and os.path.isfile(self.blob_path(sha256))
+
+    def add_blob(self, tmp_path: str, sha256: str) -> str:
+        """Move a fully written and verified file into the store.
+
+        If the blob already exists the temporary file is simply dropped."""
+        dst = self.blob_path(sha256)
+        with self._lock:
+            if os.path.isfile(dst):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                os.replace(tmp_path, dst)
+        return dst
+
+    def refcount(self, sha256: str) -> int:
+        with self._lock:
+            return self._refs.get(sha256, 0)
+
+    def drop_unused(self, sha256: str) -> None:
+        """Delete a blob no record references (its record could not be written)."""
+        with self._lock:
+            if not self._refs.get(sha256):
+                self._release(sha256)
+
+    def uploaded_by(self, sha256: Optional[str], uploader: Optional[str]) -> bool:
+        """True when `uploader` sent this content to the server before (its bytes were hashed here)."""
+        return bool(sha256) and bool(uploader) and self.catalog.has_upload(sha256, uploader)
+
+    # ---- records ----
+    def _record_path(self, seq: str) -> str:
+        return os.path.join(self.meta_dir, f"{seq}.json")
+
+    def put_record(self, seq: str, filename: str, size: int, sha256: str,
+                   room: Optional[str] = None, uploader: Optional[str] = None,
+                   replace: bool = False) -> Dict[str, Any]:
+        """Write the record of a shared file.
+
+        Raises FileExistsError when `seq` already has a record, unless
+        `replace` is set: the previous record is then overwritten and its
+        blob released."""
+        if not self.has_blob(sha256):
+            raise FileNotFoundError(f"blob {sha256} absent")
+        record = {
+            "seq": seq,
+            "filename": filename,
+            "size": size,
+            "sha256": sha256,
+            "room": room,
+            "uploader": uploader,
+            "uploaded_at": time.time(),
+        }
+        path = self._record_path(seq)
+        tmp = path + ".tmp"
+        with self._lock:
+            previous = self._read(path)
+            if previous is not None and not replace:
+                raise FileExistsError(f"record {seq} exists")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(record, f)
+            os.replace(tmp, path)
+            self.catalog.put(record)
+            self._refs[sha256] = self._refs.get(sha256, 0) + 1
+            if previous:
+                self._release(previous["sha256"])
+        return record
+
+    def get_record(self, seq: str) -> Optional[Dict[str, Any]]:
+        if not seq:
+            return None
+        return self.catalog.get(str(seq))
+
+    def path_of(self, record: Dict[str, Any]) -> str:
+        """Location of a record's content on disk."""
+        if record.get("path"):
+            return os.path.join(self.root, record["path"])
+        return self.blob_path(record["sha256"])
+
+    def remove_record(self, seq: str) -> bool:
+        path = self._record_path(seq)
+        with self._lock:
+            record = self._read(path)
+            if record is None:
+                return False
+            os.remove(path)
+            self.catalog.delete(seq)
+            self._release(record["sha256"])
+        return True
+
+    def _release(self, sha256: str) -> None:
+        count = self._refs.get(sha256, 0) - 1
+        if count > 0:
+            self._refs[sha256] = count
+            return
+        self._refs.pop(sha256, None)
+        try:
+            os.remove(self.blob_path(sha256))
+        except OSError:
+            pass
+
+    def records(self) -> List[Dict[str, Any]]:
+        """All records (full scan of the meta directory)."""
+        out = []
+        for name in os.listdir(self.meta_dir):
+            if name.endswith(".json"):
+                record = self._read(os.path.join(self.meta_dir, name))
+                if record:
+                    out.append(record)
+        return out
+
+    def find_by_filename(self, filename: str) -> Optional[Dict[str, Any]]:
+        return self.catalog.find_by_filename(filename)
+
+    def list_room(self, room: str, before: Optional[int] = None,
+                  limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        return self.catalog.list_room(room, before, limit)
+
+    def close(self) -> None:
+        self.catalog.close()
+
+    # ---- catalog rebuild ----
+    def rebuild_catalog(self) -> int:
+        """Index every record and legacy file (used when the catalog is missing)."""
+        def rows() -> Iterator[Dict[str, Any]]:
+            yield from sorted(self.records(), key=lambda r: r.get("uploaded_at") or 0)
+            yield from self._legacy_files()
+        return self.catalog.put_many(rows())
+
+    def _legacy_files(self) -> Iterator[Dict[str, Any]]:
+        """Files saved before the blob store, as downloads/<seq>_<filename>."""
+        catalog_name = os.path.basename(self.catalog.path)  # and its -wal/-shm files
+        with os.scandir(self.root) as it:
+            entries = [e for e in it if e.is_file() and not e.name.startswith((".", catalog_name))]
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            seq, sep, filename = entry.name.partition("_")
+            if not sep or not filename:
+                seq, filename = entry.name, entry.name
+            st = entry.stat()
+            yield {"seq": seq, "filename": filename, "size": st.st_size, "sha256": None,
+                   "path": entry.name, "room": None, "uploader": None,
+                   "uploaded_at": st.st_mtime}
+
+    @staticmethod
+    def _read(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
@@ -0,0 +1,121 @@
+"""Persistent index of shared files (sqlite3, stdlib).
+
+One row per shared file, keyed by seq:
+  id, seq, filename, size, sha256, path, room, uploader, uploaded_at
+
+`id` grows with every insert and orders a room's history; it is also the
+pagination cursor of LIST_FILES. `path` is only set for files stored
+outside the blob store (legacy downloads/<seq>_<filename>), relative to the
+downloads directory.
+
+The catalog is an index: the source of truth stays on disk (meta records
+and legacy files) and BlobStore rebuilds the database from it when the
+file is missing.
+"""
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id          INTEGER PRIMARY KEY,
+    seq         TEXT NOT NULL UNIQUE,
+    filename    TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    sha256      TEXT,
+    path        TEXT,
+    room        TEXT,
+    uploader    TEXT,
+    uploaded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_room ON files (room, id);
+CREATE INDEX IF NOT EXISTS files_filename ON files (filename);
+CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+"""
+
+_COLUMNS = ("id", "seq", "filename", "size", "sha256", "path", "room", "uploader", "uploaded_at")
+_INSERT = (
+    "INSERT OR REPLACE INTO files (seq, filename, size, sha256, path, room, uploader, uploaded_at) "
+    "VALUES (:seq, :filename, :size, :sha256, :path, :room, :uploader, :uploaded_at)"
+)
+
+MAX_PAGE_SIZE = 200
+
+
+class FileCatalog:
+    def __init__(self, path: str):
+        self.path = path
+        self.created = not os.path.exists(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def put(self, record: Dict[str, Any]) -> None:
+        row = {c: record.get(c) for c in _COLUMNS[1:]}
+        with self._lock:
+            self._db.execute(_INSERT, row)
+
+    def put_many(self, records: Iterable[Dict[str, Any]]) -> int:
+        rows = [{c: r.get(c) for c in _COLUMNS[1:]} for r in records]
+        with self._lock:
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany(_INSERT, rows)
+        return len(rows)
+
+    def get(self, seq: str) -> Optional[Dict[str, Any]]:
+        return self._one("SELECT * FROM files WHERE seq = ?", (seq,))
+
+    def find_by_filename(self, filename: str) -> Optional[Dict[str, Any]]:
+        # the latest file with this name
+        return self._one("SELECT * FROM files WHERE filename = ? ORDER BY id DESC LIMIT 1", (filename,))
+
+    def delete(self, seq: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM files WHERE seq = ?", (seq,))
+
+    def list_room(self, room: str, before: Optional[int] = None,
+                  limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """One page of a room's files, newest first.
+
+        Returns (files, cursor); pass the cursor as `before` to get the next
+        page, None means there are no older files."""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        if before is None:
+            sql, args = "SELECT * FROM files WHERE room = ? ORDER BY id DESC LIMIT ?", (room, limit + 1)
+        else:
+            sql = "SELECT * FROM files WHERE room = ? AND id < ? ORDER BY id DESC LIMIT ?"
+            args = (room, int(before), limit + 1)
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        files = [dict(zip(_COLUMNS, row)) for row in rows[:limit]]
+        cursor = files[-1]["id"] if len(rows) > limit else None
+        return files, cursor
+
+    def has_upload(self, sha256: str, uploader: str) -> bool:
+        """True when `uploader` already shared a file with this content."""
+        row = self._one("SELECT * FROM files WHERE sha256 = ? AND uploader = ? LIMIT 1", (sha256, uploader))
+        return row is not None
+
+    def sha256_counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT sha256, COUNT(*) FROM files WHERE sha256 IS NOT NULL GROUP BY sha256"
+            ).fetchall()
+        return dict(rows)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _one(self, sql: str, args: tuple) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(sql, args).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
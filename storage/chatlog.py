@@ -0,0 +1,523 @@
+"""Persistent chat log: append-only, segmented log of the rooms' messages.
+
+Layout, one directory per room (hex of the room name in UTF-8):
+  downloads/chatlog/<room hex>/<first id, 20 digits>.log   records
+  downloads/chatlog/<room hex>/<first id, 20 digits>.idx   sparse index
+
+A record is a 24-byte header followed by the message in JSON:
+
+    [u32 length][u32 crc32][u64 id][f64 ts][{"text": ...} or {"event": ...}]
+
+Records of a room have increasing ids (the ids of RoomHistory). Once a
+segment reaches segment_bytes a new one is started. The index of a segment
+holds (id, offset) pairs, u64 each: the first record, then one record
+every INDEX_INTERVAL bytes, so finding an id is a binary search in the
+index plus a scan of at most INDEX_INTERVAL bytes.
+
+Writes are group-committed: append() only queues the entry; a writer
+thread writes everything queued since its previous pass, then flushes and
+fsyncs each file once for the whole batch. Queued entries are already
+returned by page(). Reads go through mmap: only the records returned are
+copied out of the page cache.
+
+Retention: segments whose last write is older than max_age seconds are
+deleted, and the oldest segments of a room while it holds more than
+max_bytes (None: no limit).
+
+At startup the tail of the last segment of every room is checked (length
+and crc) and a record torn by a crash is truncated. Entries still queued
+when the process is killed are lost. A directory must only be written by
+one process: in cluster mode every worker has its own.
+"""
+import collections
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from network import protocol as proto
+
+SEGMENT_BYTES = 64 * 1024 * 1024
+INDEX_INTERVAL = 4096
+RETENTION_INTERVAL = 60.0
+# entries waiting for the writer before new ones are dropped
+MAX_PENDING = 100_000
+# segments kept mapped / active segments kept open for writing
+MAX_MAPPED_SEGMENTS = 128
+MAX_OPEN_SEGMENTS = 256
+
+_HEADER = struct.Struct("!IIQd")
+_INDEX = struct.Struct("!QQ")
+_NO_BOUND = 1 << 64
+
+
+class _Segment:
+    __slots__ = ("base", "path", "size", "written", "ids", "offsets")
+
+    def __init__(self, directory: str, base: int):
+        self.base = base  # id of its first record
+        self.path = os.path.join(directory, f"{base:020d}")
+        self.size = 0      # bytes readers may use (complete, flushed records)
+        self.written = 0   # bytes written by the writer thread
+        self.ids: Optional[array] = None      # sparse index, loaded on first use
+        self.offsets: Optional[array] = None
+
+    def load_index(self) -> Tuple[array, array]:
+        ids, offsets = self.ids, self.offsets
+        if ids is None:
+            pairs = array("Q")
+            try:
+                with open(self.path + ".idx", "rb") as f:
+                    data = f.read()
+                pairs.frombytes(data[:len(data) - len(data) % _INDEX.size])
+            except OSError:
+                pass
+            if sys.byteorder == "little":
+                pairs.byteswap()
+            offsets = pairs[1::2]
+            ids = pairs[0::2]
+            self.offsets, self.ids = offsets, ids
+        return ids, offsets
+
+
+class _RoomLog:
+    __slots__ = ("room", "directory", "segments", "pending", "writing")
+
+    def __init__(self, room: str, directory: str):
+        self.room = room
+        self.directory = directory
+        self.segments: List[_Segment] = []
+        self.pending: List[Dict[str, Any]] = []  # queued by append()
+        self.writing: List[Dict[str, Any]] = []  # taken by the writer, not yet readable on disk
+
+
+class ChatLog:
+    def __init__(self, root: str, segment_bytes: int = SEGMENT_BYTES, max_age: Optional[float] = None,
+                 max_bytes: Optional[int] = None, fsync: bool = True):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.dropped = 0  # entries lost (queue full or write error)
+        self.last_id = 0  # highest id in the log at startup
+        self._cond = threading.Condition()
+        self._rooms: Dict[str, _RoomLog] = {}
+        self._dirty: Dict[str, _RoomLog] = {}
+        self._pending = 0
+        self._closed = False
+        self._maps: "collections.OrderedDict[_Segment, mmap.mmap]" = collections.OrderedDict()
+        self._map_lock = threading.Lock()
+        self._files: "collections.OrderedDict[str, Tuple[Any, Any]]" = collections.OrderedDict()  # writer only
+        os.makedirs(root, exist_ok=True)
+        self._load()
+        self._writer = threading.Thread(target=self._run, name="chatlog-writer", daemon=True)
+        self._writer.start()
+
+    # ---- writing ----
+
+    def append(self, room: str, entry: Dict[str, Any]) -> None:
+        """Queue an entry {"id", "ts", "text" or "event"}; never blocks on the disk."""
+        with self._cond:
+            if self._closed or self._pending >= MAX_PENDING:
+                self.dropped += 1
+                return
+            r = self._rooms.get(room)
+            if r is None:
+                r = self._rooms[room] = _RoomLog(room, os.path.join(self.root, room.encode("utf-8").hex()))
+            r.pending.append(entry)
+            self._pending += 1
+            self._dirty[room] = r
+            self._cond.notify()
+
+    def close(self) -> None:
+        """Write what is queued and stop the writer."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._writer.join()
+
+    def _run(self) -> None:
+        next_retention = time.monotonic() + RETENTION_INTERVAL
+        while True:
+            with self._cond:
+                while not self._dirty and not self._closed:
+                    timeout = next_retention - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                batch = list(self._dirty.values())
+                self._dirty.clear()
+                for r in batch:
+                    r.writing, r.pending = r.pending, []
+                    self._pending -= len(r.writing)
+                closed = self._closed
+            touched = {}
+            for r in batch:
+                try:
+                    self._write(r, touched)
+                except OSError:
+                    self._write_failed(r, touched)
+            self._commit(batch, touched)
+            if closed:
+                with self._cond:
+                    if self._dirty:
+                        continue
+                for log_file, idx_file in self._files.values():
+                    log_file.close()
+                    idx_file.close()
+                self._files.clear()
+                return
+            if time.monotonic() >= next_retention:
+                self._apply_retention()
+                next_retention = time.monotonic() + RETENTION_INTERVAL
+
+    def _write(self, r: _RoomLog, touched: Dict[str, Tuple[_Segment, Any, Any]]) -> None:
+        seg = r.segments[-1] if r.segments else None
+        log_file = idx_file = None
+        for entry in r.writing:
+            if seg is None or seg.written >= self.segment_bytes:
+                seg = self._rotate(r, entry["id"], touched)
+                log_file = None
+            if log_file is None:
+                log_file, idx_file = self._open(r, seg)
+                touched[r.room] = (seg, log_file, idx_file)
+            body = {"event": entry["event"]} if "event" in entry else {"text": entry["text"]}
+            payload = proto.encode_json(body)
+            offset = seg.written
+            log_file.write(_HEADER.pack(len(payload), zlib.crc32(payload), entry["id"], entry["ts"]))
+            log_file.write(payload)
+            seg.written += _HEADER.size + len(payload)
+            if not seg.offsets or offset - seg.offsets[-1] >= INDEX_INTERVAL:
+                idx_file.write(_INDEX.pack(entry["id"], offset))
+                # offsets first: a reader never sees an id without its offset
+                seg.offsets.append(offset)
+                seg.ids.append(entry["id"])
+
+    def _rotate(self, r: _RoomLog, base: int, touched) -> _Segment:
+        """Seal the active segment (its records become readable) and start a new one."""
+        current = touched.pop(r.room, None)
+        if current is not None:
+            seg, log_file, idx_file = current
+            if not log_file.closed:
+                log_file.flush()
+                idx_file.flush()
+                if self.fsync:
+                    os.fsync(log_file.fileno())
+            with self._cond:
+                seg.size = seg.written
+        files = self._files.pop(r.room, None)
+        if files is not None:
+            files[0].close()
+            files[1].close()
+        os.makedirs(r.directory, exist_ok=True)
+        seg = _Segment(r.directory, base)
+        seg.ids, seg.offsets = array("Q"), array("Q")
+        with self._cond:
+            r.segments.append(seg)
+        return seg
+
+    def _open(self, r: _RoomLog, seg: _Segment):
+        files = self._files.get(r.room)
+        if files is None:
+            files = self._files[r.room] = (open(seg.path + ".log", "ab"), open(seg.path + ".idx", "ab"))
+            if len(self._files) > MAX_OPEN_SEGMENTS:
+                _, (log_file, idx_file) = self._files.popitem(last=False)
+                log_file.close()
+                idx_file.close()
+        else:
+            self._files.move_to_end(r.room)
+        return files
+
+    def _commit(self, batch: List[_RoomLog], touched) -> None:
+        """Flush the batch once per file; its records become readable from the log."""
+        for seg, log_file, idx_file in touched.values():
+            # closed: evicted from the open files, flushed by close()
+            if not log_file.closed:
+                log_file.flush()
+                idx_file.flush()
+        with self._cond:
+            for seg, _, _ in touched.values():
+                seg.size = seg.written
+            for r in batch:
+                r.writing = []
+        if self.fsync:
+            for seg, log_file, _ in touched.values():
+                if log_file.closed:
+                    continue
+                try:
+                    os.fsync(log_file.fileno())
+                except OSError:
+                    pass
+
+    def _write_failed(self, r: _RoomLog, touched) -> None:
+        # disk full...: the batch of this room is lost, the segment goes back
+        # to its last readable record
+        touched.pop(r.room, None)
+        files = self._files.pop(r.room, None)
+        if files is not None:
+            for f in files:
+                try:
+                    f.close()
+                except OSError:
+                    pass
+        with self._cond:
+            self.dropped += len(r.writing)
+            r.writing = []
+        if r.segments:
+            seg = r.segments[-1]
+            seg.written = seg.size
+            try:
+                os.truncate(seg.path + ".log", seg.size)
+            except OSError:
+                pass
+            n = bisect_left(seg.offsets, seg.size)
+            del seg.ids[n:]
+            del seg.offsets[n:]
+            self._write_index(seg)
+
+    # ---- retention ----
+
+    def _apply_retention(self) -> None:
+        if self.max_age is None and self.max_bytes is None:
+            return
+        limit = time.time() - self.max_age if self.max_age is not None else None
+        # runs in the writer thread: segments are not written meanwhile
+        with self._cond:
+            rooms = [(r, list(r.segments)) for r in self._rooms.values()]
+        for r, segments in rooms:
+            total = sum(seg.size for seg in segments)
+            expired = []
+            for i, seg in enumerate(segments):
+                try:
+                    old = limit is not None and os.path.getmtime(seg.path + ".log") < limit
+                except OSError:
+                    old = True
+                # the active segment only goes when expired (next entry starts a new one)
+                if not old and (self.max_bytes is None or total <= self.max_bytes or i == len(segments) - 1):
+                    break
+                expired.append(seg)
+                total -= seg.size
+            if not expired:
+                continue
+            if expired[-1] is segments[-1]:
+                files = self._files.pop(r.room, None)
+                if files is not None:
+                    files[0].close()
+                    files[1].close()
+            with self._cond:
+                del r.segments[:len(expired)]
+            for seg in expired:
+                with self._map_lock:
+                    # a reader may still use the mapping: closed when released
+                    self._maps.pop(seg, None)
+                for path in (seg.path + ".log", seg.path + ".idx"):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    # ---- reading ----
+
+    def page(self, room: str, before: Optional[int] = None,
+             limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Entries of `room` older than `before` (newest when None), oldest first.
+
+        Same contract as RoomHistory.page: returns (entries, cursor), the
+        cursor is the `before` of the previous page, None when nothing older
+        is logged."""
+        limit = max(1, int(limit))
+        bound = _NO_BOUND if before is None else int(before)
+        with self._cond:
+            r = self._rooms.get(room)
+            if r is None:
+                return [], None
+            segments = [(seg, seg.size) for seg in r.segments]
+            queued = r.writing + r.pending
+        first = segments[0][0].base if segments else (queued[0]["id"] if queued else None)
+        entries = [e for e in queued if e["id"] < bound][-limit:]
+        if queued:
+            # the log only holds older entries than the queued ones
+            bound = min(bound, queued[0]["id"])
+        if len(entries) < limit:
+            entries = self._read(segments, bound, limit - len(entries)) + entries
+        cursor = entries[0]["id"] if entries and first is not None and entries[0]["id"] > first else None
+        return entries, cursor
+
+    def first_id(self, room: str) -> Optional[int]:
+        """Id of the oldest entry logged for `room` (None if none)."""
+        with self._cond:
+            r = self._rooms.get(room)
+            if r is None:
+                return None
+            if r.segments:
+                return r.segments[0].base
+            queued = r.writing or r.pending
+            return queued[0]["id"] if queued else None
+
+    def _read(self, segments: List[Tuple[_Segment, int]], bound: int, limit: int) -> List[Dict[str, Any]]:
+        # segments from the newest holding ids < bound, backwards
+        i = bisect_left([seg.base for seg, _ in segments], bound)
+        chunks = []
+        count = 0
+        while i > 0 and count < limit:
+            i -= 1
+            seg, size = segments[i]
+            try:
+                records = self._segment_tail(seg, size, bound, limit - count)
+            except (OSError, ValueError):
+                break  # deleted by the retention meanwhile
+            chunks.append(records)
+            count += len(records)
+        entries = []
+        for records in reversed(chunks):
+            for mm, rid, ts, start, length in records:
+                entry = {"id": rid, "ts": ts}
+                entry.update(proto.decode_json(mm[start:start + length]))
+                entries.append(entry)
+        return entries[-limit:]
+
+    def _segment_tail(self, seg: _Segment, size: int, bound: int, limit: int) -> List[tuple]:
+        """Last `limit` records of a segment with an id < bound (located, not decoded)."""
+        if size == 0:
+            return []
+        ids, offsets = seg.load_index()
+        n = bisect_left(offsets, size, 0, len(ids))
+        k = bisect_left(ids, bound, 0, n)  # index points with an id < bound
+        if k == 0:
+            return []
+        mm = self._map(seg, size)
+        end = size if k == n else offsets[k]
+        chunks = []
+        count = 0
+        j = k - 1
+        # chunk between two index points, backwards until enough records
+        while j >= 0 and count < limit:
+            chunk: Deque[tuple] = collections.deque(maxlen=limit - count)
+            off = offsets[j]
+            while off < end:
+                length, _, rid, ts = _HEADER.unpack_from(mm, off)
+                if rid >= bound:
+                    break
+                chunk.append((mm, rid, ts, off + _HEADER.size, length))
+                off += _HEADER.size + length
+            chunks.append(chunk)
+            count += len(chunk)
+            end = offsets[j]
+            j -= 1
+        return [rec for chunk in reversed(chunks) for rec in chunk][-limit:]
+
+    def _map(self, seg: _Segment, size: int) -> mmap.mmap:
+        with self._map_lock:
+            mm = self._maps.get(seg)
+            if mm is not None and len(mm) >= size:
+                self._maps.move_to_end(seg)
+                return mm
+        with open(seg.path + ".log", "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with self._map_lock:
+            self._maps[seg] = mm
+            self._maps.move_to_end(seg)
+            while len(self._maps) > MAX_MAPPED_SEGMENTS:
+                # not closed: a reader may still use it (closed when released)
+                self._maps.popitem(last=False)
+        return mm
+
+    def stats(self) -> List[Tuple[str, int, int]]:
+        """(room, segments, bytes on disk) for every logged room."""
+        with self._cond:
+            return [(r.room, len(r.segments), sum(seg.size for seg in r.segments)) for r in self._rooms.values()]
+
+    # ---- startup ----
+
+    def _load(self) -> None:
+        for name in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, name)
+            try:
+                room = bytes.fromhex(name).decode("utf-8")
+            except ValueError:
+                continue
+            if not os.path.isdir(directory):
+                continue
+            r = _RoomLog(room, directory)
+            bases = sorted(int(f[:-4]) for f in os.listdir(directory) if f.endswith(".log") and f[:-4].isdigit())
+            for base in bases:
+                seg = _Segment(directory, base)
+                seg.size = seg.written = os.path.getsize(seg.path + ".log")
+                r.segments.append(seg)
+            last_id = self._recover(r)
+            if r.segments:
+                self._rooms[room] = r
+                self.last_id = max(self.last_id, last_id)
+
+    def _recover(self, r: _RoomLog) -> int:
+        """Check the tail of the last segment, truncate a torn record.
+        Returns the id of the last record (0 when the room has none left)."""
+        while r.segments:
+            seg = r.segments[-1]
+            ids, offsets = seg.load_index()
+            while True:
+                n = bisect_left(offsets, seg.size)
+                del ids[n:]
+                del offsets[n:]
+                start = offsets[-1] if offsets else 0
+                last_id, end = self._scan_tail(seg, start)
+                if last_id is not None or start == 0:
+                    break
+                # the record of the last index point is torn: scan from the previous one
+                seg.size = start
+            if end != os.path.getsize(seg.path + ".log"):
+                os.truncate(seg.path + ".log", end)
+            seg.size = seg.written = end
+            self._write_index(seg)
+            if last_id is not None:
+                return last_id
+            # empty segment: the previous one is the last
+            for path in (seg.path + ".log", seg.path + ".idx"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            r.segments.pop()
+        return 0
+
+    @staticmethod
+    def _scan_tail(seg: _Segment, start: int) -> Tuple[Optional[int], int]:
+        """Check the records from `start` (crc), index those the index missed.
+        Returns (id of the last intact record, end of the last intact record)."""
+        ids, offsets = seg.ids, seg.offsets
+        with open(seg.path + ".log", "rb") as f:
+            f.seek(start)
+            data = f.read(max(0, seg.size - start))
+        pos = 0
+        last_id = None
+        while pos + _HEADER.size <= len(data):
+            length, crc, rid, ts = _HEADER.unpack_from(data, pos)
+            payload = data[pos + _HEADER.size:pos + _HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            offset = start + pos
+            if not offsets or offset - offsets[-1] >= INDEX_INTERVAL:
+                # crash before the index was written
+                offsets.append(offset)
+                ids.append(rid)
+            last_id = rid
+            pos += _HEADER.size + length
+        return last_id, start + pos
+
+    @staticmethod
+    def _write_index(seg: _Segment) -> None:
+        pairs = array("Q")
+        for rid, offset in zip(seg.ids, seg.offsets):
+            pairs.append(rid)
+            pairs.append(offset)
+        if sys.byteorder == "little":
+            pairs.byteswap()
+        with open(seg.path + ".idx", "wb") as f:
+            f.write(pairs.tobytes())
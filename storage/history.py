@@ -0,0 +1,154 @@
+"""Recent history of the rooms, kept in memory.
+
+Each room keeps a bounded ring of its last events (chat messages, system
+notices, shared files), numbered with increasing ids:
+
+    history = RoomHistory()
+    history.append("room1", text="MSG|alice|salut")
+    history.append("room1", event={"type": "FILE_AVAILABLE", ...})
+    entries, cursor = history.page("room1", before=None, limit=50)
+    newer = history.since("room1", entries[-1]["id"])  # memory only
+
+An entry is {"id", "ts", "text"} (text frame) or {"id", "ts", "event"}
+(structured message). Pages are in chronological order; pass the cursor as
+`before` to get the previous page, None means nothing older is kept.
+
+Memory is capped: a room keeps at most max_messages entries and max_bytes
+(estimated size of the entries), evicting its oldest entries first, and at
+most max_rooms rooms are kept, the least recently active one being dropped
+first. Rooms stay in the history after their last member left, so a
+client rejoining gets the backlog.
+
+Ids are unique within a process: in cluster mode every worker numbers the
+history of the messages it delivers.
+
+With a ChatLog (storage.chatlog) every entry is also persisted: pages
+going further back than the memory are read from the log, and numbering
+continues after the last logged id on restart.
+"""
+import collections
+import json
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from storage.chatlog import ChatLog
+
+HISTORY_MAX_MESSAGES = 500
+HISTORY_MAX_BYTES = 256 * 1024
+HISTORY_MAX_ROOMS = 1000
+MAX_PAGE_SIZE = 200
+# estimated cost of an entry besides its text (dict, id, timestamp)
+ENTRY_OVERHEAD = 200
+
+
+class _Room:
+    __slots__ = ("entries", "sizes", "bytes")
+
+    def __init__(self):
+        self.entries: Deque[Dict[str, Any]] = collections.deque()
+        self.sizes: Deque[int] = collections.deque()
+        self.bytes = 0
+
+
+class RoomHistory:
+    def __init__(self, max_messages: int = HISTORY_MAX_MESSAGES, max_bytes: int = HISTORY_MAX_BYTES,
+                 max_rooms: int = HISTORY_MAX_ROOMS, log: Optional[ChatLog] = None):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_rooms = max_rooms
+        self.log = log
+        self._lock = threading.Lock()
+        self._rooms: "collections.OrderedDict[str, _Room]" = collections.OrderedDict()
+        self._next_id = log.last_id + 1 if log is not None else 1
+
+    def append(self, room: str, text: Optional[str] = None,
+               event: Optional[Dict[str, Any]] = None) -> int:
+        """Record a text frame or a structured message; returns its id."""
+        if event is not None:
+            size = ENTRY_OVERHEAD + len(json.dumps(event))
+        else:
+            size = ENTRY_OVERHEAD + len(text)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            entry = {"id": entry_id, "ts": time.time()}
+            if event is not None:
+                entry["event"] = event
+            else:
+                entry["text"] = text
+            r = self._rooms.get(room)
+            if r is None:
+                r = self._rooms[room] = _Room()
+                if len(self._rooms) > self.max_rooms:
+                    self._rooms.popitem(last=False)
+            else:
+                self._rooms.move_to_end(room)
+            if self.log is not None:
+                # under the lock: the log receives the ids in order
+                self.log.append(room, entry)
+            r.entries.append(entry)
+            r.sizes.append(size)
+            r.bytes += size
+            while len(r.entries) > self.max_messages or (r.bytes > self.max_bytes and len(r.entries) > 1):
+                r.entries.popleft()
+                r.bytes -= r.sizes.popleft()
+            return entry_id
+
+    def page(self, room: str, before: Optional[int] = None,
+             limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Entries of `room` older than `before` (newest when None), oldest first.
+
+        Returns (entries, cursor); the cursor is the `before` of the previous
+        page, None when there is nothing older."""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        before = None if before is None else int(before)
+        with self._lock:
+            r = self._rooms.get(room)
+            entries = r.entries if r is not None else ()
+            end = len(entries) if before is None else _first_at_least(entries, before)
+            start = max(0, end - limit)
+            page = [entries[i] for i in range(start, end)]
+        if start > 0:
+            return page, page[0]["id"]
+        if self.log is None:
+            return page, None
+        # older than the memory: from the log
+        bound = page[0]["id"] if page else before
+        if len(page) < limit:
+            older, cursor = self.log.page(room, bound, limit - len(page))
+            return older + page, cursor
+        first = self.log.first_id(room)
+        return page, bound if first is not None and first < bound else None
+
+    def since(self, room: str, after: int) -> List[Dict[str, Any]]:
+        """Entries of `room` newer than id `after` still in memory, oldest first.
+
+        Never reads the log, so it is cheap enough to call under another lock."""
+        with self._lock:
+            r = self._rooms.get(room)
+            if r is None:
+                return []
+            entries = r.entries
+            return [entries[i] for i in range(_first_at_least(entries, int(after) + 1), len(entries))]
+
+    def stats(self) -> List[Tuple[str, int, int]]:
+        """(room, entries, estimated bytes) for every room, most active first."""
+        with self._lock:
+            return [(room, len(r.entries), r.bytes) for room, r in reversed(self._rooms.items())]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(r.entries) for r in self._rooms.values())
+
+
+def _first_at_least(entries: Deque[Dict[str, Any]], entry_id: int) -> int:
+    # ids increase along the ring: binary search for the first id >= entry_id
+    lo, hi = 0, len(entries)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if entries[mid]["id"] < entry_id:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
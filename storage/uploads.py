@@ -0,0 +1,340 @@
+"""Streaming uploads written to disk chunk by chunk.
+
+An upload is announced with FILE_BEGIN, receives FILE_CHUNK messages that
+are appended to a temporary file in the downloads directory, and ends with
+FILE_END carrying the SHA-256 of the whole file. Only the current chunk is
+held in memory, whatever the file size. On success the temporary file is
+atomically moved into the BlobStore and a metadata record is written.
+
+If FILE_BEGIN announces a SHA-256 the same uploader already sent (same file
+shared earlier, possibly in another room), the upload completes immediately
+and no byte is transferred. A hash announced by anyone else is not trusted:
+the bytes are received and hashed, and the blob is then shared.
+
+A seq is used once: FILE_BEGIN for a seq that already has a record fails.
+
+Uploads are resumable: when the uploader's connection goes away the partial
+file is kept (suspend_owner) and a later FILE_BEGIN with the same seq, file
+name, size and uploader continues at the number of bytes already received.
+A small JSON sidecar next to the partial file keeps this possible across a
+server restart; partial uploads left alone for PARTIAL_UPLOAD_TTL seconds
+are deleted.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from storage.blobstore import BlobStore
+
+
+# partial uploads not resumed within this delay are deleted (seconds)
+PARTIAL_UPLOAD_TTL = 24 * 3600
+
+
+class UploadError(Exception):
+    pass
+
+
+class Upload:
+    __slots__ = ("seq", "filename", "size", "room", "uploader", "owner",
+                 "tmp_path", "path", "file", "hasher", "received", "sha256", "complete",
+                 "expected_sha256", "suspended_at")
+
+    def __init__(self, seq: str, filename: str, size: int, room: Optional[str],
+                 uploader: Optional[str], owner=None):
+        self.seq = seq
+        self.filename = filename
+        self.size = size
+        self.room = room
+        self.uploader = uploader
+        self.owner = owner
+        self.tmp_path = None
+        self.path = None
+        self.file = None
+        self.hasher = hashlib.sha256()
+        self.received = 0
+        self.sha256 = None
+        self.complete = False
+        self.expected_sha256 = None
+        self.suspended_at = None
+
+    def matches(self, filename: str, size: int, uploader: Optional[str],
+                sha256: Optional[str]) -> bool:
+        """Same file announced again by the same uploader (resume)."""
+        return (self.filename == filename and self.size == size and self.uploader == uploader
+                and (not sha256 or not self.expected_sha256 or sha256 == self.expected_sha256))
+
+
+def safe_filename(name: Optional[str]) -> str:
+    name = os.path.basename(name or "")
+    return name if name not in ("", ".", "..") else "file.bin"
+
+
+class UploadManager:
+    """Track in-progress uploads by seq."""
+
+    def __init__(self, store: BlobStore):
+        self.store = store
+        self.root = store.root
+        self._uploads: Dict[str, Upload] = {}
+        self._lock = threading.Lock()
+        self.purge_stale()
+
+    def begin(self, seq: str, filename: str, size: int, room: Optional[str] = None,
+              uploader: Optional[str] = None, owner=None, sha256: Optional[str] = None) -> Upload:
+        """Start or resume an upload.
+
+        The returned Upload has complete=True when the announced content was
+        already uploaded by `uploader` (nothing to send); otherwise
+        up.received is the offset the client must continue from (0 for a new
+        upload)."""
+        if not seq or safe_filename(seq) != seq:
+            raise UploadError("seq invalide")
+        if size < 0:
+            raise UploadError("taille invalide")
+        if self.store.get_record(seq) is not None:
+            raise UploadError(f"seq {seq} déjà utilisé")
+        filename = safe_filename(filename)
+        sha256 = sha256.lower() if sha256 else None
+        up = Upload(seq, filename, size, room, uploader, owner)
+        # the announced hash alone proves nothing (hashes are not secret):
+        # skip the transfer only for content this uploader already sent
+        if self.store.uploaded_by(sha256, uploader) and self.store.has_blob(sha256):
+            if os.path.getsize(self.store.blob_path(sha256)) == size:
+                with self._lock:
+                    current = self._uploads.get(seq)
+                    if current is not None and current.owner is not None:
+                        raise UploadError(f"upload {seq} déjà en cours")
+                self.discard(seq)
+                self._commit(up, sha256)
+                return up
+        resumed = self._resume(seq, filename, size, room, uploader, owner, sha256)
+        if resumed is not None:
+            return resumed
+        up.expected_sha256 = sha256
+        with self._lock:
+            if seq in self._uploads:
+                raise UploadError(f"upload {seq} déjà en cours")
+            self._uploads[seq] = up
+        up.tmp_path = self._part_path(seq)
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            up.file = open(up.tmp_path, "wb")
+            self._write_sidecar(up)
+        except OSError:
+            with self._lock:
+                self._uploads.pop(seq, None)
+            self._discard(up)
+            raise
+        return up
+
+    def _resume(self, seq, filename, size, room, uploader, owner, sha256) -> Optional[Upload]:
+        """Reattach a suspended upload, in memory or left on disk by a previous run."""
+        with self._lock:
+            up = self._uploads.get(seq)
+            if up is not None:
+                if up.owner is not None:
+                    raise UploadError(f"upload {seq} déjà en cours")
+                if not up.matches(filename, size, uploader, sha256):
+                    del self._uploads[seq]
+                    self._discard(up)
+                    return None
+                up.owner = owner  # claimed: a concurrent FILE_BEGIN now fails
+        if up is None:
+            up = self._load_partial(seq)
+            if up is None:
+                return None
+            if not up.matches(filename, size, uploader, sha256):
+                self._discard(up)
+                return None
+            with self._lock:
+                if seq in self._uploads:
+                    raise UploadError(f"upload {seq} déjà en cours")
+                up.owner = owner
+                self._uploads[seq] = up
+        try:
+            up.file = open(up.tmp_path, "ab")
+        except OSError:
+            self.abort(seq)
+            raise
+        up.room = room
+        up.suspended_at = None
+        up.expected_sha256 = up.expected_sha256 or sha256
+        return up
+
+    def _load_partial(self, seq: str) -> Optional[Upload]:
+        """Rebuild an Upload from its partial file and sidecar (rehashes the data)."""
+        tmp_path = self._part_path(seq)
+        try:
+            with open(tmp_path + ".json", encoding="utf-8") as f:
+                info = json.load(f)
+            up = Upload(seq, info["filename"], int(info["size"]), info.get("room"), info.get("uploader"))
+            up.expected_sha256 = info.get("sha256")
+            up.tmp_path = tmp_path
+            with open(tmp_path, "rb") as f:
+                while True:
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    up.hasher.update(chunk)
+                    up.received += len(chunk)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if up.received > up.size:
+            self._discard(up)
+            return None
+        return up
+
+    def _part_path(self, seq: str) -> str:
+        # leading dot: hidden from the catalog rebuild of legacy files
+        return os.path.join(self.root, f".upload-{seq}.part")
+
+    def _write_sidecar(self, up: Upload) -> None:
+        info = {"filename": up.filename, "size": up.size, "room": up.room,
+                "uploader": up.uploader, "sha256": up.expected_sha256}
+        with open(up.tmp_path + ".json", "w", encoding="utf-8") as f:
+            json.dump(info, f)
+
+    def get(self, seq: str) -> Optional[Upload]:
+        with self._lock:
+            return self._uploads.get(seq)
+
+    def write(self, seq: str, data: bytes, offset: Optional[int] = None) -> Upload:
+        """Append a chunk. `offset`, when given, must be the bytes received so far."""
+        up = self.get(seq)
+        if up is None or up.file is None:
+            raise UploadError(f"upload {seq} inconnu")
+        if offset is not None and offset != up.received:
+            raise UploadError(f"upload {seq}: offset {offset} attendu {up.received}")
+        if up.received + len(data) > up.size:
+            self.abort(seq)
+            raise UploadError(f"upload {seq} dépasse la taille annoncée")
+        up.file.write(data)
+        up.hasher.update(data)
+        up.received += len(data)
+        return up
+
+    def finish(self, seq: str, sha256: Optional[str] = None) -> Upload:
+        """Check size and checksum, then move the file into the blob store."""
+        with self._lock:
+            up = self._uploads.get(seq)
+            if up is None or up.file is None:
+                raise UploadError(f"upload {seq} inconnu")
+            if up.received != up.size:
+                # keep it: the client may resume it
+                raise UploadError(f"upload {seq} incomplet ({up.received}/{up.size} octets)")
+            del self._uploads[seq]
+        up.file.close()
+        digest = up.hasher.hexdigest()
+        if sha256 and sha256.lower() != digest:
+            self._discard(up)
+            raise UploadError(f"upload {seq}: checksum invalide")
+        self.store.add_blob(up.tmp_path, digest)
+        self._remove_sidecar(up)
+        try:
+            self._commit(up, digest)
+        except UploadError:
+            self.store.drop_unused(digest)
+            raise
+        return up
+
+    def _commit(self, up: Upload, sha256: str) -> None:
+        try:
+            self.store.put_record(up.seq, up.filename, up.size, sha256,
+                                  room=up.room, uploader=up.uploader)
+        except FileExistsError:
+            raise UploadError(f"seq {up.seq} déjà utilisé")
+        up.sha256 = sha256
+        up.path = self.store.blob_path(sha256)
+        up.complete = True
+
+    def abort(self, seq: str) -> None:
+        with self._lock:
+            up = self._uploads.pop(seq, None)
+        if up is not None:
+            self._discard(up)
+
+    def discard(self, seq: str) -> None:
+        """Forget an upload and its partial file, wherever it is."""
+        self.abort(seq)
+        self._remove_files(self._part_path(seq))
+
+    def cancel(self, seq: str, owner) -> bool:
+        """Discard an upload of `owner` and its partial file (FILE_CANCEL).
+
+        False when the upload does not exist or belongs to another connection."""
+        with self._lock:
+            up = self._uploads.get(seq)
+            if up is None or up.owner is not owner:
+                return False
+        self.discard(seq)
+        return True
+
+    def suspend_owner(self, owner) -> None:
+        """Keep the partial uploads of a connection that went away, for resume."""
+        now = time.time()
+        with self._lock:
+            ups = [up for up in self._uploads.values() if up.owner is owner]
+            for up in ups:
+                # closed before being released: a resume reopens the file
+                if up.file is not None:
+                    up.file.close()
+                    up.file = None
+                up.owner = None
+                up.suspended_at = now
+        if ups:
+            self._purge_suspended(now - PARTIAL_UPLOAD_TTL)
+
+    def _purge_suspended(self, limit: float) -> None:
+        with self._lock:
+            stale = [seq for seq, up in self._uploads.items()
+                     if up.suspended_at is not None and up.suspended_at < limit]
+        for seq in stale:
+            self.abort(seq)
+
+    def purge_stale(self, max_age: float = PARTIAL_UPLOAD_TTL) -> None:
+        """Delete partial uploads nobody resumed for max_age seconds
+        (scans the downloads directory: run at startup)."""
+        limit = time.time() - max_age
+        self._purge_suspended(limit)
+        with self._lock:
+            active = set(self._uploads)
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return
+        for name in names:
+            if not (name.startswith(".upload-") and name.endswith(".part")):
+                continue
+            seq = name[len(".upload-"):-len(".part")]
+            path = os.path.join(self.root, name)
+            try:
+                if seq not in active and os.path.getmtime(path) < limit:
+                    self._remove_files(path)
+            except OSError:
+                pass
+
+    def _discard(self, up: Upload) -> None:
+        if up.file is not None:
+            up.file.close()
+            up.file = None
+        if up.tmp_path is not None:
+            self._remove_files(up.tmp_path)
+
+    @staticmethod
+    def _remove_files(tmp_path: str) -> None:
+        # partial file and its sidecar
+        for path in (tmp_path, tmp_path + ".json"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _remove_sidecar(self, up: Upload) -> None:
+        try:
+            os.remove(up.tmp_path + ".json")
+        except OSError:
+            pass
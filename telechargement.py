@@ -6,11 +6,70 @@ l'envoi et la réception de fichiers dans les rooms.
 
 import os
 import base64
+import binascii
+import collections
+import hashlib
+import hmac
+import itertools
+import threading
+import time
 import uuid
 import socket
 import tkinter as tk
 from tkinter import filedialog
 from network import protocol as proto
+from network import state_machine as sm
+
+# Délai d'attente de la réponse UPLOAD_ACCEPT du serveur (secondes)
+UPLOAD_ACCEPT_TIMEOUT = 10
+
+# Uploads en attente de UPLOAD_ACCEPT, complétés par handle_upload_accept
+# depuis le thread de réception
+_pending_uploads = sm.IntermediateStateManager()
+
+# Transferts directs entre deux membres d'une room (P2P_REQUEST) :
+# délai de la réponse P2P_INVITE du serveur, délai laissé au destinataire
+# pour se connecter (au-delà, le fichier passe par le serveur), et délai
+# d'inactivité de la connexion directe
+P2P_INVITE_TIMEOUT = 10
+P2P_CONNECT_TIMEOUT = 5
+P2P_IO_TIMEOUT = 30
+# en dessous de cette taille, le relais du serveur suffit
+P2P_MIN_SIZE = 1024 * 1024
+
+# Transferts directs en attente de P2P_INVITE, complétés par handle_p2p_invite
+_pending_p2p = sm.IntermediateStateManager()
+# seq -> Event levé par handle_p2p_failed (le destinataire n'a pas pu se connecter)
+_p2p_failed = {}
+
+# Téléchargement par plages sur des connexions de données parallèles
+# (DATA|jeton, jeton reçu dans LOGIN_OK) : nombre de connexions par défaut,
+# taille des plages demandées une à une par chaque connexion
+PARALLEL_CONNECTIONS = 4
+PARALLEL_RANGE_SIZE = 8 * 1024 * 1024
+DATA_TIMEOUT = 30  # inactivité d'une connexion de données (secondes)
+
+# Uploads interrompus : (room, chemin, taille, mtime) -> seq. Renvoyer le même
+# fichier réutilise le seq et le serveur reprend là où il s'était arrêté.
+_interrupted_uploads = {}
+
+# Suffixe des téléchargements en cours (renommés une fois complets)
+PARTIAL_SUFFIX = ".part"
+
+# Transferts en arrière-plan (TransferManager) : nombre de transferts
+# simultanés par défaut, et intervalle minimal entre deux notifications de
+# progression d'un même transfert (secondes)
+TRANSFER_CONCURRENCY = 2
+PROGRESS_INTERVAL = 0.1
+# Octets de trames de fichiers en attente dans SocketSender au-delà desquels
+# l'envoi d'un fichier attend que la socket avance
+SENDER_MAX_BULK = 1024 * 1024
+# Octets pas encore envoyés que le noyau garde pour la socket du client
+# (TCP_NOTSENT_LOWAT) : sans limite, un message de chat attend derrière
+# plusieurs Mo de blocs déjà passés au noyau
+SENDER_NOTSENT_LOWAT = 128 * 1024
+# Tranche de sendfile d'un envoi direct : progression et annulation entre deux
+P2P_SLICE = 1024 * 1024
 
 
 def pick_file():
@@ -33,19 +92,61 @@ def pick_file():
     return file_path if file_path else None
 
 
-def send_file_to_room(sclient, room, file_path):
-    """Envoie un fichier à une room spécifique.
+def file_sha256(file_path):
+    """Calcule le SHA-256 d'un fichier par blocs (mémoire constante)."""
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(proto.FILE_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def send_file_to_room(sclient, room, file_path, seq=None, compression=None, codec=None, to=None,
+                      transfer=None):
+    """Envoie un fichier à une room spécifique, en flux.
+    
+    Le SHA-256 du fichier est annoncé dans FILE_BEGIN. Si le même
+    utilisateur a déjà envoyé ce contenu au serveur (UPLOAD_ACCEPT
+    status=complete), aucun octet n'est renvoyé. Sinon le fichier est lu par blocs de
+    proto.FILE_CHUNK_SIZE octets envoyés en trames binaires FILE_CHUNK,
+    puis FILE_END. La mémoire utilisée ne dépend pas de la taille du fichier.
+    
+    Si un précédent envoi du même fichier a été interrompu (connexion
+    perdue), son seq est réutilisé : le serveur répond avec l'offset déjà
+    reçu et seuls les octets manquants sont envoyés.
+    
+    Avec `compression` (négociée au LOGIN), les blocs sont
+    compressés ; dès qu'un bloc ne rétrécit pas (média, archive), le reste
+    du fichier est envoyé sans compression.
+    
+    La réponse UPLOAD_ACCEPT est lue par le thread de réception, qui doit
+    appeler handle_upload_accept.
+    
+    Sur un SocketSender, les blocs passent par sa file de trames de
+    fichiers (bornée : l'envoi suit le rythme de la socket). Avec
+    `transfer` (TransferManager), la progression y est reportée et
+    l'annulation est vérifiée entre deux blocs : le serveur est prévenu
+    (FILE_CANCEL) et abandonne le fichier partiel.
     
     Args:
         sclient: Le socket client connecté
         room: Le nom de la room
         file_path: Le chemin du fichier à envoyer
+        seq: Identifiant à utiliser (None = reprise ou nouvel identifiant)
+        compression: Algorithme de compression accepté par le serveur, ou None
+        codec: Codec de messages négocié au LOGIN (None = JSON)
+        to: Pseudo du seul membre à prévenir (None = toute la room)
+        transfer: Transfer suivi par un TransferManager, ou None
     
     Returns:
-        dict: {"success": bool, "message": str, "filename": str, "size": int}
+        dict: {"success": bool, "message": str, "filename": str, "size": int, "sent": int}
     
     Raises:
         OSError, socket.error, ConnectionError: Si erreur de connexion
+        TransferCancelled: Si `transfer` a été annulé
         Exception: Pour toutes autres erreurs
     """
     if not os.path.isfile(file_path):
@@ -53,34 +154,97 @@ def send_file_to_room(sclient, room, file_path):
             "success": False,
             "message": f"Fichier introuvable: {file_path}",
             "filename": None,
-            "size": 0
+            "size": 0,
+            "sent": 0
         }
     
     try:
-        with open(file_path, "rb") as f:
-            data = f.read()
-        
-        b64 = base64.b64encode(data).decode("ascii")
-        seq_id = uuid.uuid4().hex
         filename = os.path.basename(file_path)
+        st = os.stat(file_path)
+        size = st.st_size
+        key = (room, os.path.abspath(file_path), size, st.st_mtime)
+        seq_id = seq or _interrupted_uploads.get(key) or uuid.uuid4().hex
+        digest = file_sha256(file_path)
         
-        obj = {
-            "type": "SEND_FILE",
+        print(f"[TELECHARGEMENT] Envoi FILE_BEGIN: seq={seq_id}, room={room}, filename={filename}, size={size}")
+        _pending_uploads.begin_sequence(seq_id)
+        begin = {
+            "type": "FILE_BEGIN",
             "seq": seq_id,
             "room": room,
-            "meta": {"filename": filename, "size": len(data)},
-            "data": b64,
+            "meta": {"filename": filename, "size": size},
+            "sha256": digest,
         }
+        end = {"type": "FILE_END", "seq": seq_id, "sha256": digest}
+        if to:
+            begin["to"] = end["to"] = to
+        proto.send_json(sclient, begin, codec)
+        accept = _pending_uploads.wait(seq_id, timeout=UPLOAD_ACCEPT_TIMEOUT)
+        if accept is None:
+            return {
+                "success": False,
+                "message": "Pas de réponse du serveur pour l'upload",
+                "filename": filename,
+                "size": size,
+                "sent": 0
+            }
         
-        print(f"[TELECHARGEMENT] Envoi SEND_FILE: seq={seq_id}, room={room}, filename={filename}")
-        proto.send_json(sclient, obj)
+        sent = 0
+        if accept.get("status") != "complete":
+            offset = int(accept.get("offset") or 0)
+            if offset:
+                print(f"[TELECHARGEMENT] Reprise de l'upload à {offset}/{size} octets")
+            if transfer is not None:
+                transfer.skip(offset)
+            _interrupted_uploads[key] = seq_id
+            send_bulk = getattr(sclient, "send_bulk", None)
+            try:
+                with open(file_path, "rb") as f:
+                    f.seek(offset)
+                    while True:
+                        if transfer is not None:
+                            transfer.check()
+                        chunk = f.read(proto.FILE_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        frame = proto.PreparedFrame.binary({"type": "FILE_CHUNK", "seq": seq_id, "offset": offset + sent}, chunk)
+                        if compression:
+                            packed = frame.compressed(compression)
+                            if packed is frame and len(chunk) == proto.FILE_CHUNK_SIZE:
+                                compression = None  # contenu incompressible : inutile d'insister
+                            frame = packed
+                        if send_bulk is not None:
+                            send_bulk(frame, transfer)
+                        else:
+                            proto.send_frame(sclient, frame)
+                        sent += len(chunk)
+                        if transfer is not None:
+                            transfer.advance(len(chunk))
+            except TransferCancelled:
+                # les blocs encore en file sont retirés : le serveur a reçu un début
+                # de fichier cohérent, qu'il abandonne
+                print(f"[TELECHARGEMENT] Envoi annulé: {filename} ({offset + sent}/{size} octets)")
+                _send_after_chunks(sclient, {"type": "FILE_CANCEL", "seq": seq_id}, codec)
+                _interrupted_uploads.pop(key, None)
+                raise
+            
+            _send_after_chunks(sclient, end, codec)
+            del _interrupted_uploads[key]
+        else:
+            print(f"[TELECHARGEMENT] Contenu déjà présent sur le serveur, rien à envoyer")
+            _interrupted_uploads.pop(key, None)
+            if transfer is not None:
+                transfer.skip(size)
         
         return {
             "success": True,
             "message": f"Fichier envoyé avec succès",
             "filename": filename,
-            "size": len(data)
+            "size": size,
+            "sent": sent
         }
+    except TransferCancelled:
+        raise
     except (OSError, socket.error, ConnectionError) as ex:
         print(f"[TELECHARGEMENT] Erreur envoi: {ex}")
         raise
@@ -89,13 +253,222 @@ def send_file_to_room(sclient, room, file_path):
         raise
 
 
-def request_file_download(sclient, seq, filename):
+def _send_after_chunks(sclient, obj, codec=None):
+    """Envoie un message qui doit suivre les blocs de fichier déjà en file.
+    
+    Sur un SocketSender, FILE_END et FILE_CANCEL passent par la file des
+    trames de fichiers : un message ordinaire doublerait les derniers blocs.
+    """
+    send_bulk = getattr(sclient, "send_bulk", None)
+    if send_bulk is None:
+        proto.send_json(sclient, obj, codec)
+    else:
+        send_bulk((codec or proto.JSON_CODEC).frame(obj))
+
+
+def handle_upload_accept(payload):
+    """Traite une réponse UPLOAD_ACCEPT (appelé par le thread de réception).
+    
+    Args:
+        payload: Le dictionnaire JSON du message
+    """
+    _pending_uploads.complete_sequence(payload.get("seq"), payload)
+
+
+def send_file_to_member(sclient, room, to, file_path, compression=None, codec=None, transfer=None):
+    """Envoie un fichier à un membre de la room, directement si possible.
+    
+    Le fichier est servi par une socket d'écoute de ce client : le serveur
+    transmet au destinataire l'adresse et un jeton à usage unique
+    (P2P_REQUEST -> P2P_INVITE), le destinataire se connecte, présente le
+    jeton et reçoit le fichier en flux (sendfile), sans qu'un octet ne
+    passe par le serveur. Si le destinataire ne s'est pas connecté au bout
+    de P2P_CONNECT_TIMEOUT secondes (ou signale un échec), ou si le
+    transfert direct échoue, le fichier est envoyé par le serveur
+    (send_file_to_room avec `to`). Les petits fichiers passent toujours
+    par le serveur.
+    
+    Les réponses P2P_INVITE et P2P_FAILED sont lues par le thread de
+    réception, qui doit appeler handle_p2p_invite / handle_p2p_failed.
+    
+    `transfer` (TransferManager) : comme pour send_file_to_room ; un
+    envoi direct annulé n'est pas relayé par le serveur.
+    
+    Returns:
+        dict: comme send_file_to_room, plus "p2p": True si le transfert a été direct
+    
+    Raises:
+        OSError, socket.error, ConnectionError: Si erreur de connexion au serveur
+    """
+    if not os.path.isfile(file_path) or os.path.getsize(file_path) < P2P_MIN_SIZE:
+        return dict(send_file_to_room(sclient, room, file_path, compression=compression, codec=codec, to=to,
+                                      transfer=transfer), p2p=False)
+    
+    filename = os.path.basename(file_path)
+    size = os.path.getsize(file_path)
+    seq_id = uuid.uuid4().hex
+    failed = _p2p_failed[seq_id] = threading.Event()
+    try:
+        with socket.create_server(("", 0)) as listener:
+            _pending_p2p.begin_sequence(seq_id)
+            proto.send_json(sclient, {
+                "type": "P2P_REQUEST",
+                "seq": seq_id,
+                "room": room,
+                "to": to,
+                "port": listener.getsockname()[1],
+                "meta": {"filename": filename, "size": size},
+                "sha256": file_sha256(file_path),
+            }, codec)
+            invite = _pending_p2p.wait(seq_id, timeout=P2P_INVITE_TIMEOUT)
+            if invite is not None and invite.get("error"):
+                return {"success": False, "message": invite["error"], "filename": filename,
+                        "size": size, "sent": 0, "p2p": False}
+            if invite is not None and _serve_p2p(listener, invite, file_path, size, failed, transfer):
+                print(f"[TELECHARGEMENT] Envoi direct terminé: {filename} -> {to}")
+                return {"success": True, "message": "Fichier envoyé en direct", "filename": filename,
+                        "size": size, "sent": size, "p2p": True}
+    finally:
+        _p2p_failed.pop(seq_id, None)
+    print(f"[TELECHARGEMENT] Envoi direct impossible, relais par le serveur: {filename} -> {to}")
+    if transfer is not None:
+        transfer.reset()  # le relais repart du début
+    return dict(send_file_to_room(sclient, room, file_path, compression=compression, codec=codec, to=to,
+                                  transfer=transfer), p2p=False)
+
+
+def _serve_p2p(listener, invite, file_path, size, failed, transfer=None):
+    """Attend le destinataire sur `listener` et lui envoie le fichier. True si reçu et vérifié."""
+    token = str(invite.get("token") or "")
+    listener.settimeout(0.2)
+    deadline = time.monotonic() + P2P_CONNECT_TIMEOUT
+    while time.monotonic() < deadline and not failed.is_set():
+        if transfer is not None:
+            transfer.check()
+        try:
+            conn, addr = listener.accept()
+        except socket.timeout:
+            continue
+        with conn:
+            try:
+                conn.settimeout(P2P_IO_TIMEOUT)
+                reader = proto.FrameReader(conn)
+                hello = proto.decode_message(reader.read_frame())
+                if not hmac.compare_digest(str(hello.get("token") or ""), token):
+                    print(f"[TELECHARGEMENT] Connexion directe refusée (jeton invalide): {addr}")
+                    continue
+                meta = {"filename": os.path.basename(file_path), "size": size}
+                header = {"type": "FILE_STREAM", "seq": invite.get("seq"), "meta": meta}
+                stream = proto.FileStream(header, open(file_path, "rb"), 0, size)
+                if transfer is None:
+                    proto.send_stream(conn, stream)
+                else:
+                    _send_stream_sliced(conn, stream, transfer)
+                done = proto.decode_message(reader.read_frame())
+                return done.get("status") == "ok"
+            except (OSError, ValueError) as ex:
+                print(f"[TELECHARGEMENT] Transfert direct interrompu: {ex}")
+                return False
+    return False
+
+
+def _send_stream_sliced(conn, stream, transfer):
+    """proto.send_stream par tranches de P2P_SLICE : progression et annulation entre deux."""
+    with stream.file:
+        proto.send_frame(conn, stream.frame)
+        offset, end = stream.offset, stream.offset + stream.count
+        while offset < end:
+            transfer.check()
+            sent = conn.sendfile(stream.file, offset, min(P2P_SLICE, end - offset))
+            if not sent:
+                raise ConnectionError(f"file stream truncated ({offset}/{end} bytes)")
+            offset += sent
+            transfer.advance(sent)
+
+
+def receive_file_p2p(sclient, invite, downloads_dir=None, codec=None):
+    """Reçoit un fichier envoyé en direct (P2P_INVITE role "caller").
+    
+    Se connecte à l'émetteur, présente le jeton et écrit le flux comme
+    receive_file_stream, puis vérifie le SHA-256 annoncé. Bloquant : à
+    appeler dans un thread, pas dans le thread de réception. Si l'émetteur
+    est injoignable, le serveur en est averti (P2P_FAILED) et le fichier
+    arrivera par le relais (FILE_AVAILABLE).
+    
+    Args:
+        sclient: Le socket client connecté au serveur
+        invite: Le message P2P_INVITE reçu
+        downloads_dir: Répertoire de téléchargement (None = dossier Downloads Windows)
+        codec: Codec de messages négocié au LOGIN (None = JSON)
+    
+    Returns:
+        dict: {"success": bool, "message": str, "path": str}
+    """
+    seq_id = invite.get("seq")
+    peer = invite.get("peer") or {}
+    try:
+        conn = socket.create_connection((peer["ip"], int(peer["port"])), timeout=P2P_CONNECT_TIMEOUT)
+    except (OSError, KeyError, TypeError, ValueError) as ex:
+        print(f"[TELECHARGEMENT] Émetteur injoignable ({ex}), relais par le serveur")
+        try:
+            proto.send_json(sclient, {"type": "P2P_FAILED", "seq": seq_id, "to": invite.get("from"),
+                                      "reason": str(ex)}, codec)
+        except (OSError, ConnectionError):
+            pass
+        return {"success": False, "message": f"Émetteur injoignable: {ex}", "path": None}
+    
+    result = {"success": False, "message": "Transfert direct interrompu", "path": None}
+    with conn:
+        try:
+            conn.settimeout(P2P_IO_TIMEOUT)
+            proto.send_json(conn, {"type": "P2P_HELLO", "seq": seq_id, "token": invite.get("token")})
+            reader = proto.FrameReader(conn)
+            frame = reader.read_frame()
+            if frame.kind != proto.KIND_STREAM:
+                raise ConnectionError("réponse inattendue de l'émetteur")
+            # vérifié avant le renommage : un contenu altéré est supprimé et
+            # le relais du serveur enverra le bon fichier
+            result = receive_file_stream(reader, frame.header, downloads_dir, sha256=invite.get("sha256"))
+            proto.send_json(conn, {"type": "P2P_DONE", "seq": seq_id,
+                                   "status": "ok" if result["success"] else "error"})
+        except (OSError, ValueError) as ex:
+            print(f"[TELECHARGEMENT] Transfert direct interrompu: {ex}")
+    return result
+
+
+def handle_p2p_invite(payload):
+    """Traite une réponse P2P_INVITE adressée à l'émetteur (appelé par le thread de réception).
+    
+    Args:
+        payload: Le dictionnaire JSON du message
+    """
+    _pending_p2p.complete_sequence(payload.get("seq"), payload)
+
+
+def handle_p2p_failed(payload):
+    """Traite un P2P_FAILED : le destinataire n'a pas pu se connecter.
+    
+    Args:
+        payload: Le dictionnaire JSON du message
+    """
+    failed = _p2p_failed.get(payload.get("seq"))
+    if failed is not None:
+        failed.set()
+
+
+def request_file_download(sclient, seq, filename, downloads_dir=None, codec=None):
     """Demande le téléchargement d'un fichier au serveur.
     
+    Si un téléchargement précédent du fichier a été interrompu, seule la
+    partie manquante est demandée (GET_FILE avec offset) et complète le
+    fichier partiel local.
+    
     Args:
         sclient: Le socket client connecté
         seq: L'identifiant de séquence du fichier
         filename: Le nom du fichier
+        downloads_dir: Répertoire de téléchargement (None = dossier Downloads Windows)
+        codec: Codec de messages négocié au LOGIN (None = JSON)
     
     Returns:
         dict: {"success": bool, "message": str}
@@ -103,9 +476,14 @@ def request_file_download(sclient, seq, filename):
     Raises:
         OSError, socket.error, ConnectionError: Si erreur de connexion
     """
-    req = {"type": "GET_FILE", "seq": seq, "filename": filename}
+    # stream: le serveur répond par un en-tête FILE_STREAM suivi des octets
+    # bruts du fichier (sendfile), reçus par receive_file_stream
+    req = {"type": "GET_FILE", "seq": seq, "filename": filename, "stream": True}
+    partial = _partial_path(_downloads_path(downloads_dir), filename, seq)
+    if os.path.isfile(partial):
+        req["offset"] = os.path.getsize(partial)
     try:
-        proto.send_json(sclient, req)
+        proto.send_json(sclient, req, codec)
         print(f"[TELECHARGEMENT] GET_FILE envoyé pour {filename}")
         return {
             "success": True,
@@ -116,41 +494,479 @@ def request_file_download(sclient, seq, filename):
         raise
 
 
-def save_received_file(filename, data_b64, downloads_dir=None):
-    """Sauvegarde un fichier reçu dans le dossier Téléchargements.
+def download_file_parallel(host, port, data_token, seq, filename, connections=PARALLEL_CONNECTIONS,
+                           downloads_dir=None, range_size=PARALLEL_RANGE_SIZE, transfer=None):
+    """Télécharge un fichier par plages, sur plusieurs connexions de données.
+    
+    Ouvre jusqu'à `connections` connexions au serveur, authentifiées par le
+    jeton de données de LOGIN_OK (DATA|jeton) et réservées aux
+    téléchargements. Une première requête de longueur nulle donne la taille
+    et le SHA-256 du fichier ; le "<nom>.<seq>.part" est alloué à sa taille, puis
+    chaque connexion demande la plage suivante de `range_size` octets
+    (GET_FILE stream avec offset/length) et l'écrit à sa position
+    (os.pwrite). Une connexion qui échoue rend sa plage aux autres. Le
+    fichier complet est vérifié (SHA-256) avant d'être renommé.
+    
+    Bloquant : à appeler dans un thread. Indépendant du thread de
+    réception : les réponses arrivent sur les connexions de données.
+    Avec `transfer` (TransferManager), la taille et la progression y sont
+    reportées ; une annulation arrête les connexions et supprime le .part.
+    
+    Args:
+        host, port: Adresse du serveur
+        data_token: Jeton "data_token" reçu dans LOGIN_OK
+        seq: L'identifiant de séquence du fichier
+        filename: Le nom du fichier
+        connections: Nombre maximal de connexions parallèles
+        downloads_dir: Répertoire de téléchargement (None = dossier Downloads Windows)
+        range_size: Taille des plages demandées
+        transfer: Transfer suivi par un TransferManager, ou None
+    
+    Returns:
+        dict: {"success": bool, "message": str, "path": str}
+    """
+    req = {"type": "GET_FILE", "seq": seq, "filename": filename, "stream": True}
+    downloads_path = _downloads_path(downloads_dir)
+    try:
+        first = _DataConnection(host, port, data_token)
+    except (OSError, ValueError) as ex:
+        return {"success": False, "message": f"Connexion de données impossible: {ex}", "path": None}
+    try:
+        header = first.get_range(req, 0, 0, None)
+    except (OSError, ValueError) as ex:
+        first.close()
+        return {"success": False, "message": f"Fichier indisponible: {ex}", "path": None}
+    meta = header.get("meta", {})
+    size = int(meta.get("size", 0))
+    name = os.path.basename(meta.get("filename") or filename or "file.bin")
+    partial = _partial_path(downloads_path, name, seq)
+    if transfer is not None:
+        transfer.size = size
+    
+    ranges = [(offset, min(range_size, size - offset)) for offset in range(0, size, range_size)]
+    ranges.reverse()  # pop() : dans l'ordre du fichier
+    lock = threading.Lock()
+    
+    def worker(conn, out):
+        try:
+            while True:
+                with lock:
+                    if not ranges:
+                        return
+                    offset, length = ranges.pop()
+                try:
+                    conn.get_range(req, offset, length, out, transfer)
+                except TransferCancelled:
+                    return
+                except (OSError, ValueError) as ex:
+                    print(f"[TELECHARGEMENT] Connexion de données perdue ({ex}), plage {offset} rendue")
+                    with lock:
+                        ranges.append((offset, length))
+                    return
+        finally:
+            conn.close()
+    
+    try:
+        os.makedirs(downloads_path, exist_ok=True)
+        with open(partial, "wb") as f:
+            f.truncate(size)
+        with _PositionalFile(partial) as out:
+            threads = []
+            for i in range(max(1, min(connections, len(ranges)))):
+                try:
+                    conn = first if i == 0 else _DataConnection(host, port, data_token)
+                except (OSError, ValueError) as ex:
+                    print(f"[TELECHARGEMENT] Connexion de données {i + 1} refusée: {ex}")
+                    break
+                threads.append(threading.Thread(target=worker, args=(conn, out), daemon=True))
+                threads[-1].start()
+            if not threads:
+                first.close()
+            for t in threads:
+                t.join()
+    except OSError as ex:
+        first.close()
+        return {"success": False, "message": f"Erreur lors de la sauvegarde: {ex}", "path": None}
+    if transfer is not None and transfer.cancelled:
+        os.remove(partial)
+        return {"success": False, "message": "Téléchargement annulé", "path": None}
+    if ranges:
+        # plages manquantes au milieu du fichier : pas de reprise possible par
+        # un GET_FILE avec offset, qui se fie à la taille du .part
+        os.remove(partial)
+        return {"success": False, "message": "Téléchargement interrompu", "path": None}
+    # plages écrites dans le désordre : SHA-256 calculé en relisant le .part
+    print(f"[TELECHARGEMENT] {name} reçu sur {len(threads)} connexions")
+    try:
+        return _finish_download(partial, downloads_path, name, header.get("sha256"))
+    except OSError as ex:
+        return {"success": False, "message": f"Erreur lors de la sauvegarde: {ex}", "path": None}
+
+
+class _DataConnection:
+    """Connexion de données : GET_FILE par plages, corps écrits à leur position."""
+    
+    def __init__(self, host, port, data_token):
+        self.sock = socket.create_connection((host, port), timeout=DATA_TIMEOUT)
+        proto.send_message(self.sock, f"DATA|{data_token}".encode())
+        self.reader = proto.FrameReader(self.sock)
+        self.buf = bytearray(proto.STREAM_BUFFER_SIZE)
+    
+    def get_range(self, req, offset, length, out, transfer=None):
+        """Demande [offset, offset + length) et l'écrit dans `out`. Retourne l'en-tête."""
+        proto.send_json(self.sock, dict(req, offset=offset, length=length))
+        frame = self.reader.read_frame()
+        if frame.kind != proto.KIND_STREAM:
+            # ERROR|... : jeton refusé, fichier introuvable
+            raise ConnectionError(bytes(frame.data).decode("utf-8", "replace"))
+        header = frame.header
+        remaining = int(header.get("length", 0))
+        if int(header.get("offset", 0)) != offset or remaining != length:
+            raise ValueError("plage inattendue")
+        view = memoryview(self.buf)
+        while remaining:
+            n = self.reader.recv_into(view, min(len(view), remaining))
+            if not n:
+                raise ConnectionError("socket closed while reading")
+            out.write_at(offset, view[:n])
+            offset += n
+            remaining -= n
+            if transfer is not None:
+                transfer.advance(n)
+                transfer.check()  # connexion fermée au milieu d'une plage : abandonnée
+        return header
+    
+    def close(self):
+        try:
+            proto.send_json(self.sock, {"type": "QUIT"})
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class _PositionalFile:
+    """Écritures à une position donnée, depuis plusieurs threads sans verrou.
+    
+    os.pwrite où il existe ; sinon (Windows) un descripteur par thread avec
+    seek + write.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+        self._local = threading.local()
+        self._files = []
+    
+    def write_at(self, offset, data):
+        if hasattr(os, "pwrite"):
+            while data:
+                n = os.pwrite(self.fd, data, offset)
+                data = data[n:]
+                offset += n
+            return
+        f = getattr(self._local, "file", None)
+        if f is None:
+            f = self._local.file = open(self.path, "r+b")
+            self._files.append(f)
+        f.seek(offset)
+        f.write(data)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        for f in self._files:
+            f.close()
+        os.close(self.fd)
+
+
+def request_file_list(sclient, room, before=None, limit=50, codec=None):
+    """Demande l'historique des fichiers partagés dans une room.
+
+    Le serveur répond par FILE_LIST (du plus récent au plus ancien) avec un
+    curseur `next` à repasser dans `before` pour obtenir la page suivante.
+
+    Raises:
+        OSError, socket.error, ConnectionError: Si erreur de connexion
+    """
+    req = {"type": "LIST_FILES", "room": room, "limit": limit}
+    if before is not None:
+        req["before"] = before
+    proto.send_json(sclient, req, codec)
+
+
+def request_history(sclient, room, before=None, limit=50, codec=None):
+    """Demande les messages d'une room plus anciens que `before`.
+
+    Le serveur répond par HISTORY (messages dans l'ordre chronologique) avec
+    un curseur `next` à repasser dans `before` pour remonter plus loin, None
+    quand il n'a rien de plus ancien.
+
+    Raises:
+        OSError, socket.error, ConnectionError: Si erreur de connexion
+    """
+    req = {"type": "HISTORY", "room": room, "limit": limit}
+    if before is not None:
+        req["before"] = before
+    proto.send_json(sclient, req, codec)
+
+
+def save_received_file(filename, data_b64, downloads_dir=None, sha256=None, seq=None):
+    """Sauvegarde un fichier reçu en base64 (ancien format SEND_FILE JSON).
+    
+    Le base64 est décodé par tranches de proto.B64_SLICE caractères,
+    écrites au fur et à mesure dans "<nom>.<seq>.part" : le fichier décodé n'est
+    jamais entier en mémoire. Vérifié et renommé comme save_received_data.
     
     Args:
         filename: Le nom du fichier
         data_b64: Les données encodées en base64
         downloads_dir: Répertoire de téléchargement (None = dossier Downloads Windows)
+        sha256: SHA-256 annoncé par le serveur, ou None
+        seq: L'identifiant de séquence du fichier (nom du .part)
+    
+    Returns:
+        dict: {"success": bool, "message": str, "path": str}
+    """
+    return _save_received(filename, downloads_dir, sha256, seq, lambda out: _write_base64(out, data_b64))
+
+
+def save_received_data(filename, data, downloads_dir=None, sha256=None, seq=None):
+    """Sauvegarde un fichier reçu dans le dossier Téléchargements.
+    
+    Les octets sont écrits dans "<nom>.<seq>.part", vérifiés avec le SHA-256
+    annoncé par le serveur, puis le fichier est renommé sans écraser un
+    fichier existant (voir _commit_download).
+    
+    Args:
+        filename: Le nom du fichier
+        data: Les octets du fichier (bytes ou memoryview d'une trame binaire)
+        downloads_dir: Répertoire de téléchargement (None = dossier Downloads Windows)
+        sha256: SHA-256 annoncé par le serveur, ou None
+        seq: L'identifiant de séquence du fichier (nom du .part)
     
     Returns:
         dict: {"success": bool, "message": str, "path": str}
     """
+    return _save_received(filename, downloads_dir, sha256, seq, lambda out: out.write(data))
+
+
+def _save_received(filename, downloads_dir, sha256, seq, write):
+    filename = os.path.basename(filename or "file.bin")
+    downloads_path = _downloads_path(downloads_dir)
+    partial = _partial_path(downloads_path, filename, seq)
     try:
-        # Utiliser le dossier Téléchargements Windows par défaut
-        if downloads_dir is None:
-            downloads_path = os.path.join(os.path.expanduser("~"), "Downloads")
-        else:
-            downloads_path = downloads_dir
-        
         os.makedirs(downloads_path, exist_ok=True)
-        
-        # Décoder et sauvegarder
-        data = base64.b64decode(data_b64)
-        dst = os.path.join(downloads_path, filename)
-        
-        with open(dst, "wb") as f:
-            f.write(data)
-        
-        print(f"[TELECHARGEMENT] Fichier reçu et sauvegardé: {dst}")
-        
+        with _PartialWriter(partial, hashed=bool(sha256)) as out:
+            write(out)
+        return _finish_download(partial, downloads_path, filename, sha256, out)
+    except (OSError, ValueError) as ex:
+        print(f"[TELECHARGEMENT] Erreur sauvegarde: {ex}")
+        return {
+            "success": False,
+            "message": f"Erreur lors de la sauvegarde: {ex}",
+            "path": None
+        }
+
+
+def _write_base64(out, text):
+    """Décode `text` dans `out` par tranches de proto.B64_SLICE caractères."""
+    try:
+        if len(text) % 4:
+            raise binascii.Error("longueur invalide")
+        for i in range(0, len(text), proto.B64_SLICE):
+            out.write(base64.b64decode(text[i:i + proto.B64_SLICE], validate=True))
+    except binascii.Error:
+        # caractères hors de l'alphabet (retours à la ligne) : décodé d'un bloc,
+        # comme base64.b64decode
+        out.restart()
+        out.write(base64.b64decode(text))
+
+
+class _PartialWriter:
+    """Fichier "<nom>.<seq>.part" d'un téléchargement, avec le SHA-256 de son contenu.
+    
+    Avec `offset` (reprise), le début déjà présent est relu pour le
+    calcul du SHA-256 et la suite est écrite à partir de `offset`.
+    """
+    
+    def __init__(self, path, offset=0, hashed=True):
+        self.hasher = hashlib.sha256() if hashed else None
+        if not offset:
+            self.file = open(path, "wb")
+            return
+        self.file = open(path, "r+b")
+        try:
+            if os.fstat(self.file.fileno()).st_size < offset:
+                raise OSError(f"fichier partiel plus court que l'offset {offset}")
+            if self.hasher is not None:
+                remaining = offset
+                while remaining:
+                    chunk = self.file.read(min(proto.FILE_CHUNK_SIZE * 16, remaining))
+                    if not chunk:
+                        raise OSError("fichier partiel illisible")
+                    self.hasher.update(chunk)
+                    remaining -= len(chunk)
+            self.file.seek(offset)
+            self.file.truncate()
+        except OSError:
+            self.file.close()
+            raise
+    
+    def write(self, data):
+        if self.hasher is not None:
+            self.hasher.update(data)
+        return self.file.write(data)
+    
+    def restart(self):
+        """Repart d'un fichier vide."""
+        self.file.seek(0)
+        self.file.truncate()
+        if self.hasher is not None:
+            self.hasher = hashlib.sha256()
+    
+    def hexdigest(self):
+        return self.hasher.hexdigest() if self.hasher is not None else None
+    
+    def close(self):
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _finish_download(partial, downloads_path, filename, expected, out=None):
+    """Vérifie un .part complet puis le renomme. Retourne le dict de résultat.
+    
+    `out` : le _PartialWriter qui l'a écrit (SHA-256 déjà calculé), sinon
+    le fichier est relu. Un contenu qui ne correspond pas au SHA-256
+    `expected` est supprimé : une reprise repartirait d'octets faux.
+    """
+    if expected:
+        digest = out.hexdigest() if out is not None else None
+        if digest is None:
+            digest = file_sha256(partial)
+        if digest != expected.lower():
+            os.remove(partial)
+            print(f"[TELECHARGEMENT] Checksum invalide, fichier supprimé: {filename}")
+            return {"success": False, "message": "Checksum invalide", "path": None}
+    dst = _commit_download(partial, downloads_path, filename)
+    print(f"[TELECHARGEMENT] Fichier reçu et sauvegardé: {dst}")
+    return {
+        "success": True,
+        "message": f"Fichier enregistré avec succès",
+        "path": dst
+    }
+
+
+def _commit_download(partial, downloads_path, filename):
+    """Renomme un .part complet sous un nom libre, sans écraser de fichier.
+    
+    "doc.pdf" existe déjà : "doc (1).pdf", puis "doc (2).pdf"... Le nom est
+    réservé par un fichier vide créé en exclusif (O_EXCL), que os.replace
+    remplace d'un coup : le fichier final n'existe jamais à moitié écrit,
+    et deux téléchargements du même nom ne s'écrasent pas. Retourne le
+    chemin final.
+    """
+    base, ext = os.path.splitext(os.path.basename(filename or "file.bin"))
+    for n in itertools.count():
+        dst = os.path.join(downloads_path, f"{base} ({n}){ext}" if n else f"{base}{ext}")
+        try:
+            fd = os.open(dst, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            continue
+        os.close(fd)
+        try:
+            os.replace(partial, dst)
+        except OSError:
+            os.remove(dst)
+            raise
+        return dst
+
+
+def _downloads_path(downloads_dir=None):
+    if downloads_dir is None:
+        return os.path.join(os.path.expanduser("~"), "Downloads")
+    return downloads_dir
+
+
+def _partial_path(downloads_path, filename, seq=None):
+    # "<nom>.<seq>.part" : deux fichiers de même nom téléchargés en même
+    # temps n'écrivent pas dans le même fichier partiel
+    name = os.path.basename(filename or "file.bin")
+    key = "".join(c for c in str(seq or "") if c.isalnum() or c in "-_")[:64]
+    if key:
+        name = f"{name}.{key}"
+    return os.path.join(downloads_path, name + PARTIAL_SUFFIX)
+
+
+def receive_file_stream(sclient, header, downloads_dir=None, sha256=None):
+    """Reçoit le corps d'un FILE_STREAM et l'écrit directement sur le disque.
+    
+    Doit être appelé par le thread de réception juste après la trame
+    d'en-tête : les header["length"] octets suivants sur la socket sont
+    le contenu du fichier. Ils sont copiés par blocs, sans jamais charger
+    le fichier entier en mémoire, dans "<nom>.<seq>.part" à la position
+    header["offset"], et hachés au passage. Une fois complet, le fichier
+    est vérifié avec le SHA-256 annoncé (header["sha256"] ou `sha256`),
+    puis renommé sans écraser de fichier existant (_commit_download) ;
+    s'il est interrompu, le .part permet de reprendre et aucun fichier
+    final tronqué n'apparaît.
+    
+    Args:
+        sclient: Le FrameReader qui a lu l'en-tête (ou le socket client
+            si l'en-tête a été lu avec proto.recv_frame)
+        header: L'en-tête JSON de la trame FILE_STREAM
+        downloads_dir: Répertoire de téléchargement (None = dossier Downloads Windows)
+        sha256: SHA-256 attendu, si l'en-tête n'en porte pas (envoi direct)
+    
+    Returns:
+        dict: {"success": bool, "message": str, "path": str}
+    
+    Raises:
+        OSError, socket.error, ConnectionError: Si erreur de connexion
+    """
+    meta = header.get("meta", {})
+    filename = os.path.basename(meta.get("filename") or "file.bin")
+    length = int(header.get("length", 0))
+    offset = int(header.get("offset", 0))
+    total = int(meta.get("size", offset + length))
+    expected = header.get("sha256") or sha256
+    complete = offset + length >= total
+    
+    downloads_path = _downloads_path(downloads_dir)
+    partial = _partial_path(downloads_path, filename, header.get("seq"))
+    
+    try:
+        os.makedirs(downloads_path, exist_ok=True)
+        # haché seulement si la fin du fichier arrive (sinon vérifié plus tard)
+        out = _PartialWriter(partial, offset, hashed=bool(expected) and complete)
+    except OSError as ex:
+        # il faut quand même consommer le flux pour garder la socket utilisable
+        print(f"[TELECHARGEMENT] Erreur sauvegarde: {ex}")
+        proto.recv_stream_into(sclient, _NullFile(), length)
+        return {
+            "success": False,
+            "message": f"Erreur lors de la sauvegarde: {ex}",
+            "path": None
+        }
+    
+    with out:
+        proto.recv_stream_into(sclient, out, length)
+    
+    if not complete:
+        print(f"[TELECHARGEMENT] Reçu {offset + length}/{total} octets de {filename}")
         return {
             "success": True,
-            "message": f"Fichier enregistré avec succès",
-            "path": dst
+            "message": f"Plage reçue ({offset + length}/{total} octets)",
+            "path": partial
         }
-    except Exception as ex:
+    try:
+        return _finish_download(partial, downloads_path, filename, expected, out)
+    except OSError as ex:
         print(f"[TELECHARGEMENT] Erreur sauvegarde: {ex}")
         return {
             "success": False,
@@ -159,6 +975,11 @@ def save_received_file(filename, data_b64, downloads_dir=None):
         }
 
 
+class _NullFile:
+    def write(self, data):
+        return len(data)
+
+
 def handle_file_available(payload, files_by_room):
     """Traite une notification FILE_AVAILABLE.
     
@@ -210,3 +1031,409 @@ def check_socket_connection(sclient):
         return True
     except (OSError, socket.error):
         return False
+
+
+# ----------------------------
+# Transferts en arrière-plan
+# ----------------------------
+
+class TransferCancelled(Exception):
+    """Transfert annulé (Transfer.cancel), levé entre deux blocs."""
+
+
+def _frozen(buf):
+    # écrit plus tard par le thread d'envoi : copie de ce qui peut encore changer
+    if isinstance(buf, bytes) or (isinstance(buf, memoryview) and isinstance(buf.obj, bytes)):
+        return buf
+    return bytes(buf)
+
+
+class SocketSender:
+    """Socket du client dont un seul thread écrit les trames.
+    
+    S'utilise à la place de la socket : proto.send_message / send_json /
+    send_frame, appelés depuis l'interface, le thread de réception ou les
+    transferts, mettent la trame entière en file et le thread d'envoi
+    l'écrit d'un bloc. Deux trames ne peuvent pas s'entrelacer sur le flux.
+    
+    Les trames de fichiers (send_bulk) ont leur propre file, bornée à
+    `max_bulk` octets : un envoi de fichier avance au rythme de la socket,
+    et un message de chat passe devant les blocs en attente (le noyau en
+    garde au plus SENDER_NOTSENT_LOWAT octets non envoyés). Les
+    lectures (FrameReader, getpeername...) vont directement à la socket.
+    
+    Après une erreur d'écriture, la socket est coupée (le thread de
+    réception le voit) et les envois suivants lèvent ConnectionError.
+    """
+    
+    def __init__(self, sock, max_bulk=SENDER_MAX_BULK):
+        self.sock = sock
+        self.max_bulk = max_bulk
+        if hasattr(socket, "TCP_NOTSENT_LOWAT"):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NOTSENT_LOWAT, SENDER_NOTSENT_LOWAT)
+            except OSError:
+                pass  # option absente du système : file du noyau non bornée
+        self._frames = collections.deque()  # messages : tampons d'une trame
+        self._bulk = collections.deque()  # trames de fichiers : (transfert, tampons, taille)
+        self._bulk_bytes = 0
+        self._writing = False
+        self._error = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="client-send", daemon=True)
+        self._thread.start()
+    
+    def __getattr__(self, name):
+        if name in ("send", "sendto", "sendfile"):
+            # écriture hors de la file : interdite
+            raise AttributeError(name)
+        return getattr(self.sock, name)
+    
+    def sendmsg(self, buffers):
+        """Met en file une trame entière (appelé par proto.sendmsg_all)."""
+        buffers = [_frozen(b) for b in buffers]
+        with self._cond:
+            self._check()
+            self._frames.append(buffers)
+            self._cond.notify_all()
+        return sum(len(b) for b in buffers)
+    
+    def sendall(self, data):
+        self.sendmsg([data])
+    
+    def send_bulk(self, frame, transfer=None):
+        """Met en file une trame de fichier, après les précédentes.
+        
+        Attend tant que la file dépasse max_bulk octets.
+        
+        Raises:
+            TransferCancelled: Si `transfer` a été annulé
+            ConnectionError: Si la socket a échoué ou a été fermée
+        """
+        buffers = [_frozen(b) for b in frame.buffers]
+        size = sum(len(b) for b in buffers)
+        with self._cond:
+            if transfer is not None:
+                transfer.sender = self
+            while True:
+                self._check()
+                if transfer is not None and transfer.cancelled:
+                    raise TransferCancelled()
+                if self._bulk_bytes < self.max_bulk:
+                    break
+                self._cond.wait()
+            self._bulk.append((transfer, buffers, size))
+            self._bulk_bytes += size
+            self._cond.notify_all()
+    
+    def discard(self, transfer):
+        """Retire de la file les trames de fichier de `transfer` pas encore écrites."""
+        with self._cond:
+            self._bulk = collections.deque(item for item in self._bulk if item[0] is not transfer)
+            self._bulk_bytes = sum(item[2] for item in self._bulk)
+            self._cond.notify_all()
+    
+    def flush(self, timeout=None):
+        """Attend que tout ce qui est en file soit écrit. False au bout de `timeout`."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._error is not None or not (self._frames or self._bulk or self._writing), timeout)
+    
+    def pending(self):
+        """(messages, octets de fichiers) en attente d'écriture."""
+        with self._cond:
+            return len(self._frames), self._bulk_bytes
+    
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self.sock.close()
+    
+    def _check(self):
+        # sous le verrou
+        if self._error is not None:
+            raise ConnectionError(f"envoi impossible: {self._error}")
+        if self._closed:
+            raise ConnectionError("socket fermée")
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not (self._frames or self._bulk or self._closed):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                if self._frames:
+                    buffers = self._frames.popleft()
+                else:
+                    _, buffers, size = self._bulk.popleft()
+                    self._bulk_bytes -= size
+                    self._cond.notify_all()  # place pour le bloc suivant
+                self._writing = True
+            try:
+                proto.sendmsg_all(self.sock, buffers)
+            except OSError as ex:
+                print(f"[TELECHARGEMENT] Erreur d'envoi: {ex}")
+                with self._cond:
+                    self._error = ex
+                    self._frames.clear()
+                    self._bulk.clear()
+                    self._bulk_bytes = 0
+                    self._writing = False
+                    self._cond.notify_all()
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                return
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class Transfer:
+    """Un envoi ou un téléchargement confié à un TransferManager.
+    
+    `state` : "queued", "running", "done", "failed" ou "cancelled".
+    `done` et `size` sont en octets ; `result` est le dict rendu par la
+    fonction d'envoi ou de téléchargement, `message` son message.
+    `source` : chemin local envoyé, ou (seq, nom) du fichier téléchargé.
+    """
+    
+    def __init__(self, kind, name, size=0, source=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind  # "upload" ou "download"
+        self.name = name
+        self.source = source
+        self.size = size
+        self.done = 0
+        self.state = "queued"
+        self.message = ""
+        self.result = None
+        self.started = None
+        self.finished = None
+        self.sender = None  # SocketSender qui a des trames de ce transfert en file
+        self._skipped = 0  # octets déjà présents (reprise) : hors du débit
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._on_progress = None
+    
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+    
+    @property
+    def active(self):
+        return self.state in ("queued", "running")
+    
+    def cancel(self):
+        """Demande l'arrêt ; le transfert s'arrête au bloc suivant."""
+        self._cancel.set()
+        if self.sender is not None:
+            self.sender.discard(self)
+    
+    def check(self):
+        """Lève TransferCancelled si le transfert a été annulé."""
+        if self._cancel.is_set():
+            raise TransferCancelled()
+    
+    def advance(self, count):
+        """`count` octets de plus transférés (depuis n'importe quel thread)."""
+        with self._lock:
+            self.done += count
+        if self._on_progress is not None:
+            self._on_progress(self)
+    
+    def skip(self, count):
+        """Octets que l'on n'a pas à transférer (reprise, contenu déjà sur le serveur)."""
+        with self._lock:
+            self.done += count
+            self._skipped += count
+        if self._on_progress is not None:
+            self._on_progress(self)
+    
+    def reset(self):
+        """Repart de zéro (autre chemin après un échec, ex. relais après un envoi direct)."""
+        with self._lock:
+            self.done = self._skipped = 0
+            self.started = time.monotonic()
+    
+    @property
+    def progress(self):
+        """Fraction transférée, entre 0 et 1."""
+        if self.size <= 0:
+            return 1.0 if self.state == "done" else 0.0
+        return min(1.0, self.done / self.size)
+    
+    @property
+    def throughput(self):
+        """Débit moyen depuis le début du transfert (octets/s)."""
+        if self.started is None:
+            return 0.0
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return (self.done - self._skipped) / elapsed if elapsed > 0 else 0.0
+
+
+class TransferManager:
+    """Envois et téléchargements en arrière-plan, `max_active` à la fois.
+    
+        transfers = TransferManager(on_update=rafraichir)
+        t = transfers.upload(sclient, room, chemin, compression=..., codec=...)
+        t.cancel()
+    
+    Les transferts attendent leur tour dans l'ordre de soumission, chacun
+    s'exécute sur son thread. `on_update(transfer)` est appelé à chaque
+    changement d'état et au plus tous les PROGRESS_INTERVAL pendant le
+    transfert, depuis ces threads : il ne doit pas bloquer.
+    
+    Les envois partagent la connexion au serveur : passer un SocketSender,
+    qui écrit leurs blocs et les messages de chat sans les entrelacer.
+    """
+    
+    def __init__(self, max_active=TRANSFER_CONCURRENCY, on_update=None):
+        if max_active < 1:
+            raise ValueError("max_active doit être >= 1")
+        self.max_active = max_active
+        self.on_update = on_update
+        self._waiting = collections.deque()  # (transfer, run)
+        self._transfers = []
+        self._active = 0
+        self._lock = threading.Lock()
+        self._last_notified = {}  # id -> instant de la dernière notification de progression
+    
+    def submit(self, kind, name, size, run, source=None):
+        """Ajoute un transfert ; `run(transfer)` rend un dict {"success", "message", ...}."""
+        transfer = Transfer(kind, name, size, source)
+        transfer._on_progress = self._progress
+        with self._lock:
+            self._transfers.append(transfer)
+            self._waiting.append((transfer, run))
+            ready = self._take_ready()
+        self._notify(transfer)
+        self._start(ready)
+        return transfer
+    
+    def upload(self, sclient, room, file_path, to=None, compression=None, codec=None):
+        """Envoie un fichier à la room (ou à `to`, en direct si possible) en arrière-plan."""
+        size = os.path.getsize(file_path) if os.path.isfile(file_path) else 0
+        if to:
+            run = lambda t: send_file_to_member(sclient, room, to, file_path, compression=compression,
+                                                codec=codec, transfer=t)
+        else:
+            run = lambda t: send_file_to_room(sclient, room, file_path, compression=compression,
+                                              codec=codec, transfer=t)
+        return self.submit("upload", os.path.basename(file_path), size, run, source=file_path)
+    
+    def download(self, host, port, data_token, seq, filename, **kwargs):
+        """Télécharge un fichier sur des connexions de données (download_file_parallel).
+        
+        Un téléchargement du même fichier déjà en attente ou en cours est
+        rendu tel quel : les deux écriraient dans le même .part."""
+        with self._lock:
+            current = next((t for t in self._transfers
+                            if t.kind == "download" and t.source == (seq, filename) and t.active), None)
+        if current is not None:
+            return current
+        return self.submit("download", filename, 0, lambda t: download_file_parallel(
+            host, port, data_token, seq, filename, transfer=t, **kwargs), source=(seq, filename))
+    
+    def transfers(self):
+        with self._lock:
+            return list(self._transfers)
+    
+    def get(self, transfer_id):
+        with self._lock:
+            return next((t for t in self._transfers if t.id == transfer_id), None)
+    
+    def cancel(self, transfer_id):
+        """Annule un transfert, en attente ou en cours. False s'il est déjà terminé."""
+        transfer = self.get(transfer_id)
+        if transfer is None or not transfer.active:
+            return False
+        transfer.cancel()
+        with self._lock:
+            waiting = [item for item in self._waiting if item[0] is transfer]
+            for item in waiting:
+                self._waiting.remove(item)
+        if waiting:
+            self._finish(transfer, {"success": False, "message": "Transfert annulé"})
+        return True
+    
+    def cancel_all(self):
+        for transfer in self.transfers():
+            self.cancel(transfer.id)
+    
+    def forget_finished(self):
+        """Retire de la liste les transferts terminés."""
+        with self._lock:
+            self._transfers = [t for t in self._transfers if t.active]
+    
+    def set_limit(self, max_active):
+        """Change le nombre de transferts simultanés (les transferts en cours continuent)."""
+        if max_active < 1:
+            raise ValueError("max_active doit être >= 1")
+        with self._lock:
+            self.max_active = max_active
+            ready = self._take_ready()
+        self._start(ready)
+    
+    def _take_ready(self):
+        # sous le verrou : transferts à démarrer dans la limite max_active
+        ready = []
+        while self._waiting and self._active < self.max_active:
+            ready.append(self._waiting.popleft())
+            self._active += 1
+        return ready
+    
+    def _start(self, ready):
+        for transfer, run in ready:
+            threading.Thread(target=self._run, args=(transfer, run),
+                             name=f"transfer-{transfer.kind}", daemon=True).start()
+    
+    def _run(self, transfer, run):
+        transfer.state = "running"
+        transfer.started = time.monotonic()
+        self._notify(transfer)
+        try:
+            transfer.check()
+            result = run(transfer)
+        except TransferCancelled:
+            result = {"success": False, "message": "Transfert annulé"}
+        except (OSError, ConnectionError, ValueError) as ex:
+            result = {"success": False, "message": str(ex)}
+        except Exception as ex:
+            print(f"[TELECHARGEMENT] Erreur transfert {transfer.name}: {ex}")
+            result = {"success": False, "message": str(ex)}
+        with self._lock:
+            self._active -= 1
+            ready = self._take_ready()
+        self._finish(transfer, result)
+        self._start(ready)
+    
+    def _finish(self, transfer, result):
+        transfer.result = result
+        transfer.message = result.get("message", "")
+        transfer.finished = time.monotonic()
+        if result.get("success"):
+            transfer.state = "done"
+        elif transfer.cancelled:
+            transfer.state = "cancelled"
+        else:
+            transfer.state = "failed"
+        self._last_notified.pop(transfer.id, None)
+        self._notify(transfer)
+    
+    def _progress(self, transfer):
+        now = time.monotonic()
+        if now - self._last_notified.get(transfer.id, 0.0) >= PROGRESS_INTERVAL:
+            self._last_notified[transfer.id] = now
+            self._notify(transfer)
+    
+    def _notify(self, transfer):
+        if self.on_update is not None:
+            try:
+                self.on_update(transfer)
+            except Exception as ex:
+                print(f"[TELECHARGEMENT] Erreur notification transfert: {ex}")
@@ -0,0 +1,198 @@
+"""Round trip of every frame kind and message codec (PROTOCOL.md §7, §11, §12)."""
+import base64
+import json
+import random
+
+import pytest
+
+from network import protocol as proto
+from network.dispatch import decode_frame
+
+META = {"filename": "rapport final.pdf", "size": 1_482_113}
+
+
+def server_messages():
+    files = [
+        {"seq": f"{i:032x}", "filename": f"photo_{i}.jpg", "size": 200_000 + i * 37,
+         "uploader": f"user{i % 7}", "uploaded_at": 1_760_000_000 + i}
+        for i in range(50)
+    ]
+    history = [{"id": 1000 + i, "ts": 1_760_000_000.25 + i, "text": f"MSG|user{i % 7}|message numéro {i}"}
+               for i in range(49)]
+    history.append({"id": 1049, "ts": 1_760_000_049.5,
+                    "event": {"type": "FILE_AVAILABLE", "seq": "9f" * 16, "room": "r1",
+                              "meta": META, "uploader": "alice"}})
+    return [
+        ("LOGIN_OK", {"type": "LOGIN_OK", "compression": "zlib", "codec": "struct"}),
+        ("LOGIN_OK none", {"type": "LOGIN_OK", "compression": None, "codec": "json"}),
+        ("UPLOAD_ACCEPT", {"type": "UPLOAD_ACCEPT", "seq": "9f" * 16, "status": "send", "offset": 1 << 33}),
+        ("UPLOAD_ACCEPT done", {"type": "UPLOAD_ACCEPT", "seq": "9f" * 16, "status": "complete"}),
+        ("FILE_AVAILABLE", {"type": "FILE_AVAILABLE", "seq": "9f" * 16, "room": "général",
+                            "meta": META, "uploader": "alice"}),
+        ("FILE_LIST", {"type": "FILE_LIST", "room": "r1", "files": files, "next": 1234}),
+        ("FILE_LIST empty", {"type": "FILE_LIST", "room": "r1", "files": [], "next": None}),
+        ("SEND_FILE", {"type": "SEND_FILE", "seq": "9f" * 16, "meta": META, "offset": 10, "length": 3000,
+                       "sha256": "cd" * 32,
+                       "data": base64.b64encode(bytes(range(256)) * 12).decode("ascii")}),
+        ("FILE_STREAM", {"type": "FILE_STREAM", "seq": "9f" * 16, "meta": META, "sha256": "cd" * 32}),
+        ("HISTORY", {"type": "HISTORY", "room": "r1", "before": None, "next": 950, "messages": history}),
+    ]
+
+
+def client_messages():
+    return [
+        ("FILE_BEGIN", {"type": "FILE_BEGIN", "seq": "ab" * 16, "room": "r1",
+                        "meta": {"filename": "a.txt", "size": 12}, "sha256": "cd" * 32}),
+        ("FILE_END", {"type": "FILE_END", "seq": "ab" * 16, "sha256": "cd" * 32}),
+        ("GET_FILE", {"type": "GET_FILE", "seq": "ab" * 16, "filename": "a.txt", "stream": True, "offset": 5}),
+        ("LIST_FILES", {"type": "LIST_FILES", "room": "r1", "limit": 50, "before": 99}),
+        ("HISTORY request", {"type": "HISTORY", "room": "r1", "limit": 50, "before": 1000}),
+    ]
+
+
+def edge_messages():
+    # within 64 bits: beyond, orjson decodes integers as floats (test_bigints)
+    ints = [0, 1, -1, 127, 128, -128, -129, 2**31 - 1, 2**31, -2**31, -2**31 - 1,
+            2**63 - 1, 2**63, -2**63, 2**64 - 1]
+    return [
+        ("empty", {}),
+        ("ints", {"type": "X", "values": ints}),
+        ("floats", {"f": [0.0, -0.0, 1.5, 1e300, -2.5e-300, 3.141592653589793]}),
+        ("constants", {"n": None, "t": True, "f": False, "l": [None, True, False, 0, 1]}),
+        ("strings", {"s": ["", "a", "é" * 127, "x" * 255, "x" * 256, "🙂" * 70, "z" * 100_000]}),
+        ("keys", {"": 1, "clé": 2, "k" * 255: 3, "k" * 300: 4, "type": "FILE_LIST", "TYPE": "x"}),
+        ("nesting", {"a": [[[{"b": [{"c": {}}]}]], []], "d": {"e": {"f": {"g": [1, "seq"]}}}}),
+        ("tuple", {"t": (1, 2, ("x",))}),
+    ]
+
+
+MESSAGES = server_messages() + client_messages() + edge_messages()
+CODECS = sorted(proto.MESSAGE_CODECS)
+COMPRESSIONS = [None] + sorted(proto.CODECS)
+
+
+class BytesSocket:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def recv_into(self, buffer, nbytes=0):
+        n = min(nbytes or len(buffer), len(self.data) - self.pos)
+        buffer[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def recv(self, n):
+        data = bytes(self.data[self.pos:self.pos + n])
+        self.pos += len(data)
+        return data
+
+
+def read_back(frame):
+    """The frame as FrameReader and recv_frame see it on the wire (both must agree)."""
+    data = b"".join(frame.buffers)
+    received = proto.FrameReader(BytesSocket(data)).read_frame()
+    direct = proto.recv_frame(BytesSocket(data))
+    assert (received.kind, received.header, bytes(received.data)) == \
+           (direct.kind, direct.header, bytes(direct.data))
+    return received
+
+
+@pytest.mark.parametrize("codec_name", CODECS)
+@pytest.mark.parametrize("name,msg", MESSAGES, ids=[name for name, _ in MESSAGES])
+def test_codec_round_trip(codec_name, name, msg):
+    codec = proto.MESSAGE_CODECS[codec_name]
+    expected = json.loads(json.dumps(msg))
+    encoded = codec.encode(msg)
+    assert codec.decode(encoded) == expected
+    assert codec.decode(memoryview(encoded)) == expected
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+@pytest.mark.parametrize("codec_name", CODECS)
+@pytest.mark.parametrize("name,msg", MESSAGES, ids=[name for name, _ in MESSAGES])
+def test_message_frame_round_trip(compression, codec_name, name, msg):
+    codec = proto.MESSAGE_CODECS[codec_name]
+    expected = json.loads(json.dumps(msg))
+    frame = codec.frame(msg).compressed(compression)
+    received = read_back(frame)
+    assert received.kind == codec.kind
+    assert proto.decode_message(received) == expected
+    if expected:
+        assert decode_frame(received) == (expected.get("type"), expected)
+
+
+# one frame of each kind, large and repetitive enough to be compressed
+PADDING = "abcdefgh" * 200
+
+
+def typed_frames():
+    header = {"type": "FILE_CHUNK", "seq": "ab" * 16, "note": PADDING}
+    stream = proto.FileStream({"type": "FILE_STREAM", "seq": "ab" * 16, "meta": META, "note": PADDING},
+                              None, 5, 10)
+    return [
+        ("legacy text", proto.PreparedFrame(f"MSG|alice|{PADDING}".encode()), proto.KIND_LEGACY),
+        ("text", proto.PreparedFrame(f"MSG|alice|{PADDING}".encode(), proto.KIND_TEXT), proto.KIND_TEXT),
+        ("json", proto.PreparedFrame.from_json(header, proto.KIND_JSON), proto.KIND_JSON),
+        ("binary", proto.PreparedFrame.binary(header, PADDING.encode() * 4), proto.KIND_BINARY),
+        ("stream", stream.frame, proto.KIND_STREAM),
+        ("struct", proto.STRUCT_CODEC.frame(header), proto.KIND_STRUCT),
+    ]
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+@pytest.mark.parametrize("name,frame,kind", typed_frames(), ids=[name for name, _, _ in typed_frames()])
+def test_frame_kind_round_trip(compression, name, frame, kind):
+    sent = frame.compressed(compression)
+    assert bool(sent.kind & proto.FLAG_COMPRESSED) == (compression is not None)
+    assert sent.kind & ~proto.FLAG_COMPRESSED == kind
+    plain = read_back(frame)
+    received = read_back(sent)
+    assert received.kind == kind
+    assert received.header == plain.header
+    assert bytes(received.data) == bytes(plain.data)
+    assert decode_frame(received)[0] == decode_frame(plain)[0]
+    if kind == proto.KIND_STREAM:
+        assert received.header["offset"] == 5 and received.header["length"] == 10
+    if kind == proto.KIND_BINARY:
+        assert bytes(received.data) == PADDING.encode() * 4
+
+
+def test_small_frames_are_not_compressed():
+    frame = proto.PreparedFrame(b"MSG|alice|salut")
+    for compression in COMPRESSIONS:
+        assert frame.compressed(compression) is frame
+
+
+def test_bigints():
+    msg = {"values": [-2**63 - 1, 2**64, 10**40, -10**40]}
+    assert proto.STRUCT_CODEC.decode(proto.STRUCT_CODEC.encode(msg)) == msg
+    assert json.loads(proto.JSON_CODEC.encode(msg)) == msg
+
+
+@pytest.mark.parametrize("name,msg", MESSAGES, ids=[name for name, _ in MESSAGES])
+def test_damaged_struct_payload_rejected(name, msg):
+    # truncated or corrupted: ValueError (or still a dict), never another exception
+    rnd = random.Random(3)
+    codec = proto.STRUCT_CODEC
+    encoded = codec.encode(msg)
+    step = max(1, len(encoded) // 200)
+    for cut in range(0, len(encoded), step):
+        with pytest.raises(ValueError):
+            codec.decode(encoded[:cut])
+    for _ in range(200):
+        damaged = bytearray(encoded)
+        damaged[rnd.randrange(len(damaged))] = rnd.randrange(256)
+        try:
+            assert isinstance(codec.decode(bytes(damaged)), dict)
+        except ValueError:
+            pass
+
+
+def test_corrupt_compressed_frame_rejected():
+    frame = proto.PreparedFrame(f"MSG|alice|{PADDING}".encode(), proto.KIND_TEXT).compressed("zlib")
+    data = bytearray(b"".join(frame.buffers))
+    del data[-8:]
+    data[:4] = (len(data) - 5 | proto.TYPED_FLAG).to_bytes(4, "big")
+    with pytest.raises(ValueError):
+        proto.FrameReader(BytesSocket(bytes(data))).read_frame()
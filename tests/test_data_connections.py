@@ -0,0 +1,52 @@
+"""Data connections (DATA|token) exist only without workers (PROTOCOL.md §14)."""
+import socket
+import threading
+
+import pytest
+
+from network import protocol as proto
+
+
+@pytest.fixture
+def start(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the server stores into ./downloads
+    import serveur
+
+    def start(worker=False):
+        srv = serveur.CustomServer()
+        if worker:
+            bus_dir = tmp_path / "bus"
+            bus_dir.mkdir()
+            srv.attach_bus(str(bus_dir), "w0", ["w0", "master"])
+        listener = socket.create_server(("127.0.0.1", 0))
+        threading.Thread(target=srv._run_socket_server, args=(listener,), daemon=True).start()
+        return listener.getsockname()
+
+    return start
+
+
+def login(addr):
+    sock = socket.create_connection(addr)
+    sock.settimeout(10)
+    proto.send_message(sock, b"LOGIN|alice|zlib|json")
+    return sock, proto.recv_json(sock)
+
+
+def test_data_token_opens_data_connections(start):
+    addr = start()
+    sock, login_ok = login(addr)
+    with sock:
+        assert login_ok["data_token"]
+        with socket.create_connection(addr) as data:
+            data.settimeout(10)
+            proto.send_message(data, f"DATA|{login_ok['data_token']}".encode())
+            proto.send_json(data, {"type": "GET_FILE", "seq": "missing", "filename": "x", "stream": True})
+            reply = proto.recv_message(data)
+            assert reply.startswith(b"ERROR|") and b"Jeton" not in reply  # served, not refused
+
+
+def test_no_data_token_in_cluster_mode(start):
+    sock, login_ok = login(start(worker=True))
+    with sock:
+        assert login_ok["type"] == "LOGIN_OK"
+        assert login_ok["data_token"] is None
@@ -0,0 +1,106 @@
+"""Frame size limits: a declared length alone allocates nothing (PROTOCOL.md §4, §7)."""
+import asyncio
+import os
+import socket
+import threading
+import tracemalloc
+
+import pytest
+
+from network import protocol as proto
+
+GIB = 1 << 30
+
+
+def typed_header(length, kind=proto.KIND_BINARY):
+    return proto._TYPED_HEADER.pack(proto.TYPED_FLAG | length, kind)
+
+
+def test_declared_length_is_not_allocated():
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(typed_header(GIB) + b"\x00\x02{}" + b"x" * 1000)
+        a.shutdown(socket.SHUT_WR)
+        reader = proto.FrameReader(b)
+        tracemalloc.start()
+        try:
+            with pytest.raises(ConnectionError):
+                reader.read_frame()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    assert peak < 4 * proto.READ_BUFFER_MAX
+
+
+@pytest.mark.parametrize("typed", [False, True])
+def test_frame_over_the_limit_is_refused(typed):
+    a, b = socket.socketpair()
+    with a, b:
+        header = typed_header(5000) if typed else (5000).to_bytes(4, "big")
+        a.sendall(header)
+        with pytest.raises(ValueError):
+            proto.FrameReader(b, max_frame=4096).read_frame()
+        a.sendall(header)
+        with pytest.raises(ValueError):
+            proto.recv_frame(b, max_length=4096)
+
+    async def read_async():
+        reader = asyncio.StreamReader()
+        reader.feed_data(header)
+        await proto.async_recv_frame(reader, 4096)
+
+    with pytest.raises(ValueError):
+        asyncio.run(read_async())
+
+
+def test_large_frame_read_whole():
+    data = os.urandom(5 * proto.READ_BUFFER_MAX + 123)
+    frame = proto.PreparedFrame.binary({"type": "FILE_CHUNK", "seq": "s"}, data)
+    a, b = socket.socketpair()
+    with a, b:
+        sender = threading.Thread(target=proto.send_frame, args=(a, frame))
+        sender.start()
+        received = proto.FrameReader(b).read_frame()
+        sender.join()
+    assert received.header == {"type": "FILE_CHUNK", "seq": "s"}
+    assert bytes(received.data) == data
+
+
+@pytest.fixture(params=["threads", "asyncio"])
+def server(request, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the server stores into ./downloads
+    import serveur
+
+    srv = serveur.CustomServer()
+    listener = socket.create_server(("127.0.0.1", 0))
+    threading.Thread(target=srv.runner(request.param), args=(listener,), daemon=True).start()
+    return srv, listener.getsockname()[1]
+
+
+def closed_by_server(sock):
+    sock.settimeout(10)
+    try:
+        while sock.recv(65536):
+            pass
+    except ConnectionResetError:
+        pass
+    return True
+
+
+def test_oversized_frames_close_the_connection(server):
+    import serveur
+
+    srv, port = server
+    # before LOGIN: one length word is enough to be dropped
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.sendall(typed_header(GIB))
+        assert closed_by_server(sock)
+
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        proto.send_message(sock, b"LOGIN|alice")
+        proto.send_message(sock, b"ROOM|r1")
+        # a chat message larger than the login limit is fine once logged in
+        proto.send_message(sock, b"MSG|" + b"x" * (2 * serveur.LOGIN_MAX_FRAME))
+        sock.sendall(typed_header(serveur.CLIENT_MAX_FRAME + 1))
+        assert closed_by_server(sock)
+    assert srv.sessions.by_pseudo("alice") is None
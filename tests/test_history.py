@@ -0,0 +1,63 @@
+"""Room history on join: the log is read outside the sessions lock (PROTOCOL.md §13)."""
+import socket
+import threading
+
+from network import protocol as proto
+from storage.history import RoomHistory
+
+
+def test_since_is_memory_only():
+    history = RoomHistory(max_messages=5)
+    ids = [history.append("r1", text=f"MSG|a|{i}") for i in range(8)]
+    assert [e["id"] for e in history.since("r1", ids[4])] == ids[5:]
+    assert [e["id"] for e in history.since("r1", 0)] == ids[3:]  # evicted ones are not read back
+    assert history.since("r1", ids[-1]) == []
+    assert history.since("other", 0) == []
+
+
+def recv_history(sock):
+    sock.settimeout(10)
+    while True:
+        frame = proto.recv_frame(sock)
+        if bytes(frame.data[:1]) == b"{":
+            msg = proto.decode_message(frame)
+            if msg.get("type") == "HISTORY":
+                return msg
+
+
+def test_join_after_restart_reads_the_log_outside_the_lock(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import serveur
+
+    before = serveur.CustomServer()
+    logged = [before.history.append("r1", text=f"MSG|bob|{i}") for i in range(80)]
+    before.chatlog.close()
+
+    # restart: the ring is empty, the join page comes from the log
+    srv = serveur.CustomServer()
+    read = srv.chatlog.page
+    locked = []
+
+    def page(*args, **kwargs):
+        locked.append(srv.sessions.lock._is_owned())
+        if len(locked) == 1:
+            # delivered while the log is read: must end the page, once
+            srv.history.append("r1", text="MSG|carol|pendant")
+        return read(*args, **kwargs)
+
+    monkeypatch.setattr(srv.chatlog, "page", page)
+    listener = socket.create_server(("127.0.0.1", 0))
+    threading.Thread(target=srv._run_socket_server, args=(listener,), daemon=True).start()
+
+    with socket.create_connection(listener.getsockname()) as sock:
+        proto.send_message(sock, b"LOGIN|alice|zlib|json")
+        proto.send_message(sock, b"ROOM|r1")
+        history = recv_history(sock)
+
+    assert locked and not any(locked)
+    texts = [m["text"] for m in history["messages"]]
+    assert len(texts) == serveur.HISTORY_ON_JOIN
+    assert texts[-1] == "MSG|carol|pendant"
+    assert texts[:-1] == [f"MSG|bob|{i}" for i in range(31, 80)]
+    assert history["next"] == logged[31]
+    srv.chatlog.close()
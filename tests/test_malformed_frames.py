@@ -0,0 +1,75 @@
+"""A malformed frame closes the connection and removes the session (PROTOCOL.md §4, §11)."""
+import socket
+import threading
+import time
+
+import pytest
+
+from network import protocol as proto
+
+MALFORMED = [
+    ("binary too short", proto.KIND_BINARY, b"\x00"),
+    ("binary header past the end", proto.KIND_BINARY, b"\x00\x40{}"),
+    ("binary header not an object", proto.KIND_BINARY, b"\x00\x02[]"),
+    ("binary header not json", proto.KIND_BINARY, b"\x00\x03{{{data"),
+    ("stream header not json", proto.KIND_STREAM, b"\xff\xfe"),
+    ("stream header not an object", proto.KIND_STREAM, b"42"),
+    ("compressed empty", proto.KIND_JSON | proto.FLAG_COMPRESSED, b""),
+    ("compressed unknown codec", proto.KIND_JSON | proto.FLAG_COMPRESSED, b"\x09data"),
+    ("compressed corrupt zlib", proto.KIND_JSON | proto.FLAG_COMPRESSED, b"\x01not zlib at all"),
+    ("compressed truncated zlib", proto.KIND_JSON | proto.FLAG_COMPRESSED, b"\x01\x78\x01"),
+    ("compressed corrupt lzma", proto.KIND_JSON | proto.FLAG_COMPRESSED, b"\x02not lzma at all"),
+]
+
+
+def typed_frame(kind, body):
+    return proto._TYPED_HEADER.pack(proto.TYPED_FLAG | len(body), kind) + body
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timeout"
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("kind,body", [(k, b) for _, k, b in MALFORMED], ids=[n for n, _, _ in MALFORMED])
+def test_decode_typed_raises_value_error(kind, body):
+    if kind & proto.FLAG_COMPRESSED and body[:1] == b"\x02" and proto.lzma is None:
+        pytest.skip("no lzma")
+    with pytest.raises(ValueError):
+        proto.decode_typed(kind, body)
+
+
+@pytest.fixture(params=["threads", "asyncio"])
+def server(request, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the server stores into ./downloads
+    import serveur
+
+    srv = serveur.CustomServer()
+    listener = socket.create_server(("127.0.0.1", 0))
+    threading.Thread(target=srv.runner(request.param), args=(listener,), daemon=True).start()
+    return srv, listener.getsockname()[1]
+
+
+def test_malformed_frames_drop_the_session(server):
+    srv, port = server
+    for i, (name, kind, body) in enumerate(MALFORMED):
+        pseudo = f"user{i}"
+        sock = socket.create_connection(("127.0.0.1", port))
+        try:
+            proto.send_message(sock, f"LOGIN|{pseudo}".encode())
+            proto.send_message(sock, b"ROOM|r1")
+            wait_for(lambda: any(s.pseudo == pseudo for s in srv.sessions.members("r1")))
+
+            sock.sendall(typed_frame(kind, body))
+
+            wait_for(lambda: srv.sessions.by_pseudo(pseudo) is None)
+            assert all(s.pseudo != pseudo for s in srv.sessions.members("r1")), name
+            # the server closed its end: whatever was queued, then end of stream
+            sock.settimeout(10)
+            while sock.recv(65536):
+                pass
+        finally:
+            sock.close()
+    assert len(srv.sessions) == 0
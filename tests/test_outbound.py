@@ -0,0 +1,61 @@
+"""Streams discarded by an OutboundQueue have their file closed."""
+import socket
+
+import pytest
+
+from network import protocol as proto
+from network.outbound import OutboundQueue, SlowConsumerPolicy, run_writer
+
+
+@pytest.fixture
+def open_stream(tmp_path):
+    path = tmp_path / "file.bin"
+    path.write_bytes(b"x" * 10_000)
+    opened = []
+
+    def make():
+        stream = proto.FileStream({"type": "FILE_STREAM", "seq": "s"}, open(path, "rb"), 0, 10_000)
+        opened.append(stream.file)
+        return stream
+
+    make.opened = opened
+    return make
+
+
+def test_close_closes_pending_streams(open_stream):
+    outbox = OutboundQueue()
+    for _ in range(3):
+        assert outbox.put(open_stream())
+    outbox.close()
+    assert all(f.closed for f in open_stream.opened)
+    assert outbox.depth == 0 and outbox.bytes == 0
+    assert outbox.poll() is None
+
+
+def test_close_with_flush_keeps_streams_open(open_stream):
+    outbox = OutboundQueue()
+    outbox.put(open_stream())
+    outbox.close(flush=True)
+    assert not open_stream.opened[0].closed
+    assert isinstance(outbox.poll(), proto.FileStream)
+
+
+def test_overflow_closes_pending_streams(open_stream):
+    reasons = []
+    outbox = OutboundQueue(SlowConsumerPolicy("disconnect", max_bytes=300), on_overflow=reasons.append)
+    assert outbox.put(open_stream())
+    assert not outbox.put(proto.PreparedFrame(b"x" * 1000))
+    assert reasons
+    assert open_stream.opened[0].closed
+    assert outbox.depth == 0 and outbox.bytes == 0
+
+
+def test_dead_writer_closes_pending_streams(open_stream):
+    a, b = socket.socketpair()
+    b.close()
+    outbox = OutboundQueue()
+    for _ in range(3):
+        outbox.put(open_stream())
+    with a:
+        run_writer(a, outbox)
+    assert all(f.closed for f in open_stream.opened)
@@ -0,0 +1,202 @@
+"""Interrupted transfers resume where they stopped (PROTOCOL.md §10)."""
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from network import protocol as proto
+from storage.blobstore import BlobStore
+from storage.uploads import UploadManager
+
+SIZE = 4 * 1024 * 1024
+
+
+class KilledSocket:
+    """Socket wrapper that kills the connection after `send_limit` bytes sent
+    or `recv_limit` bytes received."""
+
+    def __init__(self, sock, send_limit=None, recv_limit=None):
+        self.sock = sock
+        self.send_limit = send_limit
+        self.recv_limit = recv_limit
+        self.sent = 0
+        self.received = 0
+
+    def _kill(self):
+        self.sock.shutdown(socket.SHUT_RDWR)
+        raise ConnectionResetError("connection killed by the test")
+
+    def sendmsg(self, buffers):
+        if self.send_limit is not None and self.sent >= self.send_limit:
+            self._kill()
+        n = self.sock.sendmsg(buffers)
+        self.sent += n
+        return n
+
+    def sendall(self, data):
+        self.sendmsg([data])
+
+    def recv(self, n):
+        return self.sock.recv(n)
+
+    def recv_into(self, buf, n=0):
+        if self.recv_limit is not None and self.received >= self.recv_limit:
+            self._kill()
+        n = self.sock.recv_into(buf, n)
+        self.received += n
+        return n
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timeout"
+        time.sleep(0.01)
+
+
+def sha256_of(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+@pytest.fixture
+def data():
+    body = os.urandom(SIZE)
+    return body, hashlib.sha256(body).hexdigest()
+
+
+def test_upload_resumes_after_disconnect(tmp_path, data):
+    body, digest = data
+    uploads = UploadManager(BlobStore(str(tmp_path)))
+    first, second = object(), object()
+    up = uploads.begin("s1", "doc.bin", SIZE, room="r1", uploader="alice", owner=first, sha256=digest)
+    assert up.received == 0
+    uploads.write("s1", body[:SIZE // 3])
+    uploads.suspend_owner(first)
+
+    up = uploads.begin("s1", "doc.bin", SIZE, room="r1", uploader="alice", owner=second, sha256=digest)
+    assert up.received == SIZE // 3
+    uploads.write("s1", body[SIZE // 3:], offset=SIZE // 3)
+    up = uploads.finish("s1", digest)
+    assert up.sha256 == digest
+    assert sha256_of(up.path) == digest
+
+
+def test_upload_resumes_after_restart(tmp_path, data):
+    body, digest = data
+    uploads = UploadManager(BlobStore(str(tmp_path)))
+    owner = object()
+    uploads.begin("s1", "doc.bin", SIZE, room="r1", uploader="alice", owner=owner, sha256=digest)
+    uploads.write("s1", body[:SIZE // 2])
+    uploads.suspend_owner(owner)
+
+    # new process: the partial file and its sidecar are found on disk
+    uploads = UploadManager(BlobStore(str(tmp_path)))
+    up = uploads.begin("s1", "doc.bin", SIZE, room="r1", uploader="alice", owner=object(), sha256=digest)
+    assert up.received == SIZE // 2
+    uploads.write("s1", body[SIZE // 2:])
+    assert uploads.finish("s1", digest).sha256 == digest
+
+
+def test_resume_refused_to_another_uploader(tmp_path, data):
+    body, digest = data
+    uploads = UploadManager(BlobStore(str(tmp_path)))
+    owner = object()
+    uploads.begin("s1", "doc.bin", SIZE, uploader="alice", owner=owner, sha256=digest)
+    uploads.write("s1", body[:SIZE // 2])
+    uploads.suspend_owner(owner)
+    up = uploads.begin("s1", "doc.bin", SIZE, uploader="mallory", owner=object(), sha256=digest)
+    assert up.received == 0
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the server stores into ./downloads
+    import serveur
+
+    srv = serveur.CustomServer()
+    listener = socket.create_server(("127.0.0.1", 0))
+    threading.Thread(target=srv._run_socket_server, args=(listener,), daemon=True).start()
+    return srv, listener.getsockname()[1]
+
+
+def connect(port, pseudo, room):
+    sock = socket.create_connection(("127.0.0.1", port))
+    proto.send_message(sock, f"LOGIN|{pseudo}".encode())
+    proto.send_message(sock, f"ROOM|{room}".encode())
+    return sock
+
+
+def start_receiver(sock, dl, downloads, results):
+    def run():
+        try:
+            while True:
+                frame = proto.recv_frame(sock)
+                if frame.kind == proto.KIND_STREAM:
+                    results.append(dl.receive_file_stream(sock, frame.header, downloads))
+                    continue
+                raw = bytes(frame.data)
+                if raw.startswith(b"{"):
+                    payload = json.loads(raw)
+                    if payload.get("type") == "UPLOAD_ACCEPT":
+                        dl.handle_upload_accept(payload)
+        except (ConnectionError, OSError) as ex:
+            results.append(ex)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def test_killed_transfers_resume_over_the_network(server, tmp_path, data):
+    import telechargement as dl
+
+    srv, port = server
+    body, digest = data
+    src = tmp_path / "source.bin"
+    src.write_bytes(body)
+
+    # upload killed half way, then sent again on a new connection
+    sock = connect(port, "alice", "r1")
+    start_receiver(sock, dl, None, [])
+    killed = KilledSocket(sock, send_limit=SIZE // 2)
+    with pytest.raises(ConnectionError):
+        dl.send_file_to_room(killed, "r1", str(src), seq="resume-1")
+    wait_for(lambda: srv.uploads.get("resume-1") is not None and srv.uploads.get("resume-1").owner is None)
+    kept = srv.uploads.get("resume-1").received
+    assert 0 < kept < SIZE
+
+    sock = connect(port, "alice", "r1")
+    start_receiver(sock, dl, None, [])
+    result = dl.send_file_to_room(sock, "r1", str(src))
+    assert result["success"]
+    assert result["sent"] == SIZE - kept  # only the missing bytes
+    wait_for(lambda: srv.store.get_record("resume-1") is not None)
+    assert srv.store.get_record("resume-1")["sha256"] == digest
+    sock.close()
+
+    # download killed after a third, then asked again from the .part size
+    downloads = str(tmp_path / "client")
+    results = []
+    sock = connect(port, "bob", "r1")
+    killed = KilledSocket(sock, recv_limit=SIZE // 3)
+    start_receiver(killed, dl, downloads, results)
+    dl.request_file_download(sock, "resume-1", "source.bin", downloads)
+    wait_for(lambda: results)
+    assert isinstance(results[0], ConnectionError)
+    partial = os.path.getsize(dl._partial_path(downloads, "source.bin", "resume-1"))
+    assert 0 < partial < SIZE
+    assert not os.path.exists(os.path.join(downloads, "source.bin"))
+
+    results = []
+    sock = connect(port, "bob", "r1")
+    counter = KilledSocket(sock)
+    start_receiver(counter, dl, downloads, results)
+    dl.request_file_download(sock, "resume-1", "source.bin", downloads)
+    wait_for(lambda: results)
+    assert results[0]["success"], results
+    assert counter.received < SIZE - partial + 4096  # resumed at the .part size
+    assert sha256_of(os.path.join(downloads, "source.bin")) == digest
+    sock.close()
@@ -0,0 +1,114 @@
+"""Sequences on one timer thread: every sequence ends once, nothing leaks."""
+import asyncio
+import random
+import threading
+import time
+
+import pytest
+
+from network.state_machine import COMPLETE, TIMEOUT, IntermediateStateManager
+from network.timers import Scheduler
+
+# the 100k-sequence run is benchmarks/bench_sequences.py
+COUNT = 20_000
+WAITERS = 4
+WAITED = 500  # sequences per waiter thread
+FINISHED_TTL = 5.0  # waiters reach every entry before it is forgotten
+
+
+def wait_until(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timeout"
+        time.sleep(0.02)
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler()
+    yield scheduler
+    scheduler.close()
+
+
+def test_stress_every_sequence_ends_once(scheduler):
+    rnd = random.Random(5)
+    mgr = IntermediateStateManager(scheduler, finished_ttl=FINISHED_TTL)
+    ended = {}
+    lock = threading.Lock()
+
+    def record(seq_id, how):
+        with lock:
+            assert seq_id not in ended, f"{seq_id} ended twice"
+            ended[seq_id] = how
+
+    def complete(seq_id):
+        if mgr.complete_sequence(seq_id, {"seq": seq_id}):
+            record(seq_id, COMPLETE)
+
+    seqs = [f"seq-{i}" for i in range(COUNT)]
+    to_complete = set(rnd.sample(seqs, COUNT // 2))
+    # completions are due at most timeout / 2 after `start`, timeouts at least
+    # timeout after it (each sequence begins later): a margin of at least
+    # 0.5 s however long enqueueing takes, and the timer thread runs them in
+    # deadline order
+    start = time.monotonic()
+    for seq_id in seqs:
+        timeout = rnd.uniform(1.0, 2.0)
+        mgr.begin_sequence(seq_id, timeout, on_timeout=lambda sid: record(sid, TIMEOUT))
+        if seq_id in to_complete:
+            due = start + timeout * rnd.uniform(0.1, 0.5)
+            scheduler.call_later(due - time.monotonic(), complete, seq_id)
+
+    waited = {}
+    errors = []
+
+    def waiter(ids):
+        try:
+            for seq_id in ids:
+                waited[seq_id] = mgr.wait(seq_id)
+        except Exception as ex:
+            errors.append(ex)
+
+    waited_ids = rnd.sample(seqs, WAITERS * WAITED)
+    waiters = [threading.Thread(target=waiter, args=(waited_ids[i::WAITERS],)) for i in range(WAITERS)]
+    for t in waiters:
+        t.start()
+    wait_until(lambda: len(ended) == COUNT, 60)
+    for t in waiters:
+        t.join()
+
+    assert not errors
+    assert {s for s, how in ended.items() if how == COMPLETE} == to_complete
+    for seq_id, result in waited.items():
+        assert result == ({"seq": seq_id} if seq_id in to_complete else None), seq_id
+
+    # finished entries are forgotten after finished_ttl, their timers with them
+    wait_until(lambda: len(mgr) == 0, FINISHED_TTL + 5)
+    wait_until(lambda: len(scheduler) == 0, 5)
+
+
+def test_complete_after_timeout_is_ignored(scheduler):
+    mgr = IntermediateStateManager(scheduler)
+    timed_out = threading.Event()
+    mgr.begin_sequence("s", 0.05, on_timeout=lambda sid: timed_out.set())
+    assert timed_out.wait(2)
+    assert mgr.state("s") == TIMEOUT
+    assert not mgr.complete_sequence("s", {"late": True})
+    assert mgr.wait("s") is None
+
+
+def test_wait_many_empty_and_unknown(scheduler):
+    mgr = IntermediateStateManager(scheduler)
+    assert mgr.wait_any([]) == ({}, set())
+    assert mgr.wait_all([]) == ({}, set())
+    assert asyncio.run(mgr.wait_any_async([])) == ({}, set())
+
+    mgr.begin_sequence("a", 5)
+    with pytest.raises(KeyError):
+        mgr.wait_any(["a", "unknown"])
+    with pytest.raises(KeyError):
+        asyncio.run(mgr.wait_all_async(["a", "unknown"]))
+    # nothing was registered on "a" by the failed waits
+    assert mgr._seqs["a"].callbacks is None
+    mgr.complete_sequence("a", {"ok": 1})
+    assert mgr.wait_all(["a"], 1) == ({"a": {"ok": 1}}, set())